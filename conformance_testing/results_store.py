@@ -0,0 +1,278 @@
+"""
+Machine-readable results of the test sessions: the verdict, the duration of the steps, the failure and the last
+message received of each test are appended to a results store (JSONL or SQLite file) as soon as the test ends, and
+they can be exported to JUnit XML. The pass rates and step latencies of many sessions can be queried without
+parsing the HTML reports.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import collections
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+
+import click
+
+RESULTS_DIR_ENV = 'TAS_RESULTS_DIR'
+RESULTS_FORMAT_ENV = 'TAS_RESULTS_FORMAT'
+FORMAT_JSONL = "jsonl"
+FORMAT_SQLITE = "sqlite"
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+
+VERDICT_PASS = "PASS"
+VERDICT_FAIL = "FAIL"
+
+TestResult = collections.namedtuple("TestResult", "session_id deveui test_name verdict started duration steps "
+                                                  "error_type error_message last_message")
+TestResult.__doc__ = """
+Result of a test of a device: steps is a list of (step name, seconds) and last_message is the hex string of the
+PHYPayload of the last uplink received in the test (None if no uplink was received).
+"""
+
+PassRate = collections.namedtuple("PassRate", "test_name passed total")
+StepLatency = collections.namedtuple("StepLatency", "test_name step_name count mean_seconds max_seconds")
+
+
+def result_to_dict(result):
+    result_dict = result._asdict()
+    result_dict["steps"] = [list(step) for step in result.steps]
+    return result_dict
+
+
+def result_from_dict(result_dict):
+    result_dict = dict(result_dict)
+    result_dict["steps"] = [tuple(step) for step in result_dict["steps"]]
+    return TestResult(**result_dict)
+
+
+def pass_rates(results):
+    """ Returns the PassRate of each test of an iterable of TestResult, sorted by test name."""
+    passed = collections.Counter()
+    total = collections.Counter()
+    for result in results:
+        total[result.test_name] += 1
+        if result.verdict == VERDICT_PASS:
+            passed[result.test_name] += 1
+    return [PassRate(test_name, passed[test_name], total[test_name]) for test_name in sorted(total)]
+
+
+def step_latencies(results):
+    """ Returns the StepLatency of each step of the tests of an iterable of TestResult, sorted by test and step."""
+    durations = collections.defaultdict(list)
+    for result in results:
+        for step_name, seconds in result.steps:
+            durations[(result.test_name, step_name)].append(seconds)
+    return [StepLatency(test_name, step_name, len(seconds), sum(seconds) / len(seconds), max(seconds))
+            for (test_name, step_name), seconds in sorted(durations.items())]
+
+
+class JsonlResultsStore(object):
+    """ Appends the results of the tests to a JSON lines file (one TestResult per line)."""
+
+    def __init__(self, path):
+        """
+        :param path: path of the results file (created if it doesn't exist).
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._results_file = open(path, 'a')
+
+    def record(self, result):
+        line = json.dumps(result_to_dict(result))
+        with self._lock:
+            self._results_file.write(line + "\n")
+            self._results_file.flush()
+
+    def results(self):
+        """ Returns the TestResult of the file, in order."""
+        with open(self.path) as results_file:
+            return [result_from_dict(json.loads(line)) for line in results_file if line.strip()]
+
+    def pass_rates(self):
+        return pass_rates(self.results())
+
+    def step_latencies(self):
+        return step_latencies(self.results())
+
+    def close(self):
+        with self._lock:
+            self._results_file.close()
+
+
+class SqliteResultsStore(object):
+    """
+    Stores the results of the tests in a SQLite database: a row of the results table per test and a row of the
+    steps table per step, indexed to query the pass rates and step latencies of many sessions.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT, deveui TEXT, test_name TEXT, verdict TEXT, started REAL, duration REAL,
+            error_type TEXT, error_message TEXT, last_message TEXT);
+        CREATE TABLE IF NOT EXISTS steps (
+            result_id INTEGER REFERENCES results(id), position INTEGER, step_name TEXT, seconds REAL);
+        CREATE INDEX IF NOT EXISTS results_test_name ON results(test_name);
+        CREATE INDEX IF NOT EXISTS steps_result_id ON steps(result_id);
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path of the database file (created if it doesn't exist).
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(self.SCHEMA)
+
+    def record(self, result):
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO results (session_id, deveui, test_name, verdict, started, duration, error_type, "
+                "error_message, last_message) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (result.session_id, result.deveui, result.test_name, result.verdict, result.started,
+                 result.duration, result.error_type, result.error_message, result.last_message))
+            self._connection.executemany(
+                "INSERT INTO steps (result_id, position, step_name, seconds) VALUES (?, ?, ?, ?)",
+                [(cursor.lastrowid, position, step_name, seconds)
+                 for position, (step_name, seconds) in enumerate(result.steps)])
+
+    def results(self):
+        """ Returns the TestResult of the database, in order."""
+        with self._lock:
+            steps = collections.defaultdict(list)
+            for result_id, step_name, seconds in self._connection.execute(
+                    "SELECT result_id, step_name, seconds FROM steps ORDER BY result_id, position"):
+                steps[result_id].append((step_name, seconds))
+            rows = self._connection.execute(
+                "SELECT id, session_id, deveui, test_name, verdict, started, duration, error_type, error_message, "
+                "last_message FROM results ORDER BY id").fetchall()
+        return [TestResult(session_id, deveui, test_name, verdict, started, duration, steps[result_id],
+                           error_type, error_message, last_message)
+                for (result_id, session_id, deveui, test_name, verdict, started, duration, error_type,
+                     error_message, last_message) in rows]
+
+    def pass_rates(self):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT test_name, SUM(verdict = ?), COUNT(*) FROM results GROUP BY test_name ORDER BY test_name",
+                (VERDICT_PASS,)).fetchall()
+        return [PassRate(*row) for row in rows]
+
+    def step_latencies(self):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT results.test_name, steps.step_name, COUNT(*), AVG(steps.seconds), MAX(steps.seconds) "
+                "FROM steps JOIN results ON steps.result_id = results.id "
+                "GROUP BY results.test_name, steps.step_name ORDER BY results.test_name, steps.step_name").fetchall()
+        return [StepLatency(*row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def open_store(path):
+    """ Opens the results store of a file: SQLite for the .db, .sqlite and .sqlite3 files, JSON lines otherwise."""
+    if os.path.splitext(path)[1] in SQLITE_EXTENSIONS:
+        return SqliteResultsStore(path)
+    return JsonlResultsStore(path)
+
+
+def new_session_id(worker_id=None):
+    """ Returns an identifier of a test session from its start time (and the worker running it)."""
+    session_id = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+    return session_id if worker_id is None else f"{session_id}-w{worker_id}"
+
+
+def store_from_env(session_id):
+    """
+    Returns the results store of a session in the directory set in TAS_RESULTS_DIR (None if it isn't set). The
+    format is set in TAS_RESULTS_FORMAT (jsonl by default, or sqlite).
+    """
+    results_dir = os.environ.get(RESULTS_DIR_ENV)
+    if not results_dir:
+        return None
+    os.makedirs(results_dir, exist_ok=True)
+    extension = ".db" if os.environ.get(RESULTS_FORMAT_ENV, FORMAT_JSONL) == FORMAT_SQLITE else ".jsonl"
+    return open_store(os.path.join(results_dir, f"session_{session_id}{extension}"))
+
+
+def to_junit_xml(results):
+    """
+    Returns the JUnit XML report (string) of an iterable of TestResult: a test suite per session and device and a
+    test case per test.
+    """
+    testsuites = ElementTree.Element("testsuites")
+    suites = collections.OrderedDict()
+    for result in results:
+        suite_name = f"{result.session_id}.{result.deveui}"
+        if suite_name not in suites:
+            suites[suite_name] = ElementTree.SubElement(testsuites, "testsuite", name=suite_name)
+        testcase = ElementTree.SubElement(suites[suite_name], "testcase", classname=suite_name,
+                                          name=result.test_name, time=f"{result.duration:.3f}")
+        if result.verdict != VERDICT_PASS:
+            failure = ElementTree.SubElement(testcase, "failure", type=result.error_type or VERDICT_FAIL,
+                                             message=(result.error_message or "").split("\n")[0])
+            failure.text = result.error_message
+        output_lines = [f"{step_name}: {seconds:.3f} s" for step_name, seconds in result.steps]
+        if result.last_message:
+            output_lines.append(f"Last message: {result.last_message}")
+        if output_lines:
+            ElementTree.SubElement(testcase, "system-out").text = "\n".join(output_lines)
+    for suite in suites.values():
+        testcases = suite.findall("testcase")
+        suite.set("tests", str(len(testcases)))
+        suite.set("failures", str(sum(1 for testcase in testcases if testcase.find("failure") is not None)))
+        suite.set("time", f"{sum(float(testcase.get('time')) for testcase in testcases):.3f}")
+    return ElementTree.tostring(testsuites, encoding="unicode")
+
+
+@click.command()
+@click.argument('results_paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--junit', default=None, type=click.Path(dir_okay=False), help='Path of the JUnit XML report.')
+def results_main(results_paths, junit):
+    """ Prints the pass rates and step latencies of the results files and exports them to JUnit XML."""
+    results = []
+    for results_path in results_paths:
+        store = open_store(results_path)
+        results.extend(store.results())
+        store.close()
+    for rate in pass_rates(results):
+        print(f"{rate.test_name}: {rate.passed}/{rate.total} PASS")
+    for latency in step_latencies(results):
+        print(f"{latency.test_name} {latency.step_name}: {latency.count} steps, mean {latency.mean_seconds:.3f} s, "
+              f"max {latency.max_seconds:.3f} s")
+    if junit:
+        with open(junit, 'w') as junit_file:
+            junit_file.write(to_junit_xml(results))
+    sys.exit(0 if all(result.verdict == VERDICT_PASS for result in results) else 1)
+
+
+if __name__ == '__main__':
+    results_main()
@@ -0,0 +1,131 @@
+"""
+Capture files of the messages exchanged in a test session (uplinks, downlinks and the description of the session
+published by the Test Application Server), to replay the session offline.
+A capture file is an append-only JSON lines file, each line is a record:
+{"time": 1539000000.12, "direction": "up", "routing_key": "fromAgent.gw1", "content_type": "application/json",
+ "body": "<base64>"}
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import base64
+import collections
+import json
+import os
+import random
+import threading
+import time
+
+from parameters.message_broker import routing_keys
+
+DIRECTION_UP = "up"
+DIRECTION_DOWN = "down"
+DIRECTION_INFO = "info"
+
+RANDOM_SEED_ENV = 'TAS_RANDOM_SEED'
+
+CaptureRecord = collections.namedtuple("CaptureRecord", "time direction routing_key content_type body")
+
+
+def direction_of(routing_key):
+    """ Returns the direction of a message of the session from its routing key (None if it isn't captured)."""
+    if routing_key.startswith(routing_keys.fromAgent + '.'):
+        return DIRECTION_UP
+    if routing_key.startswith(routing_keys.toAgent + '.'):
+        return DIRECTION_DOWN
+    if routing_key == routing_keys.session_info:
+        return DIRECTION_INFO
+    return None
+
+
+def random_seed_from_env():
+    """
+    Returns the seed of the random numbers of the session set in TAS_RANDOM_SEED. If it isn't set a new seed
+    is generated, so the session (recorded in the session info) can always be replayed.
+    """
+    seed_str = os.environ.get(RANDOM_SEED_ENV)
+    if seed_str:
+        return int(seed_str)
+    return random.SystemRandom().randrange(2 ** 32)
+
+
+def seed_random(seed):
+    """
+    Seeds the random numbers used by the session (e.g. AppNonce and DevAddr of the Join Accept), so the
+    downlinks of a replayed session are the same as the recorded ones.
+    """
+    if seed is not None:
+        random.seed(seed)
+
+
+class CaptureWriter(object):
+    """ Appends the messages of a session to a capture file."""
+
+    def __init__(self, path):
+        """
+        :param path: path of the capture file (created if it doesn't exist).
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._capture_file = open(path, 'a')
+
+    def record(self, routing_key, body, properties=None, direction=None, timestamp=None):
+        """
+        Appends a message to the capture file.
+        :param routing_key: routing key of the message.
+        :param body: bytes of the message.
+        :param properties: AMQP properties of the message (the content type is recorded).
+        :param direction: up, down or info (obtained from the routing key by default).
+        :param timestamp: reception time (now by default).
+        """
+        if isinstance(body, str):
+            body = body.encode()
+        line = json.dumps({
+            "time": time.time() if timestamp is None else timestamp,
+            "direction": direction or direction_of(routing_key),
+            "routing_key": routing_key,
+            "content_type": properties.content_type if properties is not None else None,
+            "body": base64.b64encode(body).decode()
+        })
+        with self._lock:
+            self._capture_file.write(line + "\n")
+            self._capture_file.flush()
+
+    def close(self):
+        with self._lock:
+            self._capture_file.close()
+
+
+def read_capture(path):
+    """ Yields the CaptureRecord of a capture file, in order."""
+    with open(path) as capture_file:
+        for line in capture_file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield CaptureRecord(time=record["time"],
+                                direction=record["direction"],
+                                routing_key=record["routing_key"],
+                                content_type=record.get("content_type"),
+                                body=base64.b64decode(record["body"]))
@@ -0,0 +1,223 @@
+"""
+Offline replay of a captured test session: the recorded uplinks are fed to a TestSessionCoordinator running on
+the in-process broker, as fast as possible, and the downlinks that it produces are checked against the recorded
+ones. It allows to run the regression tests of the test cases without a device, a gateway or a broker.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import json
+import logging
+import sys
+import time
+
+import click
+import pika
+
+from conformance_testing import session_capture
+from conformance_testing import test_planner
+from conformance_testing import test_registry
+from conformance_testing import testingtool_services
+from lorawan.parsing import flora_messages
+import message_queueing
+from user_interface.ui import ui_publisher
+
+logger = logging.getLogger(__name__)
+
+COMPARED_FIELDS = ("tmst", "freq", "datr")
+
+
+class ReplayCoordinator(testingtool_services.TestSessionCoordinator):
+    """ Session coordinator that keeps the downlinks that it sends, to be compared with the recorded ones."""
+
+    def __init__(self, reset_attemps=3, amqp_url=message_queueing.MEMORY_URL_SCHEME, planner=None):
+        super().__init__(reset_attemps=reset_attemps, amqp_url=amqp_url, planner=planner)
+        self.produced_downlinks = []
+
+    def publish(self, msg, routing_key, exchange_name=message_queueing.DEFAULT_EXCHANGE, properties=None):
+        if session_capture.direction_of(routing_key) == session_capture.DIRECTION_DOWN:
+            self.produced_downlinks.append(session_capture.CaptureRecord(
+                time=time.time(),
+                direction=session_capture.DIRECTION_DOWN,
+                routing_key=routing_key,
+                content_type=properties.content_type if properties is not None else None,
+                body=msg.encode() if isinstance(msg, str) else msg))
+        super().publish(msg, routing_key, exchange_name=exchange_name, properties=properties)
+
+
+def compare_downlinks(expected, produced):
+    """
+    Compares a recorded downlink with a replayed one (PHYPayload and transmission parameters).
+    :param expected: recorded CaptureRecord.
+    :param produced: replayed CaptureRecord.
+    :return: list of strings describing the differences (empty if they match).
+    """
+    expected_msg = flora_messages.GatewayMessage.from_bytes(expected.body, content_type=expected.content_type)
+    produced_msg = flora_messages.GatewayMessage.from_bytes(produced.body, content_type=produced.content_type)
+    differences = []
+    if expected_msg.get_phypaload_bytes() != produced_msg.get_phypaload_bytes():
+        differences.append(f"PHYPayload {expected_msg.get_phypaload_bytes().hex()} -> "
+                           f"{produced_msg.get_phypaload_bytes().hex()}")
+    for field in COMPARED_FIELDS:
+        if getattr(expected_msg, field) != getattr(produced_msg, field):
+            differences.append(f"{field} {getattr(expected_msg, field)} -> {getattr(produced_msg, field)}")
+    return differences
+
+
+class ReplayResult(object):
+    """ Result of the replay of a captured session."""
+
+    def __init__(self, uplinks, expected_downlinks, produced_downlinks, mismatches, reports, elapsed_seconds):
+        self.uplinks = uplinks
+        self.expected_downlinks = expected_downlinks
+        self.produced_downlinks = produced_downlinks
+        self.mismatches = mismatches
+        self.reports = reports
+        self.elapsed_seconds = elapsed_seconds
+
+    @property
+    def passed(self):
+        return not self.mismatches
+
+    def get_printable_str(self):
+        lines = [f"Replayed {self.uplinks} uplinks in {self.elapsed_seconds:.3f} s: "
+                 f"{len(self.produced_downlinks)} downlinks produced, {len(self.expected_downlinks)} recorded."]
+        for downlink_index, description in self.mismatches:
+            lines.append(f"Downlink {downlink_index}: {description}")
+        for report in self.reports:
+            verdicts = [field["name"] + (f": {field['value']}" if field["value"].strip() else "")
+                        for field in report.fields if field["name"] != ":"]
+            lines.append(f"{report.title} " + ", ".join(verdicts))
+        lines.append("REPLAY: PASS" if self.passed else "REPLAY: FAIL")
+        return "\n".join(lines)
+
+
+class SessionReplayer(object):
+    """ Replays the records of a capture file against a TestSessionCoordinator running in-process."""
+
+    def __init__(self, records, test_modules, devices=(), session_info=None, random_seed=None, reset_attempts=3):
+        """
+        :param records: iterable of CaptureRecord of the session.
+        :param test_modules: dict {test_name: test module} of the available tests.
+        :param devices: list of the configurations of the devices with their keys ({"DevEUI": ..., "AppKey": ...},
+            hex encoded as in the session configuration), the session description doesn't include them.
+        :param session_info: description of the session (devices and tests), the last one of the capture by
+            default.
+        :param random_seed: overrides the random seed recorded in the session description.
+        :param reset_attempts: maximum number of consecutive resets of a device.
+        """
+        self.records = list(records)
+        self.test_modules = test_modules
+        if session_info is None:
+            info_records = [record for record in self.records
+                            if record.direction == session_capture.DIRECTION_INFO]
+            if not info_records:
+                raise ValueError("The capture has no session description.")
+            session_info = json.loads(info_records[-1].body.decode())
+        self.session_info = session_info
+        local_devices = {device_config["DevEUI"].lower(): device_config for device_config in devices}
+        self.device_configs = []
+        for device_config in session_info["devices"]:
+            device_config = dict(device_config, **local_devices.get(device_config["DevEUI"].lower(), {}))
+            if "AppKey" not in device_config:
+                raise ValueError(f"The keys of the device {device_config['DevEUI']} aren't configured.")
+            self.device_configs.append(device_config)
+        self.random_seed = random_seed if random_seed is not None else session_info.get("random_seed")
+        self.reset_attempts = reset_attempts
+
+    def run(self):
+        """ Replays the session and returns the ReplayResult."""
+        if not ui_publisher.connected or not message_queueing.is_memory_url(ui_publisher.amqp_url):
+            ui_publisher.connect(amqp_url=message_queueing.MEMORY_URL_SCHEME)
+        # The remaining tests are planned again after a reset of the device, as in the recorded session.
+        planner = test_planner.TestPlanner(reorder=self.session_info.get("reorder", True))
+        coordinator = ReplayCoordinator(reset_attemps=self.reset_attempts, planner=planner)
+        uplinks = 0
+        start_time = time.perf_counter()
+        try:
+            for device_config in self.device_configs:
+                device_id = coordinator.parse_device_config(device_config)
+                coordinator.add_device_session(device_id=device_id,
+                                               requested_tests=self.session_info["tests"][device_id.deveui.hex()],
+                                               planner=coordinator.planner)
+            active = coordinator.start_sessions(self.test_modules, random_seed=self.random_seed)
+            for record in self.records:
+                if not active:
+                    break
+                if record.direction != session_capture.DIRECTION_UP:
+                    continue
+                uplinks += 1
+                coordinator.uplink_dispatcher(ch=coordinator.channel,
+                                              method=pika.spec.Basic.Deliver(routing_key=record.routing_key),
+                                              properties=pika.BasicProperties(content_type=record.content_type),
+                                              body=record.body)
+                active = any(not session.finished for session in coordinator.sessions.values())
+        finally:
+            elapsed_seconds = time.perf_counter() - start_time
+            coordinator.channel.close()
+            coordinator.connection.close()
+        for session in coordinator.sessions.values():
+            session.add_verdict()
+        expected_downlinks = [record for record in self.records
+                              if record.direction == session_capture.DIRECTION_DOWN]
+        mismatches = []
+        for downlink_index, (expected, produced) in enumerate(zip(expected_downlinks,
+                                                                  coordinator.produced_downlinks)):
+            for difference in compare_downlinks(expected, produced):
+                mismatches.append((downlink_index, difference))
+        for downlink_index in range(len(coordinator.produced_downlinks), len(expected_downlinks)):
+            mismatches.append((downlink_index, "recorded downlink not produced."))
+        for downlink_index in range(len(expected_downlinks), len(coordinator.produced_downlinks)):
+            mismatches.append((downlink_index, "unexpected downlink produced."))
+        return ReplayResult(uplinks=uplinks,
+                            expected_downlinks=expected_downlinks,
+                            produced_downlinks=coordinator.produced_downlinks,
+                            mismatches=mismatches,
+                            reports=[session.result_report for session in coordinator.sessions.values()],
+                            elapsed_seconds=elapsed_seconds)
+
+
+@click.command()
+@click.argument('capture_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--devices', 'devices_path', required=True, type=click.Path(exists=True, dir_okay=False),
+              help='JSON file with the list of devices of the session and their keys '
+                   '([{"DevEUI": ..., "AppKey": ...}]).')
+@click.option('--seed', default=None, type=int, help='Random seed (overrides the recorded one).')
+@click.option('--reset_attempts', default=3, type=int, help='Maximum number of consecutive resets of a device.')
+def replay_main(capture_path, devices_path, seed, reset_attempts):
+    """ Replays a captured test session and checks the downlinks of the Test Application Server."""
+    with open(devices_path) as devices_file:
+        devices = json.load(devices_file)
+    replayer = SessionReplayer(records=session_capture.read_capture(capture_path),
+                               test_modules=test_registry.TestRegistry(),
+                               devices=devices,
+                               random_seed=seed,
+                               reset_attempts=reset_attempts)
+    result = replayer.run()
+    print(result.get_printable_str())
+    sys.exit(0 if result.passed else 1)
+
+
+if __name__ == '__main__':
+    replay_main()
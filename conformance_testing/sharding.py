@@ -0,0 +1,258 @@
+"""
+Sharding of the Devices Under Test across several Test Application Server worker processes.
+The devices are assigned to the workers by consistent hashing on their DevEUI; a supervisor receives
+the uplinks of the agent and forwards each one to the worker that owns the device.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import bisect
+import hashlib
+import json
+import logging
+import multiprocessing
+import threading
+
+from lorawan.parsing import flora_messages
+import message_queueing
+import user_interface.ui_reports as ui_reports
+from parameters.message_broker import routing_keys
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPLICAS = 64
+DEVADDR_ANNOUNCEMENT_KEY = routing_keys.tas_workers + '.devaddr'
+RESULTS_KEY = routing_keys.tas_workers + '.results'
+
+
+def worker_uplink_key(worker_id):
+    """ Routing key prefix of the uplinks forwarded to a worker (the original routing key is appended)."""
+    return f"{routing_keys.tas_workers}.{worker_id}.up"
+
+
+def worker_uplink_queue(worker_id):
+    """ Name of the queue of the uplinks forwarded to a worker."""
+    return f"up_tas_worker_{worker_id}"
+
+
+class ConsistentHashRing(object):
+    """
+    Consistent hashing ring: each node is placed several times (replicas) in the ring and a key belongs to the
+    first node found clockwise from the hash of the key. Adding or removing a node only moves the keys of
+    that node.
+    """
+
+    def __init__(self, nodes=(), replicas=DEFAULT_REPLICAS):
+        """
+        :param nodes: initial nodes of the ring (e.g. the worker ids).
+        :param replicas: number of points of each node in the ring.
+        """
+        self.replicas = replicas
+        self._hashes = []
+        self._nodes = {}
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def _hash(key):
+        if isinstance(key, str):
+            key = key.encode()
+        return int.from_bytes(hashlib.md5(key).digest()[:8], byteorder='big')
+
+    @property
+    def nodes(self):
+        return sorted(set(self._nodes.values()), key=str)
+
+    def add_node(self, node):
+        for replica in range(self.replicas):
+            point = self._hash(f"{node}:{replica}")
+            if point not in self._nodes:
+                bisect.insort(self._hashes, point)
+            self._nodes[point] = node
+
+    def remove_node(self, node):
+        for replica in range(self.replicas):
+            point = self._hash(f"{node}:{replica}")
+            if self._nodes.get(point) == node:
+                del self._nodes[point]
+                self._hashes.pop(bisect.bisect_left(self._hashes, point))
+
+    def node_for(self, key):
+        """
+        Returns the node that owns the key.
+        :param key: bytes or str (e.g. the DevEUI of a device).
+        """
+        if not self._hashes:
+            raise LookupError("The ring has no nodes.")
+        index = bisect.bisect_right(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._nodes[self._hashes[index]]
+
+
+class ShardSupervisor(message_queueing.MqInterface):
+    """
+    Runs the test sessions of the devices in several workers. The supervisor consumes the uplinks of the
+    agent and forwards them to the worker that owns the device (by DevEUI for the Join Requests and by
+    DevAddr for the data messages, as announced by the workers after each join). Messages of unknown
+    devices are forwarded to all the workers. When the workers finish they send their result reports, that
+    are merged in a single session report.
+    The workers are processes, unless the in-process broker (memory://) is used: in that case they are
+    threads sharing the broker.
+    """
+
+    def __init__(self, worker_count, worker_target, amqp_url=None):
+        """
+        :param worker_count: maximum number of workers.
+        :param worker_target: function run by each worker, called as
+            worker_target(worker_id, device_ids, requested_tests).
+        :param amqp_url: url of the message broker (AMQP_URL by default).
+        """
+        super().__init__(amqp_url=amqp_url)
+        self.worker_count = worker_count
+        self.ring = ConsistentHashRing(range(worker_count))
+        self.workers = {}
+        self.worker_reports = {}
+        self._worker_target = worker_target
+        self._owner_by_deveui = {}
+        self._owner_by_devaddr = {}
+
+    def assign_devices(self, device_ids):
+        """
+        Assigns each device to a worker.
+        :param device_ids: list of DeviceID of the devices under test.
+        :return: dict {worker_id: [DeviceID]}, without the workers that have no devices.
+        """
+        assignments = {}
+        for device_id in device_ids:
+            worker_id = self.ring.node_for(device_id.deveui)
+            assignments.setdefault(worker_id, []).append(device_id)
+            self._owner_by_deveui[device_id.deveui] = worker_id
+            self._owner_by_devaddr[device_id.devaddr] = worker_id
+        return assignments
+
+    def find_owners(self, body, properties=None):
+        """ Returns the ids of the workers that must receive the uplink."""
+        content_type = properties.content_type if properties is not None else None
+        try:
+            lorawan_message = flora_messages.GatewayMessage.from_bytes(
+                body, content_type=content_type).parse_lorawan_message(ignore_format_errors=True)
+            if lorawan_message.mhdr.mtype_str == 'JOIN_REQUEST':
+                owner = self._owner_by_deveui.get(lorawan_message.macpayload.deveui_bytes)
+            else:
+                owner = self._owner_by_devaddr.get(lorawan_message.macpayload.fhdr.devaddr_bytes)
+        except Exception as parsing_error:
+            logger.debug(f"Unable to parse uplink: {parsing_error}")
+            owner = None
+        if owner is None:
+            return list(self.workers)
+        return [owner]
+
+    def uplink_router(self, ch, method, properties, body):
+        """ Forwards an uplink of the agent to the worker of the device."""
+        for worker_id in self.find_owners(body, properties):
+            self.publish(msg=body,
+                         routing_key=f"{worker_uplink_key(worker_id)}.{method.routing_key}",
+                         properties=properties)
+
+    def devaddr_announcement_handler(self, ch, method, properties, body):
+        """ Updates the DevAddr of a device after a join, announced by the worker that owns it."""
+        announcement = json.loads(body.decode())
+        for devaddr_hex in announcement["DevAddr"]:
+            self._owner_by_devaddr[bytes.fromhex(devaddr_hex)] = announcement["worker"]
+
+    def results_handler(self, ch, method, properties, body):
+        """ Stores the result reports sent by a worker when it finishes."""
+        results = json.loads(body.decode())
+        self.worker_reports[results["worker"]] = results["reports"]
+
+    def _pending_workers(self):
+        return [worker_id for worker_id in self.workers if worker_id not in self.worker_reports]
+
+    def run(self, device_ids, requested_tests):
+        """
+        Starts the workers and forwards the uplinks until all of them send their results.
+        :param device_ids: list of DeviceID of the devices under test.
+        :param requested_tests: list of the names of the tests to be run in each device.
+        :return: merged results report (InputFormBody).
+        """
+        assignments = self.assign_devices(device_ids)
+        self.declare_and_consume_many(queue_name='tas_supervisor',
+                                      callbacks={DEVADDR_ANNOUNCEMENT_KEY: self.devaddr_announcement_handler,
+                                                 RESULTS_KEY: self.results_handler},
+                                      durable=False,
+                                      auto_delete=True)
+        for worker_id in assignments:
+            # Declared before the worker starts so no uplink is lost while it initializes.
+            self.declare_queue(queue_name=worker_uplink_queue(worker_id), exclusive=False, durable=False)
+            self.bind_queue(queue_name=worker_uplink_queue(worker_id),
+                            routing_key=worker_uplink_key(worker_id) + '.#')
+        self.declare_and_consume(queue_name='up_tas',
+                                 routing_key=routing_keys.fromAgent + '.#',
+                                 durable=False,
+                                 auto_delete=True,
+                                 callback=self.uplink_router)
+        if message_queueing.is_memory_url(self.amqp_url):
+            worker_class = threading.Thread
+        else:
+            worker_class = multiprocessing.get_context('spawn').Process
+        for worker_id, worker_devices in assignments.items():
+            worker = worker_class(target=self._worker_target,
+                                  args=(worker_id, worker_devices, list(requested_tests)),
+                                  name=f"tas_worker_{worker_id}",
+                                  daemon=True)
+            self.workers[worker_id] = worker
+            worker.start()
+            logger.info(f"Worker {worker_id} started with {len(worker_devices)} devices.")
+        try:
+            while self._pending_workers():
+                self.connection.process_data_events(time_limit=1)
+                if not any(self.workers[worker_id].is_alive() for worker_id in self._pending_workers()):
+                    # The results of the workers that ended may still be in the queue.
+                    self.connection.process_data_events(time_limit=0)
+                    break
+        finally:
+            for worker_id in assignments:
+                self.channel.queue_delete(queue=worker_uplink_queue(worker_id))
+            for worker in self.workers.values():
+                worker.join(timeout=5)
+        return self.merge_reports()
+
+    def merge_reports(self):
+        """ Merges the result reports of the workers in a single session report."""
+        merged_report = ui_reports.InputFormBody(title="Results summary of the tests.",
+                                                 tag_key="Test",
+                                                 tag_value="Results",
+                                                 level=ui_reports.LEVEL_HL)
+        for worker_id in sorted(self.workers):
+            if worker_id not in self.worker_reports:
+                merged_report.level = ui_reports.LEVEL_ERR
+                merged_report.add_field(ui_reports.ParagraphField(
+                    name=f"Worker {worker_id}:",
+                    value="ended without sending the results of its devices."))
+                continue
+            for report in self.worker_reports[worker_id]:
+                if report["level"] == ui_reports.LEVEL_ERR:
+                    merged_report.level = ui_reports.LEVEL_ERR
+                merged_report.add_field(ui_reports.ParagraphField(name=report["title"], value=" "))
+                merged_report.fields.extend(report["fields"])
+        return merged_report
@@ -0,0 +1,197 @@
+"""
+Planner of the order of the tests of a session. Each test has preconditions (e.g. the DUT in test mode or using the
+default channel plan) and postconditions (test mode activated or deactivated, new join, channel plan modified), and
+the planner orders the requested tests to minimize the Test Mode activations, joins and resets added to satisfy them.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+ACTIVATION_TEST = "td_lorawan_act_01"
+DEACTIVATION_TEST = "td_lorawan_deactivate"
+RESET_TEST = "td_lorawan_reset"
+
+TestConditions = collections.namedtuple("TestConditions",
+                                        "requires_test_mode requires_default_channels test_mode_after joins "
+                                        "modifies_channels")
+TestConditions.__new__.__defaults__ = (True, False, None, False, False)
+TestConditions.__doc__ = """
+Preconditions and postconditions of a test.
+requires_test_mode: the DUT must be in test mode when the test starts.
+requires_default_channels: the DUT must use the default channel plan (e.g. the test adds channels in fixed indexes).
+test_mode_after: test mode state when the test finishes (None if the test doesn't change it).
+joins: the test triggers an OTAA join (the default channel plan is restored).
+modifies_channels: the channel plan isn't the default one when the test finishes.
+"""
+
+DeviceState = collections.namedtuple("DeviceState", "test_mode default_channels")
+
+INITIAL_STATE = DeviceState(test_mode=False, default_channels=True)
+# State after td_lorawan_reset: test mode activated again, the channel plan is unknown.
+AFTER_RESET_STATE = DeviceState(test_mode=True, default_channels=False)
+
+_OTAA_JOIN = TestConditions(joins=True, test_mode_after=True)
+
+TEST_CONDITIONS = {
+    ACTIVATION_TEST: TestConditions(requires_test_mode=False, test_mode_after=True),
+    "td_lorawan_act_02": _OTAA_JOIN,
+    "td_lorawan_act_03": _OTAA_JOIN,
+    "td_lorawan_act_04": TestConditions(joins=True, test_mode_after=True, modifies_channels=True),
+    "td_lorawan_act_05": _OTAA_JOIN,
+    "td_lorawan_mac_03": TestConditions(requires_default_channels=True, modifies_channels=True),
+    "td_lorawan_mac_04": TestConditions(requires_default_channels=True, modifies_channels=True),
+    "td_lorawan_mac_05": TestConditions(requires_default_channels=True, modifies_channels=True),
+    DEACTIVATION_TEST: TestConditions(test_mode_after=False),
+    RESET_TEST: TestConditions(requires_test_mode=False, test_mode_after=True),
+}
+# Tests not in TEST_CONDITIONS (e.g. td_lorawan_fun_01) need the test mode and don't change the state of the DUT.
+DEFAULT_CONDITIONS = TestConditions()
+
+
+def register_conditions(test_name, conditions):
+    """ Declares the conditions of a test (e.g. an out-of-tree test registered with an entry point)."""
+    TEST_CONDITIONS[test_name] = conditions
+
+
+def conditions_of(test_name):
+    return TEST_CONDITIONS.get(test_name, DEFAULT_CONDITIONS)
+
+
+def state_after(state, test_name):
+    """ Returns the DeviceState after running a test (assuming that it passes)."""
+    conditions = conditions_of(test_name)
+    test_mode = state.test_mode if conditions.test_mode_after is None else conditions.test_mode_after
+    default_channels = state.default_channels
+    if conditions.joins:
+        default_channels = True
+    if conditions.modifies_channels:
+        default_channels = False
+    return DeviceState(test_mode=test_mode, default_channels=default_channels)
+
+
+class TestPlan(object):
+    """ Ordered list of tests of a session, with the number of transitions that it needs."""
+
+    def __init__(self, tests, requested_tests, activations, joins, unsatisfied):
+        """
+        :param tests: ordered list of the test names to be run.
+        :param requested_tests: list of the test names in the order requested by the user.
+        :param activations: number of Test Mode activations (ACT 01) added by the planner.
+        :param joins: number of OTAA joins of the plan.
+        :param unsatisfied: list of the tests that run without their default channel plan precondition.
+        """
+        self.tests = tests
+        self.requested_tests = requested_tests
+        self.activations = activations
+        self.joins = joins
+        self.unsatisfied = unsatisfied
+
+    def get_printable_str(self):
+        lines = ["Test plan: " + ", ".join(self.tests),
+                 f"Activations added: {self.activations}, joins: {self.joins}."]
+        if self.unsatisfied:
+            lines.append("Run without the default channel plan: " + ", ".join(self.unsatisfied))
+        return "\n".join(lines)
+
+
+class TestPlanner(object):
+    """
+    Orders the tests of a session. Starting from the state of the DUT, the next test is chosen greedily:
+    1. Tests that don't change the channel plan, grouped while the plan is the default one.
+    2. A test with a join, when the channel plan was modified and there are still tests that need the default one.
+    3. Tests that modify the channel plan, one at a time, followed by a join if possible.
+    4. The remaining joins, and at the end the deactivation of the test mode.
+    Ties keep the order requested by the user. The Test Mode activation (ACT 01) is added when the DUT is not
+    in test mode and the deactivation at the end of the session.
+    """
+
+    def __init__(self, reorder=True):
+        """
+        :param reorder: if False the requested order is kept and only the activation and deactivation are added.
+        """
+        self.reorder = reorder
+
+    def _rank(self, test_name, state, remaining):
+        conditions = conditions_of(test_name)
+        needs_activation = conditions.requires_test_mode and not state.test_mode
+        needs_default_channels = conditions.requires_default_channels and not state.default_channels
+        other_tests = [other for other in remaining if other != test_name]
+        if conditions.test_mode_after is False and any(conditions_of(other).requires_test_mode
+                                                       for other in other_tests):
+            category = 5
+        elif not conditions.joins and not conditions.modifies_channels:
+            category = 0
+        elif conditions.joins and not state.default_channels and not conditions.modifies_channels:
+            category = 1
+        elif conditions.modifies_channels and not conditions.joins:
+            category = 2
+        else:
+            category = 3
+        return int(needs_activation) + 2 * int(needs_default_channels), category
+
+    def plan(self, requested_tests, state=INITIAL_STATE, deactivate=True):
+        """
+        Plans the order of the tests.
+        :param requested_tests: list of test names in the order requested by the user.
+        :param state: DeviceState of the DUT when the session starts.
+        :param deactivate: if True the plan finishes with the deactivation of the test mode.
+        :return: TestPlan.
+        """
+        remaining = [test_name for test_name in requested_tests if test_name != DEACTIVATION_TEST]
+        deactivate = deactivate or DEACTIVATION_TEST in requested_tests
+        tests = []
+        activations = 0
+        joins = 0
+        unsatisfied = []
+        while remaining:
+            if self.reorder:
+                next_test = min(remaining, key=lambda test_name: (self._rank(test_name, state, remaining),
+                                                                  remaining.index(test_name)))
+            else:
+                next_test = remaining[0]
+            remaining.remove(next_test)
+            conditions = conditions_of(next_test)
+            if conditions.requires_test_mode and not state.test_mode:
+                tests.append(ACTIVATION_TEST)
+                activations += 1
+                state = state_after(state, ACTIVATION_TEST)
+            if conditions.requires_default_channels and not state.default_channels:
+                unsatisfied.append(next_test)
+            if conditions.joins:
+                joins += 1
+            tests.append(next_test)
+            state = state_after(state, next_test)
+        if deactivate and state.test_mode:
+            tests.append(DEACTIVATION_TEST)
+        test_plan = TestPlan(tests=tests,
+                             requested_tests=list(requested_tests),
+                             activations=activations,
+                             joins=joins,
+                             unsatisfied=unsatisfied)
+        logger.debug(test_plan.get_printable_str())
+        return test_plan
@@ -0,0 +1,131 @@
+"""
+Registry of the available test cases. The test modules are imported only when a test is run, instead
+of importing all of them when the Test Application Server starts.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import collections.abc
+import importlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+TESTS_PACKAGE = "lorawan.lorawan_conformance"
+ENTRY_POINT_GROUP = "lorawan_conformance.tests"
+
+
+class TestRegistry(collections.abc.Mapping):
+    """
+    Read only mapping {test_name: test module} of the available tests (as the dict of test modules used by the
+    session coordinator). Only the module paths are stored when the registry is created, each module is
+    imported the first time that its test is requested and the import time is recorded.
+    Out-of-tree test cases can be registered with an entry point of the ENTRY_POINT_GROUP group, e.g. in setup.py:
+    entry_points={'lorawan_conformance.tests': ['td_vendor_01 = vendor_tests.td_vendor_01']}
+    """
+
+    def __init__(self, test_groups=None, package=TESTS_PACKAGE, discover_entry_points=True):
+        """
+        :param test_groups: dict {group_name: [test_name]} of the tests of the package (test_names of
+            lorawan.lorawan_conformance by default).
+        :param package: package with a sub-package for each group of tests.
+        :param discover_entry_points: if True, the tests registered as entry points are added.
+        """
+        self._module_paths = collections.OrderedDict()
+        self._modules = {}
+        self._import_lock = threading.Lock()
+        self.import_times = collections.OrderedDict()
+        if test_groups is None:
+            test_groups = importlib.import_module(package).test_names
+        for test_group, group_test_names in test_groups.items():
+            for test_name in group_test_names:
+                self.register(test_name, f"{package}.{test_group}.{test_name}")
+        if discover_entry_points:
+            self.discover_entry_points()
+
+    def register(self, test_name, module_path):
+        """
+        Adds a test to the registry (the module is not imported).
+        :param test_name: name of the test (e.g. td_lorawan_act_01).
+        :param module_path: dotted path of the module with the TestAppManager of the test.
+        """
+        self._module_paths[test_name] = module_path
+        self._modules.pop(test_name, None)
+
+    def discover_entry_points(self, group=ENTRY_POINT_GROUP):
+        """ Registers the tests of the installed distributions that define entry points of the group."""
+        try:
+            import pkg_resources
+        except ImportError:
+            logger.debug("setuptools is not available, entry point discovery of tests skipped.")
+            return
+        for entry_point in pkg_resources.iter_entry_points(group):
+            logger.debug(f"Test {entry_point.name} registered from {entry_point.dist}.")
+            self.register(entry_point.name, entry_point.module_name)
+
+    def module_path(self, test_name):
+        return self._module_paths[test_name]
+
+    def __getitem__(self, test_name):
+        try:
+            return self._modules[test_name]
+        except KeyError:
+            module_path = self._module_paths[test_name]
+        with self._import_lock:
+            if test_name not in self._modules:
+                start_time = time.perf_counter()
+                self._modules[test_name] = importlib.import_module(module_path)
+                self.import_times[test_name] = time.perf_counter() - start_time
+                logger.debug(f"Test module {module_path} imported in {self.import_times[test_name] * 1000:.1f} ms.")
+        return self._modules[test_name]
+
+    def __contains__(self, test_name):
+        return test_name in self._module_paths
+
+    def __iter__(self):
+        return iter(self._module_paths)
+
+    def __len__(self):
+        return len(self._module_paths)
+
+    def loaded(self):
+        """ Returns the names of the tests whose modules were already imported."""
+        return [test_name for test_name in self._module_paths if test_name in self._modules]
+
+    def load_all(self):
+        """ Imports the modules of all the registered tests (e.g. to check them before a session)."""
+        for test_name in self._module_paths:
+            self[test_name]
+
+    def import_report(self):
+        """ Returns a printable report of the import time of the loaded test modules, slowest first."""
+        lines = [f"{import_time * 1000:8.1f} ms  {test_name} ({self._module_paths[test_name]})"
+                 for test_name, import_time in sorted(self.import_times.items(),
+                                                      key=lambda item: item[1],
+                                                      reverse=True)]
+        lines.append(f"{sum(self.import_times.values()) * 1000:8.1f} ms  total "
+                     f"({len(self.import_times)}/{len(self)} test modules loaded)")
+        return "\n".join(lines)
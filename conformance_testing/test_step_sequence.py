@@ -27,7 +27,9 @@ particular technology under test (e.g. LoRaWAN).
 # SOFTWARE.
 #################################################################################
 import abc
+import collections
 import logging
+import os
 
 import conformance_testing.test_errors as test_errors
 import utils
@@ -40,6 +42,19 @@ from conformance_testing.testingtool_messages import TestingToolMessage
 logger = logging.getLogger(__name__)
 
 
+def _float_from_env(variable_name, default):
+    value_str = os.environ.get(variable_name)
+    return float(value_str) if value_str else default
+
+
+# Deadlines of the tests (seconds, 0 disables them) and number of times that a step waits again for the DUT
+# before failing with a TimeOutError. The steps that wait for an action of the user (e.g. a manual reset of the DUT)
+# disable their deadline with timeout_seconds = 0.
+STEP_TIMEOUT_SECONDS = _float_from_env('TAS_STEP_TIMEOUT', 120.0)
+TEST_TIMEOUT_SECONDS = _float_from_env('TAS_TEST_TIMEOUT', 900.0)
+STEP_TIMEOUT_RETRIES = int(_float_from_env('TAS_STEP_TIMEOUT_RETRIES', 0))
+
+
 class Step(object, metaclass=abc.ABCMeta):
     """
     This abstract class represents a step of the test under execution, defining the basic and common
@@ -47,7 +62,10 @@ class Step(object, metaclass=abc.ABCMeta):
     step should be designed to test one specific functionality of the communication standard under test.
     """
 
-    def __init__(self, ctx_test_manager, step_name, next_step=None):
+    # Seconds that the step waits for a message of the DUT (None uses the step_timeout_seconds of the TestManager).
+    timeout_seconds = None
+
+    def __init__(self, ctx_test_manager, step_name, next_step=None, timeout_seconds=None):
         """Step constructor. The step attribute context_test_session_coordinator is a reference to the Test App Server instance
         of which this step is part.
         """
@@ -55,6 +73,8 @@ class Step(object, metaclass=abc.ABCMeta):
         self.ctx_test_manager = ctx_test_manager
         self.next_step = next_step
         self.received_testscript_msg = None
+        if timeout_seconds is not None:
+            self.timeout_seconds = timeout_seconds
 
     @abc.abstractmethod
     def step_handler(self, ch, method, properties, body):
@@ -71,6 +91,16 @@ class Step(object, metaclass=abc.ABCMeta):
         """
         pass
 
+    def on_timeout(self, retry):
+        """
+        Called when the DUT doesn't send any message before the deadline of the step and the step waits again
+        (retry policy of the TestManager). Should be overwritten by the steps that can repeat their last action.
+        :param retry: number of the retry (starting at 1).
+        :return: None
+        """
+        logger.info(f"Test {self.ctx_test_manager.tc_name}: no response in step {self.name}, waiting again "
+                    f"(retry {retry}/{self.ctx_test_manager.step_timeout_retries}).")
+
     def send_downlink(self, msg, routing_key):
         logger.debug(msg)
         self.ctx_test_manager.ctx_test_session_coordinator.publish(msg=msg,
@@ -85,31 +115,36 @@ class Step(object, metaclass=abc.ABCMeta):
         :param additional_message: Additional message to be presented to the user.
         :return: None
         """
-        if not received_str:
-            received_str = self.received_testscript_msg.get_printable_str(
-                encryption_key=self.ctx_test_manager.device_under_test.loramac_params.appskey)
-        step_report = ui_reports.InputFormBody(
-            title=f"{self.ctx_test_manager.tc_name.upper()}: Step information",
-            tag_key=self.ctx_test_manager.tc_name,
-            tag_value=" ")
-        if self.next_step:
-            step_name = self.next_step.name
-        else:
-            step_name = "No next step."
-        step_info_str = f"\nNext step: {step_name}\nReceived from DUT:\n {received_str}"
-        step_report.add_field(ui_reports.ParagraphField(name=f"Completed Step: {self.name}",
-                                                        value=""))
-        for line in step_info_str.split("\n"):
-            step_report.add_field(ui_reports.ParagraphField(name="",
-                                                            value=line))
-        if sending:
-            step_report.add_field(ui_reports.ParagraphField(name="Sending to DUT:",
-                                                            value=utils.bytes_to_text(sending)))
-        if additional_message:
-            step_report.add_field(ui_reports.ParagraphField(name="Additional information:",
-                                                            value=additional_message))
-        ui_publisher.display_on_gui(msg_str=str(step_report),
-                                    key_prefix=message_broker.service_names.test_session_coordinator)
+        received_msg = self.received_testscript_msg
+        appskey = self.ctx_test_manager.device_under_test.loramac_params.appskey
+        tc_name = self.ctx_test_manager.tc_name
+        step_name = self.name
+        next_step_name = self.next_step.name if self.next_step else "No next step."
+
+        def render():
+            received = received_str
+            if not received:
+                received = received_msg.get_printable_str(encryption_key=appskey)
+            step_report = ui_reports.InputFormBody(
+                title=f"{tc_name.upper()}: Step information",
+                tag_key=tc_name,
+                tag_value=" ")
+            step_info_str = f"\nNext step: {next_step_name}\nReceived from DUT:\n {received}"
+            step_report.add_field(ui_reports.ParagraphField(name=f"Completed Step: {step_name}",
+                                                            value=""))
+            for line in step_info_str.split("\n"):
+                step_report.add_field(ui_reports.ParagraphField(name="",
+                                                                value=line))
+            if sending:
+                step_report.add_field(ui_reports.ParagraphField(name="Sending to DUT:",
+                                                                value=utils.bytes_to_text(sending)))
+            if additional_message:
+                step_report.add_field(ui_reports.ParagraphField(name="Additional information:",
+                                                                value=additional_message))
+            return str(step_report)
+
+        # The report is rendered and published by the reporting thread, after the downlink of the step was sent.
+        ui_publisher.defer_report(render, key_prefix=message_broker.service_names.test_session_coordinator)
 
     def success(self):
         """
@@ -123,9 +158,107 @@ class Step(object, metaclass=abc.ABCMeta):
         self.ctx_test_manager.ctx_test_session_coordinator.consume_stop()
 
 
+StepSpec = collections.namedtuple("StepSpec", "name step_class next_step description kwargs")
+StepSpec.__new__.__defaults__ = (None, "", ())
+StepSpec.__doc__ = """
+Declaration of a step of a test: name, Step class, name of the next step (None for the final step), description
+shown in the GUI and dict of additional arguments of the constructor of the class (e.g. count_limit).
+"""
+
+
+class TestDefinition(object):
+    """
+    Declarative description of the steps of a test, validated once when the test module is imported. The
+    TestManager of each session creates its own steps from the declaration and then follows their next_step
+    references (the steps that check the DUT before going on, or repeat themselves, e.g. CountingStep, change
+    them while the test runs). The description of the test shown in the GUI is rendered only once.
+    The steps are listed in execution order: the first one is the initial step and each step can only jump to a
+    step declared after it.
+    """
+    __slots__ = ("test_id", "description", "steps", "initial_step", "_reports")
+
+    def __init__(self, test_id, description, steps):
+        """
+        :param test_id: identifier of the test shown in the GUI (e.g. TD_LoRaWAN_ACT_01).
+        :param description: objective, references and pre-test conditions of the test.
+        :param steps: list of StepSpec in execution order.
+        """
+        self.test_id = test_id
+        self.description = description
+        self.steps = tuple(StepSpec(name=spec.name,
+                                    step_class=spec.step_class,
+                                    next_step=spec.next_step,
+                                    description=spec.description,
+                                    kwargs=tuple(sorted(dict(spec.kwargs).items()))) for spec in steps)
+        if not self.steps:
+            raise ValueError(f"{test_id}: a test needs at least one step.")
+        step_names = [spec.name for spec in self.steps]
+        for step_index, spec in enumerate(self.steps):
+            if spec.name in step_names[:step_index]:
+                raise ValueError(f"{test_id}: repeated step {spec.name}.")
+            if spec.next_step is not None and spec.next_step not in step_names[step_index + 1:]:
+                raise ValueError(f"{test_id}: the next step of {spec.name} ({spec.next_step}) must be declared "
+                                 f"after it.")
+        self.initial_step = self.steps[0].name
+        self._reports = dict()
+
+    def report_str(self, tc_name):
+        """ Returns the description of the test to be displayed in the GUI (rendered the first time)."""
+        try:
+            return self._reports[tc_name]
+        except KeyError:
+            pass
+        test_label = ui_reports.InputFormBody(title=f"TEST CASE: {tc_name}",
+                                              tag_key=tc_name,
+                                              tag_value=" ")
+        descriptions = [(f"Test ID: {self.test_id}", self.description)]
+        descriptions.extend((f"Step {step_number}: {spec.name}", spec.description)
+                            for step_number, spec in enumerate(self.steps, start=1))
+        for step_name, description in descriptions:
+            test_label.add_field(ui_reports.ParagraphField(name=step_name, value=""))
+            for line in description.split("\n"):
+                test_label.add_field(ui_reports.ParagraphField(name="", value=line))
+        self._reports[tc_name] = str(test_label)
+        return self._reports[tc_name]
+
+    def build_steps(self, ctx_test_manager):
+        """
+        Creates the steps of a session of the test.
+        :param ctx_test_manager: TestManager of the session.
+        :return: dict {step name: Step}.
+        """
+        session_steps = dict()
+        for spec in reversed(self.steps):
+            session_steps[spec.name] = spec.step_class(ctx_test_manager=ctx_test_manager,
+                                                       step_name=spec.name,
+                                                       next_step=session_steps.get(spec.next_step),
+                                                       **dict(spec.kwargs))
+        return session_steps
+
+
+class TestRunState(object):
+    """ Per session state of the execution of a test (deadlines and duration of the steps)."""
+    __slots__ = ("step_start_time", "step_retries", "step_timer", "test_timer", "step_durations")
+
+    def __init__(self):
+        self.step_start_time = None
+        self.step_retries = 0
+        self.step_timer = None
+        self.test_timer = None
+        self.step_durations = []
+
+
 class TestManager(object, metaclass=abc.ABCMeta):
     """ The implementation of each Test Case consists of a Test Manager that knows the list of steps to be executed.
+    The test has a deadline and each step another one (renewed with every message of the DUT), enforced with timers
+    of the connection of the session coordinator. When the step deadline expires the step waits again up to
+    step_timeout_retries times and then the test fails with a TimeOutError.
     """
+    step_timeout_seconds = STEP_TIMEOUT_SECONDS
+    test_timeout_seconds = TEST_TIMEOUT_SECONDS
+    step_timeout_retries = STEP_TIMEOUT_RETRIES
+    # TestDefinition of the tests declared with a table of steps (None if the TestAppManager creates its steps).
+    definition = None
 
     @abc.abstractmethod
     def __init__(self, test_name, ctx_test_session_coordinator):
@@ -139,6 +272,12 @@ class TestManager(object, metaclass=abc.ABCMeta):
         self.test_label = ui_reports.InputFormBody(title=f"TEST CASE: {self.tc_name}",
                                                    tag_key=self.tc_name,
                                                    tag_value=" ")
+        self.current_step = None
+        self.steps = dict()
+        self.run_state = TestRunState()
+        if self.definition is not None:
+            self.steps = self.definition.build_steps(ctx_test_manager=self)
+            self.current_step = self.steps[self.definition.initial_step]
         self.ctx_test_session_coordinator.declare_and_consume(queue_name='up_tas',
                                                               routing_key=routing_keys.fromAgent + '.#',
                                                               durable=False,
@@ -148,8 +287,15 @@ class TestManager(object, metaclass=abc.ABCMeta):
 
     def get_testcase_str(self):
         """ Returns a string with all the information of the tests to be displayed to the user."""
+        if self.definition is not None:
+            return self.definition.report_str(self.tc_name)
         return str(self.test_label)
 
+    @property
+    def step_durations(self):
+        """ List of (step name, seconds) of the steps completed by the test."""
+        return self.run_state.step_durations
+
     def add_step_description(self, step_name, description):
         """ Adds a text field in the test case description to be shown in the GUI."""
         description_lines = description.split('\n')
@@ -160,10 +306,17 @@ class TestManager(object, metaclass=abc.ABCMeta):
     def start_test(self):
         ui_publisher.display_on_gui(msg_str=self.get_testcase_str(),
                                     key_prefix=message_broker.service_names.test_session_coordinator)
+        self.run_state.step_start_time = self.ctx_test_session_coordinator.monotonic_time()
+        if self.test_timeout_seconds:
+            self.run_state.test_timer = self.ctx_test_session_coordinator.add_timeout(self.test_timeout_seconds,
+                                                                                      self.test_timeout_handler)
+        self.arm_step_timeout()
         self.ctx_test_session_coordinator.consume_start()
 
     def go_to_next_step(self):
         if self.current_step.next_step:
+            if self.current_step.next_step is not self.current_step:
+                self.record_step_duration()
             self.current_step = self.current_step.next_step
             self.current_step.ctx_test_manager = self
 
@@ -174,3 +327,62 @@ class TestManager(object, metaclass=abc.ABCMeta):
                                        properties=properties,
                                        body=body)
         self.go_to_next_step()
+        self.run_state.step_retries = 0
+        self.arm_step_timeout()
+
+    # >> Deadlines of the test -------------------------------------------------------------------
+    def record_step_duration(self):
+        """ Records the time spent in the current step (the report shows it with the test verdict)."""
+        now = self.ctx_test_session_coordinator.monotonic_time()
+        if self.run_state.step_start_time is not None and self.current_step is not None:
+            self.run_state.step_durations.append((self.current_step.name, now - self.run_state.step_start_time))
+        self.run_state.step_start_time = now
+
+    def current_step_timeout(self):
+        if self.current_step.timeout_seconds is not None:
+            return self.current_step.timeout_seconds
+        return self.step_timeout_seconds
+
+    def arm_step_timeout(self):
+        """ (Re)starts the deadline of the current step."""
+        if self.run_state.step_timer is not None:
+            self.ctx_test_session_coordinator.remove_timeout(self.run_state.step_timer)
+            self.run_state.step_timer = None
+        step_timeout = self.current_step_timeout()
+        if step_timeout:
+            self.run_state.step_timer = self.ctx_test_session_coordinator.add_timeout(step_timeout,
+                                                                                      self.step_timeout_handler)
+
+    def cancel_timeouts(self):
+        """ Removes the timers of the test and records the duration of the last step (called when the test ends)."""
+        for timer_id in (self.run_state.step_timer, self.run_state.test_timer):
+            if timer_id is not None:
+                self.ctx_test_session_coordinator.remove_timeout(timer_id)
+        self.run_state.step_timer = None
+        self.run_state.test_timer = None
+        if self.run_state.step_start_time is not None:
+            self.record_step_duration()
+            self.run_state.step_start_time = None
+
+    def step_timeout_handler(self):
+        self.run_state.step_timer = None
+        if self.run_state.step_retries < self.step_timeout_retries:
+            self.run_state.step_retries += 1
+            self.current_step.on_timeout(retry=self.run_state.step_retries)
+            self.arm_step_timeout()
+            return
+        self.timeout_expired(f"No response from the DUT in {self.current_step_timeout()} s "
+                             f"({self.run_state.step_retries} retries).")
+
+    def test_timeout_handler(self):
+        self.run_state.test_timer = None
+        self.timeout_expired(f"The test didn't finish in {self.test_timeout_seconds} s.")
+
+    def timeout_expired(self, description):
+        """ Fails the test with a TimeOutError, handled by the session coordinator."""
+        self.cancel_timeouts()
+        self.ctx_test_session_coordinator.test_timed_out(
+            test_errors.TimeOutError(description=description,
+                                     test_case=self.tc_name,
+                                     step_name=self.current_step.name))
+    # << End deadlines of the test ---------------------------------------------------------------
@@ -26,63 +26,75 @@ This Module define the main services of the Test Session Coordinator in charge o
 # SOFTWARE.
 #################################################################################
 import json
+import collections
 import logging
+import time
 
 import lorawan.sessions as device_sessions
 import lorawan.parsing.configuration as configuration_parser
+from lorawan.parsing import flora_messages
 import message_queueing
 import conformance_testing.test_errors as test_errors
+from conformance_testing import sharding
+from conformance_testing import results_store
+from conformance_testing import session_capture
+from conformance_testing import test_planner
 from user_interface.ui import ui_publisher
 import user_interface.ui_reports as ui_reports
+import user_interface.ui_errors
 import parameters.message_broker as message_broker
 from parameters.message_broker import routing_keys
 
 logger = logging.getLogger(__name__)
 
+# Seconds that the requests answered by the user in the GUI wait for the reply (None waits until the user answers).
+GUI_REPLY_TIMEOUT_SECONDS = None
 
-class TestSessionCoordinator(message_queueing.MqInterface):
+
+class DeviceTestSession(object):
     """
-    This class implements the testing service and is in charge of coordinating the execution
-    of the selected tests. It is a MqInterface, it can communicate with the RMQ broker in order to receive uplink
-    messages and send downlink messages to the agent (using the correct routing key).
+    Test session of one Device Under Test (DUT). It keeps the state of the session of the device (list of tests,
+    current test with its step state machine, downlink counter and reset logic) and is used by the Test Managers
+    of the device as their session coordinator: the uplink messages of the device are dispatched by the
+    TestSessionCoordinator, that multiplexes the sessions of all the devices in a single consumer.
     """
 
-    def __init__(self, reset_attemps=3):
+    def __init__(self, ctx_test_session_coordinator, device_under_test, requested_tests, reset_attemps=3,
+                 planner=None):
         """
-        The constructor initializes the downlink counter of the test session (defined in the test application
-        protocol) and declares logging queues in the RMQ Broker to avoid the message loss (in case that the clients
-        haven't initialized the logging queues when the session starts.
+        :param ctx_test_session_coordinator: TestSessionCoordinator multiplexing the sessions.
+        :param device_under_test: EndDevice under test.
+        :param requested_tests: list of the names of the tests to be run.
+        :param reset_attemps: maximum number of consecutive resets of the device.
+        :param planner: TestPlanner used to order again the remaining tests after a reset of the device (None
+            keeps the order).
         """
-        super().__init__()
-        self.device_under_test = None
+        self.ctx_test_session_coordinator = ctx_test_session_coordinator
+        self.device_under_test = device_under_test
+        self.requested_tests = requested_tests
+        self.planner = planner
         self.current_test = None
-        self.requested_tests = None
+        self.current_test_name = None
+        self.test_completed = False
+        self.finished = False
+        self._message_handler = None
         self._next_test_index = 0
         self._reset_dut = False
         self._reset_count = 0
         self._reset_limit = reset_attemps
         self.downlink_counter = 0
-        self.testingtool_on = True
-        self.last_deviceid = None
+        self.step_durations = []
+        self._test_start_time = None
+        self._test_start_monotonic = None
+        self._last_uplink = None
+        self.result_report = ui_reports.InputFormBody(
+            title=f"Results summary of the tests ({self.deveui_hex}).",
+            tag_key="Test",
+            tag_value=f"Results {self.deveui_hex}")
 
-        # >> Declare log queue to avoid message loss --------------------------------------
-        self.declare_queue(queue_name='logger_tas', auto_delete=True, exclusive=False)
-        log_tas_routing_key = "log." + message_broker.service_names.test_session_coordinator
-        self.bind_queue(queue_name='logger_tas', routing_key=log_tas_routing_key)
-
-        self.declare_queue(queue_name='logger_all', auto_delete=True, exclusive=False)
-        log_all_routing_key = "log.#"
-        self.bind_queue(queue_name='logger_all', routing_key=log_all_routing_key)
-        # << End declare log queue  -------------------------------------------------------
-        self.declare_queue(queue_name='display_gui', auto_delete=False, exclusive=False)
-        self.bind_queue(queue_name='display_gui',
-                        routing_key=message_broker.routing_keys.ui_all_users + '.display')
-        self.declare_queue(queue_name='configuration_request', auto_delete=False, exclusive=False)
-        self.bind_queue(queue_name='configuration_request',
-                        routing_key=message_broker.routing_keys.configuration_request)
-        self.declare_queue(queue_name='request_action_gui', auto_delete=False, exclusive=False)
-        self.bind_queue(queue_name='request_action_gui',
-                        routing_key=message_broker.routing_keys.ui_all_users + '.request')
+    @property
+    def deveui_hex(self):
+        return self.device_under_test.deveui.hex()
 
     @property
     def reset_dut(self):
@@ -122,7 +134,12 @@ class TestSessionCoordinator(message_queueing.MqInterface):
             logger.info("Resetting device.")
             self.reset_dut = False
             self._reset_count += 1
-            return "td_lorawan_reset"
+            if self.planner is not None:
+                remaining_plan = self.planner.plan(self.requested_tests[self._next_test_index:],
+                                                   state=test_planner.AFTER_RESET_STATE,
+                                                   deactivate=False)
+                self.requested_tests[self._next_test_index:] = remaining_plan.tests
+            return test_planner.RESET_TEST
         else:
             logger.info("Returning new test.")
             self._reset_count = 0
@@ -130,17 +147,409 @@ class TestSessionCoordinator(message_queueing.MqInterface):
             self._next_test_index += 1
             return self.requested_tests[idx]
 
-    def publish(self, msg, routing_key, exchange_name=message_queueing.DEFAULT_EXCHANGE):
+    def devaddrs(self):
+        """ Returns the DevAddr of the current, previous and default sessions of the device."""
+        device = self.device_under_test
+        return {loramac.devaddr for loramac in (device.loramac_params,
+                                                device.loramac_previous_session,
+                                                device.loramac_defaults) if loramac is not None}
+
+    # >> Session coordinator interface used by the Test Managers and steps ---------------------------
+    def publish(self, msg, routing_key, exchange_name=message_queueing.DEFAULT_EXCHANGE, properties=None):
         """
-        Sends a message to the broker using the default channel.
+        Sends a message to the broker using the channel of the coordinator.
         :param msg: byte sequence of the message to be sent.
         :param routing_key:
         :param exchange_name:
+        :param properties: AMQP properties of the message (e.g. content type).
         :return:
         """
         if self.current_test and routing_keys.toAgent in routing_key:
             self.downlink_counter += 1
-        super().publish(msg, routing_key)
+        self.ctx_test_session_coordinator.publish(msg, routing_key, exchange_name=exchange_name,
+                                                  properties=properties)
+
+    def declare_and_consume(self, queue_name, routing_key, callback, **kwargs):
+        """
+        Registers the uplink message handler of the current test. The uplinks are consumed by the
+        TestSessionCoordinator and dispatched to the handler of the session of the device.
+        """
+        self._message_handler = callback
+
+    def consume_start(self):
+        """ The coordinator consumes the uplinks of all the sessions."""
+        pass
+
+    def consume_stop(self):
+        """ Called when the current test ends (e.g. a successful final step)."""
+        self.test_completed = True
+
+    def add_timeout(self, seconds, callback):
+        """ Adds a timer (deadline of a test or step) to the connection of the coordinator."""
+        return self.ctx_test_session_coordinator.add_timeout(seconds, callback)
+
+    def remove_timeout(self, timer_id):
+        self.ctx_test_session_coordinator.remove_timeout(timer_id)
+
+    def monotonic_time(self):
+        return self.ctx_test_session_coordinator.monotonic_time()
+
+    def test_timed_out(self, timeout_error):
+        """
+        Called by the Test Manager when a deadline of the current test expires: the test fails and the next one
+        is started.
+        :param timeout_error: TimeOutError describing the expired deadline.
+        """
+        if self.finished or self.current_test is None:
+            return
+        self.end_current_test(failure=timeout_error)
+        self.start_next_test(self.ctx_test_session_coordinator.test_modules)
+        self.ctx_test_session_coordinator.stop_if_finished()
+    # << End session coordinator interface -----------------------------------------------------------
+
+    def start_next_test(self, test_modules):
+        """
+        Creates the Test Manager of the next test of the session and starts it. Errors (e.g. unknown test names)
+        are reported and the next test is tried.
+        :param test_modules: dict {test_name: test module} of the available tests.
+        :return: True if a test was started, False if the session finished.
+        """
+        while self.test_available():
+            test_name = self.pop_next_test_name()
+            if test_name is None:
+                break
+            self.current_test_name = test_name
+            try:
+                try:
+                    test_module = test_modules[test_name]
+                except KeyError:
+                    raise test_errors.UnknownTestError(test_name)
+                except Exception as import_error:
+                    # The test modules are imported lazily, a broken one only skips its test.
+                    logger.exception(f"Unable to import the module of the test {test_name}.")
+                    raise test_errors.UnknownTestError(
+                        f"{test_name} (unable to import its module: {import_error!r})") from import_error
+                logger.debug(f"Selected test: {test_name} (DevEUI {self.deveui_hex})")
+                self.test_completed = False
+                self._message_handler = None
+                self._test_start_time = time.time()
+                self._test_start_monotonic = self.monotonic_time()
+                self._last_uplink = None
+                self.current_test = test_module.TestAppManager(self)
+                self.current_test.start_test()
+                return True
+            except test_errors.UnknownTestError as unknown_test:
+                self.ctx_test_session_coordinator.handle_error(raised_exception=unknown_test,
+                                                               test_name=test_name,
+                                                               result_report=self.result_report,
+                                                               session=self)
+        self.current_test = None
+        self.finished = True
+        return False
+
+    def handle_uplink(self, ch, method, properties, body, test_modules):
+        """
+        Runs the current step of the current test with an uplink message of the device. If the test ends
+        (PASS or FAIL) the next one is started.
+        """
+        if self.finished or self._message_handler is None:
+            return
+        self._last_uplink = (body, properties.content_type)
+        try:
+            self._message_handler(ch, method, properties, body)
+        except test_errors.TestFailError as test_fail_exception:
+            self.end_current_test(failure=test_fail_exception)
+        else:
+            if not self.test_completed:
+                return
+            self.end_current_test()
+        self.start_next_test(test_modules)
+
+    def end_current_test(self, failure=None):
+        """
+        Stops the deadlines of the current test and adds its verdict and the duration of its steps to the results
+        report.
+        :param failure: TestFailError that made the test fail (None if it passed).
+        """
+        durations = []
+        if self.current_test is not None:
+            self.current_test.cancel_timeouts()
+            durations = self.current_test.step_durations
+            self.step_durations.extend((self.current_test_name, step_name, seconds)
+                                       for step_name, seconds in durations)
+        if failure is None:
+            self.result_report.add_field(ui_reports.ParagraphField(name=self.current_test_name,
+                                                                   value="PASS"))
+        else:
+            self.ctx_test_session_coordinator.handle_error(raised_exception=failure,
+                                                           test_name=self.current_test_name,
+                                                           result_report=self.result_report,
+                                                           session=self)
+        if durations:
+            self.result_report.add_field(ui_reports.ParagraphField(
+                name=":",
+                value="Steps: " + ", ".join(f"{step_name} {seconds:.2f} s" for step_name, seconds in durations)))
+        self.ctx_test_session_coordinator.record_result(self.test_result(durations, failure))
+        self._message_handler = None
+
+    def last_message_hex(self):
+        """ Returns the hex string of the PHYPayload of the last uplink received in the current test."""
+        if self._last_uplink is None:
+            return None
+        body, content_type = self._last_uplink
+        try:
+            return flora_messages.GatewayMessage.from_bytes(
+                body, content_type=content_type).get_phypaload_bytes().hex()
+        except Exception:
+            return body.hex() if isinstance(body, bytes) else str(body)
+
+    def test_result(self, durations, failure=None):
+        """ Returns the TestResult of the current test, to be appended to the results store."""
+        if self._test_start_time is None:
+            started, duration = time.time(), 0.0
+        else:
+            started, duration = self._test_start_time, self.monotonic_time() - self._test_start_monotonic
+        return results_store.TestResult(
+            session_id=self.ctx_test_session_coordinator.session_id,
+            deveui=self.deveui_hex,
+            test_name=self.current_test_name,
+            verdict=results_store.VERDICT_PASS if failure is None else results_store.VERDICT_FAIL,
+            started=started,
+            duration=duration,
+            steps=list(durations),
+            error_type=type(failure).__name__ if failure is not None else None,
+            error_message=str(failure) if failure is not None else None,
+            last_message=self.last_message_hex())
+
+    def add_verdict(self):
+        """ Adds the verdict of the session to its results report."""
+        if not self.result_report.level == ui_reports.LEVEL_ERR:
+            self.result_report.level = ui_reports.LEVEL_HL
+            self.result_report.add_field(ui_reports.ParagraphField(name="TEST VERDICT: PASS", value=" "))
+        else:
+            self.result_report.add_field(ui_reports.ParagraphField(name="TEST VERDICT: FAIL", value=" "))
+
+
+class TestSessionCoordinator(message_queueing.MqInterface):
+    """
+    This class implements the testing service and is in charge of coordinating the execution
+    of the selected tests. It is a MqInterface, it can communicate with the RMQ broker in order to receive uplink
+    messages and send downlink messages to the agent (using the correct routing key).
+    Several Devices Under Test can be tested concurrently: each one has its own DeviceTestSession and the uplink
+    messages are dispatched to the session of the device (by DevEUI in the Join Requests and by DevAddr in the
+    data messages).
+    A coordinator with a worker_id runs as a worker of a ShardSupervisor: it consumes the uplinks forwarded
+    by the supervisor and announces the DevAddr of its devices after each join.
+    """
+
+    def __init__(self, reset_attemps=3, worker_id=None, amqp_url=None, planner=None, results=None):
+        """
+        The constructor declares logging queues in the RMQ Broker to avoid the message loss (in case that the
+        clients haven't initialized the logging queues when the session starts.
+        :param planner: TestPlanner that orders the tests requested in the session configuration.
+        :param results: results store where the result of each test is appended when it ends (optional).
+        """
+        super().__init__(amqp_url=amqp_url)
+        self.results = results
+        self.session_id = results_store.new_session_id(worker_id)
+        self.planner = planner if planner is not None else test_planner.TestPlanner()
+        self.worker_id = worker_id
+        self.device_ids = []
+        self.sessions = collections.OrderedDict()
+        self._sessions_by_devaddr = dict()
+        self._announced_devaddrs = dict()
+        self.requested_tests = None
+        self._reset_limit = reset_attemps
+        self.testingtool_on = True
+        self.last_deviceid = None
+        self._test_modules = None
+
+        # >> Declare log queue to avoid message loss --------------------------------------
+        self.declare_queue(queue_name='logger_tas', auto_delete=True, exclusive=False)
+        log_tas_routing_key = "log." + message_broker.service_names.test_session_coordinator
+        self.bind_queue(queue_name='logger_tas', routing_key=log_tas_routing_key)
+
+        self.declare_queue(queue_name='logger_all', auto_delete=True, exclusive=False)
+        log_all_routing_key = "log.#"
+        self.bind_queue(queue_name='logger_all', routing_key=log_all_routing_key)
+        # << End declare log queue  -------------------------------------------------------
+        self.declare_queue(queue_name='display_gui', auto_delete=False, exclusive=False)
+        self.bind_queue(queue_name='display_gui',
+                        routing_key=message_broker.routing_keys.ui_all_users + '.display')
+        self.declare_queue(queue_name='configuration_request', auto_delete=False, exclusive=False)
+        self.bind_queue(queue_name='configuration_request',
+                        routing_key=message_broker.routing_keys.configuration_request)
+        self.declare_queue(queue_name='request_action_gui', auto_delete=False, exclusive=False)
+        self.bind_queue(queue_name='request_action_gui',
+                        routing_key=message_broker.routing_keys.ui_all_users + '.request')
+
+    @property
+    def device_under_test(self):
+        """ Device under test of the first session (single device sessions)."""
+        return next(iter(self.sessions.values())).device_under_test if self.sessions else None
+
+    def add_device_session(self, device_id, requested_tests, planner=None):
+        """
+        Creates the test session of a device.
+        :param device_id: DeviceID of the device (DevEUI, DevAddr and keys).
+        :param requested_tests: list of the names of the tests to be run.
+        :param planner: TestPlanner that orders again the remaining tests after a reset (None keeps the order).
+        :return: the new DeviceTestSession.
+        """
+        device = device_sessions.EndDevice(ctx_test_tool_service=self,
+                                           deveui=device_id.deveui,
+                                           devaddr=device_id.devaddr,
+                                           appkey=device_id.appkey,
+                                           nwkskey=device_id.nwkskey,
+                                           appskey=device_id.appskey)
+        session = DeviceTestSession(ctx_test_session_coordinator=self,
+                                    device_under_test=device,
+                                    requested_tests=list(requested_tests),
+                                    reset_attemps=self._reset_limit,
+                                    planner=planner)
+        self.sessions[session.deveui_hex] = session
+        self._sessions_by_devaddr[device_id.devaddr] = session
+        self._announced_devaddrs[session.deveui_hex] = session.devaddrs()
+        self.device_ids.append(device_id)
+        self.last_deviceid = device_id
+        return session
+
+    def find_session(self, lorawan_message):
+        """
+        Returns the session of the device that sent the message (or None if the device is unknown). The Join
+        Requests are looked up by DevEUI and the data messages by DevAddr.
+        """
+        if lorawan_message is None:
+            return None
+        if lorawan_message.mhdr.mtype_str == 'JOIN_REQUEST':
+            if lorawan_message.macpayload.deveui_bytes is None:
+                return None
+            return self.sessions.get(lorawan_message.macpayload.deveui_bytes.hex())
+        devaddr = lorawan_message.macpayload.fhdr.devaddr_bytes
+        session = self._sessions_by_devaddr.get(devaddr)
+        if session is not None and devaddr in session.devaddrs():
+            return session
+        # The DevAddr of the devices changes with the joins, rebuild the index.
+        self._sessions_by_devaddr = {session_devaddr: device_session
+                                     for device_session in self.sessions.values()
+                                     for session_devaddr in device_session.devaddrs()}
+        return self._sessions_by_devaddr.get(devaddr)
+
+    def uplink_dispatcher(self, ch, method, properties, body):
+        """ Dispatches the uplink messages to the session of the device that sent it."""
+        try:
+            lorawan_message = flora_messages.GatewayMessage.from_bytes(
+                body, content_type=properties.content_type).parse_lorawan_message(ignore_format_errors=True)
+        except Exception as parsing_error:
+            logger.debug(f"Unable to parse uplink: {parsing_error}")
+            lorawan_message = None
+        session = self.find_session(lorawan_message)
+        if session is None:
+            active_sessions = [device_session for device_session in self.sessions.values()
+                               if not device_session.finished]
+            if len(active_sessions) != 1 or self.worker_id is not None:
+                logger.info("Uplink from an unknown device ignored.")
+                return
+            # A single device is under test: the message is checked by the test (e.g. a wrong DevAddr).
+            session = active_sessions[0]
+        session.handle_uplink(ch, method, properties, body, test_modules=self._test_modules)
+        if self.worker_id is not None:
+            self.announce_devaddrs(session)
+        self.stop_if_finished()
+
+    @property
+    def test_modules(self):
+        return self._test_modules
+
+    def record_result(self, test_result):
+        """ Appends the TestResult of a test of a device session to the results store."""
+        if self.results is None:
+            return
+        try:
+            self.results.record(test_result)
+        except Exception:
+            logger.exception(f"Unable to store the result of {test_result.test_name}.")
+
+    def stop_if_finished(self):
+        """ Stops consuming when all the device sessions finished."""
+        if all(device_session.finished for device_session in self.sessions.values()):
+            self.consume_stop()
+
+    def announce_devaddrs(self, session):
+        """ Informs the supervisor of the DevAddr of a device of the worker if they changed (e.g. after a join)."""
+        devaddrs = session.devaddrs()
+        if devaddrs == self._announced_devaddrs.get(session.deveui_hex):
+            return
+        self._announced_devaddrs[session.deveui_hex] = devaddrs
+        announcement = {"worker": self.worker_id,
+                        "DevEUI": session.deveui_hex,
+                        "DevAddr": sorted(devaddr.hex() for devaddr in devaddrs)}
+        self.publish(msg=json.dumps(announcement), routing_key=sharding.DEVADDR_ANNOUNCEMENT_KEY)
+
+    def publish_results(self):
+        """ Sends the result reports of the sessions of the worker to the supervisor."""
+        results = {"worker": self.worker_id,
+                   "reports": [session.result_report.to_dict() for session in self.sessions.values()]}
+        self.publish(msg=json.dumps(results), routing_key=sharding.RESULTS_KEY)
+
+    def session_info(self, random_seed=None):
+        """
+        Returns a dict describing the test sessions (devices, tests, random seed and planner), used to replay
+        them. It is published on the broker, so the keys of the devices are left out: the replay reads them from
+        a local device configuration.
+        """
+        return {"devices": [{"DevEUI": device_id.deveui.hex(),
+                             "DevAddr": device_id.devaddr.hex()} for device_id in self.device_ids],
+                "tests": {session.deveui_hex: session.requested_tests for session in self.sessions.values()},
+                "random_seed": random_seed,
+                "reorder": self.planner.reorder,
+                "worker": self.worker_id}
+
+    def start_sessions(self, test_modules, random_seed=None):
+        """
+        Declares the consumers of the uplinks and starts the first test of each device session.
+        :param test_modules: dict {test_name: test module} of the available tests.
+        :param random_seed: seed of the random numbers of the session (to be able to replay it).
+        :return: True if there are sessions with tests to be run.
+        """
+        self._test_modules = test_modules
+        if self.worker_id is None:
+            terminate_queue = 'testingtool_terminate_tas'
+            up_queue, up_routing_key = 'up_tas', routing_keys.fromAgent + '.#'
+            up_exclusive = True
+        else:
+            terminate_queue = f'testingtool_terminate_tas_worker_{self.worker_id}'
+            up_queue = sharding.worker_uplink_queue(self.worker_id)
+            up_routing_key = sharding.worker_uplink_key(self.worker_id) + '.#'
+            # Declared by the supervisor.
+            up_exclusive = False
+        self.declare_and_consume(queue_name=terminate_queue,
+                                 routing_key=routing_keys.testing_terminate,
+                                 callback=self.session_terminate_handler)
+        self.declare_and_consume(queue_name=up_queue,
+                                 routing_key=up_routing_key,
+                                 exclusive=up_exclusive,
+                                 durable=False,
+                                 auto_delete=up_exclusive,
+                                 callback=self.uplink_dispatcher)
+        self.publish(msg=json.dumps(self.session_info(random_seed=random_seed)),
+                     routing_key=routing_keys.session_info)
+        session_capture.seed_random(random_seed)
+        for session in self.sessions.values():
+            session.start_next_test(test_modules)
+        return any(not session.finished for session in self.sessions.values())
+
+    def run_sessions(self, test_modules, random_seed=None):
+        """
+        Runs the requested tests of all the device sessions concurrently, until all the sessions finish or the
+        session is terminated by the user.
+        :param test_modules: dict {test_name: test module} of the available tests.
+        :param random_seed: seed of the random numbers of the session (to be able to replay it).
+        :return: None
+        """
+        if self.start_sessions(test_modules, random_seed=random_seed):
+            logger.debug("Starting test sessions...")
+            self.consume_start()
 
     def wait_press_start(self):
         """ Publishes the Start button in the GUI."""
@@ -151,17 +560,11 @@ class TestSessionCoordinator(message_queueing.MqInterface):
                                               channel=self.channel,
                                               body=str(start_request_body))
 
-        start_reply_json = request_start.wait_response(timeout_seconds=120).decode()
+        start_reply_json = request_start.wait_response(timeout_seconds=GUI_REPLY_TIMEOUT_SECONDS,
+                                                       test_case="start of the session",
+                                                       step_name="Start button").decode()
         self.consume_stop()
 
-    def start_testing(self):
-        """ Starts the current test."""
-        self.declare_and_consume(queue_name='testingtool_terminate_tas',
-                                 routing_key=routing_keys.testing_terminate,
-                                 callback=self.session_terminate_handler)
-        logger.debug("Starting current test case...")
-        self.current_test.start_test()
-
     def session_terminate_handler(self, ch, method, properties, body):
         """ Handles a Sesstion Termination message."""
         logger.debug("SESSION TERMINATED BY THE USER.")
@@ -208,7 +611,9 @@ class TestSessionCoordinator(message_queueing.MqInterface):
                     body=str(device_request_body))
 
                 device_reply = device_request_body.get_parsed_reply(
-                    request_device.wait_response(timeout_seconds=120))
+                    request_device.wait_response(timeout_seconds=GUI_REPLY_TIMEOUT_SECONDS,
+                                                 test_case="device registration",
+                                                 step_name="Device information"))
 
                 device_id.deveui = validate_bytes(number_of_bytes=8,
                                                   field_str=device_reply["DevEUI"])
@@ -249,7 +654,9 @@ class TestSessionCoordinator(message_queueing.MqInterface):
             channel=self.channel,
             body=str(testcases_request_body))
         device_reply = testcases_request_body.get_parsed_reply(
-            request_testcases.wait_response(timeout_seconds=120))
+            request_testcases.wait_response(timeout_seconds=GUI_REPLY_TIMEOUT_SECONDS,
+                                            test_case="session configuration",
+                                            step_name="List of test cases"))
         return device_reply["TestCases"].split()
 
     def ask_configuration_register_device(self):
@@ -263,46 +670,71 @@ class TestSessionCoordinator(message_queueing.MqInterface):
         request_config = ui_reports.RPCRequest(request_key=routing_keys.configuration_request,
                                                channel=self.channel,
                                                body='{"_api_version": "1.0.0"}')
-        session_configuration_bytes = request_config.wait_response(timeout_seconds=10)
+        session_configuration_bytes = request_config.wait_response(timeout_seconds=GUI_REPLY_TIMEOUT_SECONDS,
+                                                                   test_case="session configuration",
+                                                                   step_name="Configuration request")
         logger.debug(f"Received configuration from GUI: \n{json.dumps(session_configuration_bytes.decode(), indent=4, sort_keys=True)}")
 
         config = ui_reports.SessionConfigurationBody.build_from_json(
             json_str=session_configuration_bytes.decode())
 
-        self.requested_tests = ["td_lorawan_act_01"]
         if config.testcases:
-            self.requested_tests.extend(config.testcases)
+            test_plan = self.planner.plan(config.testcases)
         else:
-            self.requested_tests.extend(self.get_testcases())
-
-        self.requested_tests.append("td_lorawan_deactivate")
+            test_plan = self.planner.plan(self.get_testcases())
+        self.requested_tests = test_plan.tests
         testcases_display = ui_reports.InputFormBody(title="Test Cases to be excecuted.",
                                                      tag_key="Configuration",
                                                      tag_value="Information")
         testcases_display.add_field(ui_reports.ParagraphField(
             name="TCs list:",
             value="\n".join(self.requested_tests)))
+        testcases_display.add_field(ui_reports.ParagraphField(
+            name="Plan:",
+            value=f"{test_plan.activations} activations and {test_plan.joins} joins."))
         ui_publisher.display_on_gui(msg_str=str(testcases_display),
                                     key_prefix=message_broker.service_names.test_session_coordinator)
-        device_id = self.get_device_from_gui()
+        if config.devices:
+            device_ids = [self.parse_device_config(device_config) for device_config in config.devices]
+        else:
+            device_ids = [self.get_device_from_gui()]
         #########################################################################################
-        self.device_under_test = device_sessions.EndDevice(ctx_test_tool_service=self,
-                                                           deveui=device_id.deveui,
-                                                           devaddr=device_id.devaddr,
-                                                           appkey=device_id.appkey,
-                                                           nwkskey=device_id.nwkskey,
-                                                           appskey=device_id.appskey)
-        self.last_deviceid = device_id
+        for device_id in device_ids:
+            self.add_device_session(device_id=device_id, requested_tests=self.requested_tests, planner=self.planner)
 
-    def handle_error(self, raised_exception, test_name, result_report=None):
+    @staticmethod
+    def parse_device_config(device_config):
         """
-        Handles a raised exception, setting a flag to reset the DUT in case of a test failure.
+        Creates the DeviceID of a device of the session configuration, with the fields hex encoded:
+        {"DevEUI": ..., "DevAddr": ..., "AppKey": ...} (optionally "AppSKey" and "NwkSKey", derived from the
+        AppKey as in the GUI if not provided).
+        """
+        try:
+            device_id = configuration_parser.DeviceID()
+            device_id.deveui = bytes.fromhex(device_config["DevEUI"])
+            device_id.devaddr = bytes.fromhex(device_config["DevAddr"])
+            device_id.appkey = bytes.fromhex(device_config["AppKey"])
+            device_id.appskey = bytes.fromhex(
+                device_config.get("AppSKey", "ff" + device_config["AppKey"][2:]))
+            device_id.nwkskey = bytes.fromhex(
+                device_config.get("NwkSKey", "00" + device_config["AppKey"][2:]))
+        except (KeyError, ValueError, TypeError) as config_error:
+            raise user_interface.ui_errors.SessionConfigurationBodyError(
+                f"Invalid device configuration {device_config}: {config_error}")
+        if (len(device_id.deveui), len(device_id.devaddr), len(device_id.appkey)) != (8, 4, 16):
+            raise user_interface.ui_errors.SessionConfigurationBodyError(
+                f"Invalid device configuration {device_config}: wrong field length.")
+        return device_id
+
+    def handle_error(self, raised_exception, test_name, result_report=None, session=None):
+        """
+        Handles a raised exception, setting a flag to reset the DUT of the session in case of a test failure.
         """
 
         error_name = type(raised_exception).__name__
         error_details = str(raised_exception)
-        if isinstance(raised_exception, test_errors.TestFailError):
-            self.reset_dut = True
+        if isinstance(raised_exception, test_errors.TestFailError) and session is not None:
+            session.reset_dut = True
         fail_message = f"Test {test_name} failed with {error_name} error."
         fail_message_paragraph = ui_reports.ParagraphField(name=test_name, value=fail_message)
         fail_details_paragraphs = [ui_reports.ParagraphField(name=":", value=line) for line in
@@ -322,4 +754,5 @@ class TestSessionCoordinator(message_queueing.MqInterface):
         step_error.level = ui_reports.LEVEL_ERR
         ui_publisher.display_on_gui(
             msg_str=str(step_error),
-            key_prefix=message_broker.service_names.test_session_coordinator)
+            key_prefix=message_broker.service_names.test_session_coordinator,
+            level=ui_reports.LEVEL_ERR)
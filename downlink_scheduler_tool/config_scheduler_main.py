@@ -7,18 +7,29 @@ from logger_configurator import LoggerConfigurator
 LoggerConfigurator(level="INFO")
 logger = logging.getLogger(__name__)
 
-POSTGRES_PORT = int(os.environ.get('POSTGRES_PORT'))
+# CSV, JSON or SQLite file with the devices served by the scheduler (devices_data.py if it isn't defined).
+SCHEDULER_DEVICES_PATH = os.environ.get('SCHEDULER_DEVICES_PATH')
+# Path of an embedded SQLite database, used instead of PostgreSQL if it's defined.
+SCHEDULER_DB_PATH = os.environ.get('SCHEDULER_DB_PATH')
+POSTGRES_PORT = int(os.environ.get('POSTGRES_PORT', 5432))
 POSTGRES_HOST = os.environ.get('POSTGRES_HOST')
+# Number of the last DevNonces of a device rejected in its joins (0 rejects every DevNonce used by the device).
+SCHEDULER_DEVNONCE_WINDOW = int(os.environ.get('SCHEDULER_DEVNONCE_WINDOW', 4))
 
-DB_CONFIG = {"database": "config_scheduler",
-             "host": POSTGRES_HOST,
-             "port": POSTGRES_PORT,
-             "user": "postgres",
-             "password": "CushVenyayz0"}
+if SCHEDULER_DB_PATH:
+    DB_CONFIG = {"path": SCHEDULER_DB_PATH}
+else:
+    DB_CONFIG = {"database": "config_scheduler",
+                 "host": POSTGRES_HOST,
+                 "port": POSTGRES_PORT,
+                 "user": "postgres",
+                 "password": "CushVenyayz0"}
 
 
 def main():
-    config_scheduler = downlink_scheduler.DownlinkScheduler(db_config=DB_CONFIG)
+    config_scheduler = downlink_scheduler.DownlinkScheduler(db_config=DB_CONFIG,
+                                                            devices_path=SCHEDULER_DEVICES_PATH,
+                                                            devnonce_window=SCHEDULER_DEVNONCE_WINDOW or None)
     config_scheduler.start_scheduler()
 
 
@@ -0,0 +1,263 @@
+"""
+Registry of the devices served by the downlink scheduler (DevEUI, AppEUI, AppKey and the optional DevAddr and
+command), indexed by DevEUI, AppEUI and DevAddr. The devices are loaded from a CSV, JSON or SQLite file that is
+watched for changes (only the modified devices are updated) and they can also be added or removed through the
+message broker while the scheduler is running.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import csv
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+SQLITE_TABLE = "devices"
+POLL_INTERVAL_SECONDS = 2
+
+
+def normalize_device(deveui, device):
+    """
+    Returns the DevEUI (upper case hex) and a copy of the device description with the AppEUI and the DevAddr in
+    upper case hex (the empty optional fields are removed).
+    """
+    device = {field: value for field, value in device.items() if value not in (None, "") and field != "deveui"}
+    if "appkey" not in device:
+        raise ValueError(f"Device {deveui} without appkey.")
+    for field in ("appeui", "devaddr"):
+        if field in device:
+            device[field] = device[field].upper()
+    return deveui.upper(), device
+
+
+def read_devices_file(path):
+    """
+    Reads the devices of a file:
+    - JSON: dict {DevEUI: device} (like devices_data.devices_to_configure) or list of devices with their "deveui".
+    - CSV: one device per row, with a header (deveui, appeui, appkey, command, devaddr).
+    - SQLite (.db, .sqlite, .sqlite3): the rows of the devices table, with the same columns than the CSV files.
+    :return: dict {DevEUI hex: device description}.
+    """
+    if path.endswith(SQLITE_EXTENSIONS):
+        connection = sqlite3.connect(path)
+        connection.row_factory = sqlite3.Row
+        try:
+            rows = [dict(row) for row in connection.execute(f"SELECT * FROM {SQLITE_TABLE};")]
+        finally:
+            connection.close()
+    elif path.endswith('.csv'):
+        with open(path, newline='') as devices_file:
+            rows = list(csv.DictReader(devices_file))
+    else:
+        with open(path) as devices_file:
+            rows = json.load(devices_file)
+        if isinstance(rows, dict):
+            rows = [dict(device, deveui=deveui) for deveui, device in rows.items()]
+    return dict(normalize_device(row["deveui"], row) for row in rows)
+
+
+class DeviceRegistry(object):
+    """ Devices served by the scheduler, it can be used from any thread."""
+
+    def __init__(self, devices=None, path=None):
+        """
+        :param devices: dict {DevEUI hex: device description} of the initial devices.
+        :param path: file of the devices (see read_devices_file), it's loaded and it can be watched for changes.
+        """
+        self.path = path
+        self._devices = {}
+        self._by_appeui = {}
+        self._by_devaddr = {}
+        self._file_devices = set()
+        self._file_version = None
+        self._lock = threading.RLock()
+        self._watcher = None
+        self._stop_watching = threading.Event()
+        self._removal_callbacks = []
+        for deveui, device in (devices or {}).items():
+            self.add(deveui, device)
+        if path is not None:
+            self.reload()
+
+    @classmethod
+    def from_module(cls):
+        """ Registry of the devices of downlink_scheduler_tool/devices_data.py (devices_to_configure)."""
+        import downlink_scheduler_tool.devices_data as dev_data
+        return cls(devices=dev_data.devices_to_configure)
+
+    def __len__(self):
+        return len(self._devices)
+
+    def __contains__(self, deveui):
+        return deveui in self._devices
+
+    def get(self, deveui):
+        """ Returns the description of a device (dict), None if it isn't registered."""
+        return self._devices.get(deveui)
+
+    def is_registered(self, deveui, appeui=None):
+        """
+        Returns True if the device is registered and, if an AppEUI is given, it belongs to that application (the
+        devices registered without AppEUI are accepted with any of them).
+        """
+        device = self._devices.get(deveui)
+        if device is None:
+            return False
+        if not appeui or "appeui" not in device:
+            return True
+        return deveui in self._by_appeui.get(appeui, ())
+
+    def devices_of_appeui(self, appeui):
+        """ Returns the DevEUIs of the devices of an application."""
+        return frozenset(self._by_appeui.get(appeui, ()))
+
+    def find_by_devaddr(self, devaddr):
+        """ Returns the DevEUI of the device with a fixed DevAddr (ABP), None if there isn't one."""
+        return self._by_devaddr.get(devaddr)
+
+    def add(self, deveui, device):
+        """ Adds or replaces a device."""
+        deveui, device = normalize_device(deveui, device)
+        with self._lock:
+            self._unindex(deveui)
+            self._devices[deveui] = device
+            if "appeui" in device:
+                self._by_appeui.setdefault(device["appeui"], set()).add(deveui)
+            if "devaddr" in device:
+                self._by_devaddr[device["devaddr"]] = deveui
+        return deveui
+
+    def add_removal_callback(self, callback):
+        """ Registers a function called with the DevEUI of each removed device."""
+        self._removal_callbacks.append(callback)
+
+    def remove(self, deveui):
+        """ Removes a device, returns False if it wasn't registered."""
+        deveui = deveui.upper()
+        with self._lock:
+            self._file_devices.discard(deveui)
+            if deveui not in self._devices:
+                return False
+            self._unindex(deveui)
+            del self._devices[deveui]
+        for callback in self._removal_callbacks:
+            try:
+                callback(deveui)
+            except Exception:
+                logger.exception(f"Error handling the removal of the device {deveui}.")
+        return True
+
+    def _unindex(self, deveui):
+        device = self._devices.get(deveui)
+        if device is None:
+            return
+        applications = self._by_appeui.get(device.get("appeui"))
+        if applications is not None:
+            applications.discard(deveui)
+            if not applications:
+                del self._by_appeui[device["appeui"]]
+        if self._by_devaddr.get(device.get("devaddr")) == deveui:
+            del self._by_devaddr[device["devaddr"]]
+
+    def _get_file_version(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload(self):
+        """
+        Loads the devices file and updates only the devices that changed. The devices of a previous version of the
+        file that aren't in the new one are removed (the ones added through the broker are kept).
+        :return: tuple (added or modified, removed) number of devices.
+        """
+        file_version = self._get_file_version()
+        file_devices = read_devices_file(self.path)
+        with self._lock:
+            changed = 0
+            for deveui, device in file_devices.items():
+                if self._devices.get(deveui) != device:
+                    self.add(deveui, device)
+                    changed += 1
+            removed = self._file_devices - file_devices.keys()
+            for deveui in removed:
+                self.remove(deveui)
+            self._file_devices = set(file_devices)
+            self._file_version = file_version
+        logger.info(f"Devices file {self.path} loaded: {changed} devices added or modified, {len(removed)} removed.")
+        return changed, len(removed)
+
+    def reload_if_modified(self):
+        """ Reloads the devices file if it was modified since the last load."""
+        try:
+            if self._get_file_version() == self._file_version:
+                return False
+            self.reload()
+        except Exception:
+            logger.exception(f"Unable to reload the devices file {self.path}.")
+            return False
+        return True
+
+    def start_watching(self, poll_interval=POLL_INTERVAL_SECONDS):
+        """ Starts a thread that reloads the devices file when it's modified."""
+        if self.path is None or self._watcher is not None:
+            return
+
+        def watch():
+            while not self._stop_watching.wait(poll_interval):
+                self.reload_if_modified()
+
+        self._stop_watching.clear()
+        self._watcher = threading.Thread(target=watch, name="devices_file_watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        if self._watcher is not None:
+            self._stop_watching.set()
+            self._watcher.join()
+            self._watcher = None
+
+    def handle_request(self, request):
+        """
+        Handles a request of the broker API:
+        {"action": "add", "devices": {DevEUI: device} or [device with "deveui"]} or
+        {"action": "remove", "deveuis": [DevEUI]}.
+        :return: number of devices added or removed.
+        """
+        if isinstance(request, (str, bytes)):
+            request = json.loads(request)
+        action = request.get("action")
+        if action == "add":
+            devices = request["devices"]
+            if isinstance(devices, dict):
+                devices = [dict(device, deveui=deveui) for deveui, device in devices.items()]
+            for device in devices:
+                self.add(device["deveui"], device)
+            return len(devices)
+        if action == "remove":
+            return sum(self.remove(deveui) for deveui in request["deveuis"])
+        raise ValueError(f"Unknown registry action: {action}.")
@@ -1,35 +1,53 @@
+import atexit
 import logging
 import struct
+import threading
 import random
 import utils
 import downlink_scheduler_tool.scheduler_errors as scheduler_errors
-import downlink_scheduler_tool.devices_data as dev_data
+import downlink_scheduler_tool.device_registry as device_registry
+import downlink_scheduler_tool.session_storage as session_storage
 import lorawan.lorawan_parameters.general as lorawan_parameters
+from lorawan import frame_counter
+from lorawan import join_accept
+from lorawan import nonce_history
 
 import sqlalchemy as sqla
 from sqlalchemy.ext.declarative import declarative_base
 # from postgresclient import db_utils
 
-import psycopg2
-import psycopg2.extensions
-
 
 Base = declarative_base()
 
 logger = logging.getLogger(__name__)
 
+# The session updates are written to the database in batches (write-behind), at most every FLUSH_INTERVAL_SECONDS
+# or FLUSH_BATCH_SIZE updates.
+FLUSH_INTERVAL_SECONDS = 5
+FLUSH_BATCH_SIZE = 100
+# Number of AppNonce, NetID and DevAddr generated in advance for the joins of each device.
+JOIN_CANDIDATES_POOL_SIZE = 8
+# Number of the last DevNonces of a device that can't be used again in a Join Request. The scheduler serves the
+# joins of the devices under test, that may be reset (e.g. a DevNonce generator restarted with the device), so by
+# default only the last ones are rejected. None rejects every DevNonce used since the first join (LoRaWAN 1.0.x
+# network server behaviour), at the cost of a bitmap of 8 KiB per device.
+DEVNONCE_WINDOW = 4
+
 
 class DeviceSession(Base):
     __tablename__ = "device_session_config"
 
     dev_eui_hex = sqla.Column(sqla.String, nullable=False, index=True, primary_key=True)
     appkey_hex = sqla.Column(sqla.String, nullable=False)
-    dev_addr_hex = sqla.Column(sqla.String, nullable=True)
+    dev_addr_hex = sqla.Column(sqla.String, nullable=True, index=True)
     nwk_s_key_hex = sqla.Column(sqla.String, nullable=True)
     app_s_key_hex = sqla.Column(sqla.String, nullable=True)
     last_join_accept_hex = sqla.Column(sqla.String, nullable=True)
+    # Last used devnonce (the whole history is kept in devnonce_history).
     used_otaa_devnonces_hex = sqla.Column(sqla.String, nullable=True)
-    fcnt_down = sqla.Column(sqla.Integer, nullable=False)
+    devnonce_history = sqla.Column(sqla.LargeBinary, nullable=True)
+    fcnt_down = sqla.Column(sqla.BigInteger, nullable=False)
+    fcnt_up = sqla.Column(sqla.BigInteger, nullable=True)
 
     def __init__(self, dev_eui_hex, appkey_hex, dev_addr_hex=None, app_s_key_hex=None,
                  nwk_s_key_hex=None, fcnt_down=0):
@@ -39,8 +57,12 @@ class DeviceSession(Base):
         self.app_s_key_hex = app_s_key_hex
         self.nwk_s_key_hex = nwk_s_key_hex
         self.fcnt_down = fcnt_down
+        self.fcnt_up = None
         self.last_join_accept_hex = None
         self.used_otaa_devnonces_hex = ""
+        self.devnonce_history = None
+        self._devnonces = None
+        self._join_accept_builder = None
 
         self._used_otaa_appnonces = []
 
@@ -63,32 +85,80 @@ class DeviceSession(Base):
         """
         return random.randint(0, 2 ** 24 - 1)
 
+    @sqla.orm.reconstructor
+    def init_on_load(self):
+        self._devnonces = None
+        self._join_accept_builder = None
+
+    def update_appkey(self, appkey_hex):
+        """
+        Sets the AppKey of a re-provisioned device, the Join Accept builder with the previous key is dropped.
+        :return: True if the AppKey changed.
+        """
+        if self.appkey_hex.lower() == appkey_hex.lower():
+            return False
+        self.appkey_hex = appkey_hex
+        self._join_accept_builder = None
+        return True
+
+    def get_join_accept_builder(self):
+        """ JoinAcceptBuilder of the device, with the AppKey cipher and the random parts of its next joins."""
+        if self._join_accept_builder is None:
+            self._join_accept_builder = join_accept.JoinAcceptBuilder(appkey=bytes.fromhex(self.appkey_hex),
+                                                                      new_appnonce=self.create_appnonce,
+                                                                      pool_size=JOIN_CANDIDATES_POOL_SIZE)
+        return self._join_accept_builder
+
+    def get_devnonces(self, window=DEVNONCE_WINDOW):
+        """
+        Returns the used devnonces, decoded once from the stored session.
+        :param window: number of devnonces remembered (see DEVNONCE_WINDOW).
+        :return: RecentNonces with the last window devnonces or, if window is None, NonceBitmap with all of them.
+        """
+        if self._devnonces is None:
+            stored_hex_list = list(filter(None, (self.used_otaa_devnonces_hex or "").split(",")))
+            if window is not None:
+                self._devnonces = nonce_history.RecentNonces(maxlen=window)
+            elif self.devnonce_history is not None:
+                self._devnonces = nonce_history.NonceBitmap.from_bytes(self.devnonce_history)
+                stored_hex_list = []
+            else:
+                self._devnonces = nonce_history.NonceBitmap()
+            # Comma separated list of the last hex nonces (sessions stored without the devnonce history).
+            for devnonce_hex in stored_hex_list:
+                self._devnonces.add(bytes.fromhex(devnonce_hex))
+        return self._devnonces
+
     def get_used_devnoce_hex_list(self):
-        if self.used_otaa_devnonces_hex is None:
-            return []
-        else:
-            return self.used_otaa_devnonces_hex.split(",")
+        return [utils.bytes_to_text(struct.pack('>H', devnonce)) for devnonce in self.get_devnonces()]
 
     def get_last_devnonce_hex(self):
-        return self.get_used_devnoce_hex_list()[-1]
+        last_devnonce = self.get_devnonces().last
+        if last_devnonce is None:
+            return None
+        return utils.bytes_to_text(struct.pack('>H', last_devnonce))
 
-    def store_used_devnonce(self, devnonce_bytes):
+    def store_used_devnonce(self, devnonce_bytes, window=DEVNONCE_WINDOW):
         """
-        (EndDevice, int) -> (None)
+        (EndDevice, bytes) -> (None)
         Store the used device nonce to avoid repeated use of the same value and prevent replay attacks.
-        :param devnonce: (int) Value to store as a used device nonce.
+        :param devnonce_bytes: (bytes) Value to store as a used device nonce (2 bytes, big endian).
+        :param window: number of devnonces remembered (see DEVNONCE_WINDOW).
         :return: None
         """
-        devnonce_hex_new = utils.bytes_to_text(devnonce_bytes)
-        devnonce_hex_list = self.get_used_devnoce_hex_list()
-        if devnonce_hex_new in devnonce_hex_list:
+        devnonces = self.get_devnonces(window=window)
+        if not devnonces.add(devnonce_bytes):
             raise scheduler_errors.DuplicatedNonce()
-        if len(devnonce_hex_list) > 3:
-            devnonce_hex_list = devnonce_hex_list[1:]
-        devnonce_hex_list.append(devnonce_hex_new)
-        self.used_otaa_devnonces_hex = ",".join(devnonce_hex_list)
+        if window is not None:
+            self.used_otaa_devnonces_hex = ",".join(utils.bytes_to_text(struct.pack('>H', devnonce))
+                                                    for devnonce in devnonces)
+            # Rebuilt from the list if the whole history is enabled later.
+            self.devnonce_history = None
+        else:
+            self.devnonce_history = devnonces.to_bytes()
+            self.used_otaa_devnonces_hex = utils.bytes_to_text(devnonce_bytes)
 
-    def accept_join(self, devnonce, dlsettings, rxdelay, cflist):
+    def accept_join(self, devnonce, dlsettings, rxdelay, cflist, devnonce_window=DEVNONCE_WINDOW):
         """
         Updates the session information and creates the PHYPayload of a join accept message to be sent to the DUT.
 
@@ -96,30 +166,16 @@ class DeviceSession(Base):
         :param dlsettings: byte of the dlsettings field (join accept)
         :param rxdelay: byte of the rxdelay field (join accept)
         :param cflist: 16 bytes with the frequency list.
+        :param devnonce_window: number of devnonces remembered (see DEVNONCE_WINDOW).
         :return: bytes of the lorawan join accept message PHYPayload.
         """
-        appnonce = struct.pack("<L", self.create_appnonce())[:3]
-        devaddr_int = random.randint(0, 2 ** 32 - 1)
-        nwkid_int = (devaddr_int & 0xfe000000) // 2 ** 25
-        netid_int = (random.randint(0, 2 ** 24 - 1) & 0xffff80) | nwkid_int
-        devaddr = struct.pack(">L", devaddr_int)
-        netid = struct.pack(">L", netid_int)[-3:]
-        appnonce_netid_devnonce = appnonce + netid[::-1] + devnonce[::-1]
-
-        appkey_bytes = bytes.fromhex(self.appkey_hex)
-        nwkskey = utils.aes128_encrypt(appkey_bytes, b'\x01' + appnonce_netid_devnonce + bytes(7))
-        appskey = utils.aes128_encrypt(appkey_bytes, b'\x02' + appnonce_netid_devnonce + bytes(7))
-        logger.info(f"AppSKey: {utils.bytes_to_text(appskey)}")
-        logger.info(f"NwkSKey: {utils.bytes_to_text(nwkskey)}")
-        self.store_used_devnonce(devnonce)
-        macpayload = appnonce + netid[::-1] + devaddr[::-1] + dlsettings + rxdelay + cflist
-        mhdr_macpayload = lorawan_parameters.MHDR.JOIN_ACCEPT + macpayload
-        mic = utils.aes128_cmac(appkey_bytes, mhdr_macpayload)[:4]
-
-        join_accept_phypayload = (lorawan_parameters.MHDR.JOIN_ACCEPT +
-                                  utils.aes128_decrypt(key=appkey_bytes,
-                                                       cipher_text=macpayload + mic)
-                                  )
+        builder = self.get_join_accept_builder()
+        accept = builder.build(devnonce=devnonce, dlsettings=dlsettings, rxdelay=rxdelay, cflist=cflist)
+        logger.info(f"AppSKey: {utils.bytes_to_text(accept.appskey)}")
+        logger.info(f"NwkSKey: {utils.bytes_to_text(accept.nwkskey)}")
+        self.store_used_devnonce(devnonce, window=devnonce_window)
+        join_accept_phypayload = accept.phypayload
+        devaddr, appskey, nwkskey = accept.devaddr, accept.appskey, accept.nwkskey
         devaddr_hex = utils.bytes_to_text(devaddr)
         appskey_hex = utils.bytes_to_text(appskey)
         nwkskey_hex = utils.bytes_to_text(nwkskey)
@@ -138,6 +194,19 @@ class DeviceSession(Base):
         self.dev_addr_hex = devaddr_hex
         self.app_s_key_hex = appskey_hex
         self.nwk_s_key_hex = nwkskey_hex
+        self.fcnt_up = None
+        self.fcnt_down = 0
+
+    def track_uplink_fcnt(self, lorawan_message):
+        """
+        Reconstructs the 32-bit frame counter of an uplink of the device from the last one stored in its session.
+        :param lorawan_message: parsed LoRaWANMessage (data uplink).
+        :return: calculated MIC (bytes).
+        """
+        counters = frame_counter.FrameCounter(last_up=self.fcnt_up, next_down=self.fcnt_down)
+        calculated_mic = counters.track_uplink(lorawan_message, key=bytes.fromhex(self.nwk_s_key_hex))
+        self.fcnt_up = counters.last_up
+        return calculated_mic
 
     def prepare_lorawan_data(self,
                              frmpayload,
@@ -153,12 +222,12 @@ class DeviceSession(Base):
         :param mhdr: MAC Header (1 byte)
         :param fctr: Frame control field of the Frame header (FHDR)
         :param fopts: Frame options field used to send MAC commands (0 to 15 bytes).
-        :param force_fcntdown_int: Force the use of a forged downlink frame count (don't increase de downlink count).
         :return: bytes of the PHYPayload
         """
-        fcnt_down = 0
+        fcnt_down = self.fcnt_down or 0
+        self.fcnt_down = (fcnt_down + 1) % frame_counter.FCNT_MOD
         dev_addr_bytes = bytes.fromhex(self.dev_addr_hex)
-        fhdr = dev_addr_bytes[::-1] + fctr + struct.pack('<H', fcnt_down) + fopts
+        fhdr = dev_addr_bytes[::-1] + fctr + struct.pack('<H', fcnt_down % frame_counter.FCNT_WIRE_MOD) + fopts
         mhdr_fhdr = mhdr + fhdr
         assert mhdr in (
             b'\x00', b'\x40', b'\x80', b'\x20', b'\x60', b'\xA0', b'\xC0'), "Unrecognized MHDR."
@@ -189,78 +258,165 @@ class DeviceSession(Base):
         return phy_payload
 
 
-def create_db(database, user, password, host, port=5432):
-    connection = psycopg2.connect(user=user, password=password, host=host, port=port)
-    connection.autocommit = True
-
-    try:
-        connection.cursor().execute("CREATE DATABASE %s;",
-                                    [psycopg2.extensions.AsIs(database)])
-    except Exception as error:
-        if not hasattr(error, "pgerror") or "already exists" not in error.pgerror:
-            raise error
-        logger.warning("Database '%s' already exists.", database)
-
-    connection.close()
-    logger.debug("""It is possible that you want to install some extensions. 
-    Check utils.EXTENSIONS and use create_db_with_extensions if desired.""")
-
-
 class DevicesSessionHandler(object):
-    def __init__(self, db_config):
-        self._devices = dev_data.devices_to_configure
-        self._active_sessions = {}
-        database_uri = "postgresql://{}:{}@{}:{}/{}".format(db_config["user"],
-                                                            db_config["password"],
-                                                            db_config["host"],
-                                                            db_config["port"],
-                                                            db_config["database"])
-        create_db(**db_config)
-        engine = sqla.create_engine(database_uri)
-        engine.connect()
-        Session = sqla.orm.sessionmaker(bind=engine)
-        self.session = Session()
-        Base.metadata.create_all(engine)
-        try:
-            self.session.execute(sqla.text("""CREATE TABLE alembic_version (
-                        version_num character varying(32) NOT NULL,
-                        PRIMARY KEY (version_num)
-                        );
-                """))
-            self.session.execute(
-                sqla.text("""INSERT INTO alembic_version VALUES ('c4821ceae1a2')"""))
+    """
+    Sessions of the devices configured by the scheduler. The sessions are loaded from the database when it starts and
+    kept in memory indexed by DevEUI and DevAddr, so that the uplinks are handled without querying the database. The
+    updates (join accepts and frame counters) are written to the database in batches by a background thread: the
+    workers only copy the updated sessions, the database is written without holding the lock of the sessions.
+    """
+
+    def __init__(self, db_config, flush_interval=FLUSH_INTERVAL_SECONDS, flush_batch_size=FLUSH_BATCH_SIZE,
+                 registry=None, devnonce_window=DEVNONCE_WINDOW):
+        """
+        :param db_config: dict with the path of a SQLite database or the database, host, port, user and password of
+            a PostgreSQL database (see session_storage.storage_from_config).
+        :param flush_interval: maximum seconds that an update of a session is kept only in memory.
+        :param flush_batch_size: maximum number of updates kept only in memory.
+        :param registry: DeviceRegistry of the devices served by the scheduler (devices_data.py by default).
+        :param devnonce_window: number of the last DevNonces rejected in the joins (see DEVNONCE_WINDOW).
+        """
+        self.registry = registry if registry is not None else device_registry.DeviceRegistry.from_module()
+        self._sessions_by_eui = {}
+        self._sessions_by_addr = {}
+        self.flush_interval = flush_interval
+        self.flush_batch_size = flush_batch_size
+        self.devnonce_window = devnonce_window
+        self._pending_updates = 0
+        # Cached sessions updated (or created) since the last flush.
+        self._updated_sessions = set()
+        self._new_sessions = set()
+        # The sessions are updated by the workers of the scheduler pipeline.
+        self._lock = threading.RLock()
+        # Serializes the writes of the database (the flushes and the reloads of the sessions).
+        self._flush_lock = threading.RLock()
+        self._flush_requested = threading.Event()
+        self.session = session_storage.storage_from_config(db_config).open(Base.metadata)
+        self.load_sessions()
+        self._flush_thread = threading.Thread(target=self._flush_loop, name="sessions_flush", daemon=True)
+        self._flush_thread.start()
+        atexit.register(self.flush)
+
+    def load_sessions(self):
+        """
+        Loads the sessions stored in the database. The downlink counters are advanced by flush_batch_size, as the
+        last ones used before a crash of the scheduler may not have been stored.
+        """
+        with self._flush_lock, self._lock:
+            self._sessions_by_eui.clear()
+            self._sessions_by_addr.clear()
+            self._updated_sessions.clear()
+            self._new_sessions.clear()
+            self._pending_updates = 0
+            for dev_session in self.session.query(DeviceSession).all():
+                dev_session.fcnt_down = (dev_session.fcnt_down or 0) + self.flush_batch_size
+                self._index_session(dev_session)
             self.session.commit()
-        except:
-            logger.warning("Table alembic_version already exist")
-            self.session.rollback()
+            # The cached sessions are detached, their updates are written by flush.
+            self.session.expunge_all()
+            logger.info(f"Loaded {len(self._sessions_by_eui)} device sessions.")
+
+    def _index_session(self, dev_session, previous_dev_addr_hex=None):
+        if previous_dev_addr_hex is not None and self._sessions_by_addr.get(previous_dev_addr_hex) is dev_session:
+            del self._sessions_by_addr[previous_dev_addr_hex]
+        self._sessions_by_eui[dev_session.dev_eui_hex] = dev_session
+        if dev_session.dev_addr_hex is not None:
+            self._sessions_by_addr[dev_session.dev_addr_hex] = dev_session
+
+    def session_updated(self, dev_session, created=False):
+        """
+        Registers an update of a cached session (called with the lock held), the flush thread is woken up when
+        flush_batch_size updates are pending.
+        """
+        self._pending_updates += 1
+        self._updated_sessions.add(dev_session)
+        if created:
+            self._new_sessions.add(dev_session)
+        if self._pending_updates >= self.flush_batch_size:
+            self._flush_requested.set()
+
+    def _flush_loop(self):
+        while True:
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Unable to flush the session updates.")
+
+    def flush(self):
+        """ Writes the pending updates of the sessions to the database."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending_updates:
+                    return
+                pending_updates = self._pending_updates
+                columns = [column.key for column in DeviceSession.__table__.columns]
+                new_rows = [{column: getattr(dev_session, column) for column in columns}
+                            for dev_session in self._new_sessions]
+                updated_rows = [{column: getattr(dev_session, column) for column in columns}
+                                for dev_session in self._updated_sessions - self._new_sessions]
+                self._pending_updates = 0
+                self._updated_sessions.clear()
+                self._new_sessions.clear()
+            try:
+                self.session.bulk_insert_mappings(DeviceSession, new_rows)
+                self.session.bulk_update_mappings(DeviceSession, updated_rows)
+                self.session.commit()
+            except Exception:
+                # Handled as a crash of the scheduler: the pending updates are lost and the sessions are reloaded.
+                logger.exception(f"Unable to store {pending_updates} session updates.")
+                self.session.rollback()
+                self.load_sessions()
+                return
+            logger.debug(f"Stored {pending_updates} session updates.")
 
     def query_dev_eui_hex(self, dev_eui_hex):
-        return self.session.query(DeviceSession).filter(
-            DeviceSession.dev_eui_hex == dev_eui_hex).first()
+        return self._sessions_by_eui.get(dev_eui_hex)
 
     def query_dev_addr_hex(self, dev_addr_hex):
-        return self.session.query(DeviceSession).filter(
-            DeviceSession.dev_addr_hex == dev_addr_hex).first()
+        return self._sessions_by_addr.get(dev_addr_hex)
 
     def is_registered(self, dev_eui_hex, app_eui_hex=None):
-        if dev_eui_hex not in self._devices:
-            return False
-        if not app_eui_hex or "appeui" not in self._devices[dev_eui_hex]:
+        return self.registry.is_registered(dev_eui_hex, appeui=app_eui_hex)
+
+    def remove_session(self, dev_eui_hex):
+        """
+        Removes the session of a device that is no longer served, from the cache and from the database (its
+        pending updates are discarded).
+        :return: False if the device had no session.
+        """
+        with self._flush_lock, self._lock:
+            dev_session = self._sessions_by_eui.pop(dev_eui_hex, None)
+            if dev_session is None:
+                return False
+            if self._sessions_by_addr.get(dev_session.dev_addr_hex) is dev_session:
+                del self._sessions_by_addr[dev_session.dev_addr_hex]
+            self._updated_sessions.discard(dev_session)
+            self._new_sessions.discard(dev_session)
+            try:
+                self.session.query(DeviceSession).filter_by(dev_eui_hex=dev_eui_hex).delete()
+                self.session.commit()
+            except Exception:
+                logger.exception(f"Unable to delete the stored session of {dev_eui_hex}.")
+                self.session.rollback()
+            logger.info(f"Session of {dev_eui_hex} removed.")
             return True
-        return self._devices[dev_eui_hex]["appeui"] == app_eui_hex
 
     def has_active_session(self, dev_eui_hex):
         dev_session = self.query_dev_eui_hex(dev_eui_hex=dev_eui_hex)
         return dev_session is not None
 
     def get_appkey_hex(self, dev_eui_hex):
-        if self.is_registered(dev_eui_hex=dev_eui_hex):
-            return self._devices[dev_eui_hex]["appkey"]
+        device = self.registry.get(dev_eui_hex)
+        if device is not None:
+            return device["appkey"]
 
     def get_command_hex(self, dev_addr_hex):
         dev_eui_hex = self.get_dev_eui_hex(dev_addr_hex=dev_addr_hex)
-        if self.is_registered(dev_eui_hex=dev_eui_hex):
-            return self._devices[dev_eui_hex]["command"]
+        device = self.registry.get(dev_eui_hex)
+        if device is not None:
+            return device.get("command")
 
     def get_dev_eui_hex(self, dev_addr_hex):
         dev_session = self.query_dev_addr_hex(dev_addr_hex=dev_addr_hex)
@@ -284,21 +440,36 @@ class DevicesSessionHandler(object):
         return app_s_key_hex
 
     def process_otta_join(self, deveui_hex, devnonce, dlsettings, rxdelay, cflist):
-        try:
-            appkey_hex = self._devices[deveui_hex]["appkey"]
+        with self._lock:
+            try:
+                appkey_hex = self.registry.get(deveui_hex)["appkey"]
+                dev_session = self.query_dev_eui_hex(dev_eui_hex=deveui_hex)
+                if dev_session is None:
+                    dev_session = DeviceSession(dev_eui_hex=deveui_hex,
+                                                appkey_hex=appkey_hex)
+                    logger.info(
+                        f"Creating first session for: {deveui_hex}")
+                    created = True
+                else:
+                    created = False
+                    if dev_session.update_appkey(appkey_hex):
+                        logger.info(f"AppKey of {deveui_hex} changed in the registry.")
+                previous_dev_addr_hex = dev_session.dev_addr_hex
+                dev_session.accept_join(
+                    devnonce=devnonce, dlsettings=dlsettings, rxdelay=rxdelay, cflist=cflist,
+                    devnonce_window=self.devnonce_window)
+            except Exception as e:
+                logger.error(f"Error creating session for device {deveui_hex}.")
+            else:
+                self._index_session(dev_session, previous_dev_addr_hex=previous_dev_addr_hex)
+                self.session_updated(dev_session, created=created)
+
+    def refill_join_candidates(self, deveui_hex):
+        """ Generates the random parts of the next joins of a device, out of the path of its Join Request."""
+        with self._lock:
             dev_session = self.query_dev_eui_hex(dev_eui_hex=deveui_hex)
-            if dev_session is None:
-                dev_session = DeviceSession(dev_eui_hex=deveui_hex,
-                                            appkey_hex=appkey_hex)
-                logger.info(
-                    f"Creating first session for: {deveui_hex}")
-                self.session.add(dev_session)
-            dev_session.accept_join(
-                devnonce=devnonce, dlsettings=dlsettings, rxdelay=rxdelay, cflist=cflist)
-        except Exception as e:
-            logger.error(f"Error creating session for device {deveui_hex}.")
-        else:
-            self.session.commit()
+            if dev_session is not None:
+                dev_session.get_join_accept_builder().refill()
 
     def get_joinaccept_bytes(self, deveui_hex):
         dev_session = self.query_dev_eui_hex(dev_eui_hex=deveui_hex)
@@ -311,9 +482,30 @@ class DevicesSessionHandler(object):
             return
         return bytes.fromhex(join_accept_hex)
 
-    def prepare_lorawan_data(self, dev_eui_hex, frmpayload):
-        dev_session = self.query_dev_eui_hex(dev_eui_hex=dev_eui_hex)
-        if dev_session is None:
-            logger.error(f"Error Preparing DATA, no session for device {dev_eui_hex}.")
-            return
-        return dev_session.prepare_lorawan_data(frmpayload=frmpayload)
+    def track_uplink_fcnt(self, dev_addr_hex, lorawan_message):
+        """
+        Reconstructs the 32-bit frame counter of an uplink and stores it in the session of the device.
+        :return: calculated MIC (bytes), None if the device has no session.
+        """
+        with self._lock:
+            dev_session = self.query_dev_addr_hex(dev_addr_hex=dev_addr_hex)
+            if dev_session is None:
+                return None
+            calculated_mic = dev_session.track_uplink_fcnt(lorawan_message)
+            self.session_updated(dev_session)
+            return calculated_mic
+
+    def prepare_lorawan_data(self, dev_eui_hex, frmpayload, **kwargs):
+        """
+        Creates the PHYPayload of a downlink of the device (see DeviceSession.prepare_lorawan_data for the
+        optional fport, mhdr, fctr and fopts).
+        """
+        with self._lock:
+            dev_session = self.query_dev_eui_hex(dev_eui_hex=dev_eui_hex)
+            if dev_session is None:
+                logger.error(f"Error Preparing DATA, no session for device {dev_eui_hex}.")
+                return
+            phypayload = dev_session.prepare_lorawan_data(frmpayload=frmpayload, **kwargs)
+            # Stores the downlink counter.
+            self.session_updated(dev_session)
+            return phypayload
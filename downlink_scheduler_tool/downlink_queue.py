@@ -0,0 +1,170 @@
+"""
+Downlinks queued for the devices served by the downlink scheduler: each uplink of a device is answered with its
+queued downlink of highest priority (MAC commands, then confirmed and then unconfirmed data, in order of arrival
+within each class), the expired downlinks are discarded.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import base64
+import heapq
+import itertools
+import json
+import threading
+import time
+
+PRIORITY_MAC = 0
+PRIORITY_CONFIRMED = 1
+PRIORITY_UNCONFIRMED = 2
+PRIORITY_NAMES = {"mac": PRIORITY_MAC, "confirmed": PRIORITY_CONFIRMED, "unconfirmed": PRIORITY_UNCONFIRMED}
+MAX_QUEUED_PER_DEVICE = 32
+
+
+class QueuedDownlink(object):
+    """ Downlink waiting in the queue of a device."""
+    __slots__ = ('frmpayload', 'fport', 'confirmed', 'priority', 'expires')
+
+    def __init__(self, frmpayload, fport=1, confirmed=False, priority=None, expires=None):
+        """
+        :param frmpayload: plain text of the FRMPayload (bytes), MAC commands if fport is 0.
+        :param fport: frame port.
+        :param confirmed: True if the downlink is a confirmed data message.
+        :param priority: priority class (PRIORITY_MAC, PRIORITY_CONFIRMED or PRIORITY_UNCONFIRMED), by default
+            the one of the fport and the confirmed flag.
+        :param expires: time.monotonic() after which the downlink is discarded (None if it doesn't expire).
+        """
+        self.frmpayload = frmpayload
+        self.fport = fport
+        self.confirmed = confirmed
+        if priority is None:
+            if fport == 0:
+                priority = PRIORITY_MAC
+            else:
+                priority = PRIORITY_CONFIRMED if confirmed else PRIORITY_UNCONFIRMED
+        self.priority = priority
+        self.expires = expires
+
+    def expired(self, now):
+        return self.expires is not None and now > self.expires
+
+    @classmethod
+    def from_json(cls, request, now=None):
+        """
+        Creates a QueuedDownlink from a request of the broker API:
+        {"deveui": hex, "frmpayload": base64, "fport": int, "confirmed": bool, "priority": "mac"|"confirmed"|
+        "unconfirmed", "ttl": seconds}, only deveui and frmpayload are required.
+        :return: tuple (DevEUI hex, QueuedDownlink).
+        """
+        if isinstance(request, (str, bytes)):
+            request = json.loads(request)
+        ttl = request.get("ttl")
+        if ttl is not None:
+            ttl = (time.monotonic() if now is None else now) + float(ttl)
+        priority = request.get("priority")
+        if priority is not None:
+            priority = PRIORITY_NAMES[priority]
+        downlink = cls(frmpayload=base64.b64decode(request["frmpayload"]),
+                       fport=int(request.get("fport", 1)),
+                       confirmed=bool(request.get("confirmed", False)),
+                       priority=priority,
+                       expires=ttl)
+        return request["deveui"].upper(), downlink
+
+
+class DownlinkQueue(object):
+    """
+    Queues of the downlinks of the devices. Only the devices with queued downlinks take memory (a small heap for
+    each one), so it can hold the downlinks of hundreds of thousands of devices. It can be used from any thread.
+    """
+
+    def __init__(self, max_per_device=MAX_QUEUED_PER_DEVICE):
+        self.max_per_device = max_per_device
+        self.expired = 0
+        self._queues = {}
+        self._sequence = itertools.count()
+        # The requeued downlinks go before the ones with the same priority.
+        self._requeue_sequence = itertools.count(-1, -1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(device_queue) for device_queue in self._queues.values())
+
+    def devices(self):
+        """ Number of devices with queued downlinks."""
+        return len(self._queues)
+
+    def enqueue(self, dev_eui_hex, downlink):
+        """
+        Adds a downlink to the queue of a device.
+        :return: False if the queue of the device is full.
+        """
+        with self._lock:
+            device_queue = self._queues.setdefault(dev_eui_hex, [])
+            if len(device_queue) >= self.max_per_device:
+                self._discard_expired(device_queue, time.monotonic())
+                if len(device_queue) >= self.max_per_device:
+                    return False
+            heapq.heappush(device_queue, (downlink.priority, next(self._sequence), downlink))
+            return True
+
+    def pop(self, dev_eui_hex, now=None):
+        """
+        Takes the next downlink of a device.
+        :return: tuple (QueuedDownlink or None, True if there are more downlinks queued, i.e. the FPending bit).
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            device_queue = self._queues.get(dev_eui_hex)
+            downlink = None
+            while device_queue and downlink is None:
+                _, _, downlink = heapq.heappop(device_queue)
+                if downlink.expired(now):
+                    self.expired += 1
+                    downlink = None
+            pending = bool(device_queue) and self._discard_expired(device_queue, now) > 0
+            if device_queue is not None and not pending:
+                del self._queues[dev_eui_hex]
+            return downlink, pending
+
+    def requeue(self, dev_eui_hex, downlink):
+        """ Gives back a downlink taken with pop that wasn't sent (e.g. its uplink missed the receive window)."""
+        if downlink.expired(time.monotonic()):
+            return
+        with self._lock:
+            device_queue = self._queues.setdefault(dev_eui_hex, [])
+            heapq.heappush(device_queue, (downlink.priority, next(self._requeue_sequence), downlink))
+
+    def clear(self, dev_eui_hex):
+        with self._lock:
+            self._queues.pop(dev_eui_hex, None)
+
+    def _discard_expired(self, device_queue, now):
+        """ Removes the expired downlinks of a device, returns the number of downlinks left."""
+        alive = [entry for entry in device_queue if not entry[2].expired(now)]
+        if len(alive) != len(device_queue):
+            self.expired += len(device_queue) - len(alive)
+            heapq.heapify(alive)
+            device_queue[:] = alive
+        return len(device_queue)
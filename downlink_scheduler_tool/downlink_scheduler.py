@@ -1,8 +1,15 @@
+import functools
+import threading
+import time
+
 import utils
 import message_queueing
 from parameters.message_broker import routing_keys
 from lorawan.parsing import flora_messages
 import downlink_scheduler_tool.devices_sessions as devices_sessions
+import downlink_scheduler_tool.device_registry as device_registry
+import downlink_scheduler_tool.downlink_queue as downlink_queue
+import downlink_scheduler_tool.uplink_pipeline as uplink_pipeline
 import lorawan.lorawan_parameters.general as lorawan_parameters
 import downlink_scheduler_tool.scheduler_errors as scheduler_errors
 
@@ -10,89 +17,246 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of uplinks in the pipeline (not acknowledged to the broker).
+PREFETCH_COUNT = 64
+SESSION_WORKERS = 4
+CRYPTO_WORKERS = 4
+# Time needed to deliver a downlink to the gateway before its reception window (seconds).
+DOWNLINK_MARGIN_SECONDS = 0.2
+
+
+class ScheduledUplink(uplink_pipeline.PipelineItem):
+    """ Uplink received by the scheduler and the downlink prepared to answer it."""
+
+    def __init__(self, body, properties=None, on_done=None):
+        super().__init__(on_done=on_done)
+        self.received_time = time.monotonic()
+        self.body = body
+        self.properties = properties
+        self.gateway_message = None
+        self.lorawan_message = None
+        self.dev_eui_hex = None
+        self.dev_addr_hex = None
+        self.phypayload = None
+        self.delay = None
+
 
 class DownlinkScheduler(object):
     def __init__(self,
                  db_config,
                  accept_dlsettings=lorawan_parameters.DLSETTINGS.RX1OFFSET0_RX2DR0,
                  accept_rxdelay=lorawan_parameters.JOIN_ACCEPT_RXDELAY.DELAY0,
-                 accept_cflist=lorawan_parameters.JOIN_ACCEPT_CFLIST.NO_CHANNELS):
+                 accept_cflist=lorawan_parameters.JOIN_ACCEPT_CFLIST.NO_CHANNELS,
+                 prefetch_count=PREFETCH_COUNT,
+                 devices_path=None,
+                 devnonce_window=devices_sessions.DEVNONCE_WINDOW):
+        """
+        :param db_config: configuration of the sessions database (see session_storage.storage_from_config).
+        :param devices_path: CSV, JSON or SQLite file of the served devices, watched for changes
+            (devices_data.py is used if it isn't given).
+        :param devnonce_window: number of the last DevNonces rejected in the joins, None rejects all the used ones
+            (see devices_sessions.DEVNONCE_WINDOW).
+        """
         self.uplink_mq_interface = message_queueing.MqSelectConnectionInterface(
             queue_name='up_downlink_scheduler',
             queue_durable=False,
             queue_auto_delete=True,
             routing_key=routing_keys.fromAgentToScheduler,
-            on_message_callback=self.up_message_handler)
+            on_message_callback=self.up_message_handler,
+            raw_body=True,
+            prefetch_count=prefetch_count)
         self.downlink_mq_interface = message_queueing.MqPublisher(
             routing_key=routing_keys.fromAgentToScheduler)
+        # Downlinks enqueued by the users of the scheduler (see enqueue_handler).
+        self.downlink_queue = downlink_queue.DownlinkQueue()
+        self.enqueue_mq_interface = message_queueing.MqSelectConnectionInterface(
+            queue_name='downlink_scheduler_queue',
+            queue_durable=False,
+            queue_auto_delete=True,
+            routing_key=routing_keys.toSchedulerDownlinkQueue,
+            on_message_callback=self.enqueue_handler,
+            raw_body=True)
 
-        self.sessions_handler = devices_sessions.DevicesSessionHandler(db_config=db_config)
+        if devices_path is not None:
+            self.registry = device_registry.DeviceRegistry(path=devices_path)
+        else:
+            self.registry = device_registry.DeviceRegistry.from_module()
+        self.registry_mq_interface = message_queueing.MqSelectConnectionInterface(
+            queue_name='downlink_scheduler_registry',
+            queue_durable=False,
+            queue_auto_delete=True,
+            routing_key=routing_keys.toSchedulerRegistry,
+            on_message_callback=self.registry_handler,
+            raw_body=True)
+        self.sessions_handler = devices_sessions.DevicesSessionHandler(db_config=db_config, registry=self.registry,
+                                                                       devnonce_window=devnonce_window)
+        self.registry.add_removal_callback(self.device_removed)
         self.accept_dlsettings = accept_dlsettings
         self.accept_rxdelay = accept_rxdelay
         self.accept_cflist = accept_cflist
+        # The uplinks not acknowledged to the broker are limited by the prefetch count (backpressure). The
+        # publisher uses a single blocking connection, so the publish stage has a single worker.
+        self.pipeline = uplink_pipeline.UplinkPipeline([("decode", self.decode_uplink, 1),
+                                                        ("session", self.lookup_session, SESSION_WORKERS),
+                                                        ("crypto", self.prepare_downlink, CRYPTO_WORKERS),
+                                                        ("publish", self.publish_downlink, 1)])
 
     def start_scheduler(self):
         logger.info("Starting Config Scheduler")
-        self.uplink_mq_interface.consume_start()
+        threading.Thread(target=self.enqueue_mq_interface.consume_start, name="downlink_queue",
+                         daemon=True).start()
+        threading.Thread(target=self.registry_mq_interface.consume_start, name="device_registry",
+                         daemon=True).start()
+        self.registry.start_watching()
+        try:
+            self.uplink_mq_interface.consume_start()
+        finally:
+            self.registry.stop_watching()
+            self.pipeline.stop()
+            self.sessions_handler.flush()
+
+    def send_downlink(self, nwk_response):
+        """ Publishes the downlink message in the wire format configured for the testing tool."""
+        downlink_body, content_type = nwk_response.encode()
+        self.downlink_mq_interface.send(routing_key=routing_keys.fromSchedulerToAgent,
+                                        data=downlink_body,
+                                        content_type=content_type)
+
+    def registry_handler(self, body, properties=None):
+        """ Adds or removes devices of the registry (see device_registry.DeviceRegistry.handle_request)."""
+        try:
+            count = self.registry.handle_request(body)
+        except (ValueError, KeyError, TypeError) as error:
+            logger.error(f"Wrong registry request {body}: {error}")
+            return
+        logger.info(f"Registry request processed ({count} devices), {len(self.registry)} devices registered.")
 
-    def up_message_handler(self, body_str):
+    def device_removed(self, dev_eui_hex):
+        """ Stops serving a device removed from the registry: its session and queued downlinks are dropped."""
+        self.sessions_handler.remove_session(dev_eui_hex=dev_eui_hex)
+        self.downlink_queue.clear(dev_eui_hex)
 
-        received_testscript_msg = flora_messages.GatewayMessage(
-            json_ttm_str=body_str)
-        lorawan_msg = received_testscript_msg.parse_lorawan_message()
+    def enqueue_handler(self, body, properties=None):
+        """
+        Adds a downlink to the queue of a device, the body is a JSON request (see
+        downlink_queue.QueuedDownlink.from_json).
+        """
+        try:
+            dev_eui_hex, downlink = downlink_queue.QueuedDownlink.from_json(body)
+        except (ValueError, KeyError, TypeError) as error:
+            logger.error(f"Wrong downlink request {body}: {error}")
+            return
+        if not self.sessions_handler.is_registered(dev_eui_hex=dev_eui_hex):
+            logger.info(f"Ignoring downlink of a device not registered: {dev_eui_hex}")
+            return
+        if not self.downlink_queue.enqueue(dev_eui_hex, downlink):
+            logger.warning(f"Downlink queue of {dev_eui_hex} full, ignoring downlink.")
+
+    def up_message_handler(self, body, properties=None, ack=None):
+        """ Adds a received uplink to the pipeline, ack is called when it's answered or dropped."""
+        self.pipeline.submit(ScheduledUplink(body=body, properties=properties, on_done=ack))
+
+    def decode_uplink(self, uplink):
+        uplink.gateway_message = flora_messages.GatewayMessage.from_bytes(
+            uplink.body, content_type=getattr(uplink.properties, "content_type", None))
+        lorawan_msg = uplink.gateway_message.parse_lorawan_message()
+        uplink.lorawan_message = lorawan_msg
         logger.info("--------------------------------------------------------\n")
         logger.info(f"Received Uplink: {str(lorawan_msg)}")
 
-        mtype_int = lorawan_msg.mhdr.mtype_int
-
         if lorawan_msg.mhdr.mhdr_bytes == lorawan_parameters.MHDR.JOIN_REQUEST:
+            uplink.dev_eui_hex = utils.bytes_to_text(lorawan_msg.macpayload.deveui_bytes).upper()
+            uplink.key = uplink.dev_eui_hex
+            uplink.delay = lorawan_parameters.TIMING.JOIN_ACCEPT_DELAY1
+        elif lorawan_msg.mhdr.mhdr_bytes == lorawan_parameters.MHDR.UNCONFIRMED_UP:
+            uplink.dev_addr_hex = utils.bytes_to_text(lorawan_msg.macpayload.fhdr.devaddr_bytes).upper()
+            uplink.key = uplink.dev_addr_hex
+            uplink.delay = lorawan_parameters.TIMING.RECEIVE_DELAY1
+        else:
+            return None
+        # The downlink is useless if it can't reach the gateway before the RX1 window of the device.
+        uplink.deadline = (uplink.received_time + uplink.delay / lorawan_parameters.TIMING.MS_IN_SEC -
+                           DOWNLINK_MARGIN_SECONDS)
+        return uplink
+
+    def lookup_session(self, uplink):
+        if uplink.dev_addr_hex is None:
+            appeui_hex = utils.bytes_to_text(uplink.lorawan_message.macpayload.appeui_bytes).upper()
+            if not self.sessions_handler.is_registered(dev_eui_hex=uplink.dev_eui_hex,
+                                                       app_eui_hex=appeui_hex):
+                logger.info(f"Device Not Registered: {uplink.dev_eui_hex}")
+                return None
+            return uplink
+        uplink.dev_eui_hex = self.sessions_handler.get_dev_eui_hex(dev_addr_hex=uplink.dev_addr_hex)
+        if uplink.dev_eui_hex is None:
+            logger.info(f"No active session for device: {uplink.dev_addr_hex}")
+            return None
+        return uplink
+
+    def prepare_downlink(self, uplink):
+        lorawan_msg = uplink.lorawan_message
+        if uplink.dev_addr_hex is None:
+            devnonce = lorawan_msg.macpayload.devnonce_bytes
             try:
-                devnonce = lorawan_msg.macpayload.devnonce_bytes
-                deveui_hex = utils.bytes_to_text(lorawan_msg.macpayload.deveui_bytes).upper()
-                appeui_hex = utils.bytes_to_text(lorawan_msg.macpayload.appeui_bytes).upper()
-                if not self.sessions_handler.is_registered(dev_eui_hex=deveui_hex,
-                                                           app_eui_hex=appeui_hex):
-                    logger.info(f"Device Not Registered: {deveui_hex}")
-                    return
                 self.sessions_handler.process_otta_join(
-                    deveui_hex=deveui_hex, devnonce=devnonce,
+                    deveui_hex=uplink.dev_eui_hex, devnonce=devnonce,
                     dlsettings=self.accept_dlsettings,
                     rxdelay=self.accept_rxdelay,
                     cflist=self.accept_cflist)
-                jaccept_phypayload = self.sessions_handler.get_joinaccept_bytes(
-                    deveui_hex=deveui_hex)
-                json_nwk_response = received_testscript_msg.create_nwk_response_str(
-                    phypayload=jaccept_phypayload,
-                    delay=lorawan_parameters.TIMING.JOIN_ACCEPT_DELAY1,
-                    datr_offset=lorawan_parameters.DR_OFFSET.RX1_DEFAULT)
-                logger.info(f"Sending Join Accept: {str(json_nwk_response)}")
-
-                self.downlink_mq_interface.send(routing_key=routing_keys.fromSchedulerToAgent,
-                                                data=json_nwk_response)
             except scheduler_errors.DuplicatedNonce as dne:
                 logger.info(f"Ignoring Duplicated nonce {devnonce}")
-        elif lorawan_msg.mhdr.mhdr_bytes == lorawan_parameters.MHDR.UNCONFIRMED_UP:
-            devaddrhex = utils.bytes_to_text(lorawan_msg.macpayload.fhdr.devaddr_bytes).upper()
-            network_key_hex = self.sessions_handler.get_nwk_s_key_hex(dev_addr_hex=devaddrhex)
-            if network_key_hex is None:
-                logger.info(f"No active session for device: {devaddrhex}")
-                return
-            network_key = bytes.fromhex(network_key_hex)
-            calculated_mic = lorawan_msg.calculate_mic(key=network_key)
-            dev_eui_hex = self.sessions_handler.get_dev_eui_hex(dev_addr_hex=devaddrhex)
-            if not lorawan_msg.mic_bytes == calculated_mic:
-                logger.info(
-                    f"Wrong MIC. Expecting {calculated_mic}, Device {dev_eui_hex} ({devaddrhex}).")
-            logger.info(f"MIC OK (NwkSKey: {utils.bytes_to_text(network_key)}, dev {dev_eui_hex})")
-
-            frmpayload_command = bytes.fromhex(
-                self.sessions_handler.get_command_hex(dev_addr_hex=devaddrhex))
-            lw_response = self.sessions_handler.prepare_lorawan_data(dev_eui_hex=dev_eui_hex,
-                                                                     frmpayload=frmpayload_command)
-            json_nwk_response = received_testscript_msg.create_nwk_response_str(
-                phypayload=lw_response,
-                delay=lorawan_parameters.TIMING.RECEIVE_DELAY1,
-                datr_offset=lorawan_parameters.DR_OFFSET.RX1_DEFAULT)
-            logger.info(f"Sending Downlink Data: {str(json_nwk_response)}")
-            self.downlink_mq_interface.send(routing_key=routing_keys.fromSchedulerToAgent,
-                                            data=json_nwk_response)
+                return None
+            uplink.phypayload = self.sessions_handler.get_joinaccept_bytes(deveui_hex=uplink.dev_eui_hex)
+            return uplink
+
+        devaddrhex = uplink.dev_addr_hex
+        dev_eui_hex = uplink.dev_eui_hex
+        calculated_mic = self.sessions_handler.track_uplink_fcnt(dev_addr_hex=devaddrhex,
+                                                                 lorawan_message=lorawan_msg)
+        if not lorawan_msg.mic_bytes == calculated_mic:
+            logger.info(
+                f"Wrong MIC. Expecting {calculated_mic}, Device {dev_eui_hex} ({devaddrhex}).")
+            return None
+        network_key_hex = self.sessions_handler.get_nwk_s_key_hex(dev_addr_hex=devaddrhex)
+        logger.info(f"MIC OK (NwkSKey: {network_key_hex}, dev {dev_eui_hex})")
+
+        downlink, pending = self.downlink_queue.pop(dev_eui_hex)
+        if downlink is None:
+            # Without queued downlinks, the device gets its configured command (if any).
+            command_hex = self.sessions_handler.get_command_hex(dev_addr_hex=devaddrhex)
+            if command_hex is None:
+                return None
+            downlink = downlink_queue.QueuedDownlink(frmpayload=bytes.fromhex(command_hex))
+        else:
+            # The downlink goes back to the queue if the uplink is dropped before it's published.
+            uplink.on_dropped = functools.partial(self.downlink_queue.requeue, dev_eui_hex, downlink)
+        if downlink.confirmed:
+            mhdr = lorawan_parameters.MHDR.CONFIRMED_DOWN
+        else:
+            mhdr = lorawan_parameters.MHDR.UNCONFIRMED_DOWN
+        if pending:
+            fctr = lorawan_parameters.FCTRL.DOWN_ADROFF_ACKOFF_FPENDON_FOPTLEN0
+        else:
+            fctr = lorawan_parameters.FCTRL.DOWN_ADROFF_ACKOFF_FPENDOFF_FOPTLEN0
+        uplink.phypayload = self.sessions_handler.prepare_lorawan_data(dev_eui_hex=dev_eui_hex,
+                                                                       frmpayload=downlink.frmpayload,
+                                                                       fport=downlink.fport,
+                                                                       mhdr=mhdr,
+                                                                       fctr=fctr)
+        return uplink
+
+    def publish_downlink(self, uplink):
+        if uplink.phypayload is None:
+            return None
+        nwk_response = uplink.gateway_message.create_nwk_response(
+            phypayload=uplink.phypayload,
+            delay=uplink.delay,
+            datr_offset=lorawan_parameters.DR_OFFSET.RX1_DEFAULT)
+        if uplink.dev_addr_hex is None:
+            logger.info(f"Sending Join Accept: {str(nwk_response)}")
+            self.send_downlink(nwk_response)
+            self.sessions_handler.refill_join_candidates(deveui_hex=uplink.dev_eui_hex)
+        else:
+            logger.info(f"Sending Downlink Data: {str(nwk_response)}")
+            self.send_downlink(nwk_response)
+        return None
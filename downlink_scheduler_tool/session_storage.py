@@ -0,0 +1,179 @@
+"""
+Databases of the sessions of the downlink scheduler: PostgreSQL or an embedded SQLite database (e.g. for single host
+setups and the CI, without an external database service).
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import abc
+import logging
+
+import sqlalchemy as sqla
+import sqlalchemy.orm
+import sqlalchemy.pool
+
+logger = logging.getLogger(__name__)
+
+SESSIONS_TABLE = "device_session_config"
+
+
+class SessionStorage(object, metaclass=abc.ABCMeta):
+    """ Database of the device sessions: creates the engine and brings the tables up to date."""
+
+    @abc.abstractmethod
+    def create_engine(self):
+        """ Returns the sqlalchemy Engine of the database."""
+        raise NotImplementedError
+
+    def upgrade_schema(self, session, metadata):
+        """ Updates the tables created by previous versions of the scheduler."""
+        pass
+
+    def open(self, metadata):
+        """
+        Creates the tables of metadata (if they don't exist) and opens a session of the database.
+        :param metadata: sqlalchemy MetaData of the tables.
+        :return: sqlalchemy Session, the objects aren't expired after the commits (the scheduler caches them).
+        """
+        engine = self.create_engine()
+        engine.connect()
+        metadata.create_all(engine)
+        session = sqla.orm.sessionmaker(bind=engine, expire_on_commit=False)()
+        self.upgrade_schema(session, metadata)
+        # Tables created before the index of the DevAddr.
+        session.execute(sqla.text(f"CREATE INDEX IF NOT EXISTS ix_{SESSIONS_TABLE}_dev_addr_hex "
+                                  f"ON {SESSIONS_TABLE} (dev_addr_hex);"))
+        session.commit()
+        return session
+
+
+def create_db(database, user, password, host, port=5432):
+    import psycopg2
+    import psycopg2.extensions
+
+    connection = psycopg2.connect(user=user, password=password, host=host, port=port)
+    connection.autocommit = True
+
+    try:
+        connection.cursor().execute("CREATE DATABASE %s;",
+                                    [psycopg2.extensions.AsIs(database)])
+    except Exception as error:
+        if not hasattr(error, "pgerror") or "already exists" not in error.pgerror:
+            raise error
+        logger.warning("Database '%s' already exists.", database)
+
+    connection.close()
+    logger.debug("""It is possible that you want to install some extensions. 
+    Check utils.EXTENSIONS and use create_db_with_extensions if desired.""")
+
+
+class PostgresStorage(SessionStorage):
+    """ Sessions stored in a PostgreSQL server (requires psycopg2)."""
+
+    def __init__(self, database, user, password, host, port=5432):
+        self.db_config = {"database": database, "user": user, "password": password, "host": host, "port": port}
+
+    def create_engine(self):
+        create_db(**self.db_config)
+        return sqla.create_engine("postgresql://{user}:{password}@{host}:{port}/{database}".format(**self.db_config))
+
+    def upgrade_schema(self, session, metadata):
+        try:
+            session.execute(sqla.text("""CREATE TABLE alembic_version (
+                        version_num character varying(32) NOT NULL,
+                        PRIMARY KEY (version_num)
+                        );
+                """))
+            session.execute(
+                sqla.text("""INSERT INTO alembic_version VALUES ('c4821ceae1a2')"""))
+            session.commit()
+        except:
+            logger.warning("Table alembic_version already exist")
+            session.rollback()
+        # Sessions tables created before the 32-bit frame counters and the devnonce history.
+        session.execute(sqla.text(f"ALTER TABLE {SESSIONS_TABLE} ADD COLUMN IF NOT EXISTS fcnt_up bigint, "
+                                  "ADD COLUMN IF NOT EXISTS devnonce_history bytea, "
+                                  "ALTER COLUMN fcnt_down TYPE bigint;"))
+        session.commit()
+
+
+class SqliteStorage(SessionStorage):
+    """
+    Sessions stored in an embedded SQLite database, in WAL mode (the readers don't block the writes of the
+    scheduler) and with the statements of the lookups kept prepared by the sqlite3 module.
+    """
+
+    def __init__(self, path, cached_statements=100):
+        """
+        :param path: path of the database file (':memory:' for a database in memory).
+        :param cached_statements: number of prepared statements kept by each connection.
+        """
+        self.path = path
+        self.cached_statements = cached_statements
+
+    def create_engine(self):
+        connect_args = {"cached_statements": self.cached_statements}
+        if self.path == ":memory:":
+            # Each connection has its own database in memory: a single one is shared by the threads of the scheduler
+            # (the writes of the sessions are serialized by the DevicesSessionHandler).
+            connect_args["check_same_thread"] = False
+            engine = sqla.create_engine("sqlite://", connect_args=connect_args, poolclass=sqla.pool.StaticPool)
+        else:
+            engine = sqla.create_engine(f"sqlite:///{self.path}", connect_args=connect_args)
+
+        @sqla.event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL;")
+            # Durable at the checkpoints, the scheduler already tolerates losing the last updates (write-behind).
+            cursor.execute("PRAGMA synchronous=NORMAL;")
+            cursor.close()
+
+        return engine
+
+    def upgrade_schema(self, session, metadata):
+        # SQLite has no ADD COLUMN IF NOT EXISTS, the missing columns are found in the table info.
+        for table in metadata.sorted_tables:
+            existing_columns = {row[1] for row in session.execute(sqla.text(f"PRAGMA table_info({table.name});"))}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    column_type = column.type.compile(dialect=session.bind.dialect)
+                    session.execute(sqla.text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type};"))
+                    logger.info(f"Added column {column.name} to {table.name}.")
+        session.commit()
+
+
+def storage_from_config(db_config):
+    """
+    Creates the SessionStorage of a database configuration.
+    :param db_config: dict with the "path" of a SQLite database or the database, host, port, user and password of
+        a PostgreSQL database.
+    """
+    if db_config.get("path"):
+        return SqliteStorage(path=db_config["path"])
+    return PostgresStorage(database=db_config["database"],
+                           user=db_config["user"],
+                           password=db_config["password"],
+                           host=db_config["host"],
+                           port=db_config.get("port", 5432))
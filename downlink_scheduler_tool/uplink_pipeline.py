@@ -0,0 +1,157 @@
+"""
+Staged processing of the uplinks received by the downlink scheduler: each stage has its own pool of worker threads, a
+slow stage (e.g. a database write) of a device doesn't delay the other devices. The items of a device are always
+handled by the same worker of each stage, so they are processed in the order in which they were received, and the
+items that can't meet their reception window are dropped.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import collections
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineItem(object):
+    """
+    Item processed by an UplinkPipeline.
+    key: items with the same key are processed in order (e.g. the DevAddr or the DevEUI of the device), the items
+        without key are handled by the first worker of each stage.
+    deadline: time.monotonic() after which the item is dropped (None if it never expires).
+    on_done: function without arguments called when the item leaves the pipeline (processed, dropped or failed).
+    on_dropped: function without arguments called before on_done if the item is dropped or fails (e.g. to give back
+        the downlink taken for it).
+    """
+
+    def __init__(self, key=None, deadline=None, on_done=None, on_dropped=None):
+        self.key = key
+        self.deadline = deadline
+        self.on_done = on_done
+        self.on_dropped = on_dropped
+
+    def expired(self, now=None):
+        return self.deadline is not None and (time.monotonic() if now is None else now) > self.deadline
+
+
+class PipelineStage(object):
+    """ Stage of the pipeline: a function applied to the items by a pool of worker threads."""
+    _STOP = object()
+
+    def __init__(self, pipeline, name, function, workers=1):
+        """
+        :param name: name of the stage (used in the logs and the counters).
+        :param function: function that receives a PipelineItem and returns the item for the next stage, or None if
+            the processing of the item has finished.
+        :param workers: number of worker threads.
+        """
+        self.pipeline = pipeline
+        self.name = name
+        self.function = function
+        self.next_stage = None
+        self._queues = [queue.Queue() for _ in range(workers)]
+        self._threads = [threading.Thread(target=self._run, args=(worker_queue,), name=f"{name}_{index}",
+                                          daemon=True)
+                         for index, worker_queue in enumerate(self._queues)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, item):
+        worker_index = hash(item.key) % len(self._queues) if item.key is not None else 0
+        self._queues[worker_index].put(item)
+
+    def stop(self, timeout=None):
+        """ Stops the workers after processing the items that were already received."""
+        for worker_queue in self._queues:
+            worker_queue.put(self._STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self, worker_queue):
+        while True:
+            item = worker_queue.get()
+            if item is self._STOP:
+                return
+            if item.expired():
+                logger.warning(f"Dropping an uplink of {item.key} in {self.name}, it can't meet its window.")
+                self.pipeline.dropped[self.name] += 1
+                self.pipeline.finish(item, dropped=True)
+                continue
+            try:
+                next_item = self.function(item)
+            except Exception:
+                logger.exception(f"Error processing an uplink of {item.key} in {self.name}.")
+                self.pipeline.failed[self.name] += 1
+                self.pipeline.finish(item, dropped=True)
+                continue
+            if next_item is None or self.next_stage is None:
+                self.pipeline.finish(next_item or item)
+            else:
+                self.next_stage.put(next_item)
+
+
+class UplinkPipeline(object):
+    """ Sequence of PipelineStage, the items go through the stages in order."""
+
+    def __init__(self, stages):
+        """
+        :param stages: list of (name, function, workers) of the stages (see PipelineStage).
+        """
+        self.dropped = collections.Counter()
+        self.failed = collections.Counter()
+        self.finished = 0
+        self._lock = threading.Lock()
+        self.stages = [PipelineStage(self, name, function, workers) for name, function, workers in stages]
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            stage.next_stage = next_stage
+        for stage in self.stages:
+            stage.start()
+
+    def submit(self, item):
+        """ Adds a PipelineItem to the first stage."""
+        self.stages[0].put(item)
+
+    def finish(self, item, dropped=False):
+        with self._lock:
+            self.finished += 1
+        if dropped and item.on_dropped is not None:
+            try:
+                item.on_dropped()
+            except Exception:
+                logger.exception("Error dropping an uplink.")
+        if item.on_done is not None:
+            try:
+                item.on_done()
+            except Exception:
+                logger.exception("Error finishing an uplink.")
+
+    def stop(self, timeout=None):
+        """ Processes the pending items and stops the worker threads of all the stages."""
+        for stage in self.stages:
+            stage.stop(timeout)
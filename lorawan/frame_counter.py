@@ -0,0 +1,141 @@
+"""
+Frame counters (FCnt) of the LoRaWAN sessions: the frames only carry the 16 least significant bits of the 32-bit
+counters used in the MIC and the encryption of the FRMPayload, the full counter is reconstructed from the last one
+known of the device.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+FCNT_MOD = 2 ** 32
+FCNT_WIRE_MOD = 2 ** 16
+# Maximum difference between the last received counter and the counter of a new frame (LoRaWAN 1.0.2).
+MAX_FCNT_GAP = 2 ** 14
+# A frame is taken as the restart of the counters of the device (e.g. an ABP device that was reset) only if its
+# 16-bit FCnt is below RESTART_FCNT_LIMIT, the other frames out of the MAX_FCNT_GAP window are replays.
+RESTART_FCNT_LIMIT = 64
+
+
+def reconstruct_fcnt(wire_fcnt, last_fcnt, max_gap=MAX_FCNT_GAP):
+    """
+    Reconstructs the 32-bit frame counter of a received frame.
+    :param wire_fcnt: 16-bit FCnt of the frame header (int).
+    :param last_fcnt: last 32-bit counter received from the device (None if no frame was received).
+    :param max_gap: maximum difference with the last counter.
+    :return: the 32-bit counter, or None if it's farther than max_gap from the last one (e.g. a replayed frame or
+        a reset of the counters of the device).
+    """
+    wire_fcnt %= FCNT_WIRE_MOD
+    if last_fcnt is None:
+        return wire_fcnt
+    fcnt = (last_fcnt - last_fcnt % FCNT_WIRE_MOD) | wire_fcnt
+    if fcnt < last_fcnt:
+        # The 16 least significant bits rolled over.
+        fcnt += FCNT_WIRE_MOD
+    if fcnt - last_fcnt > max_gap or fcnt >= FCNT_MOD:
+        return None
+    return fcnt
+
+
+class FrameCounter(object):
+    """ Uplink and downlink frame counters of a device session (32-bit)."""
+
+    def __init__(self, last_up=None, next_down=0, max_gap=MAX_FCNT_GAP):
+        """
+        :param last_up: last 32-bit uplink counter received (None if no uplink was received in the session).
+        :param next_down: 32-bit counter of the next downlink.
+        :param max_gap: maximum difference between consecutive uplink counters.
+        """
+        self.last_up = last_up
+        self.next_down = next_down
+        self.max_gap = max_gap
+
+    def reset(self):
+        """ Resets the counters (e.g. after a new session of the device)."""
+        self.last_up = None
+        self.next_down = 0
+
+    def uplink_candidates(self, wire_fcnt):
+        """
+        Returns the possible 32-bit counters of an uplink, in order of preference: the counter reconstructed from
+        the last one and, if it's below RESTART_FCNT_LIMIT, the 16-bit value (the counters of the device were
+        reset). The MIC tells which one is used.
+        """
+        candidates = []
+        fcnt = reconstruct_fcnt(wire_fcnt, self.last_up, self.max_gap)
+        if fcnt is not None:
+            candidates.append(fcnt)
+        wire_fcnt %= FCNT_WIRE_MOD
+        if wire_fcnt < RESTART_FCNT_LIMIT and wire_fcnt not in candidates:
+            candidates.append(wire_fcnt)
+        return candidates
+
+    def accept_uplink(self, fcnt, restart=False):
+        """
+        Registers the 32-bit counter of a received uplink. The last counter only goes back if the counters of the
+        device restarted.
+        """
+        if restart or self.last_up is None or fcnt > self.last_up:
+            self.last_up = fcnt
+
+    def track_uplink(self, lorawan_message, key):
+        """
+        Reconstructs the 32-bit counter of a received data message: the candidate counters are checked with the MIC
+        and the one that matches is registered and set in the frame header (so it's used to decrypt the FRMPayload).
+        :param lorawan_message: parsed LoRaWANMessage (data message).
+        :param key: NwkSKey used to calculate the MIC.
+        :return: calculated MIC (bytes), it doesn't match the MIC of the message if no counter was valid.
+        """
+        fhdr = lorawan_message.macpayload.fhdr
+        candidates = self.uplink_candidates(fhdr.get_fcnt_int())
+        for fcnt in candidates:
+            calculated_mic = lorawan_message.calculate_mic(key=key, fcnt=fcnt)
+            if calculated_mic == lorawan_message.mic_bytes:
+                fhdr.full_fcnt = fcnt
+                # Only the 16-bit candidate (a restart of the device) is below the last counter.
+                self.accept_uplink(fcnt, restart=self.last_up is not None and fcnt < self.last_up)
+                return calculated_mic
+        if candidates:
+            fcnt = candidates[0]
+        else:
+            # The MIC is calculated with the next counter having the 16 bits of the frame, a replayed frame (sent
+            # with a previous counter) doesn't match it.
+            fcnt = reconstruct_fcnt(fhdr.get_fcnt_int(), self.last_up, max_gap=FCNT_MOD)
+            if fcnt is None:
+                fcnt = fhdr.get_fcnt_int()
+        fhdr.full_fcnt = fcnt
+        return lorawan_message.calculate_mic(key=key, fcnt=fcnt)
+
+    def take_downlink(self):
+        """ Returns the 32-bit counter of the next downlink and increments it."""
+        fcnt = self.next_down
+        self.next_down = (self.next_down + 1) % FCNT_MOD
+        return fcnt
+
+    def to_dict(self):
+        return {"last_up": self.last_up, "next_down": self.next_down}
+
+    @classmethod
+    def from_dict(cls, counters_dict, max_gap=MAX_FCNT_GAP):
+        return cls(last_up=counters_dict.get("last_up"), next_down=counters_dict.get("next_down", 0),
+                   max_gap=max_gap)
@@ -0,0 +1,143 @@
+"""
+Join Accept messages of the OTAA activations. The AES context of the AppKey (and the subkeys of its CMAC) is created
+once per device and the random parts of the Join Accept (AppNonce, NetID and DevAddr) can be generated in advance, so
+that answering a Join Request takes three AES operations on a prepared cipher.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import collections
+import random
+import struct
+
+from Cryptodome.Cipher import AES
+
+import lorawan.lorawan_parameters.general as lorawan_parameters
+
+BLOCK_SIZE = 16
+_MASK128 = 2 ** 128 - 1
+# Constant of the subkeys generation of the CMAC (RFC 4493).
+_CMAC_RB = 0x87
+
+JoinCandidate = collections.namedtuple("JoinCandidate", "appnonce netid devaddr")
+JoinCandidate.__doc__ = """ Random parts of a Join Accept: AppNonce (3 bytes, as sent), NetID and DevAddr (big endian)."""
+
+JoinAccept = collections.namedtuple("JoinAccept", "phypayload devaddr nwkskey appskey")
+
+
+def _cmac_subkey(block_int):
+    return ((block_int << 1) & _MASK128) ^ (_CMAC_RB if block_int >> 127 else 0)
+
+
+class AppKeyCipher(object):
+    """ AES128 (ECB) and CMAC of a key, with the key schedule and the CMAC subkeys calculated once."""
+    __slots__ = ('_cipher', '_k1', '_k2')
+
+    def __init__(self, key):
+        assert len(key) == 16, "The key must be 128 bits long."
+        self._cipher = AES.new(key, AES.MODE_ECB)
+        self._k1 = _cmac_subkey(int.from_bytes(self._cipher.encrypt(bytes(BLOCK_SIZE)), byteorder='big'))
+        self._k2 = _cmac_subkey(self._k1)
+
+    def encrypt(self, message):
+        return self._cipher.encrypt(message)
+
+    def decrypt(self, cipher_text):
+        return self._cipher.decrypt(cipher_text)
+
+    def cmac(self, message):
+        """ Returns the CMAC of the message (16 bytes), equal to utils.aes128_cmac."""
+        if message and len(message) % BLOCK_SIZE == 0:
+            last_key = self._k1
+        else:
+            message = message + b'\x80' + bytes(BLOCK_SIZE - 1 - len(message) % BLOCK_SIZE)
+            last_key = self._k2
+        mac = 0
+        last_block_start = len(message) - BLOCK_SIZE
+        for block_start in range(0, len(message), BLOCK_SIZE):
+            block = int.from_bytes(message[block_start:block_start + BLOCK_SIZE], byteorder='big') ^ mac
+            if block_start == last_block_start:
+                block ^= last_key
+            mac = int.from_bytes(self._cipher.encrypt(block.to_bytes(BLOCK_SIZE, byteorder='big')), byteorder='big')
+        return mac.to_bytes(BLOCK_SIZE, byteorder='big')
+
+
+class JoinAcceptBuilder(object):
+    """
+    Creates the Join Accept messages of a device from a pool of pre-generated JoinCandidate. With pool_size=1 the
+    candidates are generated when they are needed, drawing the same random numbers than the previous versions of the
+    testing tool (the captured sessions can be replayed with the same random seed).
+    """
+
+    def __init__(self, appkey, new_appnonce, pool_size=1, rng=random):
+        """
+        :param appkey: AppKey of the device (bytes).
+        :param new_appnonce: function that returns an unused AppNonce (int, 24 bits).
+        :param pool_size: number of candidates generated at once.
+        :param rng: random numbers generator of the DevAddr and NetID.
+        """
+        self.cipher = AppKeyCipher(appkey)
+        self.new_appnonce = new_appnonce
+        self.pool_size = pool_size
+        self.rng = rng
+        self._candidates = collections.deque()
+
+    def new_candidate(self):
+        appnonce = struct.pack("<L", self.new_appnonce())[:3]
+        devaddr_int = self.rng.randint(0, 2 ** 32 - 1)
+        nwkid_int = (devaddr_int & 0xfe000000) // 2 ** 25
+        netid_int = (self.rng.randint(0, 2 ** 24 - 1) & 0xffff80) | nwkid_int
+        return JoinCandidate(appnonce=appnonce,
+                             netid=struct.pack(">L", netid_int)[-3:],
+                             devaddr=struct.pack(">L", devaddr_int))
+
+    def refill(self):
+        """ Generates the candidates missing in the pool (e.g. while the device isn't joining)."""
+        while len(self._candidates) < self.pool_size:
+            self._candidates.append(self.new_candidate())
+
+    def build(self, devnonce, dlsettings, rxdelay, cflist):
+        """
+        Creates the Join Accept answering a Join Request.
+        :param devnonce: 2 bytes of the device nonce used in the join request message.
+        :param dlsettings: byte of the dlsettings field.
+        :param rxdelay: byte of the rxdelay field.
+        :param cflist: 16 bytes with the frequency list (or empty).
+        :return: JoinAccept with the PHYPayload (encrypted), the DevAddr (big endian) and the session keys.
+        """
+        if not self._candidates:
+            self.refill()
+        candidate = self._candidates.popleft()
+        appnonce_netid = candidate.appnonce + candidate.netid[::-1]
+        appnonce_netid_devnonce = appnonce_netid + devnonce[::-1]
+        # Both session keys in a single call (ECB).
+        session_keys = self.cipher.encrypt(b'\x01' + appnonce_netid_devnonce + bytes(7) +
+                                           b'\x02' + appnonce_netid_devnonce + bytes(7))
+        macpayload = appnonce_netid + candidate.devaddr[::-1] + dlsettings + rxdelay + cflist
+        mhdr_macpayload = lorawan_parameters.MHDR.JOIN_ACCEPT + macpayload
+        mic = self.cipher.cmac(mhdr_macpayload)[:4]
+        return JoinAccept(phypayload=lorawan_parameters.MHDR.JOIN_ACCEPT + self.cipher.decrypt(macpayload + mic),
+                          devaddr=candidate.devaddr,
+                          nwkskey=session_keys[:BLOCK_SIZE],
+                          appskey=session_keys[BLOCK_SIZE:])
@@ -30,6 +30,7 @@ Test Name: ACT_01
 
 import lorawan.lorawan_conformance.lorawan_steps as lorawan_steps
 import conformance_testing.test_step_sequence
+from conformance_testing.test_step_sequence import StepSpec
 
 
 class TestAppManager(conformance_testing.test_step_sequence.TestManager):
@@ -40,48 +41,35 @@ class TestAppManager(conformance_testing.test_step_sequence.TestManager):
     LoRaWAN Test ACT 01:
     Test Mode activation to test the device's Activation By Personalization (ABP).
     """
+    definition = conformance_testing.test_step_sequence.TestDefinition(
+        test_id="TD_LoRaWAN_ACT_01",
+        description=(
+            "Objective: Check that the node can join using ABP and enter "
+            "Test Mode Activation.\n"
+            "References: LoRaWAN Specification v1.0.2.\n"
+            "Pre-test conditions:\n"
+            "The end device has a pre-configured DevAddr, NwkSKey and AppSKey.\n"
+            "The Test Application Server has the end device registered in its device list\n"
+            "and knows its NwkSkey, AppSKey and DevAddr.\n"),
+        steps=[
+            # Step 1, waiting data: any port different from 0 (MAC commands) or 224 (test mode).
+            StepSpec(name="S1DataToActivate",
+                     step_class=lorawan_steps.WaitDataToActivate,
+                     next_step="S2ActokFinalStep",
+                     description=("Wait any data from the DUT to activate Test Mode.\n"
+                                  "- Reception from DUT: DATA packet.\n"
+                                  "- TAS sends: Test Mode activation message to the DUT "
+                                  "(DL packet with payload 0x01010101 sent to port 224). "
+                                  "The payload is encrypted with the AppSKey.\n")),
+            # Step 2, TAOK: the test is waiting for test accepted app message in port 224.
+            StepSpec(name="S2ActokFinalStep",
+                     step_class=lorawan_steps.ActokFinal,
+                     description=("The test is expecting a Test Activation Ok message with the current "
+                                  "downlink counter\n"
+                                  "- Reception from DUT: TAOK message with the downlink counter.\n"
+                                  "- TAS sends: none")),
+        ])
 
     def __init__(self, test_session_coordinator):
         super().__init__(test_name=__name__.split(".")[-1],
                          ctx_test_session_coordinator=test_session_coordinator)
-
-        # -----------------------------------------------------------------------------------------
-        # Step 2, TAOK: the test is waiting for test accepted app message in port 224.
-        self.s2_actok_finalstep = lorawan_steps.ActokFinal(ctx_test_manager=self,
-                                                           step_name="S2ActokFinalStep",
-                                                           next_step=None)
-        self.add_step_description(
-            step_name="Step 2: S2ActokFinalStep",
-            description=(
-                "The test is expecting a Test Activation Ok message with the current "
-                "downlink counter\n"
-                "- Reception from DUT: TAOK message with the downlink counter.\n"
-                "- TAS sends: none"))
-
-        # -----------------------------------------------------------------------------------------
-        # Step 1, waiting data: any port different from 0 (MAC commands) or 224 (test mode).
-        self.s1_data_to_activate = lorawan_steps.WaitDataToActivate(
-            ctx_test_manager=self,
-            step_name="S1DataToActivate",
-            next_step=self.s2_actok_finalstep)
-        self.add_step_description(
-            step_name="Step 1: S1DataToActivate",
-            description=("Wait any data from the DUT to activate Test Mode.\n"
-                         "- Reception from DUT: DATA packet.\n"
-                         "- TAS sends: Test Mode activation message to the DUT "
-                         "(DL packet with payload 0x01010101 sent to port 224). "
-                         "The payload is encrypted with the AppSKey.\n"))
-
-        # ------------------------------------------------------------------------------------------
-        # Set Initial Step
-        self.current_step = self.s1_data_to_activate
-        self.add_step_description(
-            step_name="Test ID: TD_LoRaWAN_ACT_01",
-            description=(
-                "Objective: Check that the node can join using ABP and enter "
-                "Test Mode Activation.\n"
-                "References: LoRaWAN Specification v1.0.2.\n"
-                "Pre-test conditions:\n"
-                "The end device has a pre-configured DevAddr, NwkSKey and AppSKey.\n"
-                "The Test Application Server has the end device registered in its device list\n"
-                "and knows its NwkSkey, AppSKey and DevAddr.\n"))
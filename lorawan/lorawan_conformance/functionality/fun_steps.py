@@ -78,7 +78,7 @@ class CountCheckFCntUp(lorawan_steps.CountingStep):
         super().step_handler(ch, method, properties, body)
         lorawan_received = self.received_testscript_msg.parse_lorawan_message()
 
-        received_fcntup_int = lorawan_received.macpayload.fhdr.get_fcnt_int()
+        received_fcntup_int = lorawan_received.macpayload.fhdr.get_full_fcnt()
         logger.debug(f"Received FCnt: {received_fcntup_int}")
         if self.last_fcntup is None:
             logger.debug("Saving first")
@@ -56,13 +56,14 @@ class ActokToPingDelay(lorawan_steps.ActokToPing):
         self.delay = delay
 
     def step_handler(self, ch, method, properties, body):
-        self.ctx_test_manager.device_under_test.loramac_params.rx1_delay += self.delay
+        device = self.ctx_test_manager.device_under_test
+        device.update_loramac(rx1_delay=device.loramac_params.rx1_delay + self.delay)
         try:
             super().step_handler(ch, method, properties, body)
         except test_errors.TestingToolError as tt_e:
             raise tt_e
         finally:
-            self.ctx_test_manager.device_under_test.loramac_params.rx1_delay -= self.delay
+            device.update_loramac(rx1_delay=device.loramac_params.rx1_delay - self.delay)
 
 
 class TestAppManager(conformance_testing.test_step_sequence.TestManager):
@@ -30,6 +30,7 @@ Test Name: DEACTIVATE
 import lorawan.lorawan_conformance.lorawan_steps as lorawan_steps
 import lorawan.lorawan_parameters.testing as tests_parameters
 import conformance_testing.test_step_sequence
+from conformance_testing.test_step_sequence import StepSpec
 import parameters.message_broker
 
 
@@ -66,27 +67,22 @@ class TestAppManager(conformance_testing.test_step_sequence.TestManager):
 
     LoRaWAN Test DEACTIVATION: Deactivates test mode.
     """
+    definition = conformance_testing.test_step_sequence.TestDefinition(
+        test_id="TD_LoRaWAN_DEACTIVATE",
+        description=("Objective: Deactivates test mode.\n"
+                     "References: LoRaWAN Specification v1.0.2.\n"
+                     "Pre-test conditions: The DUT is in Test Mode.\n"),
+        steps=[
+            # Step 1, waiting TAOK: the test is waiting for a TAOK message with the downlink counter to deactivate
+            # the Test Mode.
+            StepSpec(name="S1ActOkToDeactivate",
+                     step_class=ActOkToDeactivate,
+                     description=("Verifies TAOK and deactivates Test Mode.\n"
+                                  "- Reception from DUT: TAOK message with the downlink counter.\n"
+                                  "- TAS sends: Test Mode deactivation (payload 0x00).\n")),
+        ])
+
     def __init__(self, test_session_coordinator):
         super().__init__(
             test_name=__name__.split(".")[-1],
             ctx_test_session_coordinator=test_session_coordinator)
-        # ------------------------------------------------------------------------------------------------
-        # Step 1, waiting TAOK: the test is waiting for a TAOK message with the downlink counter to deactivate the
-        # Test Mode.
-        self.s1_actok_to_deactivate = ActOkToDeactivate(ctx_test_manager=self,
-                                                        step_name="S1ActOkToDeactivate", next_step=None)
-        self.add_step_description(step_name="Step 1: S1ActOkToDeactivate",
-                                  description=(
-                                      "Verifies TAOK and deactivates Test Mode.\n"
-                                      "- Reception from DUT: TAOK message with the downlink counter.\n"
-                                      "- TAS sends: Test Mode deactivation (payload 0x00).\n"))
-
-        # ------------------------------------------------------------------------------------------------
-        # Set Initial Step
-        self.current_step = self.s1_actok_to_deactivate
-        self.add_step_description(step_name="Test ID: TD_LoRaWAN_DEACTIVATE",
-                                  description=(
-                                      "Objective: Deactivates test mode.\n"
-                                      "References: LoRaWAN Specification v1.0.2.\n"
-                                      "Pre-test conditions: The DUT is in Test Mode.\n"))
-
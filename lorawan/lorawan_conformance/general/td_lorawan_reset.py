@@ -30,6 +30,7 @@ Test Name: RESET
 import lorawan.lorawan_conformance.lorawan_steps as lorawan_steps
 import lorawan.lorawan_parameters.testing as tests_parameters
 import conformance_testing.test_step_sequence
+from conformance_testing.test_step_sequence import StepSpec
 import parameters.message_broker
 
 
@@ -38,6 +39,9 @@ class AnyToDeactivate(lorawan_steps.LorawanStep):
     Step 1, waiting actok message: the test is waiting for an actok message to arrive to deactivate the
     test mode on the End Device.
     """
+    # The DUT may have to be reset by the user after the failed test.
+    timeout_seconds = 0
+
     def step_handler(self, ch, method, properties, body):
         """ Test pass if the Activation Ok message is received without an error."""
         frmpayload_response = tests_parameters.FRMPAYLOAD.TEST_DEACTIVATE
@@ -61,52 +65,40 @@ class TestAppManager(conformance_testing.test_step_sequence.TestManager):
     LoRaWAN DUT RESET: Auxiliary test, deactivates test mode to take the DUT to a known state to continue executing
     the remaining test cases in case of a test FAIL.
     """
+    # The first step waits for a manual reset of the DUT (see AnyToDeactivate).
+    test_timeout_seconds = 0
+    definition = conformance_testing.test_step_sequence.TestDefinition(
+        test_id="TD_LoRaWAN_RESET",
+        description=("Objective: Resets the DUT to a known state after a test fails, deactivating and "
+                     "activating again the Test Mode.\n"
+                     "References: LoRaWAN Specification v1.0.2.\n"
+                     "Pre-test conditions:\n"
+                     "The end device has a pre-configured DevAddr, NwkSKey and AppSKey.\n"
+                     "The Test Application Server has the end device registered in its ABP "
+                     "device list and knows its NwkSkey, AppSKey and DevAddr.\n"),
+        steps=[
+            StepSpec(name="S1AnyToDeactivate",
+                     step_class=AnyToDeactivate,
+                     next_step="S2DataToActivate",
+                     description=("Sends the Test Mode deactivation message after any received message.\n"
+                                  "- Reception from DUT: Any LoRaWAN message.\n"
+                                  "- TAS sends:  Test Mode deactivation (payload 0x00).\n")),
+            StepSpec(name="S2DataToActivate",
+                     step_class=lorawan_steps.WaitDataToActivate,
+                     next_step="S3ActokFinalStep",
+                     description=("Wait any data from the DUT to activate Test Mode.\n"
+                                  "- Reception from DUT: DATA packet.\n"
+                                  "- TAS sends: Test Mode activation message to the DUT"
+                                  "(DL packet with payload 0x01010101 sent to port 224)\n"
+                                  "The payload is encrypted with the AppSKey.\n")),
+            StepSpec(name="S3ActokFinalStep",
+                     step_class=lorawan_steps.ActokFinal,
+                     description=("The test is expecting a Test Activation Ok message with the current\n"
+                                  "downlink counter\n"
+                                  "- Reception from DUT: TAOK message with the downlink counter."
+                                  "- TAS sends: none")),
+        ])
+
     def __init__(self, test_session_coordinator):
         super().__init__(test_name=__name__.split(".")[-1],
                          ctx_test_session_coordinator=test_session_coordinator)
-
-        # ------------------------------------------------------------------------------------------------
-        # Step 3, waiting test accept: the test is waiting for test accepted app message in port 224.
-        self.s3_actok_finalstep = lorawan_steps.ActokFinal(ctx_test_manager=self,
-                                                           step_name="S3ActokFinalStep", next_step=None)
-        self.add_step_description(step_name="Step 3: S3ActokFinalStep",
-                                  description=("The test is expecting a Test Activation Ok message with the current\n"
-                                               "downlink counter\n"
-                                               "- Reception from DUT: TAOK message with the downlink counter."
-                                               "- TAS sends: none"))
-
-        # ------------------------------------------------------------------------------------------------
-        # Step 2, waiting any: the test is waiting for any data packet to arrive in a port different from 0
-        self.s2_data_to_activate = lorawan_steps.WaitDataToActivate(ctx_test_manager=self,
-                                                                    step_name="S2DataToActivate",
-                                                                    next_step=self.s3_actok_finalstep)
-        self.add_step_description(step_name="Step 2: S2DataToActivate",
-                                  description=("Wait any data from the DUT to activate Test Mode.\n"
-                                               "- Reception from DUT: DATA packet.\n"
-                                               "- TAS sends: Test Mode activation message to the DUT"
-                                               "(DL packet with payload 0x01010101 sent to port 224)\n"
-                                               "The payload is encrypted with the AppSKey.\n"))
-
-        # ------------------------------------------------------------------------------------------------
-        # Step 1, waiting any message: deactivates the test mode.
-        self.s1_any_to_deactivate = AnyToDeactivate(ctx_test_manager=self,
-                                                    step_name="S1AnyToDeactivate", next_step=self.s2_data_to_activate)
-        self.add_step_description(step_name="Step 1: S1AnyToDeactivate",
-                                  description=(
-                                      "Sends the Test Mode deactivation message after any received message.\n"
-                                      "- Reception from DUT: Any LoRaWAN message.\n"
-                                      "- TAS sends:  Test Mode deactivation (payload 0x00).\n"))
-
-        # ------------------------------------------------------------------------------------------------
-        # Set Initial Step
-        self.current_step = self.s1_any_to_deactivate
-        self.add_step_description(step_name="Test ID: TD_LoRaWAN_RESET",
-                                  description=(
-                                      "Objective: Resets the DUT to a known state after a test fails, deactivating and "
-                                      "activating again the Test Mode.\n"
-                                      "References: LoRaWAN Specification v1.0.2.\n"
-                                      "Pre-test conditions:\n"
-                                      "The end device has a pre-configured DevAddr, NwkSKey and AppSKey.\n"
-                                      "The Test Application Server has the end device registered in its ABP "
-                                      "device list and knows its NwkSkey, AppSKey and DevAddr.\n"))
-
@@ -75,8 +75,8 @@ class LorawanStep(conformance_testing.test_step_sequence.Step):
         (so an ACK could be sent to the DUT).
         """
         super().basic_check(received_testscript_msg_bytes=received_testscript_msg_bytes)
-        self.received_testscript_msg = flora_messages.GatewayMessage(
-            json_ttm_str=received_testscript_msg_bytes.decode())
+        self.received_testscript_msg = flora_messages.GatewayMessage.from_bytes(
+            received_testscript_msg_bytes)
         lorawan_msg = self.received_testscript_msg.parse_lorawan_message()
         mtype_str = lorawan_msg.mhdr.mtype_str
         # Register in flag if the received message needs Acknowdlegment knowdlege
@@ -88,7 +88,11 @@ class LorawanStep(conformance_testing.test_step_sequence.Step):
         if mtype_str in ('JOIN_REQUEST',):
             network_key = self.ctx_test_manager.device_under_test.appkey
         logger.info(f"Checking MIC using key {utils.bytes_to_text(network_key)}.")
-        calculated_mic = lorawan_msg.calculate_mic(key=network_key)
+        if mtype_str in ('UNCONFIRMED_UP', 'CONFIRMED_UP'):
+            calculated_mic = self.ctx_test_manager.device_under_test.track_received_fcnt(lorawan_msg,
+                                                                                         key=network_key)
+        else:
+            calculated_mic = lorawan_msg.calculate_mic(key=network_key)
 
         if not lorawan_msg.mic_bytes == calculated_mic:
             description_template = "Wrong MIC.\nKey: {key}\nMIC: {received_mic}\nCalculated: {calc}"
@@ -140,8 +144,8 @@ class LorawanStep(conformance_testing.test_step_sequence.Step):
         return lw_response
 
     def raise_unexpected_response_error(self, last_message_bytes):
-        self.received_testscript_msg = flora_messages.GatewayMessage(
-            json_ttm_str=last_message_bytes.decode())
+        self.received_testscript_msg = flora_messages.GatewayMessage.from_bytes(
+            last_message_bytes)
         exeption_raised = test_errors.UnexpectedResponseError(
             description="Unexpected msg.",
             test_case=self.ctx_test_manager.tc_name,
@@ -154,8 +158,8 @@ class LorawanStep(conformance_testing.test_step_sequence.Step):
     def step_handler(self, ch, method, properties, body):
         """ Actions performed in this step of the test"""
         if not self.received_testscript_msg:
-            self.received_testscript_msg = lorawan.parsing.flora_messages.GatewayMessage(
-                json_ttm_str=body.decode())
+            self.received_testscript_msg = lorawan.parsing.flora_messages.GatewayMessage.from_bytes(
+                body)
 
 
 class JoinRequestHandlerStep(LorawanStep):
@@ -204,8 +208,8 @@ class JoinRequestHandlerStep(LorawanStep):
         :return: None.
         """
         if not self.received_testscript_msg:
-            self.received_testscript_msg = flora_messages.GatewayMessage(
-                json_ttm_str=body_bytes.decode())
+            self.received_testscript_msg = flora_messages.GatewayMessage.from_bytes(
+                body_bytes)
 
         lw_joinrequest = self.received_testscript_msg.parse_lorawan_message()
         devnonce = lw_joinrequest.macpayload.devnonce_bytes
@@ -242,7 +246,7 @@ class JoinRequestHandlerStep(LorawanStep):
         (devnonce not previously used).
         """
         if not self.received_testscript_msg:
-            self.received_testscript_msg = flora_messages.GatewayMessage(json_ttm_str=body.decode())
+            self.received_testscript_msg = flora_messages.GatewayMessage.from_bytes(body)
         lw_joinrequest = self.received_testscript_msg.parse_lorawan_message()
         if lw_joinrequest.mhdr.mtype_str == "JOIN_REQUEST":
             self.process_join_request(body_bytes=body)
@@ -270,7 +274,7 @@ class WaitDataToActivate(JoinRequestHandlerStep):
         """
 
         if not self.received_testscript_msg:
-            self.received_testscript_msg = flora_messages.GatewayMessage(json_ttm_str=body.decode())
+            self.received_testscript_msg = flora_messages.GatewayMessage.from_bytes(body)
         frmpayload_response = tests_parameters.FRMPAYLOAD.TEST_ACT
         lw_received = self.received_testscript_msg.parse_lorawan_message()
         mtype_str = lw_received.mhdr.mtype_str
@@ -317,7 +321,7 @@ class WaitActokStep(LorawanStep):
     def step_handler(self, ch, method, properties, body):
         """ Checks the downlink counter of an Activation Ok message."""
         if not self.received_testscript_msg:
-            self.received_testscript_msg = flora_messages.GatewayMessage(json_ttm_str=body.decode())
+            self.received_testscript_msg = flora_messages.GatewayMessage.from_bytes(body)
         lw_message = self.received_testscript_msg.parse_lorawan_message()
         appskey = self.ctx_test_manager.device_under_test.loramac_params.appskey
         received_frmpayload = lw_message.get_frmpayload_plaintext(key=appskey)
@@ -509,7 +513,7 @@ class FrequencyCheck(WaitActokStep):
         super().step_handler(ch, method, properties, body)
         self.message_count += 1
         used_freq = self.received_testscript_msg.freq
-        if used_freq not in self.ctx_test_manager.device_under_test.loramac_params.channel_struct.used_frequencies:
+        if not self.ctx_test_manager.device_under_test.loramac_params.channel_struct.uses_frequency(used_freq):
             self.frequencies_to_check[used_freq] = 1
         else:
             self.frequencies_to_check[used_freq] += 1
@@ -620,7 +624,7 @@ class WaitPong(LorawanStep):
     def step_handler(self, ch, method, properties, body):
         """ Pong message handler."""
         if not self.received_testscript_msg:
-            self.received_testscript_msg = flora_messages.GatewayMessage(json_ttm_str=body.decode())
+            self.received_testscript_msg = flora_messages.GatewayMessage.from_bytes(body)
 
         received_lorawan = self.received_testscript_msg.parse_lorawan_message()
 
@@ -726,7 +730,7 @@ class PrintAnyMessage(LorawanStep):
 
     def step_handler(self, ch, method, properties, body):
         if not self.received_testscript_msg:
-            self.received_testscript_msg = flora_messages.GatewayMessage(json_ttm_str=body.decode())
+            self.received_testscript_msg = flora_messages.GatewayMessage.from_bytes(body)
 
         frmpayload_response = tests_parameters.FRMPAYLOAD.TEST_DEACTIVATE
         end_device = self.ctx_test_manager.device_under_test
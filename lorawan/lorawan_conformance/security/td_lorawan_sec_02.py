@@ -29,6 +29,7 @@ Test Name: SEC_02
 #################################################################################
 import lorawan.lorawan_conformance.lorawan_steps as lorawan_steps
 import conformance_testing.test_step_sequence
+from conformance_testing.test_step_sequence import StepSpec
 import parameters.message_broker as message_broker
 from utils import bytes_to_text
 
@@ -69,41 +70,31 @@ class TestAppManager(conformance_testing.test_step_sequence.TestManager):
 
     LoRaWAN Test SEC 02: Test if a message with a wrong MIC is ignored as expected.
     """
+    definition = conformance_testing.test_step_sequence.TestDefinition(
+        test_id="TD_LoRaWAN_SEC_02",
+        description=(
+            "Objective: Test if a message with a wrong MIC is ignored as expected.\n"
+            "References: LoRaWAN Specification v1.0.2.\n"
+            "Pre-test conditions: The DUT is in Test Mode.\n"),
+        steps=[
+            # Step 1, send wrong mic:
+            # the test is waiting for an Act OK message to send a ping with a wrong MIC (to be ignored)
+            StepSpec(name="S1ActokToWrongMIC",
+                     step_class=ActokToWrongMIC,
+                     next_step="S2WaitOkFinal",
+                     description=(
+                         "Wait an ACT OK from the DUT to send a PING with wrong MIC.\n"
+                         "- Reception from DUT: TAOK message with the downlink counter.\n"
+                         "- TAS sends: PING message with wrong MIC.\n")),
+            # Step 2, verifies Act Ok: verifies that the last ping message with wrong MIC
+            #  was ignored (downlink counter unchanged).
+            StepSpec(name="S2WaitOkFinal",
+                     step_class=lorawan_steps.ActokFinal,
+                     description=("Check that the last PING was ignored.\n"
+                                  "- Reception from DUT: TAOK message.\n"
+                                  "- TAS sends:  None.\n")),
+        ])
 
     def __init__(self, test_session_coordinator):
         super().__init__(test_name=__name__.split(".")[-1],
                          ctx_test_session_coordinator=test_session_coordinator)
-        # -----------------------------------------------------------------------------------------
-        # Step 2, verifies Act Ok: verifies that the last ping message with wrong MIC
-        #  was ignored (downlink counter unchanged).
-        self.s2_actok_final = lorawan_steps.ActokFinal(ctx_test_manager=self,
-                                                       step_name="S2WaitOkFinal",
-                                                       next_step=None)
-        self.add_step_description(step_name="Step 2: S2WaitOkFinal",
-                                  description=(
-                                      "Check that the last PING was ignored.\n"
-                                      "- Reception from DUT: TAOK message.\n"
-                                      "- TAS sends:  None.\n"))
-
-        # -----------------------------------------------------------------------------------------
-        # Step 1, send wrong mic:
-        # the test is waiting for an Act OK message to send a ping with a wrong MIC (to be ignored)
-        self.s1_actok_to_ping = ActokToWrongMIC(ctx_test_manager=self,
-                                                step_name="S1ActokToWrongMIC",
-                                                next_step=self.s2_actok_final)
-        self.add_step_description(
-            step_name="Step 1: S1ActokToWrongMIC",
-            description=(
-                "Wait an ACT OK from the DUT to send a PING with wrong MIC.\n"
-                "- Reception from DUT: TAOK message with the downlink counter.\n"
-                "- TAS sends: PING message with wrong MIC.\n"))
-
-        # -----------------------------------------------------------------------------------------
-        # Set Initial Step
-        self.current_step = self.s1_actok_to_ping
-        self.add_step_description(
-            step_name="Test ID: TD_LoRaWAN_",
-            description=(
-                "Objective: Test if a message with a wrong MIC is ignored as expected.\n"
-                "References: LoRaWAN Specification v1.0.2.\n"
-                "Pre-test conditions: The DUT is in Test Mode.\n"))
@@ -81,12 +81,14 @@ FCtrl = namedtuple("FCtrl",
                    "UP_ADROFF_ADRACKOFF_ACKOFF_FOPTLEN0 \
                    UP_ADROFF_ADRACKOFF_ACKOFF_FOPTLEN1 \
                    DOWN_ADROFF_ACKOFF_FPENDOFF_FOPTLEN0 \
-                   DOWN_ADROFF_ACKON_FPENDOFF_FOPTLEN0")
+                   DOWN_ADROFF_ACKON_FPENDOFF_FOPTLEN0 \
+                   DOWN_ADROFF_ACKOFF_FPENDON_FOPTLEN0")
 FCTRL = FCtrl(
     UP_ADROFF_ADRACKOFF_ACKOFF_FOPTLEN0=b'\x00',
     UP_ADROFF_ADRACKOFF_ACKOFF_FOPTLEN1=b'\x01',
     DOWN_ADROFF_ACKOFF_FPENDOFF_FOPTLEN0=b'\x00',
-    DOWN_ADROFF_ACKON_FPENDOFF_FOPTLEN0=b'\x20'
+    DOWN_ADROFF_ACKON_FPENDOFF_FOPTLEN0=b'\x20',
+    DOWN_ADROFF_ACKOFF_FPENDON_FOPTLEN0=b'\x10'
 
 )
 
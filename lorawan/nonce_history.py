@@ -0,0 +1,181 @@
+"""
+Histories of the nonces used in the OTAA joins of a device (DevNonce and AppNonce): the membership checks are O(1)
+and the memory used by each device is bounded, so that the join requests of many devices stay cheap.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import base64
+import collections
+import zlib
+
+DEVNONCE_BITS = 16
+APPNONCE_BITS = 24
+# Number of AppNonces remembered by a device (the AppNonce space is too large for a bitmap per device).
+APPNONCE_HISTORY = 4096
+
+
+def nonce_to_int(nonce):
+    """ Accepts the nonces as int or as bytes (big endian)."""
+    if isinstance(nonce, (bytes, bytearray)):
+        return int.from_bytes(nonce, byteorder='big')
+    return nonce
+
+
+class NonceBitmap(object):
+    """
+    Set of the used nonces of a device, stored as a bitmap over the nonce space (8 KiB for the 16-bit DevNonce).
+    The bitmap is allocated with the first nonce and it's serialized compressed (a few bytes for a few joins).
+    """
+    __slots__ = ('bits', 'last', '_bitmap', '_count')
+
+    def __init__(self, bits=DEVNONCE_BITS):
+        """
+        :param bits: size of the nonces in bits (multiple of 8).
+        """
+        self.bits = bits
+        self.last = None
+        self._bitmap = None
+        self._count = 0
+
+    def __contains__(self, nonce):
+        if self._bitmap is None:
+            return False
+        nonce = nonce_to_int(nonce)
+        return bool(self._bitmap[nonce >> 3] & (1 << (nonce & 7)))
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        if self._bitmap is None:
+            return
+        for byte_index, byte in enumerate(self._bitmap):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield (byte_index << 3) | bit
+
+    def add(self, nonce):
+        """
+        Stores a used nonce, it's also kept as the last one (a repeated nonce isn't).
+        :param nonce: nonce (int or big endian bytes).
+        :return: False if the nonce was already used.
+        """
+        nonce = nonce_to_int(nonce)
+        if not 0 <= nonce < 2 ** self.bits:
+            raise ValueError(f"Nonce out of range: {nonce}.")
+        if self._bitmap is None:
+            self._bitmap = bytearray(2 ** self.bits // 8)
+        mask = 1 << (nonce & 7)
+        if self._bitmap[nonce >> 3] & mask:
+            return False
+        self._bitmap[nonce >> 3] |= mask
+        self._count += 1
+        self.last = nonce
+        return True
+
+    def last_bytes(self):
+        """ Returns the last nonce as big endian bytes (None if no nonce was used)."""
+        if self.last is None:
+            return None
+        return self.last.to_bytes(self.bits // 8, byteorder='big')
+
+    def to_bytes(self):
+        """ Serializes the history: the last nonce followed by the compressed bitmap (empty if no nonce was used)."""
+        if self._bitmap is None:
+            return b''
+        return self.last_bytes() + zlib.compress(bytes(self._bitmap))
+
+    @classmethod
+    def from_bytes(cls, data, bits=DEVNONCE_BITS):
+        """ Creates a NonceBitmap from the bytes returned by to_bytes."""
+        history = cls(bits=bits)
+        if data:
+            nonce_size = bits // 8
+            bitmap = zlib.decompress(bytes(data[nonce_size:]))
+            if len(bitmap) != 2 ** bits // 8:
+                raise ValueError("Wrong size of the nonce bitmap.")
+            history._bitmap = bytearray(bitmap)
+            history._count = sum(bin(byte).count('1') for byte in bitmap if byte)
+            history.last = int.from_bytes(data[:nonce_size], byteorder='big')
+        return history
+
+    def to_text(self):
+        """ Serializes the history as a base64 string."""
+        return base64.b64encode(self.to_bytes()).decode()
+
+    @classmethod
+    def from_text(cls, text, bits=DEVNONCE_BITS):
+        return cls.from_bytes(base64.b64decode(text or ''), bits=bits)
+
+
+class RecentNonces(object):
+    """
+    The last maxlen nonces used by a device, for the nonce spaces that are too large to keep a bitmap per device
+    (the 24-bit AppNonce). The oldest nonce is forgotten when a new one is added to a full history.
+    """
+    __slots__ = ('maxlen', '_set', '_order')
+
+    def __init__(self, maxlen=APPNONCE_HISTORY):
+        self.maxlen = maxlen
+        self._set = set()
+        self._order = collections.deque()
+
+    def __contains__(self, nonce):
+        return nonce_to_int(nonce) in self._set
+
+    def __len__(self):
+        return len(self._set)
+
+    def __iter__(self):
+        return iter(self._order)
+
+    @property
+    def last(self):
+        return self._order[-1] if self._order else None
+
+    def add(self, nonce):
+        """
+        Stores a used nonce.
+        :return: False if the nonce is already in the history.
+        """
+        nonce = nonce_to_int(nonce)
+        if nonce in self._set:
+            return False
+        if len(self._order) >= self.maxlen:
+            self._set.discard(self._order.popleft())
+        self._order.append(nonce)
+        self._set.add(nonce)
+        return True
+
+    def to_list(self):
+        return list(self._order)
+
+    @classmethod
+    def from_list(cls, nonces, maxlen=APPNONCE_HISTORY):
+        history = cls(maxlen=maxlen)
+        for nonce in nonces:
+            history.add(nonce)
+        return history
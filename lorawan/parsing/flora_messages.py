@@ -28,6 +28,9 @@ Testing tool messages specific of the LoRaWAN testing.
 import base64
 import json
 import copy
+import os
+import re
+import struct
 import logging
 
 import lorawan.lorawan_parameters.general
@@ -38,6 +41,37 @@ import conformance_testing.testingtool_messages as test_messages
 
 logger = logging.getLogger(__name__)
 
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_BINARY = "application/vnd.flora.gateway-message"
+
+WIRE_FORMAT_JSON = "json"
+WIRE_FORMAT_BINARY = "binary"
+# Format used by the services to publish the Gateway Messages (the consumers accept both formats).
+WIRE_FORMAT = os.environ.get('FLORA_WIRE_FORMAT', WIRE_FORMAT_JSON).lower()
+
+# Binary envelope: fixed header followed by the raw PHYPayload.
+#   magic, version, flags, tmst, freq (Hz), SF, BW (kHz), coding rate denominator (0 if OFF),
+#   rssi (dBm), lsnr (0.1 dB), powe (dBm), rfch, chan, extra flags, stat (CRC status: 1 OK, -1 fail, 0 no CRC).
+BINARY_MAGIC = 0xF1
+BINARY_VERSION = 2
+_BINARY_HEADER = struct.Struct('>BBBQIBHBhhbBBBb')
+_DATR_REGEX = re.compile(r'^SF(\d+)BW(\d+)$')
+
+
+class BINARY_FLAGS(object):
+    IMME = 0x01
+    IPOL = 0x02
+    NCRC = 0x04
+    TX_FIELDS = 0x08  # imme, ipol, ncrc and powe are present (downlink).
+    RSSI = 0x10
+    LSNR = 0x20
+    CHAN = 0x40
+    RFCH = 0x80
+
+
+class BINARY_EXTRA_FLAGS(object):
+    STAT = 0x01
+
 
 class GatewayMessage(test_messages.TestingToolMessage):
     """
@@ -85,6 +119,139 @@ class GatewayMessage(test_messages.TestingToolMessage):
         else:
             self.testingtool_msg_dict = copy.copy(GatewayMessage.empty_gw_msg)
         self.__lorawan_message = None  # To parse the LoRaWAN message only once.
+        self.__phypayload = None  # To base64 decode the data field only once.
+
+    @classmethod
+    def from_dict(cls, gw_msg_dict, phypayload=None):
+        """
+        (dict, bytes) -> (GatewayMessage)
+        Creates a message from a dict with the fields of the message (e.g. an rxpk of the packet forwarder).
+        :param gw_msg_dict: dict with the fields of the message.
+        :param phypayload: already decoded PHYPayload (optional, avoids decoding the data field again).
+        """
+        gw_message = cls()
+        gw_message.testingtool_msg_dict = dict(gw_msg_dict)
+        gw_message.__phypayload = phypayload
+        return gw_message
+
+    @classmethod
+    def from_bytes(cls, body, content_type=None):
+        """
+        (bytes, str) -> (GatewayMessage)
+        Parses a message received from the broker, in JSON or in the binary envelope. If the content type
+        isn't provided (AMQP content_type property), the format is detected from the first byte.
+        :param body: byte sequence received from the broker.
+        :param content_type: content type of the message (optional).
+        :return: GatewayMessage.
+        """
+        if isinstance(body, str):
+            return cls(json_ttm_str=body)
+        if content_type == CONTENT_TYPE_BINARY or \
+                (content_type != CONTENT_TYPE_JSON and body[:1] == bytes([BINARY_MAGIC])):
+            return cls.from_binary(body)
+        return cls(json_ttm_str=body.decode())
+
+    @classmethod
+    def from_binary(cls, body):
+        """
+        (bytes) -> (GatewayMessage)
+        Parses a message in the binary envelope.
+        """
+        if len(body) < _BINARY_HEADER.size:
+            raise test_errors.TestingToolError("Binary Gateway Message too short.")
+        (magic, version, flags, tmst, freq_hz, spreading_factor, bandwidth, codr_den, rssi, lsnr,
+         powe, rfch, chan, extra_flags, stat) = _BINARY_HEADER.unpack_from(body)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise test_errors.TestingToolError(
+                f"Unsupported binary Gateway Message (magic {magic}, version {version}).")
+        phypayload = bytes(body[_BINARY_HEADER.size:])
+        gw_msg_dict = {
+            "codr": f"4/{codr_den}" if codr_den else "OFF",
+            "data": base64.b64encode(phypayload).decode(),
+            "datr": f"SF{spreading_factor}BW{bandwidth}",
+            "freq": freq_hz / 1000000,
+            "modu": "LORA",
+            "size": len(phypayload),
+            "tmst": tmst
+        }
+        if flags & BINARY_FLAGS.TX_FIELDS:
+            gw_msg_dict["imme"] = bool(flags & BINARY_FLAGS.IMME)
+            gw_msg_dict["ipol"] = bool(flags & BINARY_FLAGS.IPOL)
+            gw_msg_dict["ncrc"] = "true" if flags & BINARY_FLAGS.NCRC else "false"
+            gw_msg_dict["powe"] = powe
+        if flags & BINARY_FLAGS.RSSI:
+            gw_msg_dict["rssi"] = rssi
+        if flags & BINARY_FLAGS.LSNR:
+            gw_msg_dict["lsnr"] = lsnr / 10
+        if flags & BINARY_FLAGS.CHAN:
+            gw_msg_dict["chan"] = chan
+        if flags & BINARY_FLAGS.RFCH:
+            gw_msg_dict["rfch"] = rfch
+        if extra_flags & BINARY_EXTRA_FLAGS.STAT:
+            gw_msg_dict["stat"] = stat
+        return cls.from_dict(gw_msg_dict, phypayload=phypayload)
+
+    def to_binary(self):
+        """
+        (GatewayMessage) -> (bytes)
+        Serializes the message in the binary envelope. Only the fields used by the testing tool are kept
+        (e.g. the gateway "time" field is dropped).
+        :return: byte sequence of the message, or None if it can't be represented in binary (e.g. FSK).
+        """
+        msg_dict = self.testingtool_msg_dict
+        datr_match = _DATR_REGEX.match(str(msg_dict.get("datr", "")))
+        if msg_dict.get("modu", "LORA") != "LORA" or datr_match is None:
+            return None
+        codr = msg_dict.get("codr", "OFF")
+        flags = 0
+        if "imme" in msg_dict or "ipol" in msg_dict or "powe" in msg_dict:
+            flags |= BINARY_FLAGS.TX_FIELDS
+            if msg_dict.get("imme"):
+                flags |= BINARY_FLAGS.IMME
+            if msg_dict.get("ipol"):
+                flags |= BINARY_FLAGS.IPOL
+            if msg_dict.get("ncrc") in (True, "true"):
+                flags |= BINARY_FLAGS.NCRC
+        for key, flag in (("rssi", BINARY_FLAGS.RSSI), ("lsnr", BINARY_FLAGS.LSNR),
+                          ("chan", BINARY_FLAGS.CHAN), ("rfch", BINARY_FLAGS.RFCH)):
+            if key in msg_dict:
+                flags |= flag
+        extra_flags = 0
+        if "stat" in msg_dict:
+            extra_flags |= BINARY_EXTRA_FLAGS.STAT
+        try:
+            header = _BINARY_HEADER.pack(BINARY_MAGIC,
+                                         BINARY_VERSION,
+                                         flags,
+                                         int(msg_dict.get("tmst", 0)),
+                                         round(msg_dict["freq"] * 1000000),
+                                         int(datr_match.group(1)),
+                                         int(datr_match.group(2)),
+                                         int(codr.split("/")[1]) if "/" in codr else 0,
+                                         int(msg_dict.get("rssi", 0)),
+                                         round(msg_dict.get("lsnr", 0) * 10),
+                                         int(msg_dict.get("powe", 0)),
+                                         int(msg_dict.get("rfch", 0)),
+                                         int(msg_dict.get("chan", 0)),
+                                         extra_flags,
+                                         int(msg_dict.get("stat", 0)))
+        except (struct.error, ValueError, TypeError, KeyError):
+            return None
+        return header + self.get_phypaload_bytes()
+
+    def encode(self, wire_format=None):
+        """
+        (GatewayMessage, str) -> (bytes, str)
+        Serializes the message to be published in the broker.
+        :param wire_format: WIRE_FORMAT_JSON or WIRE_FORMAT_BINARY (by default FLORA_WIRE_FORMAT env variable).
+        :return: tuple with the body and its content type. JSON is used if the message can't be represented
+        in binary.
+        """
+        if (wire_format or WIRE_FORMAT) == WIRE_FORMAT_BINARY:
+            binary_body = self.to_binary()
+            if binary_body is not None:
+                return binary_body, CONTENT_TYPE_BINARY
+        return str(self).encode(), CONTENT_TYPE_JSON
 
     @property
     def datr(self):
@@ -137,6 +304,7 @@ class GatewayMessage(test_messages.TestingToolMessage):
         # Set to None in order to force the parsing an creation of a new LoRaWANMessage object when calling
         # parse_lorawan_message method.
         self.__lorawan_message = None
+        self.__phypayload = None
 
     @property
     def tmst(self):
@@ -178,9 +346,8 @@ class GatewayMessage(test_messages.TestingToolMessage):
         :return: Parsed LoRaWANMessage.
         """
         if not self.__lorawan_message:
-            b64decoded_data = base64.b64decode(self.testingtool_msg_dict["data"])
             self.__lorawan_message = lorawan.parsing.lorawan.LoRaWANMessage(
-                phypayload=b64decoded_data,
+                phypayload=self.get_phypaload_bytes(),
                 ignore_format_errors=ignore_format_errors)
         return self.__lorawan_message
 
@@ -200,6 +367,23 @@ class GatewayMessage(test_messages.TestingToolMessage):
         :param frequency: Frequency to be used by the gateway in the downlink message.
         :return: string of the dumped message, json formatted.
         """
+        return str(self.create_nwk_response(phypayload=phypayload,
+                                            delay=delay,
+                                            data_rate=data_rate,
+                                            datr_offset=datr_offset,
+                                            frequency=frequency))
+
+    def create_nwk_response(self,
+                            phypayload,
+                            delay,
+                            data_rate=None,
+                            datr_offset=None,
+                            frequency=None):
+        """
+        (NetworkMessage, bytes, int) -> (GatewayMessage)
+        Same as create_nwk_response_str, but returns the response as a GatewayMessage (e.g. to be encoded
+        in the binary format).
+        """
 
         # one and only one of the variables data_rate or datr_offset must be specified.
         if (data_rate is not None and datr_offset is not None) or (
@@ -224,14 +408,16 @@ class GatewayMessage(test_messages.TestingToolMessage):
         else:
             resp_metadata["freq"] = self.testingtool_msg_dict["freq"]
         resp_metadata["modu"] = self.testingtool_msg_dict["modu"]
-        return json.dumps(resp_metadata, sort_keys=True, indent=4)
+        return GatewayMessage.from_dict(resp_metadata, phypayload=phypayload)
 
     def get_phypaload_bytes(self):
         """
         Gets the PHYPayload byte secuence contained in the "data" field, after base64 decode.
         :return: byte sequence of the LoRaWAN PHYPayload.
         """
-        return base64.b64decode(self.testingtool_msg_dict["data"])
+        if self.__phypayload is None:
+            self.__phypayload = base64.b64decode(self.testingtool_msg_dict["data"])
+        return self.__phypayload
 
     def create_appmessage_str(self, appskey):
         """
@@ -241,7 +427,7 @@ class GatewayMessage(test_messages.TestingToolMessage):
         """
         lorawan_message = self.parse_lorawan_message()
         devaddr = lorawan_message.macpayload.fhdr.devaddr_bytes
-        fcnt = lorawan_message.macpayload.fhdr.get_fcnt_int()
+        fcnt = lorawan_message.macpayload.fhdr.get_full_fcnt()
         plain_frmpayload = utils.encrypt_ieee802154(key=appskey,
                                                     frmpayload=lorawan_message.macpayload.frmpayload_bytes,
                                                     direction=lorawan_message.mhdr.message_dir,
@@ -266,7 +452,7 @@ class GatewayMessage(test_messages.TestingToolMessage):
         logger.info(f"Getting printable representation of the Gateway Message.")
         lorawan_message = self.parse_lorawan_message(ignore_format_errors=ignore_format_errors)
         ret_str = f"tmst: {self.testingtool_msg_dict['tmst']}, freq: {self.testingtool_msg_dict['freq']}, DR: {self.testingtool_msg_dict['datr']}\n"
-        phypay = utils.bytes_to_text(base64.b64decode(self.testingtool_msg_dict["data"]))
+        phypay = utils.bytes_to_text(self.get_phypaload_bytes())
         ret_str += f"PHYPayload: {phypay} (Size: {self.testingtool_msg_dict['size']} bytes)\n"
         ret_str += str(lorawan_message)
         if encryption_key is None:
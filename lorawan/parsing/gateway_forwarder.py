@@ -83,9 +83,16 @@ class SemtechUDPMsg:
         and the json string as a second element of the tuple.
         :return: list of tuples (bytes, str) of the received messages (already decoded, base64)
         """
-        decoded_pks = []
+        return [(phypayload, json.dumps(pkt)) for phypayload, pkt in self.get_packets()]
+
+    def get_packets(self):
+        """
+        (GWFMessage -> list of (bytes, dict) tuples)
+
+        Returns a list of tuples (bytes, dict), each element corresponding to a received message after being
+        decoded (base64) and the rxpk dict of the message.
+        :return: list of tuples (bytes, dict) of the received messages.
+        """
         if self.json_object is None or self.json_object.get("rxpk") is None:
             return []
-        for pkt in self.json_object.get("rxpk"):
-            decoded_pks.append((base64.b64decode(pkt["data"]), json.dumps(pkt)))
-        return decoded_pks
+        return [(base64.b64decode(pkt["data"]), pkt) for pkt in self.json_object.get("rxpk")]
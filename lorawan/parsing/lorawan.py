@@ -103,10 +103,11 @@ class LoRaWANMessage(ConditionalRaiser):
         ret_str += "==============================================\n"
         return ret_str
 
-    def calculate_mic(self, key):
+    def calculate_mic(self, key, fcnt=None):
         """
         Calculates the MIC of the message using the provided key.
         :param key: NwkSKey or AppSKey used to calculate the MIC of the message.
+        :param fcnt: 32-bit frame counter (the one of the frame header by default).
         :return: byte sequence of the MIC (4 bytes).
         """
         mhdr_macpayload = self.mhdr.mhdr_bytes + self.macpayload.macpayload_bytes
@@ -118,22 +119,24 @@ class LoRaWANMessage(ConditionalRaiser):
                                      msg=mhdr_macpayload,
                                      devaddr=self.macpayload.fhdr.devaddr_bytes,
                                      direction=self.mhdr.message_dir,
-                                     fcnt=self.macpayload.fhdr.get_fcnt_int())
+                                     fcnt=self.macpayload.fhdr.get_full_fcnt() if fcnt is None else fcnt)
         else:
             return None
 
-    def get_frmpayload_plaintext(self, key):
+    def get_frmpayload_plaintext(self, key, fcnt=None):
         """  Return the FRMPayload plain text of a LoRaWAN data message when the content was encrypted used the
          provided key.
 
         :param key: byte sequence of the AppSKey used to encrypt the message (16 bytes).
+        :param fcnt: 32-bit frame counter (the one of the frame header by default).
         :return: byte sequence of the decrypted FRMPayload.
         """
         if self.macpayload.frmpayload_bytes is None or self.mhdr.mtype_str not in (
                 'UNCONFIRMED_UP', 'UNCONFIRMED_DOWN', 'CONFIRMED_UP', 'CONFIRMED_DOWN'):
             return None
         devaddr = self.macpayload.fhdr.devaddr_bytes
-        fcnt = self.macpayload.fhdr.get_fcnt_int()
+        if fcnt is None:
+            fcnt = self.macpayload.fhdr.get_full_fcnt()
         plain_frmpayload = utils.encrypt_ieee802154(key=key,
                                                     frmpayload=self.macpayload.frmpayload_bytes,
                                                     direction=self.mhdr.message_dir,
@@ -314,6 +317,8 @@ class LoRaWANFHDR(ConditionalRaiser):
                                   message_type=str_mtype,
                                   ignore_format_errors=self.ignore_format_errors)
         self.fcnt_bytes = macpayload[6:4:-1]
+        # 32-bit frame counter, set when it's reconstructed from the counters of the session.
+        self.full_fcnt = None
         self._piggybacked_mac = []
         if self.fctrl.foptslen_int > 0:
             self.fopts_bytes = macpayload[7:(7 + self.fctrl.foptslen_int)]
@@ -337,7 +342,7 @@ class LoRaWANFHDR(ConditionalRaiser):
         retstr += "----DevAddr: {0}\n".format(utils.bytes_to_text(self.devaddr_bytes))
         retstr += "----FCtrl: {0}\n".format(self.fctrl.fctrl_binary_str())
         retstr += str(self.fctrl)
-        retstr += "----FCnt: {0} ({1})\n".format(self.get_fcnt_int(),
+        retstr += "----FCnt: {0} ({1})\n".format(self.get_full_fcnt(),
                                                  utils.bytes_to_text(self.fcnt_bytes))
         retstr += "----FOpts: {0}\n".format(self.fopts_to_str())
         return retstr
@@ -345,9 +350,16 @@ class LoRaWANFHDR(ConditionalRaiser):
     def get_fcnt_int(self):
         """
         (LoRaWANFHDR) -> (int)
-        Get FCnt int value.
+        Get FCnt int value (16 least significant bits of the frame counter).
         """
-        return struct.unpack('>h', self.fcnt_bytes)[0]
+        return struct.unpack('>H', self.fcnt_bytes)[0]
+
+    def get_full_fcnt(self):
+        """
+        (LoRaWANFHDR) -> (int)
+        Get the 32-bit frame counter (the 16-bit FCnt if it wasn't reconstructed).
+        """
+        return self.full_fcnt if self.full_fcnt is not None else self.get_fcnt_int()
 
     def fopts_to_str(self):
         """
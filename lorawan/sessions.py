@@ -29,79 +29,176 @@ import struct
 import base64
 import json
 import random
+import array
 import utils
-import copy
 import logging
 
 import lorawan.lorawan_parameters.general as lorawan_parameters
+from lorawan import frame_counter
+from lorawan import join_accept
+from lorawan import nonce_history
 import conformance_testing.test_errors as test_errors
 
 logger = logging.getLogger(__name__)
 
+HZ_IN_MHZ = 1000000
+
+
+def frequency_to_hz(freq):
+    """ Returns the frequency in Hz (int) of a frequency in MHz."""
+    return round(freq * HZ_IN_MHZ)
+
 
 class ChannelStructure(object):
-    """ Channel structure of the LoRaWAN MAC parameters."""
+    """
+    Channel structure of the LoRaWAN MAC parameters: a table of parallel arrays (frequency in Hz, min and max DR
+    and mandatory flag of each channel) with a bitmask of the enabled channels and an index of their frequencies.
+    It is immutable: adding or removing a frequency returns a new structure (the table of a session can be kept
+    as a snapshot without copying it), so the list of used frequencies is computed once per structure.
+    """
+    __slots__ = ("_freqs_hz", "_min_dr", "_max_dr", "_mandatory", "_enabled", "_index", "_used_frequencies")
 
-    def __init__(self):
+    def __init__(self, channel_db=None):
         """
         The channel structure mantains a data base with the configured frequencies.
+        :param channel_db: sequence of the channels (dicts with freq in MHz, min_dr, max_dr and mandatory), the
+            default channels of the region if not provided.
         """
-        self._channel_db = list(lorawan_parameters.MIN_LORA_FREQ)
-        self._used_frequencies = [channel["freq"] for channel in self._channel_db if
-                                  not channel["freq"] == 0]
+        if channel_db is None:
+            channel_db = lorawan_parameters.MIN_LORA_FREQ
+        self._set_table(array.array('L', (frequency_to_hz(channel["freq"]) for channel in channel_db)),
+                        array.array('B', (channel["min_dr"] for channel in channel_db)),
+                        array.array('B', (channel["max_dr"] for channel in channel_db)),
+                        sum(1 << idx for idx, channel in enumerate(channel_db) if channel["mandatory"]))
+
+    def _set_table(self, freqs_hz, min_dr, max_dr, mandatory):
+        init = object.__setattr__
+        init(self, "_freqs_hz", freqs_hz)
+        init(self, "_min_dr", min_dr)
+        init(self, "_max_dr", max_dr)
+        init(self, "_mandatory", mandatory)
+        enabled = 0
+        index = {}
+        for idx, freq_hz in enumerate(freqs_hz):
+            if freq_hz:
+                enabled |= 1 << idx
+                index.setdefault(freq_hz, idx)
+        init(self, "_enabled", enabled)
+        init(self, "_index", index)
+        init(self, "_used_frequencies", tuple(freq_hz / HZ_IN_MHZ for freq_hz in freqs_hz if freq_hz))
+
+    @classmethod
+    def _from_table(cls, freqs_hz, min_dr, max_dr, mandatory):
+        channel_struct = object.__new__(cls)
+        channel_struct._set_table(freqs_hz, min_dr, max_dr, mandatory)
+        return channel_struct
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable, use with_frequency or without_frequency.")
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return type(self), ([self.channel(idx) for idx in range(len(self))],)
+
+    def __len__(self):
+        return len(self._freqs_hz)
+
+    def channel(self, idx):
+        """ Returns a dict with the freq (MHz), min_dr, max_dr and mandatory flag of a channel."""
+        return {"freq": self._freqs_hz[idx] / HZ_IN_MHZ if self._freqs_hz[idx] else 0,
+                "min_dr": self._min_dr[idx],
+                "max_dr": self._max_dr[idx],
+                "mandatory": self.is_mandatory(idx)}
+
+    def is_mandatory(self, idx):
+        return bool(self._mandatory >> idx & 1)
+
+    def is_enabled(self, idx):
+        return bool(self._enabled >> idx & 1)
 
     @property
     def used_frequencies(self):
         """
-        Updates from the channel data base and returns the list of frequencies currently used.
+        Returns the tuple of frequencies (MHz) currently used.
         """
-        self._used_frequencies = [channel["freq"] for channel in self._channel_db if
-                                  not channel["freq"] == 0]
         return self._used_frequencies
 
-    def add_frequency(self, freq, idx=None):
+    def uses_frequency(self, freq):
+        """ Returns True if the frequency (MHz) is enabled in a channel."""
+        return frequency_to_hz(freq) in self._index
+
+    def index_of(self, freq):
+        """ Returns the index of the channel of a frequency (MHz), None if it isn't used."""
+        return self._index.get(frequency_to_hz(freq))
+
+    def frequency_at(self, position):
+        """ Returns the used frequency of a position of the round-robin over the enabled channels."""
+        return self._used_frequencies[position % len(self._used_frequencies)]
+
+    def random_frequency(self, rng=random):
+        """ Returns a random used frequency (rng is the random number generator, random module by default)."""
+        return self._used_frequencies[rng.randrange(len(self._used_frequencies))]
+
+    def _copy_table(self):
+        return array.array('L', self._freqs_hz), array.array('B', self._min_dr), array.array('B', self._max_dr)
+
+    def with_frequency(self, freq, idx=None):
         """
-        Configures a new frequency to be used by the end device. If no position (index) is provided
-        the new frequency is configured in the first non used index.
+        Returns the channel structure with a new frequency to be used by the end device. If no position (index) is
+        provided the new frequency is configured in the first non used index.
         :param freq: frequency to be added.
         :param idx: position in the channel structure to add the new frequency.
-        :return:
+        :return: ChannelStructure (the same one if the frequency wasn't added).
         """
         if not idx:
-            for i in range(len(self._channel_db)):
-                if not self._channel_db[i]["mandatory"] and self._channel_db[i]["freq"] == 0:
-                    idx = i
-                    break
-            if not idx:
-                idx = len(self._channel_db) - 1
-
-        if freq not in self.used_frequencies and not self._channel_db[idx]["mandatory"]:
-            self._channel_db[idx]["freq"] = freq
-            self._channel_db[idx]["min_dr"] = lorawan_parameters.get_min_dr(freq)
-            self._channel_db[idx]["max_dr"] = lorawan_parameters.get_max_dr(freq)
-
-    def remove_frequency(self, idx, freq=None):
+            free_channels = ~(self._enabled | self._mandatory) & ((1 << len(self)) - 1)
+            # Index of the lowest free channel (the last channel if all of them are used).
+            idx = (free_channels & -free_channels).bit_length() - 1 if free_channels else len(self) - 1
+
+        if not self.uses_frequency(freq) and not self.is_mandatory(idx):
+            freqs_hz, min_dr, max_dr = self._copy_table()
+            freqs_hz[idx] = frequency_to_hz(freq)
+            min_dr[idx] = lorawan_parameters.get_min_dr(freq)
+            max_dr[idx] = lorawan_parameters.get_max_dr(freq)
+            return self._from_table(freqs_hz, min_dr, max_dr, self._mandatory)
+        return self
+
+    def without_frequency(self, idx, freq=None):
         """
-        Removes a frequency to disable its use.
+        Returns the channel structure with a frequency disabled.
         :param idx: index to be set as not used (set freq=0).
         :param freq: frequency to be disabled.
-        :return:
+        :return: ChannelStructure (the same one if no frequency was removed).
         """
-        if freq in self.used_frequencies:
-            for channel in self._channel_db:
-                if channel["freq"] == freq and not channel["mandatory"]:
-                    channel["freq"] = 0
-                    channel["min_dr"] = 0
-                    channel["max_dr"] = 0
-        frequency = self._channel_db[idx]["freq"]
-        if idx and not self._channel_db[idx]["mandatory"] and not frequency == 0:
-            self._channel_db[idx]["freq"] = 0
-            self._channel_db[idx]["min_dr"] = 0
-            self._channel_db[idx]["max_dr"] = 0
+        disabled = 0
+        if freq is not None and self.uses_frequency(freq):
+            freq_hz = frequency_to_hz(freq)
+            disabled |= sum(1 << channel_idx for channel_idx, channel_freq_hz in enumerate(self._freqs_hz)
+                            if channel_freq_hz == freq_hz)
+        if idx and self.is_enabled(idx):
+            disabled |= 1 << idx
+        disabled &= ~self._mandatory
+        if not disabled:
+            return self
+        freqs_hz, min_dr, max_dr = self._copy_table()
+        for channel_idx in range(len(self)):
+            if disabled >> channel_idx & 1:
+                freqs_hz[channel_idx] = min_dr[channel_idx] = max_dr[channel_idx] = 0
+        return self._from_table(freqs_hz, min_dr, max_dr, self._mandatory)
 
 
 class LoRaMACParameters(object):
-    """ LoRaWAN MAC parameters structure."""
+    """
+    LoRaWAN MAC parameters structure. It is immutable: replace returns new parameters that share the unchanged
+    fields (e.g. the channel structure), so a snapshot of the parameters of a session is just a reference.
+    """
+    __slots__ = ("devaddr", "appskey", "nwkskey", "default_dr", "_rx1_dr_offset", "rx2_dr", "_rx1_delay",
+                 "_rx2_delay", "rx2_frequency", "joinaccept_delay1", "joinaccept_delay2", "channel_struct")
 
     def __init__(self,
                  devaddr,
@@ -116,21 +213,58 @@ class LoRaMACParameters(object):
                  joinaccept_delay1=lorawan_parameters.TIMING.JOIN_ACCEPT_DELAY1,
                  joinaccept_delay2=lorawan_parameters.TIMING.JOIN_ACCEPT_DELAY2,
                  channel_struct=None):
-        self.devaddr = devaddr
-        self.appskey = appskey
-        self.nwkskey = nwkskey
-        self.default_dr = default_dr
-        self._rx1_dr_offset = rx1_dr_offset
-        self.rx2_dr = rx2_dr
-        self._rx1_delay = rx1_delay
-        self._rx2_delay = rx2_delay
-        self.rx2_frequency = rx2_frequency
-        self.joinaccept_delay1 = joinaccept_delay1
-        self.joinaccept_delay2 = joinaccept_delay2
+        init = object.__setattr__
+        init(self, "devaddr", devaddr)
+        init(self, "appskey", appskey)
+        init(self, "nwkskey", nwkskey)
+        init(self, "default_dr", default_dr)
+        init(self, "_rx1_dr_offset", rx1_dr_offset)
+        init(self, "rx2_dr", rx2_dr)
+        init(self, "_rx1_delay", rx1_delay)
+        init(self, "_rx2_delay", rx2_delay)
+        init(self, "rx2_frequency", rx2_frequency)
+        init(self, "joinaccept_delay1", joinaccept_delay1)
+        init(self, "joinaccept_delay2", joinaccept_delay2)
         if not channel_struct:
-            self.channel_struct = ChannelStructure()
+            init(self, "channel_struct", ChannelStructure())
         else:
-            self.channel_struct = channel_struct
+            init(self, "channel_struct", channel_struct)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable, use replace.")
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return type(self), (self.devaddr, self.appskey, self.nwkskey, self.default_dr, self._rx1_dr_offset,
+                            self.rx2_dr, self._rx1_delay, self._rx2_delay, self.rx2_frequency,
+                            self.joinaccept_delay1, self.joinaccept_delay2, self.channel_struct)
+
+    def replace(self, **changes):
+        """
+        Returns new parameters with the changed fields, sharing the rest with these ones. Setting rx1_delay
+        also sets rx2_delay (one second later) and rx1_dr_offset is limited to the valid offsets.
+        :param changes: new values of the fields (e.g. devaddr, appskey, rx1_delay, channel_struct).
+        :return: LoRaMACParameters
+        """
+        replaced = object.__new__(type(self))
+        for field in self.__slots__:
+            object.__setattr__(replaced, field, getattr(self, field))
+        for field, value in changes.items():
+            if field == "rx1_delay":
+                object.__setattr__(replaced, "_rx1_delay", value)
+                object.__setattr__(replaced, "_rx2_delay", value + lorawan_parameters.TIMING.MS_IN_SEC)
+            elif field == "rx1_dr_offset":
+                object.__setattr__(replaced, "_rx1_dr_offset", self.limit_rx1_dr_offset(value))
+            elif field in self.__slots__ and not field.startswith("_"):
+                object.__setattr__(replaced, field, value)
+            else:
+                raise TypeError(f"Unknown LoRa MAC parameter: {field}")
+        return replaced
 
     def to_dict(self):
         return {
@@ -148,11 +282,6 @@ class LoRaMACParameters(object):
     def rx1_delay(self):
         return self._rx1_delay
 
-    @rx1_delay.setter
-    def rx1_delay(self, rx1_delay):
-        self._rx1_delay = rx1_delay
-        self._rx2_delay = rx1_delay + lorawan_parameters.TIMING.MS_IN_SEC
-
     @property
     def rx2_delay(self):
         return self._rx2_delay
@@ -161,14 +290,14 @@ class LoRaMACParameters(object):
     def rx1_dr_offset(self):
         return self._rx1_dr_offset
 
-    @rx1_dr_offset.setter
-    def rx1_dr_offset(self, rx1_dr_offset):
+    @staticmethod
+    def limit_rx1_dr_offset(rx1_dr_offset):
         if rx1_dr_offset <= lorawan_parameters.DR_OFFSET.MIN:
-            self._rx1_dr_offset = lorawan_parameters.DR_OFFSET.MIN
+            return lorawan_parameters.DR_OFFSET.MIN
         elif rx1_dr_offset >= lorawan_parameters.DR_OFFSET.MAX:
-            self._rx1_dr_offset = lorawan_parameters.DR_OFFSET.MAX
+            return lorawan_parameters.DR_OFFSET.MAX
         else:
-            self._rx1_dr_offset = rx1_dr_offset
+            return rx1_dr_offset
 
 
 class EndDevice(object):
@@ -198,37 +327,57 @@ class EndDevice(object):
         self.loramac_previous_session = None
         self.set_default_loramac()
 
-        self._fcnt_up = 0
-        self._fcnt_down = 0
-        self._used_otaa_appnonces = []
-        self._used_otaa_devnonces = []
+        self.frame_counter = frame_counter.FrameCounter()
+        self._used_otaa_appnonces = nonce_history.RecentNonces()
+        self._used_otaa_devnonces = nonce_history.NonceBitmap()
+        self.join_accept_builder = join_accept.JoinAcceptBuilder(appkey=appkey, new_appnonce=self.create_appnonce)
 
     def set_default_loramac(self):
         logger.info(f"Restoring default LoRa MAC parameters.")
-        self.loramac_previous_session = copy.deepcopy(self.loramac_params)
-        self.loramac_params = copy.deepcopy(self.loramac_defaults)
+        # The parameters are immutable, the snapshots are references.
+        self.loramac_previous_session = self.loramac_params
+        self.loramac_params = self.loramac_defaults
+
+    def update_loramac(self, **changes):
+        """
+        Replaces fields of the LoRa MAC parameters of the current session.
+        :param changes: new values of the fields (see LoRaMACParameters.replace).
+        :return: None
+        """
+        self.loramac_params = self.loramac_params.replace(**changes)
 
     @property
     def fcnt_up(self):
-        return self._fcnt_up % 2 ** 16
+        """ Last 32-bit frame counter received from the device (0 if no frame was received)."""
+        return self.frame_counter.last_up or 0
 
     @fcnt_up.setter
     def fcnt_up(self, fcnt_up_value):
-        self._fcnt_up = fcnt_up_value % 2 ** 16
+        self.frame_counter.last_up = fcnt_up_value % frame_counter.FCNT_MOD
 
     @property
     def fcnt_down(self):
-        return self._fcnt_down % 2 ** 16
+        """ 32-bit frame counter of the next downlink."""
+        return self.frame_counter.next_down
 
     @fcnt_down.setter
     def fcnt_down(self, fcnt_down_value):
-        self._fcnt_down = fcnt_down_value % 2 ** 16
+        self.frame_counter.next_down = fcnt_down_value % frame_counter.FCNT_MOD
+
+    def track_received_fcnt(self, lorawan_message, key):
+        """
+        Reconstructs the 32-bit frame counter of a received data message (see FrameCounter.track_uplink).
+        :param lorawan_message: parsed LoRaWANMessage (data message).
+        :param key: NwkSKey used to calculate the MIC.
+        :return: calculated MIC (bytes).
+        """
+        return self.frame_counter.track_uplink(lorawan_message, key)
 
     def add_frequency(self, freq, idx=None):
-        self.loramac_params.channel_struct.add_frequency(freq=freq, idx=idx)
+        self.update_loramac(channel_struct=self.loramac_params.channel_struct.with_frequency(freq=freq, idx=idx))
 
     def remove_frequency(self, freq=None, idx=None):
-        self.loramac_params.channel_struct.remove_frequency(freq=freq, idx=idx)
+        self.update_loramac(channel_struct=self.loramac_params.channel_struct.without_frequency(freq=freq, idx=idx))
 
     def create_appnonce(self):
         """
@@ -239,9 +388,8 @@ class EndDevice(object):
         :return: int (between 0 and 2ˆ16)
         """
         nonce = random.randint(0, 2 ** 24 - 1)
-        while nonce in self._used_otaa_appnonces:
+        while not self._used_otaa_appnonces.add(nonce):
             nonce = random.randint(0, 2 ** 24 - 1)
-        self._used_otaa_appnonces.append(nonce)
         return nonce
 
     def accept_join(self,
@@ -259,37 +407,31 @@ class EndDevice(object):
         :param cflist: 16 bytes with the frequency list.
         :return: bytes of the lorawan join accept message PHYPayload.
         """
-        appnonce = struct.pack("<L", self.create_appnonce())[:3]
-        devaddr_int = random.randint(0, 2 ** 32 - 1)
-        nwkid_int = (devaddr_int & 0xfe000000) // 2 ** 25
-        netid_int = (random.randint(0, 2 ** 24 - 1) & 0xffff80) | nwkid_int
-        devaddr = struct.pack(">L", devaddr_int)
-        netid = struct.pack(">L", netid_int)[-3:]
-        appnonce_netid_devnonce = appnonce + netid[::-1] + devnonce[::-1]
-        assert len(appnonce_netid_devnonce) == 8
-        nwkskey = utils.aes128_encrypt(self.appkey, b'\x01' + appnonce_netid_devnonce + bytes(7))
-        appskey = utils.aes128_encrypt(self.appkey, b'\x02' + appnonce_netid_devnonce + bytes(7))
+        accept = self.join_accept_builder.build(devnonce=devnonce, dlsettings=dlsettings, rxdelay=rxdelay,
+                                                cflist=cflist)
         self.store_used_devnonce(devnonce)
-        macpayload = appnonce + netid[::-1] + devaddr[::-1] + dlsettings + rxdelay + cflist
-        mhdr_macpayload = lorawan_parameters.MHDR.JOIN_ACCEPT + macpayload
-        mic = utils.aes128_cmac(self.appkey, mhdr_macpayload)[:4]
-
-        join_accept_phypayload = (lorawan_parameters.MHDR.JOIN_ACCEPT +
-                                  utils.aes128_decrypt(key=self.appkey,
-                                                       cipher_text=macpayload + mic)
-                                  )
-        self.update_device_session(devaddr=devaddr, appskey=appskey, nwkskey=nwkskey)
-
-        self.loramac_params.rx1_dr_offset = (int.from_bytes(dlsettings,
-                                                            byteorder='big') & 0x70) >> 4
+        join_accept_phypayload = accept.phypayload
+        self.update_device_session(devaddr=accept.devaddr, appskey=accept.appskey, nwkskey=accept.nwkskey)
+        self.apply_join_settings(dlsettings=dlsettings, rxdelay=rxdelay, cflist=cflist)
+        return join_accept_phypayload
+
+    def apply_join_settings(self, dlsettings, rxdelay, cflist):
+        """
+        Updates the LoRa MAC parameters with the settings of a join accept message.
+        :param dlsettings: byte of the dlsettings field (RX1 DR offset and RX2 data rate).
+        :param rxdelay: byte of the rxdelay field (RX1 delay in seconds, 0 is 1 second).
+        :param cflist: 16 bytes with the frequency list (or empty).
+        :return: None
+        """
         rx2_dr = (int.from_bytes(dlsettings, byteorder='big') & 0x0f)
-        self.loramac_params.rx2_dr = lorawan_parameters.LORA_DR[rx2_dr]
         seconds_delay = max(1, (int.from_bytes(rxdelay, byteorder='big') & 0x0f))
-        self.loramac_params.rx1_delay = seconds_delay * lorawan_parameters.TIMING.MS_IN_SEC
+        channel_struct = self.loramac_params.channel_struct
         for new_frequency in lorawan_parameters.parse_cflist(cflist):
-            self.add_frequency(new_frequency)
-
-        return join_accept_phypayload
+            channel_struct = channel_struct.with_frequency(new_frequency)
+        self.update_loramac(rx1_dr_offset=(int.from_bytes(dlsettings, byteorder='big') & 0x70) >> 4,
+                            rx2_dr=lorawan_parameters.LORA_DR[rx2_dr],
+                            rx1_delay=seconds_delay * lorawan_parameters.TIMING.MS_IN_SEC,
+                            channel_struct=channel_struct)
 
     def prepare_lorawan_data(self,
                              frmpayload,
@@ -311,15 +453,15 @@ class EndDevice(object):
         :return: bytes of the PHYPayload
         """
         if force_fcntdown_int:
-            fcnt_down = force_fcntdown_int % 2 ** 16
+            fcnt_down = force_fcntdown_int % frame_counter.FCNT_MOD
         else:
-            fcnt_down = self.fcnt_down
-            self.fcnt_down += 1
+            fcnt_down = self.frame_counter.take_downlink()
 
         if self.message_to_ack and mhdr in (b'\xA0', b'\x60'):
             fctr = struct.pack('B', struct.unpack('B', fctr)[0] | 32)
 
-        fhdr = self.loramac_params.devaddr[::-1] + fctr + struct.pack('<H', fcnt_down) + fopts
+        fhdr = (self.loramac_params.devaddr[::-1] + fctr + struct.pack('<H', fcnt_down % frame_counter.FCNT_WIRE_MOD)
+                + fopts)
         mhdr_fhdr = mhdr + fhdr
         assert mhdr in (
             b'\x00', b'\x40', b'\x80', b'\x20', b'\x60', b'\xA0', b'\xC0'), "Unrecognized MHDR."
@@ -363,13 +505,9 @@ class EndDevice(object):
                 description=f"Wrong session info.\nDevAddr={appskey}\nAppSkey={nwkskey}\nNwkSKey={devaddr}\n",
                 step_name=None,
                 test_case=None)
-        self.loramac_previous_session = copy.deepcopy(self.loramac_params)
-        self.loramac_params = copy.deepcopy(self.loramac_defaults)
-        self.loramac_params.devaddr = devaddr
-        self.loramac_params.appskey = appskey
-        self.loramac_params.nwkskey = nwkskey
-        self.fcnt_up = 0
-        self.fcnt_down = 0
+        self.loramac_previous_session = self.loramac_params
+        self.loramac_params = self.loramac_defaults.replace(devaddr=devaddr, appskey=appskey, nwkskey=nwkskey)
+        self.frame_counter.reset()
         prev_str = str(self.loramac_previous_session)
         new_str = str(self.loramac_params)
         logger.info(
@@ -380,15 +518,14 @@ class EndDevice(object):
         (EndDevice, int) -> (None)
         Store the used device nonce to avoid repeated use of the same value and prevent
         replay attacks.
-        :param devnonce: (int) Value to store as a used device nonce.
+        :param devnonce: Value to store as a used device nonce (2 bytes, big endian, or int).
         :return: None
         """
-        if devnonce in self._used_otaa_devnonces:
+        if not self._used_otaa_devnonces.add(devnonce):
             raise test_errors.SessionError(
                 description="Repeated devnonce in join request message. Replay detected.",
                 test_case="TC",
                 step_name="SN")
-        self._used_otaa_devnonces.append(devnonce)
 
     def joinrequest_is_replay(self, devnonce):
         """
@@ -0,0 +1,104 @@
+"""
+Discrete event clock of the simulations: the events are callbacks scheduled at a simulated time (in micro
+seconds, as the tmst of the gateway messages) and run in order, without waiting.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import heapq
+import itertools
+
+
+class SimulationEvent(object):
+    """ Callback scheduled in the VirtualClock, it can be cancelled before it runs."""
+    __slots__ = ('time_us', 'callback', 'args', 'cancelled')
+
+    def __init__(self, time_us, callback, args):
+        self.time_us = time_us
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class VirtualClock(object):
+    """
+    Simulated time in micro seconds. The events run in order of time (and in order of scheduling for the events
+    of the same time); the clock jumps to the time of each event.
+    """
+
+    def __init__(self, start_us=0):
+        self.now_us = start_us
+        self.events_run = 0
+        self._queue = []
+        self._sequence = itertools.count()
+
+    @property
+    def pending(self):
+        return sum(1 for _, _, event in self._queue if not event.cancelled)
+
+    def schedule_at(self, time_us, callback, *args):
+        """
+        Schedules a callback at an absolute time.
+        :param time_us: time of the event in micro seconds (not before the current time).
+        :param callback: function called as callback(*args).
+        :return: the SimulationEvent.
+        """
+        if time_us < self.now_us:
+            raise ValueError(f"Event scheduled in the past ({time_us} < {self.now_us}).")
+        event = SimulationEvent(time_us, callback, args)
+        heapq.heappush(self._queue, (time_us, next(self._sequence), event))
+        return event
+
+    def schedule(self, delay_us, callback, *args):
+        """ Schedules a callback after a delay (in micro seconds) from the current time."""
+        return self.schedule_at(self.now_us + delay_us, callback, *args)
+
+    def step(self):
+        """ Runs the next event. Returns False if there are no events."""
+        while self._queue:
+            time_us, _, event = heapq.heappop(self._queue)
+            if event.cancelled:
+                continue
+            self.now_us = time_us
+            self.events_run += 1
+            event.callback(*event.args)
+            return True
+        return False
+
+    def run(self, until_us=None, stop_condition=None):
+        """
+        Runs the events in order.
+        :param until_us: the events after this time are not run (the clock stops at this time).
+        :param stop_condition: function checked after each event, the simulation stops when it returns True.
+        :return: None
+        """
+        while self._queue:
+            if until_us is not None and self._queue[0][0] > until_us:
+                self.now_us = max(self.now_us, until_us)
+                return
+            if self.step() and stop_condition is not None and stop_condition():
+                return
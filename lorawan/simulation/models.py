@@ -0,0 +1,254 @@
+"""
+Models of the end device and the gateway used in the simulations. The device implements the Test Application
+Protocol (as the device mock of the agent) and the gateway timestamps the uplinks and transmits the downlinks at
+their tmst, checking if they land in the reception windows of the devices.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import base64
+import collections
+import logging
+
+import conformance_testing.test_errors as test_errors
+import lorawan.lorawan_parameters.general as lorawan_parameters
+import lorawan.lorawan_parameters.testing as testing_parameters
+import lorawan.lorawan_utils
+from lorawan.parsing import flora_messages
+import lorawan.parsing.lorawan
+from lorawan.simulation import radio
+from lorawan.user_agent.messenger import mock_sessions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_UPLINK_INTERVAL_US = 5000000
+DEFAULT_BACKHAUL_LATENCY_US = 20000
+
+DOWNLINK_RECEIVED = "RECEIVED"
+DOWNLINK_MISSED = "MISSED"
+DOWNLINK_TOO_LATE = "TOO_LATE"
+
+DownlinkOutcome = collections.namedtuple("DownlinkOutcome", "time_us tmst freq datr window status")
+
+
+class SimulatedDevice(object):
+    """
+    End device under test. It sends an uplink periodically: unconfirmed data before the test mode is activated
+    and, in test mode, the message requested by the last downlink of the TAS (pong, join request) or an
+    activation OK with the downlink counter. After each uplink it opens the RX1 and RX2 windows.
+    """
+
+    def __init__(self, clock, device_id, appeui, timing=None, uplink_interval_us=DEFAULT_UPLINK_INTERVAL_US):
+        """
+        :param clock: VirtualClock of the simulation.
+        :param device_id: DeviceID of the device (DevEUI, DevAddr and keys).
+        :param appeui: AppEUI used in the Join Requests.
+        :param timing: DeviceTiming of the radio of the device.
+        :param uplink_interval_us: time between uplinks.
+        """
+        self.clock = clock
+        self.node = mock_sessions.EndDeviceMock(deveui=device_id.deveui,
+                                                devaddr=device_id.devaddr,
+                                                appkey=device_id.appkey,
+                                                appskey=device_id.appskey,
+                                                nwkskey=device_id.nwkskey)
+        self.appeui = appeui
+        self.timing = timing if timing is not None else radio.DeviceTiming()
+        self.uplink_interval_us = uplink_interval_us
+        self.gateway = None
+        self.test_mode = False
+        self.use_confirmed = False
+        self.ack_pending = False
+        self.pong_request = None
+        self.join_requested = False
+        self.windows = ()
+        self.uplinks_sent = 0
+        self._frequency_index = 0
+        self._uplink_event = None
+
+    def start(self, delay_us=0):
+        self._uplink_event = self.clock.schedule(delay_us, self.send_uplink)
+
+    def stop(self):
+        if self._uplink_event is not None:
+            self._uplink_event.cancel()
+
+    def get_frequency(self):
+        frequency = self.node.loramac_params.channel_struct.frequency_at(self._frequency_index)
+        self._frequency_index += 1
+        return frequency
+
+    def next_phypayload(self):
+        """ Returns the PHYPayload of the next uplink and True if it's a Join Request."""
+        if self.join_requested:
+            self.join_requested = False
+            # The Join Accept is received with the default reception settings.
+            defaults = self.node.loramac_defaults
+            self.node.update_loramac(rx1_dr_offset=defaults.rx1_dr_offset, rx2_dr=defaults.rx2_dr,
+                                     rx1_delay=defaults.rx1_delay)
+            return self.node.get_join_request(appeui=self.appeui), True
+        if not self.test_mode:
+            frmpayload, fport = b'\x01', 1
+        elif self.pong_request is not None:
+            frmpayload = lorawan.lorawan_utils.generate_pingpong(ping=self.pong_request)[1]
+            fport = testing_parameters.TESTING_PORT
+            self.pong_request = None
+        else:
+            frmpayload = self.node.downlink_counter.to_bytes(2, byteorder='big')
+            fport = testing_parameters.TESTING_PORT
+        mhdr = lorawan_parameters.MHDR.CONFIRMED_UP if self.use_confirmed else lorawan_parameters.MHDR.UNCONFIRMED_UP
+        fctrl = lorawan.lorawan_utils.get_fctrl_up_byte(adr=False, adrackreq=False, ack=self.ack_pending,
+                                                         foptlen=0)
+        self.ack_pending = False
+        return self.node.prepare_lorawan_data(frmpayload=frmpayload, fport=fport, mhdr=mhdr, fctr=fctrl), False
+
+    def send_uplink(self):
+        phypayload, join_request = self.next_phypayload()
+        freq = self.get_frequency()
+        datr = self.node.loramac_params.default_dr
+        self.uplinks_sent += 1
+        self.windows = radio.receive_windows(loramac_params=self.node.loramac_params,
+                                             uplink_end_us=self.clock.now_us,
+                                             uplink_freq=freq,
+                                             uplink_datr=datr,
+                                             timing=self.timing,
+                                             join_request=join_request)
+        self.gateway.receive_uplink(phypayload=phypayload, freq=freq, datr=datr, end_us=self.clock.now_us)
+        # A class A device doesn't transmit again until its RX2 window is closed.
+        rx_end_us = max(window.close_us for window in self.windows) - self.clock.now_us
+        self._uplink_event = self.clock.schedule(max(self.uplink_interval_us, rx_end_us), self.send_uplink)
+
+    def on_air(self, gateway_message, start_us):
+        """
+        Called when the gateway transmits a downlink.
+        :return: name of the window in which the downlink was received (None if it was missed).
+        """
+        for window in self.windows:
+            if self.timing.receives(window, start_us, gateway_message.freq, gateway_message.datr):
+                self.windows = ()
+                if self.process_downlink(gateway_message.get_phypaload_bytes()):
+                    return window.name
+                return None
+        return None
+
+    def process_downlink(self, phypayload):
+        """ Processes a received downlink as the DUT. Returns False if the downlink isn't for the device."""
+        if phypayload[0:1] == lorawan_parameters.MHDR.JOIN_ACCEPT:
+            try:
+                self.node.parse_join_accept(phypayload)
+            except test_errors.SessionError:
+                return False
+            # The new session starts with the test mode deactivated.
+            self.test_mode = False
+            self.use_confirmed = False
+            return True
+        lorawan_message = lorawan.parsing.lorawan.LoRaWANMessage(phypayload=phypayload, ignore_format_errors=True)
+        if lorawan_message.macpayload.fhdr.devaddr_bytes != self.node.loramac_params.devaddr:
+            return False
+        if lorawan_message.mhdr.mtype_str == 'CONFIRMED_DOWN':
+            self.ack_pending = True
+        self.node.track_received_fcnt(lorawan_message, key=self.node.loramac_params.nwkskey)
+        if lorawan_message.macpayload.fport_int != testing_parameters.TESTING_PORT:
+            return True
+        frmpayload = lorawan_message.get_frmpayload_plaintext(key=self.node.loramac_params.appskey)
+        self.node.downlink_counter += 1
+        if frmpayload == testing_parameters.FRMPAYLOAD.TEST_ACT:
+            self.test_mode = True
+            self.node.downlink_counter = 0
+        elif frmpayload == testing_parameters.FRMPAYLOAD.TEST_DEACTIVATE:
+            self.test_mode = False
+        elif frmpayload[0:1] == testing_parameters.TEST_CODE.PINGPONG:
+            self.pong_request = frmpayload
+        elif frmpayload[0:1] == testing_parameters.TEST_CODE.TRIGGER_JOIN:
+            self.join_requested = True
+        elif frmpayload[0:1] == testing_parameters.TEST_CODE.USE_CONFIRMED:
+            self.use_confirmed = True
+        elif frmpayload[0:1] == testing_parameters.TEST_CODE.USE_UNCONFIRMED:
+            self.use_confirmed = False
+        return True
+
+
+class SimulatedGateway(object):
+    """
+    Gateway with a packet forwarder: it timestamps the uplinks of the devices with its 32 bits micro seconds
+    counter and sends them to the network after the backhaul latency. The downlinks of the network are
+    transmitted at their tmst if they arrive in time.
+    """
+
+    def __init__(self, clock, uplink_handler=None, backhaul_latency_us=DEFAULT_BACKHAUL_LATENCY_US):
+        """
+        :param clock: VirtualClock of the simulation.
+        :param uplink_handler: function called as uplink_handler(body, content_type) with each uplink.
+        :param backhaul_latency_us: latency between the gateway and the network (each direction).
+        """
+        self.clock = clock
+        self.uplink_handler = uplink_handler
+        self.backhaul_latency_us = backhaul_latency_us
+        self.devices = []
+        self.downlinks = []
+
+    def add_device(self, device):
+        device.gateway = self
+        self.devices.append(device)
+
+    def receive_uplink(self, phypayload, freq, datr, end_us):
+        uplink = flora_messages.GatewayMessage.from_dict({"tmst": radio.time_to_tmst(end_us),
+                                                          "freq": freq,
+                                                          "datr": datr,
+                                                          "size": len(phypayload),
+                                                          "data": base64.b64encode(phypayload).decode(),
+                                                          "chan": 0,
+                                                          "rfch": 0,
+                                                          "stat": 1,
+                                                          "modu": "LORA",
+                                                          "codr": "4/5",
+                                                          "rssi": -60,
+                                                          "lsnr": 7.0}, phypayload=phypayload)
+        body, content_type = uplink.encode()
+        self.clock.schedule(self.backhaul_latency_us, self.uplink_handler, body, content_type)
+
+    def send_downlink(self, body, content_type=None):
+        """ Called by the network to send a downlink: it reaches the gateway after the backhaul latency."""
+        self.clock.schedule(self.backhaul_latency_us, self._schedule_transmission,
+                            flora_messages.GatewayMessage.from_bytes(body, content_type=content_type))
+
+    def _schedule_transmission(self, gateway_message):
+        start_us = radio.tmst_to_time_us(gateway_message.tmst, self.clock.now_us)
+        if start_us < self.clock.now_us:
+            self.downlinks.append(DownlinkOutcome(time_us=start_us, tmst=gateway_message.tmst,
+                                                  freq=gateway_message.freq, datr=gateway_message.datr,
+                                                  window=None, status=DOWNLINK_TOO_LATE))
+            return
+        self.clock.schedule_at(start_us, self._transmit, gateway_message, start_us)
+
+    def _transmit(self, gateway_message, start_us):
+        window = None
+        for device in self.devices:
+            window = device.on_air(gateway_message, start_us)
+            if window is not None:
+                break
+        self.downlinks.append(DownlinkOutcome(time_us=start_us, tmst=gateway_message.tmst,
+                                              freq=gateway_message.freq, datr=gateway_message.datr,
+                                              window=window,
+                                              status=DOWNLINK_RECEIVED if window else DOWNLINK_MISSED))
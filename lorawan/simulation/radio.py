@@ -0,0 +1,138 @@
+"""
+Model of the reception windows (RX1 and RX2) of a LoRaWAN end device, to decide if a downlink scheduled by the
+Test Application Server (tmst, frequency and data rate) is received by the device.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import collections
+import re
+
+import lorawan.lorawan_parameters.general as lorawan_parameters
+
+TMST_MODULO = 2 ** 32
+
+ReceiveWindow = collections.namedtuple("ReceiveWindow", "name open_us close_us freq datr")
+
+
+def parse_datr(datr):
+    """
+    Returns the spreading factor and the bandwidth (kHz) of a LoRa data rate.
+    :param datr: data rate string (e.g. 'SF7BW125').
+    :return: (spreading factor, bandwidth in kHz)
+    """
+    match = re.fullmatch(r"SF(\d+)BW(\d+)", datr)
+    if not match:
+        raise ValueError(f"Invalid LoRa data rate: {datr}")
+    return int(match.group(1)), int(match.group(2))
+
+
+def symbol_time_us(datr):
+    """ Duration of a LoRa symbol in micro seconds (2^SF / BW)."""
+    spreading_factor, bandwidth_khz = parse_datr(datr)
+    return (2 ** spreading_factor) * 1000.0 / bandwidth_khz
+
+
+class DeviceTiming(object):
+    """
+    Timing behaviour of the radio of a device. The device opens each reception window at the configured delay
+    after the end of the uplink (scaled by the drift of its clock) minus an early wake up margin, and keeps the
+    receiver on for rx_timeout_symbols symbols. A downlink is received if the receiver is on during at least
+    detect_symbols symbols of its preamble.
+    """
+
+    def __init__(self, clock_drift_ppm=0.0, early_wakeup_us=0, rx_timeout_symbols=6, preamble_symbols=8,
+                 detect_symbols=4):
+        """
+        :param clock_drift_ppm: drift of the clock of the device (parts per million, positive if slower).
+        :param early_wakeup_us: the receiver is turned on this time before the start of the window.
+        :param rx_timeout_symbols: duration of the reception window in symbols.
+        :param preamble_symbols: length of the preamble of the downlinks in symbols.
+        :param detect_symbols: preamble symbols needed to detect the downlink.
+        """
+        self.clock_drift_ppm = clock_drift_ppm
+        self.early_wakeup_us = early_wakeup_us
+        self.rx_timeout_symbols = rx_timeout_symbols
+        self.preamble_symbols = preamble_symbols
+        self.detect_symbols = detect_symbols
+
+    def device_delay_us(self, delay_us):
+        """ Delay measured by the clock of the device."""
+        return delay_us * (1.0 + self.clock_drift_ppm / 1e6)
+
+    def window(self, name, uplink_end_us, delay_us, freq, datr):
+        open_us = uplink_end_us + self.device_delay_us(delay_us) - self.early_wakeup_us
+        close_us = open_us + self.early_wakeup_us + self.rx_timeout_symbols * symbol_time_us(datr)
+        return ReceiveWindow(name=name, open_us=open_us, close_us=close_us, freq=freq, datr=datr)
+
+    def receives(self, window, start_us, freq, datr):
+        """
+        Returns True if a downlink that starts at start_us is received in the window.
+        :param window: ReceiveWindow of the device.
+        :param start_us: start of the transmission of the downlink (beginning of the preamble).
+        :param freq: frequency of the downlink (MHz).
+        :param datr: data rate of the downlink (e.g. 'SF7BW125').
+        """
+        if round(freq, 6) != round(window.freq, 6) or datr != window.datr:
+            return False
+        symbol_us = symbol_time_us(datr)
+        preamble_end_us = start_us + self.preamble_symbols * symbol_us
+        overlap_us = min(window.close_us, preamble_end_us) - max(window.open_us, start_us)
+        return overlap_us >= self.detect_symbols * symbol_us
+
+
+def receive_windows(loramac_params, uplink_end_us, uplink_freq, uplink_datr, timing, join_request=False):
+    """
+    Returns the RX1 and RX2 windows opened by a device after an uplink, from its LoRaMACParameters.
+    :param loramac_params: LoRaMACParameters of the device.
+    :param uplink_end_us: end of the uplink transmission (the tmst of the gateway).
+    :param uplink_freq: frequency of the uplink (MHz).
+    :param uplink_datr: data rate of the uplink (e.g. 'SF7BW125').
+    :param timing: DeviceTiming of the device.
+    :param join_request: True if the uplink is a Join Request (JOIN_ACCEPT_DELAY1/2 are used).
+    :return: (RX1 window, RX2 window)
+    """
+    if join_request:
+        rx1_delay, rx2_delay = loramac_params.joinaccept_delay1, loramac_params.joinaccept_delay2
+    else:
+        rx1_delay, rx2_delay = loramac_params.rx1_delay, loramac_params.rx2_delay
+    rx1_datr = lorawan_parameters.rx_dr_offset(initial_dr=uplink_datr, offset=loramac_params.rx1_dr_offset)
+    return (timing.window("RX1", uplink_end_us, rx1_delay, uplink_freq, rx1_datr),
+            timing.window("RX2", uplink_end_us, rx2_delay, loramac_params.rx2_frequency, loramac_params.rx2_dr))
+
+
+def tmst_to_time_us(tmst, now_us):
+    """
+    Converts the 32 bits tmst of a message scheduled by the network to the simulated time closest to now_us
+    whose counter value is tmst (it's before now_us if the message arrived too late to the gateway).
+    """
+    delta_us = (tmst - int(now_us)) % TMST_MODULO
+    if delta_us >= TMST_MODULO // 2:
+        delta_us -= TMST_MODULO
+    return int(now_us) + delta_us
+
+
+def time_to_tmst(time_us):
+    """ Value of the 32 bits micro seconds counter of the gateway at a simulated time."""
+    return int(time_us) % TMST_MODULO
@@ -0,0 +1,193 @@
+"""
+Simulated test sessions: the Test Application Server runs in-process with a simulated device and gateway driven by a
+VirtualClock, so the timing of the reception windows can be explored without hardware and without waiting.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import time
+
+import pika
+
+from conformance_testing import testingtool_services
+import message_queueing
+from lorawan.simulation import clock as simulation_clock
+from lorawan.simulation import models
+from lorawan.simulation import radio
+import user_interface.ui_reports as ui_reports
+from user_interface.ui import ui_publisher
+from parameters.message_broker import routing_keys
+
+DEFAULT_MAX_TIME_US = 3600 * 1000000
+UPLINK_ROUTING_KEY = routing_keys.fromAgent + '.gw1'
+
+
+class SimulationCoordinator(testingtool_services.TestSessionCoordinator):
+    """
+    Session coordinator that sends the downlinks to a SimulatedGateway instead of the message broker. The
+    deadlines of the tests are timers of the VirtualClock.
+    """
+
+    def __init__(self, clock, gateway, reset_attemps=3, amqp_url=message_queueing.MEMORY_URL_SCHEME):
+        super().__init__(reset_attemps=reset_attemps, amqp_url=amqp_url)
+        self.clock = clock
+        self.gateway = gateway
+
+    def add_timeout(self, seconds, callback):
+        return self.clock.schedule(seconds * 1e6, callback)
+
+    def remove_timeout(self, timer_id):
+        timer_id.cancel()
+
+    def monotonic_time(self):
+        return self.clock.now_us / 1e6
+
+    def publish(self, msg, routing_key, exchange_name=message_queueing.DEFAULT_EXCHANGE, properties=None):
+        if routing_key.startswith(routing_keys.toAgent + '.'):
+            self.gateway.send_downlink(body=msg.encode() if isinstance(msg, str) else msg,
+                                       content_type=properties.content_type if properties is not None else None)
+        else:
+            super().publish(msg, routing_key, exchange_name=exchange_name, properties=properties)
+
+    def close(self):
+        """ Deletes the queues declared in the in-process broker and closes the connection."""
+        for queue_name in self._knownQueues:
+            self.channel.queue_delete(queue=queue_name)
+        self.channel.close()
+        self.connection.close()
+
+
+class SimulationResult(object):
+    """ Result of a simulated session."""
+
+    def __init__(self, report, simulated_us, events, uplinks, downlinks, wall_seconds):
+        self.report = report
+        self.simulated_us = simulated_us
+        self.events = events
+        self.uplinks = uplinks
+        self.downlinks = downlinks
+        self.wall_seconds = wall_seconds
+
+    @property
+    def passed(self):
+        return self.report.level != ui_reports.LEVEL_ERR
+
+    @property
+    def verdicts(self):
+        """ List of (test name, verdict) of the session."""
+        return [(field["name"], field["value"]) for field in self.report.fields
+                if field["name"].startswith("td_")]
+
+    @property
+    def missed_downlinks(self):
+        return [downlink for downlink in self.downlinks if downlink.status != models.DOWNLINK_RECEIVED]
+
+    def get_printable_str(self):
+        return (f"{'PASS' if self.passed else 'FAIL'}: {len(self.verdicts)} tests, {self.uplinks} uplinks, "
+                f"{len(self.downlinks)} downlinks ({len(self.missed_downlinks)} not received), "
+                f"{self.simulated_us / 1e6:.1f} s simulated in {self.wall_seconds:.3f} s.")
+
+
+class SimulatedSession(object):
+    """ Test session of a simulated device, with the tests run by an in-process TestSessionCoordinator."""
+
+    def __init__(self, device_id, requested_tests, test_modules, timing=None, appeui=bytes(8),
+                 uplink_interval_us=models.DEFAULT_UPLINK_INTERVAL_US,
+                 backhaul_latency_us=models.DEFAULT_BACKHAUL_LATENCY_US,
+                 random_seed=0, max_time_us=DEFAULT_MAX_TIME_US, reset_attempts=3):
+        """
+        :param device_id: DeviceID of the simulated device.
+        :param requested_tests: list of the names of the tests to be run.
+        :param test_modules: dict {test_name: test module} of the available tests.
+        :param timing: DeviceTiming of the radio of the device.
+        :param appeui: AppEUI used by the device in the Join Requests.
+        :param uplink_interval_us: time between the uplinks of the device.
+        :param backhaul_latency_us: latency between the gateway and the TAS (each direction).
+        :param random_seed: seed of the random numbers of the session (the results are reproducible).
+        :param max_time_us: maximum simulated time of the session.
+        :param reset_attempts: maximum number of consecutive resets of the device.
+        """
+        self.device_id = device_id
+        self.requested_tests = list(requested_tests)
+        self.test_modules = test_modules
+        self.timing = timing if timing is not None else radio.DeviceTiming()
+        self.appeui = appeui
+        self.uplink_interval_us = uplink_interval_us
+        self.backhaul_latency_us = backhaul_latency_us
+        self.random_seed = random_seed
+        self.max_time_us = max_time_us
+        self.reset_attempts = reset_attempts
+
+    def run(self):
+        """ Runs the session until all the tests finish (or max_time_us) and returns the SimulationResult."""
+        if not ui_publisher.connected or not message_queueing.is_memory_url(ui_publisher.amqp_url):
+            ui_publisher.connect(amqp_url=message_queueing.MEMORY_URL_SCHEME)
+        start_time = time.perf_counter()
+        clock = simulation_clock.VirtualClock()
+        gateway = models.SimulatedGateway(clock, backhaul_latency_us=self.backhaul_latency_us)
+        coordinator = SimulationCoordinator(clock=clock, gateway=gateway, reset_attemps=self.reset_attempts)
+        device = models.SimulatedDevice(clock, device_id=self.device_id, appeui=self.appeui, timing=self.timing,
+                                        uplink_interval_us=self.uplink_interval_us)
+        gateway.add_device(device)
+
+        def deliver_uplink(body, content_type):
+            coordinator.uplink_dispatcher(ch=coordinator.channel,
+                                          method=pika.spec.Basic.Deliver(routing_key=UPLINK_ROUTING_KEY),
+                                          properties=pika.BasicProperties(content_type=content_type),
+                                          body=body)
+
+        gateway.uplink_handler = deliver_uplink
+        try:
+            session = coordinator.add_device_session(device_id=self.device_id,
+                                                     requested_tests=self.requested_tests)
+            if coordinator.start_sessions(self.test_modules, random_seed=self.random_seed):
+                device.start()
+                clock.run(until_us=self.max_time_us, stop_condition=lambda: session.finished)
+        finally:
+            device.stop()
+            coordinator.close()
+        session.add_verdict()
+        return SimulationResult(report=session.result_report,
+                                simulated_us=clock.now_us,
+                                events=clock.events_run,
+                                uplinks=device.uplinks_sent,
+                                downlinks=gateway.downlinks,
+                                wall_seconds=time.perf_counter() - start_time)
+
+
+def timing_sweep(parameter, values, device_id, requested_tests, test_modules, **session_kwargs):
+    """
+    Runs a simulated session for each value of a parameter of the DeviceTiming of the device (e.g.
+    clock_drift_ppm or early_wakeup_us), to explore the timing tolerances of the tests.
+    :return: list of (value, SimulationResult).
+    """
+    results = []
+    for value in values:
+        session = SimulatedSession(device_id=device_id,
+                                   requested_tests=requested_tests,
+                                   test_modules=test_modules,
+                                   timing=radio.DeviceTiming(**{parameter: value}),
+                                   **session_kwargs)
+        results.append((value, session.run()))
+    return results
@@ -34,6 +34,8 @@ import struct
 import time
 import logging
 
+import pika
+
 import lorawan.user_agent.bridge.udp_listener as udp_listener
 import message_queueing
 import lorawan.parsing.lorawan
@@ -133,9 +135,8 @@ class SPFBridge(object):
         If no PULL_DATA message was previously received from the gateway (so the downlink address is unknown), the
         message is ignored.
         """
-        body_str = body.decode()
         if self._ready_to_downlink:
-            received_gw_message = GatewayMessage(body_str)
+            received_gw_message = GatewayMessage.from_bytes(body, content_type=properties.content_type)
             self.send_pull_resp(received_gw_message.get_txpk_str().encode())
             elapsed_time = time.time() - self.last_uplink_time
             logger.info(f"\n\n<<<<<<\nTime since the last uplink: {elapsed_time}\n<<<<<<\n")
@@ -163,13 +164,13 @@ class SPFBridge(object):
             self.gateway_ul_addr = addr
             self.send_ulresponse_raw(push_ack_bytes)
 
-            data_msg_list = received_msg.get_data()
-            if len(data_msg_list) > 0:
-                for packet in data_msg_list:
-                    # packet[0]: the decoded data
-                    # packet[1]: the json string with the decoded data in it's data field.
-                    self.uplink_mq_interface.publish(msg=packet[1],
-                                                     routing_key=routing_keys.fromAgent + '.gw1')
+            for phypayload, rxpk in received_msg.get_packets():
+                uplink_body, content_type = GatewayMessage.from_dict(
+                    rxpk, phypayload=phypayload).encode()
+                self.uplink_mq_interface.publish(msg=uplink_body,
+                                                 routing_key=routing_keys.fromAgent + '.gw1',
+                                                 properties=pika.BasicProperties(
+                                                     content_type=content_type))
         # PULL_DATA (ID=2) received -> Send an PULL_ACK
         elif received_msg.msg_id == SPFBridge.PULL_DATA_ID[0]:
             pull_ack = data[0:3] + SPFBridge.PULL_ACK_ID
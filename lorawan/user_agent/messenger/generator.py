@@ -31,6 +31,8 @@ import time
 import struct
 import logging
 
+import pika
+
 import lorawan.user_agent.messenger.mock_parsing
 import lorawan.user_agent.messenger.mock_sessions as mock_sessions
 import lorawan.sessions
@@ -64,63 +66,24 @@ class MessageGenerator(object):
         self.last_pong_request = lorawan.lorawan_parameters.testing.TEST_CODE.PINGPONG
         self.__last_freq_idx = 0
 
-        self.mqif.declare_and_consume(queue_name='down_nwk_mock',
-                                      routing_key=message_broker.routing_keys.toAgent + '.#',
-                                      durable=False,
-                                      auto_delete=True,
-                                      callback=self.handle_nwk_down_msg)
-
-        self.mqif.declare_and_consume(queue_name='up_nwk_mock',
-                                      routing_key=message_broker.routing_keys.fromAgent + '.#',
-                                      durable=False,
-                                      auto_delete=True,
-                                      callback=self.handle_nwk_up_msg)
-
-        self.mqif.declare_and_consume(queue_name='mock_up_message_actok',
-                                      routing_key='mock.up.message.actok',
-                                      durable=False,
-                                      auto_delete=True,
-                                      callback=self.handle_mock_up_message_actok)
-
-        self.mqif.declare_and_consume(queue_name='mock_up_message_pong',
-                                      routing_key='mock.up.message.pong',
-                                      durable=False,
-                                      auto_delete=True,
-                                      callback=self.handle_mock_up_message_pong)
-
-        self.mqif.declare_and_consume(queue_name='mock_up_message_join',
-                                      routing_key='mock.up.message.join',
-                                      durable=False,
-                                      auto_delete=True,
-                                      callback=self.handle_mock_up_message_join)
-
-        self.mqif.declare_and_consume(queue_name='mock_up_data',
-                                      routing_key='mock.up.data',
-                                      durable=False,
-                                      auto_delete=True,
-                                      callback=self.handle_mock_up_data)
-
-        self.mqif.declare_and_consume(queue_name='mock_configure_resetABP',
-                                      routing_key='mock.configure.resetABP',
-                                      durable=False,
-                                      auto_delete=True,
-                                      callback=self.handle_mock_configure_node_resetabp)
-
-        self.mqif.declare_and_consume(queue_name='mock_configure',
-                                      routing_key='mock.configure',
-                                      durable=False,
-                                      auto_delete=True,
-                                      callback=self.handle_mock_configure_node)
-
-        self.mqif.declare_and_consume(queue_name='mock_configure_showinfo',
-                                      routing_key='mock.configure.showinfo',
-                                      durable=False,
-                                      auto_delete=True,
-                                      callback=self.handle_mock_configure_showinfo)
+        self.mqif.declare_and_consume_many(
+            queue_name='nwk_mock',
+            durable=False,
+            auto_delete=True,
+            callbacks={
+                message_broker.routing_keys.toAgent + '.#': self.handle_nwk_down_msg,
+                message_broker.routing_keys.fromAgent + '.#': self.handle_nwk_up_msg,
+                'mock.up.message.actok': self.handle_mock_up_message_actok,
+                'mock.up.message.pong': self.handle_mock_up_message_pong,
+                'mock.up.message.join': self.handle_mock_up_message_join,
+                'mock.up.data': self.handle_mock_up_data,
+                'mock.configure.resetABP': self.handle_mock_configure_node_resetabp,
+                'mock.configure': self.handle_mock_configure_node,
+                'mock.configure.showinfo': self.handle_mock_configure_showinfo,
+            })
 
     def get_frequency(self):
-        freq = self.node.loramac_params.channel_struct.used_frequencies[
-            self.__last_freq_idx % len(self.node.loramac_params.channel_struct.used_frequencies)]
+        freq = self.node.loramac_params.channel_struct.frequency_at(self.__last_freq_idx)
         self.__last_freq_idx += 1
         return freq
 
@@ -142,8 +105,8 @@ class MessageGenerator(object):
         logger.info(cli_message)
         logger.info(f"use_dr: {cli_message.use_dr}")
         logger.info(f"freq: {cli_message.freq}\n\n")
-        self.node.loramac_params.rx1_dr_offset = getattr(lorawan.lorawan_parameters.general.LORA_DR,
-                                                         cli_message.use_dr)
+        self.node.update_loramac(rx1_dr_offset=getattr(lorawan.lorawan_parameters.general.LORA_DR,
+                                                       cli_message.use_dr))
         self.node.add_frequency(cli_message.freq())
 
     def handle_mock_up_data(self, ch, method, properties, body):
@@ -191,10 +154,11 @@ class MessageGenerator(object):
         logger.info("\n\n")
 
     def handle_nwk_down_msg(self, ch, method, properties, body):
-        n_msg = lorawan.parsing.flora_messages.GatewayMessage(json_ttm_str=body.decode())
+        n_msg = lorawan.parsing.flora_messages.GatewayMessage.from_bytes(
+            body, content_type=properties.content_type)
         phypayload = n_msg.get_phypaload_bytes()
         global last_sent
-        logger.info(f"\n<-<-<-\n{body.decode()}")
+        logger.info(f"\n<-<-<-\n{str(n_msg)}")
         logger.debug(f"Time since last uplink message sent: {time.time() - last_sent} s.")
 
         if phypayload[0:1] == lorawan.lorawan_parameters.general.MHDR.JOIN_ACCEPT:
@@ -210,6 +174,7 @@ class MessageGenerator(object):
                 key = self.node.loramac_params.nwkskey
             else:
                 key = self.node.loramac_params.appskey
+            self.node.track_received_fcnt(lw_msg, key=self.node.loramac_params.nwkskey)
 
             rcv_pay = lw_msg.get_frmpayload_plaintext(key=key)
             # rcv_pay = utils.encrypt_ieee802154(key=self.node.loramac_params.appskey,
@@ -237,7 +202,8 @@ class MessageGenerator(object):
     def handle_nwk_up_msg(self, ch, method, properties, body):
         global last_sent
         last_sent = time.time()
-        nwk_msg = lorawan.parsing.flora_messages.GatewayMessage(json_ttm_str=body.decode())
+        nwk_msg = lorawan.parsing.flora_messages.GatewayMessage.from_bytes(
+            body, content_type=properties.content_type)
         phypayload = nwk_msg.get_phypaload_bytes()
         lw_msg = nwk_msg.parse_lorawan_message(ignore_format_errors=True)
 
@@ -306,6 +272,8 @@ class MessageGenerator(object):
         global last_sent
         last_sent = time.time()
         logger.info(str(ulmsg))
+        ulmsg_body, content_type = ulmsg.encode()
         broker_channel.basic_publish(exchange=message_queueing.DEFAULT_EXCHANGE,
                                      routing_key=message_broker.routing_keys.fromAgent + '.gw1',
-                                     body=str(ulmsg))
+                                     properties=pika.BasicProperties(content_type=content_type),
+                                     body=ulmsg_body)
@@ -66,7 +66,7 @@ class EndDeviceMock(lorawan.sessions.EndDevice):
         appeui_bytes = join_request_phypayload_bytes[8:0:-1]
         deveui_bytes = join_request_phypayload_bytes[16:8:-1]
         devnonce = join_request_phypayload_bytes[-5:-7:-1]
-        self._used_otaa_devnonces.append(devnonce)
+        self._used_otaa_devnonces.add(devnonce)
         app_hex = utils.bytes_to_text(appeui_bytes)
         dev_hex = utils.bytes_to_text(deveui_bytes)
         nonce_hex = utils.bytes_to_text(devnonce[::-1])
@@ -81,15 +81,14 @@ class EndDeviceMock(lorawan.sessions.EndDevice):
         :return: int (between 0 and 2ˆ16)
         """
         nonce_int = random.randint(0, 2 ** 16 - 1)
-        while nonce_int in self._used_otaa_devnonces:
+        while not self._used_otaa_devnonces.add(nonce_int):
             nonce_int = random.randint(0, 2 ** 16 - 1)
-        devnonce = struct.pack('>H', nonce_int)
-        self._used_otaa_devnonces.append(devnonce)
-        return devnonce
+        return struct.pack('>H', nonce_int)
 
     def parse_join_accept(self, join_accept_phypayload):
         """
-        Updates the keys and the device address with the information contained in a join accept message.
+        Updates the keys, the device address and the reception settings (DLSettings, RxDelay and CFList) with the
+        information contained in a join accept message.
         :param join_accept_phypayload: byte sequence of the Join Accept PHYPayload.
         :return:
         """
@@ -101,11 +100,14 @@ class EndDeviceMock(lorawan.sessions.EndDevice):
             raise test_errors.SessionError(description="Wrong MIC in the received join accept.",
                                            test_case=None,
                                            step_name=None)
-        appnonce_netid_devnonce = join_accept_and_mic[:6] + self._used_otaa_devnonces[-1][::-1]
+        appnonce_netid_devnonce = join_accept_and_mic[:6] + self._used_otaa_devnonces.last_bytes()[::-1]
         nwkskey = utils.aes128_encrypt(self.appkey, b'\x01' + appnonce_netid_devnonce + bytes(7))
         appskey = utils.aes128_encrypt(self.appkey, b'\x02' + appnonce_netid_devnonce + bytes(7))
         devaddr = join_accept_and_mic[9:5:-1]
         self.update_device_session(devaddr=devaddr,
                                    nwkskey=nwkskey,
                                    appskey=appskey)
+        self.apply_join_settings(dlsettings=join_accept_and_mic[10:11],
+                                 rxdelay=join_accept_and_mic[11:12],
+                                 cflist=join_accept_and_mic[12:-4])
 
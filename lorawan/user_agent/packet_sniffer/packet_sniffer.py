@@ -31,6 +31,7 @@ test2pcap.
 import time
 
 import lorawan.parsing.flora_messages
+from conformance_testing import session_capture
 import message_queueing
 import utils
 import parameters.message_broker as message_broker
@@ -39,38 +40,52 @@ import parameters.message_broker as message_broker
 class PacketSniffer(message_queueing.MqInterface):
     """
     Captures the traffic (uplink and downlink) by consuming the uplink and downlink routing keys on the
-    message broker.
+    message broker. If a capture file is given, the messages (and the description of the session published by
+    the Test Application Server) are also appended to it, to replay the session offline.
     """
 
-    def __init__(self):
+    def __init__(self, capture_path=None):
+        """
+        :param capture_path: path of the capture file (optional).
+        """
         super().__init__()
-
-        self.declare_and_consume(queue_name='sniffer_down',
-                                 routing_key=message_broker.routing_keys.toAgent+'.#',
-                                 durable=False,
-                                 auto_delete=True,
-                                 callback=self.handle_sniffer_down_msg)
-
-        self.declare_and_consume(queue_name='sniffer_up',
-                                 routing_key=message_broker.routing_keys.fromAgent+'.#',
-                                 durable=False,
-                                 auto_delete=True,
-                                 callback=self.handle_sniffer_up_msg)
+        self.capture_writer = session_capture.CaptureWriter(capture_path) if capture_path else None
+        # A single queue keeps the order of the uplinks and downlinks in the broker.
+        callbacks = {message_broker.routing_keys.toAgent + '.#': self.handle_sniffer_down_msg,
+                     message_broker.routing_keys.fromAgent + '.#': self.handle_sniffer_up_msg}
+        if self.capture_writer:
+            callbacks[message_broker.routing_keys.session_info] = self.handle_session_info_msg
+        self.declare_and_consume_many(queue_name='sniffer',
+                                      callbacks=callbacks,
+                                      durable=False,
+                                      auto_delete=True)
 
     def start_sniffing(self):
         """ Starts the sniffing process."""
         self.consume_start()
 
+    def capture(self, method, properties, body):
+        if self.capture_writer:
+            self.capture_writer.record(routing_key=method.routing_key, body=body, properties=properties)
+
+    def handle_session_info_msg(self, ch, method, properties, body):
+        """ Handler of the description of the session published by the Test Application Server."""
+        self.capture(method, properties, body)
+
     def handle_sniffer_down_msg(self, ch, method, properties, body):
         """ Handler of the donwlink messages."""
-        nwk_message_down = lorawan.parsing.flora_messages.GatewayMessage(json_ttm_str=body.decode())
+        self.capture(method, properties, body)
+        nwk_message_down = lorawan.parsing.flora_messages.GatewayMessage.from_bytes(
+            body, content_type=properties.content_type)
         phypayload = nwk_message_down.get_phypaload_bytes()
         print("# DOWNLINK, {0:10.2f}:".format(time.time()))
         print(utils.bytes_to_pcap_str(phypayload))
 
     def handle_sniffer_up_msg(self, ch, method, properties, body):
         """ Handler of the uplink messages."""
-        nwk_message_up = lorawan.parsing.flora_messages.GatewayMessage(json_ttm_str=body.decode())
+        self.capture(method, properties, body)
+        nwk_message_up = lorawan.parsing.flora_messages.GatewayMessage.from_bytes(
+            body, content_type=properties.content_type)
         phypayload = nwk_message_up.get_phypaload_bytes()
         print("# UPLINK, {0:10.2f}:".format(time.time()))
         print(utils.bytes_to_pcap_str(phypayload))
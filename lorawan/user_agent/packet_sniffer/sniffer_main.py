@@ -25,13 +25,17 @@ Sniffer module main function entry point.
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #################################################################################
+import click
 
 from lorawan.user_agent.packet_sniffer.packet_sniffer import PacketSniffer
 
 
-def sniff():
+@click.command()
+@click.option('--capture', 'capture_path', default=None, type=click.Path(dir_okay=False),
+              help='Append the messages of the session to this capture file (to be replayed with cl_tas_replay).')
+def sniff(capture_path):
     """ LoRaWAN hex dump packet sniffer entry point."""
-    sniffer = PacketSniffer()
+    sniffer = PacketSniffer(capture_path=capture_path)
     print("Starting sniffer.")
     sniffer.start_sniffing()
 
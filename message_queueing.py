@@ -27,39 +27,629 @@ This module manages the interaction with the message queueing broker.
 #################################################################################
 import os
 import abc
+import functools
 import time
+import heapq
+import itertools
+import collections
+import threading
+import uuid
 import pika
 import pika.exceptions
+import pika.frame
+import pika.spec
 import logging
 
+import mq_metrics
+
 logger = logging.getLogger(__name__)
 
+MEMORY_URL_SCHEME = 'memory://'
+
 mq_broker_url = os.environ.get('AMQP_URL')
-params = pika.URLParameters(mq_broker_url)
+
+
+def is_memory_url(amqp_url):
+    """ Returns True if the url selects the in-process broker (memory://) instead of RabbitMQ."""
+    return amqp_url is not None and amqp_url.startswith(MEMORY_URL_SCHEME)
+
+
+if mq_broker_url and not is_memory_url(mq_broker_url):
+    params = pika.URLParameters(mq_broker_url)
+else:
+    params = None
 
 DEFAULT_EXCHANGE = 'amq.topic'
 
 
+def topic_matches(binding_key, routing_key):
+    """
+    Checks if a routing key matches an AMQP topic binding key ('*' matches exactly one word and
+    '#' matches zero or more words).
+    :param binding_key: binding key of the queue (e.g. "fromAgent.#").
+    :param routing_key: routing key of the message.
+    :return: True if the routing key matches the binding.
+    """
+    return RoutingKeyMatcher([(binding_key, True)]).matches(routing_key)
+
+
+class RoutingKeyMatcher(object):
+    """
+    Compiled set of AMQP topic binding keys, stored as a trie of words. A routing key is matched
+    walking the trie once (the cost depends on the number of words of the key, not on the number
+    of bindings) and the results are cached per routing key.
+    """
+    MAX_CACHED_KEYS = 1024
+
+    class _Node(object):
+        __slots__ = ('children', 'values', 'is_hash')
+
+        def __init__(self, is_hash=False):
+            self.children = dict()
+            self.values = []
+            self.is_hash = is_hash
+
+    def __init__(self, bindings=None):
+        """
+        :param bindings: optional iterable of (binding_key, value) pairs.
+        """
+        self._root = self._Node()
+        self._order = itertools.count()
+        self._cache = dict()
+        if bindings:
+            for binding_key, value in bindings:
+                self.add(binding_key, value)
+
+    def add(self, binding_key, value):
+        """ Adds a binding key with its associated value (e.g. a queue name or a callback)."""
+        node = self._root
+        for word in binding_key.split('.'):
+            child = node.children.get(word)
+            if child is None:
+                child = self._Node(is_hash=(word == '#'))
+                node.children[word] = child
+            node = child
+        node.values.append((next(self._order), value))
+        self._cache.clear()
+
+    def remove(self, binding_key, value):
+        """ Removes a binding (returns False if it wasn't added)."""
+        node = self._root
+        for word in binding_key.split('.'):
+            node = node.children.get(word)
+            if node is None:
+                return False
+        for idx, (_, bound_value) in enumerate(node.values):
+            if bound_value == value:
+                del node.values[idx]
+                self._cache.clear()
+                return True
+        return False
+
+    @staticmethod
+    def _closure(node, states):
+        # A '#' matches zero words, so reaching a node also reaches its '#' children.
+        while node is not None and id(node) not in states:
+            states[id(node)] = node
+            node = node.children.get('#')
+
+    def match(self, routing_key):
+        """
+        Returns the values of all the bindings matching the routing key (in the order they were
+        added, a value bound with several matching keys is returned once per binding).
+        """
+        try:
+            return self._cache[routing_key]
+        except KeyError:
+            pass
+        states = dict()
+        self._closure(self._root, states)
+        for word in routing_key.split('.'):
+            next_states = dict()
+            for node in states.values():
+                if node.is_hash:
+                    next_states[id(node)] = node
+                self._closure(node.children.get(word), next_states)
+                self._closure(node.children.get('*'), next_states)
+            states = next_states
+            if not states:
+                break
+        values = tuple(value for _, value in
+                       sorted((bound for node in states.values() for bound in node.values),
+                              key=lambda bound: bound[0]))
+        if len(self._cache) >= self.MAX_CACHED_KEYS:
+            self._cache.clear()
+        self._cache[routing_key] = values
+        return values
+
+    def matches(self, routing_key):
+        """ Returns True if any binding matches the routing key."""
+        return bool(self.match(routing_key))
+
+
+class MemoryQueue(object):
+    """ Queue of the in-process broker."""
+
+    def __init__(self, name, durable=False, exclusive=False, auto_delete=False, owner=None):
+        self.name = name
+        self.durable = durable
+        self.exclusive = exclusive
+        self.auto_delete = auto_delete
+        self.owner = owner
+        self.messages = collections.deque()
+        self.consumer_count = 0
+
+
+class MemoryBroker(object):
+    """
+    In-process stand-in of the RabbitMQ broker, selected with AMQP_URL=memory://. It implements the
+    topic exchanges used by the services, so several of them can run in the same process (e.g. in
+    different threads) without a broker. Every exchange is a topic exchange.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self._queues = dict()
+        self._bindings = set()
+        self._matchers = collections.defaultdict(RoutingKeyMatcher)
+        self._delivery_tags = itertools.count(1)
+
+    @classmethod
+    def instance(cls):
+        """ Returns the broker shared by all the memory connections of the process."""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    @classmethod
+    def reset(cls):
+        """ Discards the shared broker (with all its queues and bindings)."""
+        with cls._instance_lock:
+            cls._instance = None
+
+    def queue_declare(self, queue, durable=False, exclusive=False, auto_delete=False, owner=None,
+                      passive=False):
+        with self.condition:
+            if not queue:
+                queue = 'amq.gen-' + uuid.uuid4().hex
+            memory_queue = self._queues.get(queue)
+            if memory_queue is None:
+                if passive:
+                    raise pika.exceptions.ChannelClosed(404, f"NOT_FOUND - no queue '{queue}'")
+                memory_queue = MemoryQueue(name=queue, durable=durable, exclusive=exclusive,
+                                           auto_delete=auto_delete, owner=owner)
+                self._queues[queue] = memory_queue
+            elif memory_queue.exclusive and memory_queue.owner is not owner:
+                raise pika.exceptions.ChannelClosed(
+                    405, f"RESOURCE_LOCKED - cannot obtain exclusive access to queue '{queue}'")
+            return memory_queue
+
+    def queue_bind(self, queue, exchange, routing_key):
+        with self.condition:
+            self._get_queue(queue)
+            binding = (exchange, routing_key, queue)
+            if binding not in self._bindings:
+                self._bindings.add(binding)
+                self._matchers[exchange].add(routing_key, queue)
+
+    def queue_unbind(self, queue, exchange, routing_key):
+        with self.condition:
+            binding = (exchange, routing_key, queue)
+            if binding in self._bindings:
+                self._bindings.remove(binding)
+                self._matchers[exchange].remove(routing_key, queue)
+
+    def queue_delete(self, queue):
+        with self.condition:
+            memory_queue = self._queues.pop(queue, None)
+            for exchange, routing_key, bound_queue in list(self._bindings):
+                if bound_queue == queue:
+                    self.queue_unbind(queue, exchange, routing_key)
+            self.condition.notify_all()
+            return len(memory_queue.messages) if memory_queue else 0
+
+    def delete_owned_queues(self, owner):
+        """ Deletes the exclusive queues declared by a connection (when it's closed)."""
+        with self.condition:
+            for name in [name for name, memory_queue in self._queues.items()
+                         if memory_queue.exclusive and memory_queue.owner is owner]:
+                self.queue_delete(name)
+
+    def _get_queue(self, queue):
+        try:
+            return self._queues[queue]
+        except KeyError:
+            raise pika.exceptions.ChannelClosed(404, f"NOT_FOUND - no queue '{queue}'")
+
+    def publish(self, exchange, routing_key, body, properties=None):
+        """
+        Routes a message to all the queues bound to the exchange with a matching binding key. The
+        message is delivered once per queue, even if several bindings of the queue match.
+        :return: number of queues the message was routed to.
+        """
+        if isinstance(body, str):
+            body = body.encode()
+        if properties is None:
+            properties = pika.BasicProperties()
+        with self.condition:
+            destinations = []
+            for queue in self._matchers[exchange].match(routing_key):
+                if queue not in destinations:
+                    destinations.append(queue)
+            for queue in destinations:
+                self._queues[queue].messages.append((exchange, routing_key, properties, body))
+            if destinations:
+                self.condition.notify_all()
+            return len(destinations)
+
+    def get(self, queue):
+        """ Pops the next message of the queue (or None if it's empty)."""
+        with self.condition:
+            memory_queue = self._queues.get(queue)
+            if memory_queue is None or not memory_queue.messages:
+                return None
+            exchange, routing_key, properties, body = memory_queue.messages.popleft()
+            return next(self._delivery_tags), exchange, routing_key, properties, body
+
+    def requeue(self, queue, message):
+        with self.condition:
+            memory_queue = self._queues.get(queue)
+            if memory_queue is not None:
+                memory_queue.messages.appendleft(message)
+                self.condition.notify_all()
+
+    def has_messages(self, queues):
+        with self.condition:
+            return any(queue in self._queues and self._queues[queue].messages
+                       for queue in queues)
+
+    def message_count(self, queue):
+        with self.condition:
+            return len(self._get_queue(queue).messages)
+
+    def add_consumer(self, queue):
+        with self.condition:
+            self._get_queue(queue).consumer_count += 1
+
+    def remove_consumer(self, queue):
+        with self.condition:
+            memory_queue = self._queues.get(queue)
+            if memory_queue is None:
+                return
+            memory_queue.consumer_count -= 1
+            if memory_queue.auto_delete and memory_queue.consumer_count <= 0:
+                self.queue_delete(queue)
+
+    def notify(self):
+        """ Wakes up the connections waiting for messages."""
+        with self.condition:
+            self.condition.notify_all()
+
+
+class MemoryChannel(object):
+    """
+    Channel of the in-process broker, implementing the subset of pika's BlockingChannel used by
+    the services.
+    """
+
+    def __init__(self, connection, channel_number):
+        self.connection = connection
+        self.channel_number = channel_number
+        self._broker = connection.broker
+        self._consumers = collections.OrderedDict()
+        self._unacked = dict()
+        self._consumer_tags = itertools.count(1)
+        self._prefetch_count = 0
+        self._closed = False
+
+    @property
+    def is_closed(self):
+        return self._closed or self.connection.is_closed
+
+    @property
+    def is_open(self):
+        return not self.is_closed
+
+    @property
+    def consumer_tags(self):
+        return list(self._consumers.keys())
+
+    def _method_frame(self, method):
+        return pika.frame.Method(self.channel_number, method)
+
+    def exchange_declare(self, exchange=None, exchange_type='direct', passive=False, durable=False,
+                         auto_delete=False, internal=False, arguments=None):
+        return self._method_frame(pika.spec.Exchange.DeclareOk())
+
+    def queue_declare(self, queue='', passive=False, durable=False, exclusive=False,
+                      auto_delete=False, arguments=None):
+        memory_queue = self._broker.queue_declare(queue, durable=durable, exclusive=exclusive,
+                                                  auto_delete=auto_delete, owner=self.connection,
+                                                  passive=passive)
+        return self._method_frame(pika.spec.Queue.DeclareOk(
+            queue=memory_queue.name,
+            message_count=len(memory_queue.messages),
+            consumer_count=memory_queue.consumer_count))
+
+    def queue_bind(self, queue, exchange, routing_key=None, arguments=None):
+        self._broker.queue_bind(queue, exchange, queue if routing_key is None else routing_key)
+        return self._method_frame(pika.spec.Queue.BindOk())
+
+    def queue_unbind(self, queue, exchange=None, routing_key=None, arguments=None):
+        self._broker.queue_unbind(queue, exchange, queue if routing_key is None else routing_key)
+        return self._method_frame(pika.spec.Queue.UnbindOk())
+
+    def queue_delete(self, queue, if_unused=False, if_empty=False):
+        message_count = self._broker.queue_delete(queue)
+        return self._method_frame(pika.spec.Queue.DeleteOk(message_count=message_count))
+
+    def basic_qos(self, prefetch_size=0, prefetch_count=0, all_channels=False):
+        """ Limits the messages delivered to the consumers with acknowledgements and not acknowledged yet."""
+        self._prefetch_count = prefetch_count
+
+    def basic_consume(self, consumer_callback, queue, no_ack=False, exclusive=False,
+                      consumer_tag=None, arguments=None):
+        if not consumer_tag:
+            consumer_tag = f'ctag{self.channel_number}.{next(self._consumer_tags)}'
+        self._broker.add_consumer(queue)
+        self._consumers[consumer_tag] = (queue, consumer_callback, no_ack)
+        return consumer_tag
+
+    def basic_cancel(self, consumer_tag):
+        consumer = self._consumers.pop(consumer_tag, None)
+        if consumer is not None:
+            self._broker.remove_consumer(consumer[0])
+            self._broker.notify()
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False,
+                      immediate=False):
+        self._broker.publish(exchange, routing_key, body, properties)
+        return True
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        for tag in self._settled_tags(delivery_tag, multiple):
+            self._unacked.pop(tag, None)
+        if self._prefetch_count:
+            self._broker.notify()
+
+    def basic_nack(self, delivery_tag=None, multiple=False, requeue=True):
+        for tag in self._settled_tags(delivery_tag, multiple):
+            queue, message = self._unacked.pop(tag)
+            if requeue:
+                self._broker.requeue(queue, message)
+
+    def basic_reject(self, delivery_tag=None, requeue=True):
+        self.basic_nack(delivery_tag=delivery_tag, multiple=False, requeue=requeue)
+
+    def _settled_tags(self, delivery_tag, multiple):
+        if multiple:
+            return [tag for tag in list(self._unacked) if delivery_tag == 0 or tag <= delivery_tag]
+        return [delivery_tag] if delivery_tag in self._unacked else []
+
+    def _prefetch_exhausted(self):
+        return self._prefetch_count and len(self._unacked) >= self._prefetch_count
+
+    def dispatch(self):
+        """
+        Delivers the available messages of the consumed queues to their consumers (in the calling
+        thread). A consumer cancelled by a callback doesn't receive any further message, and the consumers
+        with acknowledgements don't receive messages while prefetch_count of them aren't acknowledged.
+        :return: number of delivered messages.
+        """
+        delivered = 0
+        for consumer_tag in list(self._consumers):
+            while consumer_tag in self._consumers and not self.is_closed:
+                queue, callback, no_ack = self._consumers[consumer_tag]
+                if not no_ack and self._prefetch_exhausted():
+                    break
+                message = self._broker.get(queue)
+                if message is None:
+                    break
+                delivery_tag, exchange, routing_key, properties, body = message
+                if not no_ack:
+                    self._unacked[delivery_tag] = (queue, (exchange, routing_key, properties, body))
+                method = pika.spec.Basic.Deliver(consumer_tag=consumer_tag,
+                                                 delivery_tag=delivery_tag,
+                                                 redelivered=False,
+                                                 exchange=exchange,
+                                                 routing_key=routing_key)
+                delivered += 1
+                callback(self, method, properties, body)
+        return delivered
+
+    def consumed_queues(self):
+        return [consumer[0] for consumer in self._consumers.values()]
+
+    def deliverable_queues(self):
+        """ Returns the consumed queues whose messages can be delivered now (see basic_qos)."""
+        return [queue for queue, _, no_ack in self._consumers.values()
+                if no_ack or not self._prefetch_exhausted()]
+
+    def start_consuming(self):
+        """ Processes messages until all the consumers of the channel are cancelled."""
+        while self._consumers and not self.is_closed:
+            self.connection.process_data_events(time_limit=None)
+
+    def stop_consuming(self, consumer_tag=None):
+        """ Cancels one consumer or, if no consumer tag is given, all the consumers of the channel."""
+        if consumer_tag:
+            self.basic_cancel(consumer_tag)
+        else:
+            for tag in list(self._consumers):
+                self.basic_cancel(tag)
+
+    def close(self, reply_code=0, reply_text="Normal shutdown"):
+        self.stop_consuming()
+        for queue, message in list(self._unacked.values()):
+            self._broker.requeue(queue, message)
+        self._unacked.clear()
+        self._closed = True
+
+
+class MemoryConnection(object):
+    """
+    Connection to the in-process broker, implementing the subset of pika's BlockingConnection used
+    by the services. The messages are dispatched in the thread that calls process_data_events.
+    """
+
+    def __init__(self, broker=None):
+        self.broker = broker if broker is not None else MemoryBroker.instance()
+        self._channels = []
+        self._channel_numbers = itertools.count(1)
+        self._closed = False
+        self._timers = []
+        self._timer_callbacks = dict()
+        self._timer_ids = itertools.count(1)
+        self._threadsafe_callbacks = collections.deque()
+
+    @property
+    def is_closed(self):
+        return self._closed
+
+    @property
+    def is_open(self):
+        return not self._closed
+
+    def add_timeout(self, deadline, callback_method):
+        """
+        Adds a timer, run by process_data_events in the thread of the connection (as in pika's
+        BlockingConnection).
+        :param deadline: seconds until the callback is called.
+        :param callback_method: function called without arguments.
+        :return: id of the timer, to be used with remove_timeout.
+        """
+        timer_id = next(self._timer_ids)
+        self._timer_callbacks[timer_id] = callback_method
+        heapq.heappush(self._timers, (time.monotonic() + deadline, timer_id))
+        return timer_id
+
+    def remove_timeout(self, timeout_id):
+        self._timer_callbacks.pop(timeout_id, None)
+
+    def _next_timer_deadline(self):
+        while self._timers and self._timers[0][1] not in self._timer_callbacks:
+            heapq.heappop(self._timers)
+        return self._timers[0][0] if self._timers else None
+
+    def _run_due_timers(self):
+        """ Calls the callbacks of the expired timers, returns the number of callbacks called."""
+        called = 0
+        while not self._closed:
+            timer_deadline = self._next_timer_deadline()
+            if timer_deadline is None or timer_deadline > time.monotonic():
+                break
+            _, timer_id = heapq.heappop(self._timers)
+            callback_method = self._timer_callbacks.pop(timer_id)
+            called += 1
+            callback_method()
+        return called
+
+    def add_callback_threadsafe(self, callback):
+        """ Requests a call of the callback in the thread of the connection, from any thread (as in pika)."""
+        with self.broker.condition:
+            self._threadsafe_callbacks.append(callback)
+            self.broker.condition.notify_all()
+
+    def _run_threadsafe_callbacks(self):
+        called = 0
+        while self._threadsafe_callbacks and not self._closed:
+            self._threadsafe_callbacks.popleft()()
+            called += 1
+        return called
+
+    def channel(self, channel_number=None):
+        new_channel = MemoryChannel(self, channel_number or next(self._channel_numbers))
+        self._channels.append(new_channel)
+        return new_channel
+
+    def _consumed_queues(self):
+        return [queue for channel in self._channels if not channel.is_closed
+                for queue in channel.consumed_queues()]
+
+    def _deliverable_queues(self):
+        return [queue for channel in self._channels if not channel.is_closed
+                for queue in channel.deliverable_queues()]
+
+    def process_data_events(self, time_limit=0):
+        """
+        Dispatches the available messages and runs the expired timers and the callbacks added from other
+        threads. If there isn't any message it waits for them at most time_limit seconds (None waits until
+        something happens in the broker or a timer expires).
+        """
+        deadline = None if time_limit is None else time.monotonic() + time_limit
+        while True:
+            delivered = self._run_threadsafe_callbacks() + self._run_due_timers()
+            for channel in list(self._channels):
+                if not channel.is_closed:
+                    delivered += channel.dispatch()
+            if delivered or self._closed:
+                return
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            with self.broker.condition:
+                if self._threadsafe_callbacks or self.broker.has_messages(self._deliverable_queues()):
+                    continue
+                wait_until = self._next_timer_deadline()
+                if deadline is not None and (wait_until is None or deadline < wait_until):
+                    wait_until = deadline
+                if wait_until is None:
+                    self.broker.condition.wait()
+                    if not self._consumed_queues():
+                        return
+                    continue
+                remaining = wait_until - time.monotonic()
+                if remaining > 0:
+                    self.broker.condition.wait(remaining)
+
+    def sleep(self, duration):
+        self.process_data_events(time_limit=duration)
+
+    def close(self, reply_code=200, reply_text='Normal shutdown'):
+        for channel in self._channels:
+            if not channel.is_closed:
+                channel.close()
+        self._closed = True
+        self._timers.clear()
+        self._timer_callbacks.clear()
+        self.broker.delete_owned_queues(self)
+        self.broker.notify()
+
+
+def create_blocking_connection(amqp_url=None):
+    """
+    Opens a blocking connection to the broker of the url (AMQP_URL by default). A memory:// url
+    returns a connection to the in-process broker.
+    """
+    if amqp_url is None:
+        amqp_url = mq_broker_url
+    if is_memory_url(amqp_url):
+        return MemoryConnection()
+    return pika.BlockingConnection(pika.URLParameters(amqp_url))
+
+
 class MqInterface(object):
     """ Wrapper class for interfacing with the message broker."""
 
-    def __init__(self):
+    def __init__(self, amqp_url=None):
         """
         The lorawan_parameters for the connection with the RMQ Broker must be in an
-        environment variable *AMQP_URL*.
+        environment variable *AMQP_URL* (unless amqp_url is given). A memory:// url uses the
+        in-process broker.
         """
-        global mq_broker_url
-        global params
-        self.amqp_url = mq_broker_url
-        self._connection = pika.BlockingConnection(params)
+        self.amqp_url = amqp_url if amqp_url is not None else mq_broker_url
+        self._connection = create_blocking_connection(self.amqp_url)
         self._channel = self.connection.channel()
         self._knownQueues = []
         self._knownExchanges = []
+        mq_metrics.start_exporters(amqp_url=self.amqp_url)
 
     @property
     def connection(self):
         if not (self._connection and self._connection.is_open):
-            self._connection = pika.BlockingConnection(params)
+            self._connection = create_blocking_connection(self.amqp_url)
         return self._connection
 
     @property
@@ -80,6 +670,8 @@ class MqInterface(object):
                                                   auto_delete=auto_delete, durable=durable)
         if queue_name not in self._knownQueues:
             self._knownQueues.append(queue_name)
+        mq_metrics.registry.register_queue(queue_result.method.queue, exclusive=exclusive,
+                                           depth=queue_result.method.message_count)
         return queue_result
 
     def bind_queue(self, queue_name, routing_key, exchange_name=DEFAULT_EXCHANGE):
@@ -88,7 +680,14 @@ class MqInterface(object):
                                 routing_key=routing_key)
 
     def create_consumer(self, callback, queue_name, tag="", auto_ack=True):
-        return self.channel.basic_consume(consumer_callback=callback,
+        def instrumented_callback(ch, method, properties, body):
+            start_time = time.monotonic()
+            try:
+                return callback(ch, method, properties, body)
+            finally:
+                mq_metrics.registry.record_consume(queue_name, body, time.monotonic() - start_time)
+
+        return self.channel.basic_consume(consumer_callback=instrumented_callback,
                                           queue=queue_name,
                                           no_ack=auto_ack,
                                           consumer_tag=tag)
@@ -105,10 +704,57 @@ class MqInterface(object):
                                             auto_ack=auto_ack)
         return queue_result, consumer_tag
 
-    def publish(self, msg, routing_key, exchange_name=DEFAULT_EXCHANGE):
+    def declare_and_consume_many(self, queue_name, callbacks, exclusive=True, auto_delete=False,
+                                 auto_ack=True, durable=True):
+        """
+        Declares a single queue bound with several routing keys and consumes from it, dispatching
+        each message locally to the callbacks of the matching routing keys. It replaces one queue
+        (and consumer) per routing key.
+        :param queue_name: name of the queue.
+        :param callbacks: dict {routing_key: callback}, the binding keys may use '#' and '*'.
+        :return: queue result and consumer tag.
+        """
+        matcher = RoutingKeyMatcher()
+        queue_result = self.declare_queue(
+            queue_name, exclusive=exclusive, auto_delete=auto_delete, durable=durable)
+        for routing_key, callback in callbacks.items():
+            self.bind_queue(exchange_name=DEFAULT_EXCHANGE,
+                            queue_name=queue_name,
+                            routing_key=routing_key)
+            matcher.add(routing_key, callback)
+
+        def dispatch(ch, method, properties, body):
+            for matching_callback in matcher.match(method.routing_key):
+                matching_callback(ch, method, properties, body)
+
+        consumer_tag = self.create_consumer(callback=dispatch,
+                                            queue_name=queue_name,
+                                            auto_ack=auto_ack)
+        return queue_result, consumer_tag
+
+    def publish(self, msg, routing_key, exchange_name=DEFAULT_EXCHANGE, properties=None):
+        mq_metrics.registry.record_publish(routing_key, msg)
         self.channel.basic_publish(exchange=exchange_name,
                                    routing_key=routing_key,
-                                   body=msg)
+                                   body=msg,
+                                   properties=properties)
+
+    def add_timeout(self, seconds, callback):
+        """
+        Adds a timer to the connection, the callback is called by the consumer loop (in the thread of the
+        connection) when it expires.
+        :param seconds: time until the callback is called.
+        :param callback: function called without arguments.
+        :return: id of the timer, to be used with remove_timeout.
+        """
+        return self.connection.add_timeout(seconds, callback)
+
+    def remove_timeout(self, timer_id):
+        self.connection.remove_timeout(timer_id)
+
+    def monotonic_time(self):
+        """ Clock used to measure the duration of the test steps (in seconds)."""
+        return time.monotonic()
 
     def consume_start(self):
         """
@@ -135,6 +781,8 @@ class QueueSelectConsumer:
 
     """
     RECONNECT_TIMEOUT_IN_SECS = 10
+    # Messages delivered without being acknowledged (None: the messages are acknowledged when delivered).
+    prefetch_count = None
 
     def __init__(self, amqp_url):
         """Create a new instance of the consumer class, passing in the AMQP
@@ -410,9 +1058,31 @@ class QueueSelectConsumer:
         starting the IOLoop to block and allow the SelectConnection to operate.
 
         """
+        if is_memory_url(self._url):
+            self.run_in_memory()
+            return
         self._connection = self.connect()
         self._connection.ioloop.start()
 
+    def run_in_memory(self):
+        """Sets up the queue in the in-process broker and consumes from it until stop() is
+        called (memory:// url).
+
+        """
+        self._connection = MemoryConnection()
+        self._channel = self._connection.channel()
+        self._channel.queue_declare(queue=self.queue, durable=self.queue_durable,
+                                    exclusive=self.queue_exclusive,
+                                    auto_delete=self.queue_auto_delete)
+        self._channel.queue_bind(queue=self.queue, exchange=self.exchange,
+                                 routing_key=self.routing_key)
+        if self.prefetch_count:
+            self._channel.basic_qos(prefetch_count=self.prefetch_count)
+        self._consumer_tag = self._channel.basic_consume(consumer_callback=self.on_message,
+                                                         queue=self.queue,
+                                                         no_ack=not self.prefetch_count)
+        self._channel.start_consuming()
+
     def stop(self):
         """Cleanly shutdown the connection to RabbitMQ by stopping the consumer
         with RabbitMQ. When RabbitMQ confirms the cancellation, on_cancelok
@@ -426,6 +1096,9 @@ class QueueSelectConsumer:
         """
         logger.debug('Stopping')
         self._closing = True
+        if isinstance(self._connection, MemoryConnection):
+            self._connection.close()
+            return
         self.stop_consuming()
         self._connection.ioloop.start()
         logger.debug('Stopped')
@@ -467,19 +1140,23 @@ class QueueSelectSender(object):
                 time.sleep(1)
 
     def connect(self):
-        self.connection = pika.BlockingConnection(pika.URLParameters(self._broker))
+        self.connection = create_blocking_connection(self._broker)
         self.channel = self.connection.channel()
         self.channel.exchange_declare(exchange=self._exchange,
                                       exchange_type=self._exchange_type, durable=True)
 
-    def send(self, data, should_reconnect=True, routing_key=None):
+    def send(self, data, should_reconnect=True, routing_key=None, content_type=None):
+        if routing_key is None:
+            routing_key = self._routing_key
         try:
+            mq_metrics.registry.record_publish(routing_key, data)
             self.channel.basic_publish(
                 exchange=self._exchange,
-                routing_key=routing_key if routing_key is not None else self._routing_key,
+                routing_key=routing_key,
                 body=data,
                 properties=pika.BasicProperties(
                     delivery_mode=2,  # make message persistent
+                    content_type=content_type
                 )
             )
         except Exception as e:
@@ -487,16 +1164,26 @@ class QueueSelectSender(object):
             if should_reconnect:
                 logger.error("Trying to reconnect to broker")
                 self.connect()
-                self.send(data, should_reconnect=False, routing_key=routing_key)
+                self.send(data, should_reconnect=False, routing_key=routing_key,
+                          content_type=content_type)
             else:
                 raise e
 
 
 class MqSelectConnectionInterface(QueueSelectConsumer):
     def __init__(self, queue_name, routing_key, on_message_callback, queue_durable=True,
-                 queue_exclusive=False, queue_auto_delete=False):
+                 queue_exclusive=False, queue_auto_delete=False, raw_body=False, prefetch_count=None):
+        """
+        :param on_message_callback: called with the decoded body (body_str) of each message or, if
+        raw_body is True, with the body bytes and the properties of the message (body, properties).
+        :param prefetch_count: if given, at most prefetch_count messages are delivered without being acknowledged
+        and the callback also receives the function (ack) that acknowledges the message, that can be called from
+        any thread.
+        """
         self.amqp_url = mq_broker_url
         super().__init__(amqp_url=self.amqp_url)
+        mq_metrics.start_exporters(amqp_url=self.amqp_url)
+        mq_metrics.registry.register_queue(queue_name, exclusive=queue_exclusive)
 
         self.exchange = DEFAULT_EXCHANGE
         self.exchange_type = "topic"
@@ -506,11 +1193,39 @@ class MqSelectConnectionInterface(QueueSelectConsumer):
         self.queue_auto_delete = queue_auto_delete
         self.routing_key = routing_key
         self.on_message_callback = on_message_callback
+        self.raw_body = raw_body
+        self.prefetch_count = prefetch_count
+
+    def start_consuming(self):
+        if self.prefetch_count:
+            self._channel.basic_qos(prefetch_count=self.prefetch_count)
+        super().start_consuming()
+
+    def acknowledge_threadsafe(self, channel, delivery_tag):
+        """ Acknowledges a message from any thread (ignored if the channel was closed since its delivery)."""
+        def acknowledge():
+            if channel is self._channel and channel.is_open:
+                self.acknowledge_message(delivery_tag)
+        if isinstance(self._connection, MemoryConnection):
+            self._connection.add_callback_threadsafe(acknowledge)
+        else:
+            self._connection.ioloop.add_callback_threadsafe(acknowledge)
 
     def on_message(self, channel, basic_deliver, properties, body):
-        body_str = body.decode()
-        logger.info(f"Message received {body_str}.")
-        self.on_message_callback(body_str=body_str)
+        start_time = time.monotonic()
+        kwargs = {}
+        if self.prefetch_count:
+            kwargs["ack"] = functools.partial(self.acknowledge_threadsafe, channel, basic_deliver.delivery_tag)
+        try:
+            if self.raw_body:
+                logger.info(f"Message received ({len(body)} bytes).")
+                self.on_message_callback(body=body, properties=properties, **kwargs)
+                return
+            body_str = body.decode()
+            logger.info(f"Message received {body_str}.")
+            self.on_message_callback(body_str=body_str, **kwargs)
+        finally:
+            mq_metrics.registry.record_consume(self.queue, body, time.monotonic() - start_time)
 
     def consume_start(self):
         """
@@ -0,0 +1,286 @@
+"""
+This module keeps the throughput and lag metrics of the message broker interfaces (published and consumed
+messages and bytes, handler latency and queue depth) and exports them on a local HTTP endpoint and
+periodically on the broker.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import os
+import sys
+import json
+import time
+import threading
+import logging
+import http.server
+
+logger = logging.getLogger(__name__)
+
+METRICS_ROUTING_KEY_PREFIX = 'metrics'
+# Local HTTP endpoint (disabled if not defined).
+METRICS_PORT = os.environ.get('MQ_METRICS_PORT')
+# Period of the metrics reports published on metrics.<service> (disabled if not defined or 0).
+METRICS_INTERVAL = float(os.environ.get('MQ_METRICS_INTERVAL', 0))
+METRICS_SERVICE = os.environ.get('MQ_METRICS_SERVICE')
+
+
+def body_size(body):
+    """ Size in bytes of a message body (the str bodies are published utf-8 encoded)."""
+    if isinstance(body, str):
+        return len(body.encode())
+    return len(body)
+
+
+class MetricsRegistry(object):
+    """
+    Thread safe in-process registry of the broker metrics. Publications are indexed by routing key and
+    consumptions by queue.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._published = dict()
+        self._consumed = dict()
+        self._queues = dict()
+        self.start_time = time.time()
+
+    def record_publish(self, routing_key, body):
+        """
+        Registers a published message.
+        :param routing_key: routing key of the message.
+        :param body: body of the message (bytes or str).
+        """
+        size = body_size(body)
+        with self._lock:
+            stats = self._published.get(routing_key)
+            if stats is None:
+                stats = self._published[routing_key] = {"messages": 0, "bytes": 0}
+            stats["messages"] += 1
+            stats["bytes"] += size
+
+    def record_consume(self, queue_name, body, handler_seconds):
+        """
+        Registers a consumed message.
+        :param queue_name: queue the message was consumed from.
+        :param body: body of the message (bytes or str).
+        :param handler_seconds: time spent in the message handler.
+        """
+        size = body_size(body)
+        with self._lock:
+            stats = self._consumed.get(queue_name)
+            if stats is None:
+                stats = self._consumed[queue_name] = {"messages": 0,
+                                                      "bytes": 0,
+                                                      "handler_seconds_total": 0.0,
+                                                      "handler_seconds_max": 0.0}
+            stats["messages"] += 1
+            stats["bytes"] += size
+            stats["handler_seconds_total"] += handler_seconds
+            stats["handler_seconds_max"] = max(stats["handler_seconds_max"], handler_seconds)
+
+    def register_queue(self, queue_name, exclusive=False, depth=None):
+        """
+        Registers a queue declared by the service. The depth of the non exclusive queues is polled by the
+        metrics reporter.
+        """
+        with self._lock:
+            queue_info = self._queues.setdefault(queue_name, {"exclusive": exclusive, "depth": None})
+            queue_info["exclusive"] = exclusive
+            if depth is not None:
+                queue_info["depth"] = depth
+
+    def set_queue_depth(self, queue_name, depth):
+        with self._lock:
+            if queue_name in self._queues:
+                self._queues[queue_name]["depth"] = depth
+
+    def pollable_queues(self):
+        """ Returns the names of the queues whose depth can be polled from another connection."""
+        with self._lock:
+            return [name for name, queue_info in self._queues.items() if not queue_info["exclusive"]]
+
+    def snapshot(self):
+        """ Returns a copy of the metrics (dict)."""
+        with self._lock:
+            return {
+                "uptime_seconds": time.time() - self.start_time,
+                "published": {key: dict(stats) for key, stats in self._published.items()},
+                "consumed": {key: dict(stats) for key, stats in self._consumed.items()},
+                "queue_depth": {name: queue_info["depth"] for name, queue_info in self._queues.items()
+                                if queue_info["depth"] is not None}
+            }
+
+    def to_prometheus_text(self):
+        """ Returns the metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+
+        def add_metric(name, metric_type, label, samples):
+            lines.append(f"# TYPE {name} {metric_type}")
+            for label_value, value in sorted(samples.items()):
+                lines.append(f'{name}{{{label}="{label_value}"}} {value}')
+
+        add_metric("mq_published_messages_total", "counter", "routing_key",
+                   {key: stats["messages"] for key, stats in snapshot["published"].items()})
+        add_metric("mq_published_bytes_total", "counter", "routing_key",
+                   {key: stats["bytes"] for key, stats in snapshot["published"].items()})
+        add_metric("mq_consumed_messages_total", "counter", "queue",
+                   {key: stats["messages"] for key, stats in snapshot["consumed"].items()})
+        add_metric("mq_consumed_bytes_total", "counter", "queue",
+                   {key: stats["bytes"] for key, stats in snapshot["consumed"].items()})
+        add_metric("mq_handler_seconds_total", "counter", "queue",
+                   {key: stats["handler_seconds_total"] for key, stats in snapshot["consumed"].items()})
+        add_metric("mq_handler_seconds_max", "gauge", "queue",
+                   {key: stats["handler_seconds_max"] for key, stats in snapshot["consumed"].items()})
+        add_metric("mq_queue_depth", "gauge", "queue", snapshot["queue_depth"])
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._published.clear()
+            self._consumed.clear()
+            self._queues.clear()
+            self.start_time = time.time()
+
+
+registry = MetricsRegistry()
+
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    """ Serves the registry: /metrics (Prometheus text format) and /metrics.json."""
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = registry.to_prometheus_text().encode()
+            content_type = 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body = json.dumps(registry.snapshot(), sort_keys=True).encode()
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def start_http_server(port, host='127.0.0.1'):
+    """
+    Starts the local HTTP metrics endpoint in a daemon thread.
+    :return: the HTTP server.
+    """
+    server = http.server.HTTPServer((host, int(port)), MetricsRequestHandler)
+    server_thread = threading.Thread(target=server.serve_forever, name='mq_metrics_http', daemon=True)
+    server_thread.start()
+    logger.info(f"Broker metrics available on http://{host}:{server.server_port}/metrics")
+    return server
+
+
+class MetricsReporter(threading.Thread):
+    """
+    Daemon thread that polls the depth of the non exclusive queues declared by the service and publishes the
+    metrics on the metrics.<service> routing key. It uses its own broker connection (the blocking connections
+    of the services can't be shared between threads).
+    """
+
+    def __init__(self, service_name, interval, amqp_url=None):
+        super().__init__(name='mq_metrics_reporter', daemon=True)
+        self.service_name = service_name
+        self.interval = interval
+        self.amqp_url = amqp_url
+        self.routing_key = f"{METRICS_ROUTING_KEY_PREFIX}.{service_name}"
+        self._stop_event = threading.Event()
+        self._connection = None
+        self._channel = None
+
+    def _get_channel(self):
+        import message_queueing
+        if self._connection is None or self._connection.is_closed:
+            self._connection = message_queueing.create_blocking_connection(self.amqp_url)
+            self._channel = None
+        if self._channel is None or self._channel.is_closed:
+            self._channel = self._connection.channel()
+        return self._channel
+
+    def poll_queue_depths(self):
+        for queue_name in registry.pollable_queues():
+            try:
+                queue_result = self._get_channel().queue_declare(queue=queue_name, passive=True)
+                registry.set_queue_depth(queue_name, queue_result.method.message_count)
+            except Exception as error:
+                # The queue may have been deleted (e.g. auto delete queues), the channel is closed by the broker.
+                logger.debug(f"Unable to get the depth of {queue_name}: {error}")
+                self._channel = None
+
+    def report(self):
+        """ Polls the queue depths and publishes the metrics."""
+        import message_queueing
+        self.poll_queue_depths()
+        body = json.dumps({"service": self.service_name, "metrics": registry.snapshot()}, sort_keys=True)
+        self._get_channel().basic_publish(exchange=message_queueing.DEFAULT_EXCHANGE,
+                                          routing_key=self.routing_key,
+                                          body=body)
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.report()
+            except Exception as error:
+                logger.warning(f"Unable to report the broker metrics: {error}")
+                self._connection = None
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_exporters_lock = threading.Lock()
+_exporters_started = False
+
+
+def start_exporters(service_name=None, amqp_url=None):
+    """
+    Starts the HTTP endpoint (MQ_METRICS_PORT) and the periodic reporter (MQ_METRICS_INTERVAL) if they are
+    configured. It's called by every MqInterface, only the first call has effect.
+    :param service_name: name used in the metrics routing key (MQ_METRICS_SERVICE or the script name by default).
+    :param amqp_url: broker url used by the reporter.
+    """
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+    if service_name is None:
+        service_name = METRICS_SERVICE or os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0]
+    if METRICS_PORT:
+        try:
+            start_http_server(port=METRICS_PORT)
+        except OSError as error:
+            logger.warning(f"Unable to start the metrics endpoint on port {METRICS_PORT}: {error}")
+    if METRICS_INTERVAL > 0:
+        MetricsReporter(service_name=service_name, interval=METRICS_INTERVAL, amqp_url=amqp_url).start()
@@ -34,6 +34,8 @@ RoutingKeys = collections.namedtuple("RoutingKeys", '''
                                      up_tas,
                                      toAgent,
                                      fromSchedulerToAgent,
+                                     toSchedulerDownlinkQueue,
+                                     toSchedulerRegistry,
                                      config_tas,
                                      testing_ready,
                                      testing_configured,
@@ -44,7 +46,9 @@ RoutingKeys = collections.namedtuple("RoutingKeys", '''
                                      configuration_request,
                                      configuration_reply,
                                      command_configuration_reply,
-                                     command_ui_reply'''
+                                     command_ui_reply,
+                                     tas_workers,
+                                     session_info'''
                                      )
 
 
@@ -52,6 +56,8 @@ routing_keys = RoutingKeys(
     fromAgent="fromAgent",
     fromAgentToScheduler="fromAgentToScheduler",
     fromSchedulerToAgent="fromSchedulerToAgent",
+    toSchedulerDownlinkQueue="scheduler.downlink.queue",
+    toSchedulerRegistry="scheduler.registry",
     up_tas="up.tas",
     toAgent="toAgent",
     config_tas="config.tas",
@@ -64,7 +70,9 @@ routing_keys = RoutingKeys(
     configuration_request="ui.core.session.configuration.get.request",
     configuration_reply="ui.core.session.configuration.get.reply",
     command_configuration_reply="comm.config.reply",
-    command_ui_reply="comm.ui.reply"
+    command_ui_reply="comm.ui.reply",
+    tas_workers="tas.workers",
+    session_info="tas.session.info"
 )
 
 
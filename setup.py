@@ -41,7 +41,7 @@ setup(name=name,
       description=description,
       version=VERSION,
       packages=find_packages(),
-      py_modules=['utils', 'message_queueing', 'logger_configurator'],
+      py_modules=['utils', 'message_queueing', 'mq_metrics', 'logger_configurator'],
       include_package_data=True,
       install_requires=[
           'click==6.7',
@@ -64,6 +64,7 @@ setup(name=name,
               'cl_tas_config = lorawan.user_agent.messenger.cli_main:send_tas_config',
               'cl_tas_start = lorawan.user_agent.messenger.cli_main:send_start_signal',
               'cl_tas_device = lorawan.user_agent.messenger.cli_main:send_deviceid_to_tas',
+              'cl_tas_replay = conformance_testing.session_replay:replay_main',
           ]
       },
       )
@@ -31,26 +31,27 @@ import os
 
 import conformance_testing.test_errors as test_errors
 from conformance_testing import testingtool_services
+from conformance_testing import sharding
+from conformance_testing import test_registry
+from conformance_testing import session_capture
+from conformance_testing import results_store
 from user_interface.ui import ui_publisher
 import parameters.message_broker as message_broker
 import user_interface.ui_reports as ui_reports
 
-from lorawan.lorawan_conformance import test_names
-
 from logger_configurator import LoggerConfigurator
 
 LoggerConfigurator(level="INFO")
 logger = logging.getLogger(__name__)
 
 TAS_RESET_ATTEMPTS = int(os.environ.get('TAS_RESET_ATTEMPTS', 3))
+TAS_WORKERS = int(os.environ.get('TAS_WORKERS', 1))
+TAS_RANDOM_SEED = session_capture.random_seed_from_env()
+# Maximum time waiting for the pending GUI reports when the sessions end.
+REPORT_FLUSH_SECONDS = 10
 
-# Load all the modules of the available tests.
-test_modules = dict()
-for test_group in test_names.keys():
-    for name in test_names[test_group]:
-        test_modules[name] = __import__(
-            "lorawan.lorawan_conformance." + test_group + '.' + name, globals(), locals(),
-            ['object'])
+# Registry of the available tests, each module is imported when its test is run.
+test_modules = test_registry.TestRegistry()
 
 
 def display_agent_tutorial(session_coordinator):
@@ -80,6 +81,57 @@ def display_agent_tutorial(session_coordinator):
                                 key_prefix=message_broker.service_names.test_session_coordinator)
 
 
+def run_test_sessions(test_session_coordinator):
+    """
+    Runs the test sessions of the coordinator and adds the verdict to the result report of each device.
+    :param test_session_coordinator: session coordinator with the sessions of the devices already added.
+    :return: None
+    """
+    if test_session_coordinator.results is None:
+        test_session_coordinator.results = results_store.store_from_env(test_session_coordinator.session_id)
+    try:
+        test_session_coordinator.run_sessions(test_modules=test_modules, random_seed=TAS_RANDOM_SEED)
+    ########################################################################
+    # Catch Level 2 Errors
+    ########################################################################
+    except test_errors.SessionTerminatedError as session_terminated:
+        for device_session in test_session_coordinator.sessions.values():
+            if not device_session.finished:
+                test_session_coordinator.handle_error(raised_exception=session_terminated,
+                                                      test_name=device_session.current_test_name,
+                                                      result_report=device_session.result_report)
+    finally:
+        test_session_coordinator.consume_stop()
+        for device_session in test_session_coordinator.sessions.values():
+            device_session.add_verdict()
+        if test_session_coordinator.results is not None:
+            test_session_coordinator.results.close()
+        ui_publisher.flush_reports(timeout=REPORT_FLUSH_SECONDS)
+        logger.info(f"Import time of the test modules:\n{test_modules.import_report()}")
+
+
+def testing_worker_main(worker_id, device_ids, requested_tests):
+    """
+    Entry point of a worker of the supervisor mode (TAS_WORKERS > 1): runs the tests of its devices and sends
+    the results to the supervisor.
+    :param worker_id: id of the worker.
+    :param device_ids: list of DeviceID of the devices assigned to the worker.
+    :param requested_tests: list of the names of the tests to be run.
+    :return: None
+    """
+    test_session_coordinator = testingtool_services.TestSessionCoordinator(
+        reset_attemps=TAS_RESET_ATTEMPTS, worker_id=worker_id)
+    for device_id in device_ids:
+        test_session_coordinator.add_device_session(device_id=device_id, requested_tests=requested_tests,
+                                                    planner=test_session_coordinator.planner)
+    try:
+        run_test_sessions(test_session_coordinator)
+    finally:
+        test_session_coordinator.publish_results()
+        test_session_coordinator.channel.close()
+        test_session_coordinator.testingtool_on = False
+
+
 def testing_app_main():
     test_session_coordinator = testingtool_services.TestSessionCoordinator(
         reset_attemps=TAS_RESET_ATTEMPTS)
@@ -90,70 +142,23 @@ def testing_app_main():
     # << End agent instructions: -----------------------------------------------------------------
     test_session_coordinator.ask_configuration_register_device()
     test_session_coordinator.wait_press_start()
-    result_report = ui_reports.InputFormBody(title="Results summary of the tests.",
-                                             tag_key="Test",
-                                             tag_value="Results")
+    result_reports = [device_session.result_report
+                      for device_session in test_session_coordinator.sessions.values()]
     try:
-        # for test_name in test_session_coordinator.requested_tests:
-        while test_session_coordinator.test_available():
-            try:
-                try:
-                    test_name = test_session_coordinator.pop_next_test_name()
-                    if test_name is None:
-                        break
-                    test_module = test_modules[test_name]
-                except KeyError:
-                    raise test_errors.UnknownTestError(test_name)
-                logger.debug(f"Selected test: {test_name}")
-
-                test_session_coordinator.current_test = test_module.TestAppManager(
-                    test_session_coordinator)
-                logger.debug(f"Test manager loaded: {test_name}")
-                test_session_coordinator.start_testing()
-            ########################################################################
-            # Catch Level 3 Errors
-            ########################################################################
-            except test_errors.TimeOutError as timeout_exception:
-                test_session_coordinator.handle_error(raised_exception=timeout_exception,
-                                                      test_name=test_name,
-                                                      result_report=result_report)
-
-            ########################################################################
-            # Catch Level 2 Errors
-            ########################################################################
-            except test_errors.TestFailError as test_fail_exception:
-                test_session_coordinator.handle_error(raised_exception=test_fail_exception,
-                                                      test_name=test_name,
-                                                      result_report=result_report)
-
-            except test_errors.UnknownTestError as unknown_test:
-                test_session_coordinator.handle_error(raised_exception=unknown_test,
-                                                      test_name=test_name,
-                                                      result_report=result_report)
-
-            except test_errors.SessionTerminatedError as session_terminated:
-                test_session_coordinator.handle_error(raised_exception=session_terminated,
-                                                      test_name=test_name,
-                                                      result_report=result_report)
-
-                break
-            else:
-                result_report.add_field(ui_reports.ParagraphField(name=test_name, value="PASS"))
-            finally:
-                test_session_coordinator.consume_stop()
-
+        if TAS_WORKERS > 1 and len(test_session_coordinator.device_ids) > 1:
+            supervisor = sharding.ShardSupervisor(worker_count=TAS_WORKERS, worker_target=testing_worker_main)
+            result_reports = [supervisor.run(device_ids=test_session_coordinator.device_ids,
+                                             requested_tests=test_session_coordinator.requested_tests)]
+            supervisor.channel.close()
+        else:
+            run_test_sessions(test_session_coordinator)
     finally:
-        test_session_coordinator.consume_stop()
         test_session_coordinator.channel.close()
-        if not result_report.level == ui_reports.LEVEL_ERR:
-            result_report.level = ui_reports.LEVEL_HL
-            result_report.add_field(ui_reports.ParagraphField(name="TEST VERDICT: PASS", value=" "))
-        else:
-            result_report.add_field(ui_reports.ParagraphField(name="TEST VERDICT: FAIL", value=" "))
-
-        ui_publisher.display_on_gui(
-            msg_str=str(result_report),
-            key_prefix=message_broker.service_names.test_session_coordinator)
+        for result_report in result_reports:
+            ui_publisher.display_on_gui(
+                msg_str=str(result_report),
+                key_prefix=message_broker.service_names.test_session_coordinator)
+        ui_publisher.flush_reports(timeout=REPORT_FLUSH_SECONDS)
         test_session_coordinator.testingtool_on = False
 
 
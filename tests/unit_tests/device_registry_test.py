@@ -0,0 +1,110 @@
+"""
+Automated testing of the registry of the devices of the downlink scheduler.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import json
+import sqlite3
+import pytest
+from downlink_scheduler_tool import device_registry
+
+APPKEY = "75E3205B17A819F9724B22EE2CA36CF1"
+DEVICES = {"70b3d52c70104be2": {"appeui": "70b3d52c70100137", "appkey": APPKEY, "command": "01"},
+           "0000000000000002": {"appeui": "70B3D52C70100137", "appkey": APPKEY, "devaddr": "26000002"}}
+
+
+def write_devices(path, devices):
+    if path.suffix == ".json":
+        path.write_text(json.dumps(devices))
+        return
+    columns = ("deveui", "appeui", "appkey", "command", "devaddr")
+    rows = [[deveui] + [device.get(column, "") for column in columns[1:]] for deveui, device in devices.items()]
+    if path.suffix == ".csv":
+        path.write_text("\n".join(",".join(row) for row in [list(columns)] + rows) + "\n")
+        return
+    connection = sqlite3.connect(str(path))
+    with connection:
+        connection.execute(f"DROP TABLE IF EXISTS {device_registry.SQLITE_TABLE};")
+        connection.execute(f"CREATE TABLE {device_registry.SQLITE_TABLE} ({', '.join(columns)});")
+        connection.executemany(f"INSERT INTO {device_registry.SQLITE_TABLE} VALUES (?, ?, ?, ?, ?);", rows)
+    connection.close()
+
+
+class TestDeviceRegistry(object):
+    """
+    Tests of the device_registry.DeviceRegistry.
+    """
+
+    @pytest.mark.parametrize("file_name", ("devices.json", "devices.csv", "devices.db"))
+    def test_load_file(self, tmp_path, file_name):
+        path = tmp_path / file_name
+        write_devices(path, DEVICES)
+        registry = device_registry.DeviceRegistry(path=str(path))
+        assert len(registry) == 2
+        assert registry.get("70B3D52C70104BE2") == {"appeui": "70B3D52C70100137", "appkey": APPKEY,
+                                                    "command": "01"}
+        assert registry.devices_of_appeui("70B3D52C70100137") == {"70B3D52C70104BE2", "0000000000000002"}
+        assert registry.find_by_devaddr("26000002") == "0000000000000002"
+
+    def test_incremental_reload(self, tmp_path):
+        path = tmp_path / "devices.json"
+        write_devices(path, DEVICES)
+        registry = device_registry.DeviceRegistry(path=str(path))
+        registry.handle_request({"action": "add", "devices": [{"deveui": "0000000000000003", "appkey": APPKEY}]})
+        assert not registry.reload_if_modified()
+
+        write_devices(path, {"70B3D52C70104BE2": dict(DEVICES["70b3d52c70104be2"], command="02")})
+        assert registry.reload() == (1, 1)
+        assert registry.get("70B3D52C70104BE2")["command"] == "02"
+        assert "0000000000000002" not in registry
+        assert registry.find_by_devaddr("26000002") is None
+        assert "0000000000000003" in registry
+
+    def test_remove_request(self):
+        registry = device_registry.DeviceRegistry(devices=DEVICES)
+        assert registry.handle_request(json.dumps({"action": "remove",
+                                                   "deveuis": ["70b3d52c70104be2", "0000000000000009"]})) == 1
+        assert registry.devices_of_appeui("70B3D52C70100137") == {"0000000000000002"}
+        with pytest.raises(ValueError):
+            registry.handle_request({"action": "rename"})
+
+    def test_is_registered(self):
+        registry = device_registry.DeviceRegistry(devices=dict(DEVICES, **{"0000000000000003": {"appkey": APPKEY}}))
+        assert registry.is_registered("70B3D52C70104BE2")
+        assert registry.is_registered("70B3D52C70104BE2", appeui="70B3D52C70100137")
+        assert not registry.is_registered("70B3D52C70104BE2", appeui="0000000000000000")
+        assert registry.is_registered("0000000000000003", appeui="0000000000000000")
+        assert not registry.is_registered("0000000000000009")
+
+    def test_removal_callback(self, tmp_path):
+        path = tmp_path / "devices.json"
+        write_devices(path, DEVICES)
+        registry = device_registry.DeviceRegistry(path=str(path))
+        removed = []
+        registry.add_removal_callback(removed.append)
+        registry.handle_request({"action": "remove", "deveuis": ["70b3d52c70104be2", "0000000000000009"]})
+        write_devices(path, {})
+        registry.reload()
+        assert removed == ["70B3D52C70104BE2", "0000000000000002"]
@@ -0,0 +1,151 @@
+"""
+Automated testing of the sessions cache of the downlink scheduler (write-behind to a SQLite database).
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import sqlite3
+import time
+from downlink_scheduler_tool import device_registry, devices_sessions
+
+APPKEY = "75E3205B17A819F9724B22EE2CA36CF1"
+DEVEUI = "70B3D52C70104BE2"
+DLSETTINGS = b'\x00'
+RXDELAY = b'\x01'
+
+
+def stored_sessions(path):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute("SELECT dev_eui_hex, dev_addr_hex, fcnt_down FROM device_session_config;").fetchall()
+    finally:
+        connection.close()
+
+
+def wait_stored(path, expected, timeout=5):
+    deadline = time.monotonic() + timeout
+    while stored_sessions(path) != expected and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return stored_sessions(path)
+
+
+class TestDevicesSessionHandler(object):
+    """
+    Tests of the devices_sessions.DevicesSessionHandler cache of the sessions.
+    """
+
+    def create_handler(self, path, **kwargs):
+        kwargs.setdefault("flush_interval", 3600)
+        kwargs.setdefault("flush_batch_size", 100)
+        registry = device_registry.DeviceRegistry(devices={DEVEUI: {"appkey": APPKEY}})
+        return devices_sessions.DevicesSessionHandler({"path": path}, registry=registry, **kwargs)
+
+    def join(self, handler, devnonce):
+        handler.process_otta_join(DEVEUI, devnonce, DLSETTINGS, RXDELAY, b'')
+        return handler.query_dev_eui_hex(DEVEUI)
+
+    def test_rejoin_reindexed(self, tmp_path):
+        handler = self.create_handler(str(tmp_path / "sessions.db"))
+        dev_session = self.join(handler, b'\x00\x01')
+        first_dev_addr_hex = dev_session.dev_addr_hex
+        assert handler.get_dev_eui_hex(first_dev_addr_hex) == DEVEUI
+
+        assert self.join(handler, b'\x00\x02') is dev_session
+        assert dev_session.dev_addr_hex != first_dev_addr_hex
+        assert handler.query_dev_addr_hex(dev_session.dev_addr_hex) is dev_session
+        assert handler.query_dev_addr_hex(first_dev_addr_hex) is None
+
+    def test_reprovisioned_appkey(self, tmp_path):
+        path = str(tmp_path / "sessions.db")
+        handler = self.create_handler(path)
+        dev_session = self.join(handler, b'\x00\x01')
+        old_builder = dev_session.get_join_accept_builder()
+
+        handler.registry.add(DEVEUI, {"appkey": "11" * 16})
+        assert self.join(handler, b'\x00\x02') is dev_session
+        assert dev_session.appkey_hex == "11" * 16
+        assert dev_session.get_join_accept_builder() is not old_builder
+        handler.flush()
+        connection = sqlite3.connect(path)
+        assert connection.execute("SELECT appkey_hex FROM device_session_config;").fetchall() == [("11" * 16,)]
+        connection.close()
+
+    def test_batch_flush(self, tmp_path):
+        path = str(tmp_path / "sessions.db")
+        handler = self.create_handler(path, flush_batch_size=3)
+        dev_session = self.join(handler, b'\x00\x01')
+        handler.prepare_lorawan_data(DEVEUI, b'\x01')
+        assert stored_sessions(path) == []
+
+        handler.prepare_lorawan_data(DEVEUI, b'\x01')
+        assert wait_stored(path, [(DEVEUI, dev_session.dev_addr_hex, 2)]) == [(DEVEUI, dev_session.dev_addr_hex, 2)]
+
+    def test_interval_flush(self, tmp_path):
+        path = str(tmp_path / "sessions.db")
+        handler = self.create_handler(path, flush_interval=0.05)
+        dev_session = self.join(handler, b'\x00\x01')
+        expected = [(DEVEUI, dev_session.dev_addr_hex, 0)]
+        assert wait_stored(path, expected) == expected
+
+    def test_fcnt_down_advanced_on_load(self, tmp_path):
+        path = str(tmp_path / "sessions.db")
+        handler = self.create_handler(path, flush_batch_size=10)
+        dev_session = self.join(handler, b'\x00\x01')
+        for _ in range(3):
+            handler.prepare_lorawan_data(DEVEUI, b'\x01')
+        handler.flush()
+
+        reloaded = self.create_handler(path, flush_batch_size=10).query_dev_addr_hex(dev_session.dev_addr_hex)
+        assert reloaded.dev_eui_hex == DEVEUI
+        assert reloaded.fcnt_down == 13
+        assert stored_sessions(path) == [(DEVEUI, dev_session.dev_addr_hex, 13)]
+
+    def test_failed_flush_reloads(self, tmp_path):
+        path = str(tmp_path / "sessions.db")
+        handler = self.create_handler(path, flush_batch_size=10)
+        self.join(handler, b'\x00\x01')
+        # The session created by the join can't be inserted.
+        connection = sqlite3.connect(path)
+        connection.execute("INSERT INTO device_session_config (dev_eui_hex, appkey_hex, dev_addr_hex, fcnt_down) "
+                           f"VALUES ('{DEVEUI}', '{APPKEY}', '26000001', 5);")
+        connection.commit()
+        connection.close()
+
+        handler.flush()
+        dev_session = handler.query_dev_eui_hex(DEVEUI)
+        assert dev_session.dev_addr_hex == "26000001"
+        assert dev_session.fcnt_down == 15
+        assert handler.query_dev_addr_hex("26000001") is dev_session
+        assert stored_sessions(path) == [(DEVEUI, "26000001", 15)]
+
+    def test_remove_session(self, tmp_path):
+        path = str(tmp_path / "sessions.db")
+        handler = self.create_handler(path)
+        dev_addr_hex = self.join(handler, b'\x00\x01').dev_addr_hex
+        handler.flush()
+
+        assert handler.remove_session(DEVEUI)
+        assert not handler.remove_session(DEVEUI)
+        assert handler.get_dev_eui_hex(dev_addr_hex) is None
+        assert stored_sessions(path) == []
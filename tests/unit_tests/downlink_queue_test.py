@@ -0,0 +1,92 @@
+"""
+Automated testing of the downlink queues of the downlink scheduler.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import base64
+import json
+import pytest
+from downlink_scheduler_tool import downlink_queue
+
+DEVEUI = "70B3D52C70104BE2"
+
+
+class TestDownlinkQueue(object):
+    """
+    Tests of the downlink_queue.DownlinkQueue.
+    """
+
+    def test_priority_order(self):
+        queue = downlink_queue.DownlinkQueue()
+        queue.enqueue(DEVEUI, downlink_queue.QueuedDownlink(b'u1'))
+        queue.enqueue(DEVEUI, downlink_queue.QueuedDownlink(b'c1', confirmed=True))
+        queue.enqueue(DEVEUI, downlink_queue.QueuedDownlink(b'u2'))
+        queue.enqueue(DEVEUI, downlink_queue.QueuedDownlink(b'\x02', fport=0))
+        popped = [queue.pop(DEVEUI) for _ in range(5)]
+        assert [(downlink.frmpayload if downlink else None, pending) for downlink, pending in popped] == \
+               [(b'\x02', True), (b'c1', True), (b'u1', True), (b'u2', False), (None, False)]
+        assert queue.devices() == 0
+
+    def test_expired_discarded(self):
+        queue = downlink_queue.DownlinkQueue()
+        queue.enqueue(DEVEUI, downlink_queue.QueuedDownlink(b'old', expires=10))
+        queue.enqueue(DEVEUI, downlink_queue.QueuedDownlink(b'new', expires=100))
+        queue.enqueue(DEVEUI, downlink_queue.QueuedDownlink(b'late', priority=downlink_queue.PRIORITY_MAC,
+                                                            expires=15))
+        downlink, pending = queue.pop(DEVEUI, now=20)
+        assert (downlink.frmpayload, pending) == (b'new', False)
+        assert queue.expired == 2
+        assert len(queue) == 0
+
+    def test_device_limit(self):
+        queue = downlink_queue.DownlinkQueue(max_per_device=2)
+        assert queue.enqueue(DEVEUI, downlink_queue.QueuedDownlink(b'1'))
+        assert queue.enqueue(DEVEUI, downlink_queue.QueuedDownlink(b'2'))
+        assert not queue.enqueue(DEVEUI, downlink_queue.QueuedDownlink(b'3'))
+        assert queue.enqueue("0000000000000001", downlink_queue.QueuedDownlink(b'3'))
+        assert (len(queue), queue.devices()) == (3, 2)
+
+    def test_requeue(self):
+        queue = downlink_queue.DownlinkQueue()
+        queue.enqueue(DEVEUI, downlink_queue.QueuedDownlink(b'u1'))
+        queue.enqueue(DEVEUI, downlink_queue.QueuedDownlink(b'u2'))
+        downlink, _ = queue.pop(DEVEUI)
+        queue.requeue(DEVEUI, downlink)
+        queue.requeue(DEVEUI, downlink_queue.QueuedDownlink(b'old', expires=0))
+        assert [queue.pop(DEVEUI)[0].frmpayload for _ in range(2)] == [b'u1', b'u2']
+        assert queue.devices() == 0
+
+    @pytest.mark.parametrize("request_fields, expected", (
+        ({}, (1, False, downlink_queue.PRIORITY_UNCONFIRMED, None)),
+        ({"fport": 0}, (0, False, downlink_queue.PRIORITY_MAC, None)),
+        ({"confirmed": True, "ttl": 5}, (1, True, downlink_queue.PRIORITY_CONFIRMED, 105)),
+        ({"priority": "mac", "fport": 2}, (2, False, downlink_queue.PRIORITY_MAC, None)),
+    ))
+    def test_from_json(self, request_fields, expected):
+        request = dict(deveui=DEVEUI.lower(), frmpayload=base64.b64encode(b'\x01\x02').decode(), **request_fields)
+        dev_eui_hex, downlink = downlink_queue.QueuedDownlink.from_json(json.dumps(request), now=100)
+        assert dev_eui_hex == DEVEUI
+        assert downlink.frmpayload == b'\x01\x02'
+        assert (downlink.fport, downlink.confirmed, downlink.priority, downlink.expires) == expected
@@ -0,0 +1,95 @@
+"""
+Automated testing of the Gateway Messages (JSON and binary wire formats).
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import base64
+import json
+import pytest
+import lorawan.parsing.flora_messages as flora_messages
+
+
+class TestGatewayMessageWireFormat(object):
+    """
+    Tests of the binary envelope of lorawan.parsing.flora_messages.GatewayMessage, and the detection of the
+    format of the messages received from the broker.
+    """
+    phypayload = bytes.fromhex("40f11c012680000001a4d2dbd3d84cb8")
+    rxpk = {
+        "tmst": 3512348611,
+        "chan": 2,
+        "rfch": 0,
+        "freq": 868.5,
+        "stat": 1,
+        "modu": "LORA",
+        "datr": "SF7BW125",
+        "codr": "4/6",
+        "rssi": -35,
+        "lsnr": 5.1,
+        "size": 16,
+        "data": base64.b64encode(phypayload).decode()
+    }
+
+    def test_uplink_round_trip(self):
+        uplink = flora_messages.GatewayMessage.from_dict(self.rxpk)
+        body, content_type = uplink.encode(wire_format=flora_messages.WIRE_FORMAT_BINARY)
+        assert content_type == flora_messages.CONTENT_TYPE_BINARY
+        assert len(body) < len(json.dumps(self.rxpk))
+        decoded = flora_messages.GatewayMessage.from_bytes(body, content_type=content_type)
+        assert decoded.testingtool_msg_dict == self.rxpk
+        assert decoded.get_phypaload_bytes() == self.phypayload
+
+    @pytest.mark.parametrize("stat", [-1, 0, 1])
+    def test_crc_status_kept(self, stat):
+        uplink = flora_messages.GatewayMessage.from_dict(dict(self.rxpk, stat=stat))
+        decoded = flora_messages.GatewayMessage.from_bytes(uplink.to_binary())
+        assert decoded.testingtool_msg_dict["stat"] == stat
+
+    def test_downlink_round_trip(self):
+        uplink = flora_messages.GatewayMessage.from_dict(self.rxpk)
+        downlink = uplink.create_nwk_response(phypayload=self.phypayload,
+                                              delay=1000000,
+                                              data_rate="SF12BW125",
+                                              frequency=869.525)
+        decoded = flora_messages.GatewayMessage.from_bytes(downlink.to_binary())
+        assert str(decoded) == str(downlink)
+        assert str(downlink) == uplink.create_nwk_response_str(phypayload=self.phypayload,
+                                                               delay=1000000,
+                                                               data_rate="SF12BW125",
+                                                               frequency=869.525)
+
+    @pytest.mark.parametrize("content_type", [None, flora_messages.CONTENT_TYPE_JSON])
+    def test_json_body(self, content_type):
+        body = json.dumps(self.rxpk).encode()
+        decoded = flora_messages.GatewayMessage.from_bytes(body, content_type=content_type)
+        assert decoded.testingtool_msg_dict == self.rxpk
+        assert decoded.get_phypaload_bytes() == self.phypayload
+
+    def test_json_fallback(self):
+        fsk_rxpk = dict(self.rxpk, modu="FSK", datr=50000)
+        body, content_type = flora_messages.GatewayMessage.from_dict(fsk_rxpk).encode(
+            wire_format=flora_messages.WIRE_FORMAT_BINARY)
+        assert content_type == flora_messages.CONTENT_TYPE_JSON
+        assert json.loads(body.decode()) == fsk_rxpk
@@ -0,0 +1,110 @@
+"""
+Automated testing of the reconstruction of the 32-bit frame counters (lorawan.frame_counter).
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import pytest
+from lorawan import frame_counter
+from lorawan import sessions
+from lorawan.parsing import lorawan as lorawan_parser
+import lorawan.lorawan_parameters.general as lorawan_parameters
+
+
+def new_device():
+    return sessions.EndDevice(ctx_test_tool_service=None, devaddr=bytes([0x26, 0, 0, 1]), deveui=bytes(8),
+                              appkey=bytes(16), appskey=bytes([0xff]) + bytes(range(1, 16)),
+                              nwkskey=bytes(range(16)))
+
+
+class TestReconstructFCnt(object):
+    """
+    Tests of frame_counter.reconstruct_fcnt.
+    """
+    expected_results = (
+        (5, None, 5),
+        (6, 5, 6),
+        (5, 5, 5),
+        (0x8000, 0x7fff, 0x8000),
+        (0x0002, 0xfffe, 0x10002),
+        (0x1234, 0x51200, 0x51234),
+        (0x0010, 0x8000, None),
+        (0x4000, 0x0000, 0x4000),
+        (0x4001, 0x0000, None),
+    )
+
+    @pytest.mark.parametrize("wire_fcnt, last_fcnt, expected", expected_results)
+    def test_reconstruct_fcnt(self, wire_fcnt, last_fcnt, expected):
+        assert frame_counter.reconstruct_fcnt(wire_fcnt, last_fcnt) == expected
+
+    def test_candidates_after_reset(self):
+        counters = frame_counter.FrameCounter(last_up=0x12345)
+        assert counters.uplink_candidates(0x2346) == [0x12346]
+        assert counters.uplink_candidates(0x0001) == [0x0001]
+        assert counters.uplink_candidates(0x2000) == []
+        assert frame_counter.FrameCounter.from_dict(counters.to_dict()).last_up == 0x12345
+
+
+class TestFrameCounterOfDevice(object):
+    """
+    Tests of the 32-bit frame counters of the EndDevice.
+    """
+
+    @pytest.mark.parametrize("fcnt_down", (0x7fff, 0x8000, 0xffff, 0x10000, 0x123456))
+    def test_downlink_counter_above_16_bits(self, fcnt_down):
+        tas_device = new_device()
+        tas_device.fcnt_down = fcnt_down
+        phypayload = tas_device.prepare_lorawan_data(frmpayload=b'\x01\x02', fport=224)
+        assert tas_device.fcnt_down == fcnt_down + 1
+
+        message = lorawan_parser.LoRaWANMessage(phypayload)
+        assert message.macpayload.fhdr.get_fcnt_int() == fcnt_down % 2 ** 16
+        receiver = new_device()
+        receiver.frame_counter.accept_uplink(fcnt_down - 1)
+        calculated_mic = receiver.track_received_fcnt(message, key=receiver.loramac_params.nwkskey)
+        assert calculated_mic == message.mic_bytes
+        assert message.macpayload.fhdr.get_full_fcnt() == fcnt_down
+        assert message.get_frmpayload_plaintext(key=receiver.loramac_params.appskey) == b'\x01\x02'
+
+    def test_counter_reset_of_device(self):
+        tas_device = new_device()
+        phypayload = tas_device.prepare_lorawan_data(frmpayload=b'\x01', fport=224,
+                                                     mhdr=lorawan_parameters.MHDR.UNCONFIRMED_UP)
+        receiver = new_device()
+        receiver.fcnt_up = 0x5000
+        message = lorawan_parser.LoRaWANMessage(phypayload)
+        assert receiver.track_received_fcnt(message, key=receiver.loramac_params.nwkskey) == message.mic_bytes
+        assert receiver.fcnt_up == 0
+
+    @pytest.mark.parametrize("replayed_fcnt", (0x0100, 0x4fff, 0x5000 - frame_counter.RESTART_FCNT_LIMIT))
+    def test_replayed_frame_rejected(self, replayed_fcnt):
+        tas_device = new_device()
+        tas_device.fcnt_down = replayed_fcnt
+        phypayload = tas_device.prepare_lorawan_data(frmpayload=b'\x01', fport=224,
+                                                     mhdr=lorawan_parameters.MHDR.UNCONFIRMED_UP)
+        receiver = new_device()
+        receiver.fcnt_up = 0x5000
+        message = lorawan_parser.LoRaWANMessage(phypayload)
+        assert receiver.track_received_fcnt(message, key=receiver.loramac_params.nwkskey) != message.mic_bytes
+        assert receiver.fcnt_up == 0x5000
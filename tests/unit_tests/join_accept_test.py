@@ -0,0 +1,95 @@
+"""
+Automated testing of the Join Accept creation (lorawan.join_accept).
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import random
+import struct
+import pytest
+import utils
+import lorawan.lorawan_parameters.general as lorawan_parameters
+from lorawan import join_accept
+
+APPKEY = bytes(range(16))
+
+
+def reference_join_accept(appkey, rng, devnonce, dlsettings, rxdelay, cflist):
+    """ Join Accept created with the generic AES functions, drawing the random numbers in the same order."""
+    appnonce = struct.pack("<L", rng.randint(0, 2 ** 24 - 1))[:3]
+    devaddr_int = rng.randint(0, 2 ** 32 - 1)
+    nwkid_int = (devaddr_int & 0xfe000000) // 2 ** 25
+    netid_int = (rng.randint(0, 2 ** 24 - 1) & 0xffff80) | nwkid_int
+    devaddr = struct.pack(">L", devaddr_int)
+    netid = struct.pack(">L", netid_int)[-3:]
+    appnonce_netid_devnonce = appnonce + netid[::-1] + devnonce[::-1]
+    nwkskey = utils.aes128_encrypt(appkey, b'\x01' + appnonce_netid_devnonce + bytes(7))
+    appskey = utils.aes128_encrypt(appkey, b'\x02' + appnonce_netid_devnonce + bytes(7))
+    macpayload = appnonce + netid[::-1] + devaddr[::-1] + dlsettings + rxdelay + cflist
+    mic = utils.aes128_cmac(appkey, lorawan_parameters.MHDR.JOIN_ACCEPT + macpayload)[:4]
+    phypayload = lorawan_parameters.MHDR.JOIN_ACCEPT + utils.aes128_decrypt(key=appkey,
+                                                                             cipher_text=macpayload + mic)
+    return join_accept.JoinAccept(phypayload=phypayload, devaddr=devaddr, nwkskey=nwkskey, appskey=appskey)
+
+
+class TestAppKeyCipher(object):
+    """
+    Tests of the join_accept.AppKeyCipher.
+    """
+
+    @pytest.mark.parametrize("length", (0, 1, 13, 15, 16, 17, 29, 32, 40))
+    def test_cmac(self, length):
+        message = bytes(random.Random(length).getrandbits(8) for _ in range(length))
+        assert join_accept.AppKeyCipher(APPKEY).cmac(message) == utils.aes128_cmac(APPKEY, message)
+
+    def test_rfc4493_vector(self):
+        key = bytes.fromhex("2b7e151628aed2a6abf7158809cf4f3c")
+        message = bytes.fromhex("6bc1bee22e409f96e93d7e117393172a")
+        assert join_accept.AppKeyCipher(key).cmac(message).hex() == "070a16b46b4d4144f79bdd9dd04a287c"
+
+
+class TestJoinAcceptBuilder(object):
+    """
+    Tests of the join_accept.JoinAcceptBuilder, compared with the Join Accept created with the generic AES functions.
+    """
+
+    @pytest.mark.parametrize("pool_size", (1, 4))
+    @pytest.mark.parametrize("cflist", (lorawan_parameters.JOIN_ACCEPT_CFLIST.NO_CHANNELS,
+                                        lorawan_parameters.JOIN_ACCEPT_CFLIST.TEMPLATE))
+    def test_same_join_accept(self, pool_size, cflist):
+        builder_rng = random.Random(1234)
+        builder = join_accept.JoinAcceptBuilder(appkey=APPKEY,
+                                                new_appnonce=lambda: builder_rng.randint(0, 2 ** 24 - 1),
+                                                pool_size=pool_size,
+                                                rng=builder_rng)
+        reference_rng = random.Random(1234)
+        devnonces = (b'\x00\x01', b'\x12\x34', b'\xff\xfe', b'\xab\xcd', b'\x00\x02')
+        references = [reference_join_accept(APPKEY, reference_rng, devnonce,
+                                            lorawan_parameters.DLSETTINGS.RX1OFFSET3_RX2DR0,
+                                            lorawan_parameters.JOIN_ACCEPT_RXDELAY.DELAY1, cflist)
+                      for devnonce in devnonces]
+        accepts = [builder.build(devnonce=devnonce, dlsettings=lorawan_parameters.DLSETTINGS.RX1OFFSET3_RX2DR0,
+                                 rxdelay=lorawan_parameters.JOIN_ACCEPT_RXDELAY.DELAY1, cflist=cflist)
+                   for devnonce in devnonces]
+        assert accepts == references
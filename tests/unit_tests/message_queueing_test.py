@@ -0,0 +1,282 @@
+"""
+Automated testing of the message broker interface (in-process broker).
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import threading
+import pytest
+import message_queueing
+import mq_metrics
+import user_interface.ui_reports as ui_reports
+import conformance_testing.test_errors as test_errors
+
+
+@pytest.fixture
+def memory_broker():
+    message_queueing.MemoryBroker.reset()
+    yield message_queueing.MemoryBroker.instance()
+    message_queueing.MemoryBroker.reset()
+
+
+class TestTopicMatches(object):
+    """
+    Tests of the message_queueing.topic_matches function, that implements the AMQP topic exchange
+    matching rules used by the in-process broker.
+    """
+    expected_results = (
+        ('fromAgent.#', 'fromAgent.gw1', True),
+        ('fromAgent.#', 'fromAgent', True),
+        ('fromAgent.#', 'fromAgent.gw1.up', True),
+        ('fromAgent.#', 'toAgent.gw1', False),
+        ('#', 'log.tas', True),
+        ('ui.user.all.*', 'ui.user.all.request', True),
+        ('ui.user.all.*', 'ui.user.all', False),
+        ('ui.user.all.*', 'ui.user.all.request.x', False),
+        ('*.reply', 'comm.reply', True),
+        ('log.#.error', 'log.error', True),
+        ('log.#.error', 'log.tas.agent.error', True),
+        ('log.#.error', 'log.tas.agent', False),
+        ('mock.start', 'mock.start', True),
+        ('mock.start', 'mock.stop', False),
+    )
+
+    @pytest.mark.parametrize("binding_key, routing_key, expected", expected_results)
+    def test_topic_matches(self, binding_key, routing_key, expected):
+        assert message_queueing.topic_matches(binding_key, routing_key) is expected
+
+
+class TestRoutingKeyMatcher(object):
+    """
+    Tests of the message_queueing.RoutingKeyMatcher, the compiled set of topic bindings used to
+    dispatch messages locally.
+    """
+
+    def test_match_in_binding_order(self):
+        matcher = message_queueing.RoutingKeyMatcher([('fromAgent.#', 'up'),
+                                                      ('#', 'all'),
+                                                      ('*.gw1', 'gw1'),
+                                                      ('toAgent.#', 'down')])
+        assert matcher.match('fromAgent.gw1') == ('up', 'all', 'gw1')
+        assert matcher.match('toAgent.gw2') == ('all', 'down')
+        assert matcher.match('log') == ('all',)
+
+    def test_remove(self):
+        matcher = message_queueing.RoutingKeyMatcher([('mock.*', 'mock'), ('mock.#', 'any_mock')])
+        assert matcher.match('mock.configure') == ('mock', 'any_mock')
+        assert matcher.remove('mock.*', 'mock')
+        assert not matcher.remove('mock.*', 'mock')
+        assert matcher.match('mock.configure') == ('any_mock',)
+
+    def test_declare_and_consume_many(self, memory_broker):
+        consumer = message_queueing.MqInterface(amqp_url='memory://')
+        received = []
+
+        def handler(name):
+            def on_message(ch, method, properties, body):
+                received.append((name, body))
+                if body == b'stop':
+                    ch.stop_consuming()
+            return on_message
+
+        consumer.declare_and_consume_many(queue_name='demux',
+                                          callbacks={'mock.up.data': handler('data'),
+                                                     'mock.configure': handler('configure'),
+                                                     'mock.#': handler('all')})
+        publisher = message_queueing.MqInterface(amqp_url='memory://')
+        publisher.publish(msg=b'd', routing_key='mock.up.data')
+        publisher.publish(msg=b'c', routing_key='mock.configure')
+        publisher.publish(msg=b'stop', routing_key='mock.other')
+        consumer.consume_start()
+        assert received == [('data', b'd'), ('all', b'd'), ('configure', b'c'), ('all', b'c'),
+                            ('all', b'stop')]
+
+
+class TestMemoryBroker(object):
+    """
+    Tests of the in-process broker used with AMQP_URL=memory://, through the MqInterface API.
+    """
+
+    def test_publish_consume(self, memory_broker):
+        consumer = message_queueing.MqInterface(amqp_url='memory://')
+        publisher = message_queueing.MqInterface(amqp_url='memory://')
+        received = []
+
+        def on_message(ch, method, properties, body):
+            received.append((method.routing_key, body))
+            if len(received) == 2:
+                ch.stop_consuming()
+
+        consumer.declare_and_consume(queue_name='up_test', routing_key='fromAgent.#',
+                                     callback=on_message)
+        publisher.publish(msg='first', routing_key='fromAgent.gw1')
+        publisher.publish(msg=b'ignored', routing_key='toAgent.gw1')
+        publisher.publish(msg=b'second', routing_key='fromAgent.gw2')
+        publisher.publish(msg=b'third', routing_key='fromAgent.gw3')
+        consumer.consume_start()
+
+        assert received == [('fromAgent.gw1', b'first'), ('fromAgent.gw2', b'second')]
+        assert memory_broker.message_count('up_test') == 1
+
+    def test_consume_from_other_thread(self, memory_broker):
+        consumer = message_queueing.MqInterface(amqp_url='memory://')
+        received = []
+
+        def on_message(ch, method, properties, body):
+            received.append(body)
+            consumer.consume_stop()
+
+        consumer.declare_and_consume(queue_name='threaded', routing_key='mock.*',
+                                     callback=on_message)
+        worker = threading.Thread(target=consumer.consume_start)
+        worker.start()
+        message_queueing.MqInterface(amqp_url='memory://').publish(msg=b'go',
+                                                                   routing_key='mock.start')
+        worker.join(timeout=5)
+        assert not worker.is_alive()
+        assert received == [b'go']
+
+    def test_exclusive_queue_deleted_on_close(self, memory_broker):
+        interface = message_queueing.MqInterface(amqp_url='memory://')
+        interface.declare_queue(queue_name='exclusive_q', exclusive=True)
+        interface.connection.close()
+        with pytest.raises(message_queueing.pika.exceptions.ChannelClosed):
+            memory_broker.message_count('exclusive_q')
+
+    def test_rpc_request(self, memory_broker):
+        responder = message_queueing.MqInterface(amqp_url='memory://')
+
+        def on_request(ch, method, properties, body):
+            ch.basic_publish(exchange=message_queueing.DEFAULT_EXCHANGE,
+                             routing_key=properties.reply_to,
+                             properties=message_queueing.pika.BasicProperties(
+                                 correlation_id=properties.correlation_id),
+                             body=body.upper())
+            ch.stop_consuming()
+
+        responder.declare_and_consume(queue_name='requests', routing_key='ui.test.request',
+                                      callback=on_request)
+        worker = threading.Thread(target=responder.consume_start)
+        worker.start()
+
+        requester = message_queueing.MqInterface(amqp_url='memory://')
+        request = ui_reports.RPCRequest(request_key='ui.test.request', channel=requester.channel,
+                                        body=b'ping')
+        assert request.wait_response(timeout_seconds=5) == b'PING'
+        worker.join(timeout=5)
+
+    def test_rpc_request_timeout(self, memory_broker):
+        requester = message_queueing.MqInterface(amqp_url='memory://')
+        request = ui_reports.RPCRequest(request_key='ui.test.request', channel=requester.channel,
+                                        body=b'ping')
+        with pytest.raises(test_errors.TimeOutError):
+            request.wait_response(timeout_seconds=0.05)
+
+    def test_timeout_stops_idle_consumer(self, memory_broker):
+        consumer = message_queueing.MqInterface(amqp_url='memory://')
+        fired = []
+        consumer.declare_and_consume(queue_name='idle', routing_key='mock.*',
+                                     callback=lambda ch, method, properties, body: None)
+        removed_timer = consumer.add_timeout(0.01, lambda: fired.append('removed'))
+        consumer.add_timeout(0.05, lambda: (fired.append('deadline'), consumer.consume_stop()))
+        consumer.remove_timeout(removed_timer)
+        worker = threading.Thread(target=consumer.consume_start)
+        worker.start()
+        worker.join(timeout=5)
+        assert not worker.is_alive()
+        assert fired == ['deadline']
+
+    def test_prefetch_with_threadsafe_ack(self, memory_broker, monkeypatch):
+        monkeypatch.setattr(message_queueing, 'mq_broker_url', 'memory://')
+        received = threading.Condition()
+        acks = []
+
+        def on_message(body, properties, ack):
+            with received:
+                acks.append(ack)
+                received.notify_all()
+
+        def wait_received(count, timeout=5):
+            with received:
+                return received.wait_for(lambda: len(acks) >= count, timeout=timeout)
+
+        publisher = message_queueing.MqInterface(amqp_url='memory://')
+        publisher.declare_queue(queue_name='prefetch_q', exclusive=False)
+        publisher.bind_queue(queue_name='prefetch_q', routing_key='mock.#')
+        for index in range(5):
+            publisher.publish(msg=bytes([index]), routing_key='mock.up')
+        consumer = message_queueing.MqSelectConnectionInterface(queue_name='prefetch_q', routing_key='mock.#',
+                                                                on_message_callback=on_message, raw_body=True,
+                                                                prefetch_count=2)
+        worker = threading.Thread(target=consumer.consume_start)
+        worker.start()
+        assert wait_received(2)
+        assert not wait_received(3, timeout=0.05)
+        assert memory_broker.message_count('prefetch_q') == 3
+        acks[0]()
+        assert wait_received(3)
+        acks[1]()
+        acks[2]()
+        assert wait_received(5)
+        consumer.stop()
+        worker.join(timeout=5)
+        assert not worker.is_alive()
+        assert len(acks) == 5
+
+class TestBrokerMetrics(object):
+    """
+    Tests of the broker metrics (mq_metrics) recorded by the MqInterface.
+    """
+
+    def test_publish_consume_metrics(self, memory_broker):
+        mq_metrics.registry.reset()
+        consumer = message_queueing.MqInterface(amqp_url='memory://')
+        consumer.declare_and_consume(queue_name='metrics_q', routing_key='fromAgent.#',
+                                     exclusive=False,
+                                     callback=lambda ch, method, properties, body: ch.stop_consuming())
+        publisher = message_queueing.MqInterface(amqp_url='memory://')
+        publisher.publish(msg=b'12345', routing_key='fromAgent.gw1')
+        publisher.publish(msg='123', routing_key='fromAgent.gw1')
+        consumer.consume_start()
+
+        snapshot = mq_metrics.registry.snapshot()
+        assert snapshot["published"]["fromAgent.gw1"] == {"messages": 2, "bytes": 8}
+        assert snapshot["consumed"]["metrics_q"]["messages"] == 1
+        assert snapshot["consumed"]["metrics_q"]["bytes"] == 5
+        assert mq_metrics.registry.pollable_queues() == ['metrics_q']
+        assert 'mq_published_bytes_total{routing_key="fromAgent.gw1"} 8' in \
+               mq_metrics.registry.to_prometheus_text()
+
+    def test_reporter_queue_depth(self, memory_broker):
+        mq_metrics.registry.reset()
+        interface = message_queueing.MqInterface(amqp_url='memory://')
+        interface.declare_queue(queue_name='display_q', exclusive=False)
+        interface.bind_queue(queue_name='display_q', routing_key='ui.display')
+        interface.publish(msg=b'x', routing_key='ui.display')
+        interface.declare_and_consume(queue_name='metrics_out', routing_key='metrics.#',
+                                      callback=lambda ch, method, properties, body: None)
+
+        mq_metrics.MetricsReporter(service_name='tas', interval=1, amqp_url='memory://').report()
+        assert mq_metrics.registry.snapshot()["queue_depth"]["display_q"] == 1
+        assert memory_broker.message_count('metrics_out') == 1
@@ -0,0 +1,91 @@
+"""
+Automated testing of the histories of the OTAA nonces (lorawan.nonce_history).
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import pytest
+from lorawan import nonce_history
+
+
+class TestNonceBitmap(object):
+    """
+    Tests of the bitmap of the used devnonces.
+    """
+
+    def test_add_and_contains(self):
+        history = nonce_history.NonceBitmap()
+        assert b'\x12\x34' not in history
+        assert history.add(b'\x12\x34')
+        assert 0x1234 in history
+        assert b'\x12\x34' in history
+        assert not history.add(0x1234)
+        assert history.add(0)
+        assert history.add(0xffff)
+        assert len(history) == 3
+        assert list(history) == [0, 0x1234, 0xffff]
+        assert history.last_bytes() == b'\xff\xff'
+
+    def test_duplicate_keeps_last(self):
+        history = nonce_history.NonceBitmap()
+        history.add(0x1234)
+        history.add(0x0042)
+        assert not history.add(0x1234)
+        assert history.last == 0x0042
+        assert history.last_bytes() == b'\x00\x42'
+
+    @pytest.mark.parametrize("nonce", (-1, 2 ** 16))
+    def test_out_of_range(self, nonce):
+        with pytest.raises(ValueError):
+            nonce_history.NonceBitmap().add(nonce)
+
+    @pytest.mark.parametrize("nonces", ((), (7,), (1, 2, 3, 0xabcd, 0x8000)))
+    def test_serialization(self, nonces):
+        history = nonce_history.NonceBitmap()
+        for nonce in nonces:
+            history.add(nonce)
+        data = history.to_bytes()
+        assert len(data) < 100
+        restored = nonce_history.NonceBitmap.from_text(history.to_text())
+        assert list(restored) == sorted(nonces)
+        assert len(restored) == len(nonces)
+        assert restored.last == history.last
+        assert nonce_history.NonceBitmap.from_bytes(data).to_bytes() == data
+
+
+class TestRecentNonces(object):
+    """
+    Tests of the bounded history of the appnonces.
+    """
+
+    def test_oldest_forgotten(self):
+        history = nonce_history.RecentNonces(maxlen=3)
+        for nonce in (1, 2, 3):
+            assert history.add(nonce)
+        assert not history.add(2)
+        assert history.add(4)
+        assert 1 not in history
+        assert history.to_list() == [2, 3, 4]
+        assert history.last == 4
+        assert nonce_history.RecentNonces.from_list(history.to_list(), maxlen=3).to_list() == [2, 3, 4]
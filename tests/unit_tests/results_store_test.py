@@ -0,0 +1,107 @@
+"""
+Automated testing of the results store of the test sessions (conformance_testing.results_store).
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import xml.etree.ElementTree as ElementTree
+import pytest
+from conformance_testing import results_store
+
+RESULTS = (
+    results_store.TestResult(session_id="s1", deveui="0000000000000001", test_name="td_lorawan_act_01",
+                             verdict=results_store.VERDICT_PASS, started=1000.0, duration=2.5,
+                             steps=[("WaitDataToActivate", 0.5), ("ActokToPing", 2.0)],
+                             error_type=None, error_message=None, last_message="40010000260000"),
+    results_store.TestResult(session_id="s1", deveui="0000000000000001", test_name="td_lorawan_fun_01",
+                             verdict=results_store.VERDICT_FAIL, started=1003.0, duration=120.0,
+                             steps=[], error_type="TimeOutError", error_message="Step timeout.\nDetails",
+                             last_message=None),
+    results_store.TestResult(session_id="s2", deveui="0000000000000002", test_name="td_lorawan_act_01",
+                             verdict=results_store.VERDICT_FAIL, started=2000.0, duration=1.5,
+                             steps=[("WaitDataToActivate", 1.5)], error_type="WrongResponseError",
+                             error_message="Wrong FCnt.", last_message="40020000260000"),
+)
+
+
+@pytest.fixture(params=["results.jsonl", "results.db"])
+def store_path(request, tmp_path):
+    return str(tmp_path / request.param)
+
+
+class TestResultsStore(object):
+    """
+    Tests of the JSON lines and SQLite results stores.
+    """
+
+    def test_records_are_persisted(self, store_path):
+        store = results_store.open_store(store_path)
+        for result in RESULTS:
+            store.record(result)
+        store.close()
+        reopened = results_store.open_store(store_path)
+        assert reopened.results() == list(RESULTS)
+        reopened.close()
+
+    def test_queries(self, store_path):
+        store = results_store.open_store(store_path)
+        for result in RESULTS:
+            store.record(result)
+        assert store.pass_rates() == [results_store.PassRate("td_lorawan_act_01", 1, 2),
+                                      results_store.PassRate("td_lorawan_fun_01", 0, 1)]
+        latencies = {(latency.test_name, latency.step_name): latency for latency in store.step_latencies()}
+        assert latencies[("td_lorawan_act_01", "WaitDataToActivate")].count == 2
+        assert latencies[("td_lorawan_act_01", "WaitDataToActivate")].mean_seconds == pytest.approx(1.0)
+        assert latencies[("td_lorawan_act_01", "WaitDataToActivate")].max_seconds == pytest.approx(1.5)
+        assert store.pass_rates() == results_store.pass_rates(store.results())
+        store.close()
+
+    @pytest.mark.parametrize("results_format, extension", ((None, ".jsonl"),
+                                                           (results_store.FORMAT_SQLITE, ".db")))
+    def test_store_from_env(self, monkeypatch, tmp_path, results_format, extension):
+        monkeypatch.delenv(results_store.RESULTS_DIR_ENV, raising=False)
+        assert results_store.store_from_env("s1") is None
+        monkeypatch.setenv(results_store.RESULTS_DIR_ENV, str(tmp_path / "results"))
+        if results_format:
+            monkeypatch.setenv(results_store.RESULTS_FORMAT_ENV, results_format)
+        store = results_store.store_from_env("s1")
+        assert store.path == str(tmp_path / "results" / f"session_s1{extension}")
+        store.close()
+
+
+class TestJUnitExport(object):
+    """
+    Tests of the export of the results to JUnit XML.
+    """
+
+    def test_to_junit_xml(self):
+        testsuites = ElementTree.fromstring(results_store.to_junit_xml(RESULTS))
+        suites = testsuites.findall("testsuite")
+        assert [suite.get("name") for suite in suites] == ["s1.0000000000000001", "s2.0000000000000002"]
+        assert (suites[0].get("tests"), suites[0].get("failures")) == ("2", "1")
+        passed, failed = suites[0].findall("testcase")
+        assert passed.find("failure") is None
+        assert "ActokToPing: 2.000 s" in passed.find("system-out").text
+        assert failed.find("failure").get("type") == "TimeOutError"
+        assert failed.find("failure").get("message") == "Step timeout."
@@ -0,0 +1,173 @@
+"""
+Automated testing of the capture files of the test sessions.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import base64
+import json
+import types
+import pika
+import pytest
+from conformance_testing import session_capture
+from conformance_testing import session_replay
+from conformance_testing import test_errors
+from conformance_testing import test_planner
+from lorawan.parsing import flora_messages
+import message_queueing
+from user_interface.ui import ui_publisher
+
+GW_MESSAGE = '{"tmst": 1000, "chan": 0, "rfch": 0, "freq": 868.1, "stat": 1, "modu": "LORA", ' \
+             '"datr": "SF7BW125", "codr": "4/5", "rssi": -35, "lsnr": 5.5, "size": 4, "data": "QAECAw=="}'
+
+
+class TestSessionCapture(object):
+    @pytest.mark.parametrize("routing_key, direction", [
+        ("fromAgent.gw1", session_capture.DIRECTION_UP),
+        ("toAgent.gw1", session_capture.DIRECTION_DOWN),
+        ("tas.session.info", session_capture.DIRECTION_INFO),
+        ("log.tsc", None),
+    ])
+    def test_direction_of(self, routing_key, direction):
+        assert session_capture.direction_of(routing_key) == direction
+
+    def test_random_seed_from_env(self, monkeypatch):
+        monkeypatch.setenv(session_capture.RANDOM_SEED_ENV, "1234")
+        assert session_capture.random_seed_from_env() == 1234
+        monkeypatch.delenv(session_capture.RANDOM_SEED_ENV)
+        seed = session_capture.random_seed_from_env()
+        assert isinstance(seed, int)
+        assert 0 <= seed < 2 ** 32
+
+    def test_write_and_read(self, tmpdir):
+        capture_path = str(tmpdir.join("session.jsonl"))
+        writer = session_capture.CaptureWriter(capture_path)
+        writer.record(routing_key="fromAgent.gw1", body=GW_MESSAGE,
+                      properties=pika.BasicProperties(content_type=flora_messages.CONTENT_TYPE_JSON))
+        writer.record(routing_key="toAgent.gw1", body=b'\x00\xff', timestamp=10.5)
+        writer.close()
+        records = list(session_capture.read_capture(capture_path))
+        assert [record.direction for record in records] == [session_capture.DIRECTION_UP,
+                                                            session_capture.DIRECTION_DOWN]
+        assert records[0].body == GW_MESSAGE.encode()
+        assert records[0].content_type == flora_messages.CONTENT_TYPE_JSON
+        assert records[1].body == b'\x00\xff'
+        assert records[1].time == 10.5
+        assert records[1].content_type is None
+
+    def test_compare_downlinks(self):
+        recorded = session_capture.CaptureRecord(time=0, direction=session_capture.DIRECTION_DOWN,
+                                                 routing_key="toAgent.gw1", content_type=None,
+                                                 body=GW_MESSAGE.encode())
+        binary_body, content_type = flora_messages.GatewayMessage(GW_MESSAGE).encode(
+            wire_format=flora_messages.WIRE_FORMAT_BINARY)
+        replayed = recorded._replace(body=binary_body, content_type=content_type)
+        assert session_replay.compare_downlinks(recorded, replayed) == []
+        replayed = recorded._replace(body=GW_MESSAGE.replace('"tmst": 1000', '"tmst": 2000').encode())
+        assert session_replay.compare_downlinks(recorded, replayed) == ["tmst 1000 -> 2000"]
+
+
+DEVICE_CONFIG = {"DevEUI": "0000000000000001", "DevAddr": "26000001", "AppKey": "000102030405060708090a0b0c0d0e0f"}
+FAILING_TEST = "td_lorawan_fun_01"
+
+
+class ScriptedTestManager(object):
+    """ Test Manager that answers the first uplink with a downlink carrying its test name."""
+
+    def __init__(self, ctx_test_manager, test_name):
+        self.ctx_test_manager = ctx_test_manager
+        self.test_name = test_name
+        self.step_durations = []
+
+    def start_test(self):
+        self.ctx_test_manager.declare_and_consume(queue_name=None, routing_key=None, callback=self.handle_uplink)
+
+    def cancel_timeouts(self):
+        pass
+
+    def handle_uplink(self, ch, method, properties, body):
+        data = base64.b64encode(self.test_name.encode()).decode()
+        self.ctx_test_manager.publish(msg=GW_MESSAGE.replace("QAECAw==", data), routing_key="toAgent.gw1")
+        if self.test_name == FAILING_TEST:
+            raise test_errors.ConformanceError(description="Scripted failure.", test_case=self.test_name,
+                                               step_name="1")
+        self.ctx_test_manager.consume_stop()
+
+
+def scripted_modules(test_names):
+    return {test_name: types.SimpleNamespace(
+        TestAppManager=lambda ctx, test_name=test_name: ScriptedTestManager(ctx, test_name))
+        for test_name in test_names}
+
+
+class TestSessionReplay(object):
+    """
+    Tests of the replay of a captured session.
+    """
+
+    def test_replay_after_reset(self):
+        if not ui_publisher.connected or not message_queueing.is_memory_url(ui_publisher.amqp_url):
+            ui_publisher.connect(amqp_url=message_queueing.MEMORY_URL_SCHEME)
+        test_plan = test_planner.TestPlanner().plan([FAILING_TEST, "td_lorawan_mac_03", "td_lorawan_act_02"])
+        test_modules = scripted_modules(test_plan.tests + [test_planner.RESET_TEST])
+        coordinator = session_replay.ReplayCoordinator()
+        device_id = coordinator.parse_device_config(DEVICE_CONFIG)
+        coordinator.add_device_session(device_id=device_id, requested_tests=test_plan.tests,
+                                       planner=coordinator.planner)
+        session_info = coordinator.session_info(random_seed=1)
+        coordinator.start_sessions(test_modules, random_seed=1)
+        records = [session_capture.CaptureRecord(time=0, direction=session_capture.DIRECTION_INFO,
+                                                 routing_key="tas.session.info", content_type=None,
+                                                 body=json.dumps(session_info).encode())]
+        for _ in range(len(test_plan.tests) + 1):
+            record = session_capture.CaptureRecord(time=0, direction=session_capture.DIRECTION_UP,
+                                                   routing_key="fromAgent.gw1", content_type=None,
+                                                   body=GW_MESSAGE.encode())
+            records.append(record)
+            coordinator.uplink_dispatcher(ch=coordinator.channel,
+                                          method=pika.spec.Basic.Deliver(routing_key=record.routing_key),
+                                          properties=pika.BasicProperties(content_type=None),
+                                          body=record.body)
+        coordinator.channel.close()
+        coordinator.connection.close()
+        recorded_tests = [flora_messages.GatewayMessage.from_bytes(record.body).get_phypaload_bytes().decode()
+                          for record in coordinator.produced_downlinks]
+        # The join restores the default channel plan needed by MAC 03 after the reset.
+        assert recorded_tests == ["td_lorawan_act_01", FAILING_TEST, test_planner.RESET_TEST, "td_lorawan_act_02",
+                                  "td_lorawan_mac_03", test_planner.DEACTIVATION_TEST]
+        assert "AppKey" not in session_info["devices"][0]
+        result = session_replay.SessionReplayer(records=records + coordinator.produced_downlinks,
+                                                test_modules=test_modules,
+                                                devices=[DEVICE_CONFIG]).run()
+        assert result.mismatches == []
+        assert len(result.produced_downlinks) == len(recorded_tests)
+
+    def test_replay_needs_local_keys(self):
+        session_info = {"devices": [{"DevEUI": DEVICE_CONFIG["DevEUI"], "DevAddr": DEVICE_CONFIG["DevAddr"]}],
+                        "tests": {DEVICE_CONFIG["DevEUI"]: []}}
+        with pytest.raises(ValueError):
+            session_replay.SessionReplayer(records=[], test_modules={}, session_info=session_info)
+        replayer = session_replay.SessionReplayer(records=[], test_modules={}, session_info=session_info,
+                                                  devices=[DEVICE_CONFIG])
+        assert replayer.device_configs == [DEVICE_CONFIG]
@@ -0,0 +1,88 @@
+"""
+Automated testing of the databases of the downlink scheduler sessions (embedded SQLite).
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import threading
+import pytest
+import sqlalchemy as sqla
+from downlink_scheduler_tool import session_storage
+
+
+def sessions_metadata(*extra_columns):
+    metadata = sqla.MetaData()
+    sqla.Table(session_storage.SESSIONS_TABLE, metadata,
+               sqla.Column("dev_eui_hex", sqla.String, primary_key=True),
+               sqla.Column("dev_addr_hex", sqla.String, nullable=True),
+               *extra_columns)
+    return metadata
+
+
+class TestSqliteStorage(object):
+    """
+    Tests of the session_storage.SqliteStorage.
+    """
+
+    def test_open(self, tmp_path):
+        session = session_storage.SqliteStorage(path=str(tmp_path / "sessions.db")).open(sessions_metadata())
+        assert session.execute(sqla.text("PRAGMA journal_mode;")).scalar() == "wal"
+        indexes = [row[1] for row in session.execute(
+            sqla.text(f"PRAGMA index_list({session_storage.SESSIONS_TABLE});"))]
+        assert f"ix_{session_storage.SESSIONS_TABLE}_dev_addr_hex" in indexes
+
+    def test_missing_columns_added(self, tmp_path):
+        path = str(tmp_path / "sessions.db")
+        session = session_storage.SqliteStorage(path=path).open(sessions_metadata())
+        session.execute(sqla.text(f"INSERT INTO {session_storage.SESSIONS_TABLE} VALUES ('0001', '26000001');"))
+        session.commit()
+        session.close()
+
+        session = session_storage.SqliteStorage(path=path).open(
+            sessions_metadata(sqla.Column("fcnt_up", sqla.BigInteger, nullable=True),
+                              sqla.Column("devnonce_history", sqla.LargeBinary, nullable=True)))
+        rows = session.execute(sqla.text(f"SELECT * FROM {session_storage.SESSIONS_TABLE};")).fetchall()
+        assert [tuple(row) for row in rows] == [('0001', '26000001', None, None)]
+
+    def test_memory_database_shared_by_threads(self):
+        session = session_storage.SqliteStorage(path=":memory:").open(sessions_metadata())
+        session.execute(sqla.text(f"INSERT INTO {session_storage.SESSIONS_TABLE} VALUES ('0001', '26000001');"))
+        session.commit()
+        rows = []
+        reader = threading.Thread(target=lambda: rows.extend(session.bind.connect().execute(
+            sqla.text(f"SELECT dev_eui_hex FROM {session_storage.SESSIONS_TABLE};")).fetchall()))
+        reader.start()
+        reader.join(timeout=5)
+        assert [tuple(row) for row in rows] == [('0001',)]
+
+    def test_abstract_storage(self):
+        with pytest.raises(TypeError):
+            session_storage.SessionStorage()
+
+    def test_storage_from_config(self):
+        assert isinstance(session_storage.storage_from_config({"path": "sessions.db"}),
+                          session_storage.SqliteStorage)
+        assert isinstance(session_storage.storage_from_config({"database": "db", "user": "u", "password": "p",
+                                                               "host": "localhost"}),
+                          session_storage.PostgresStorage)
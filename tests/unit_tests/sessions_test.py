@@ -0,0 +1,148 @@
+"""
+Automated testing of the session information of the devices (lorawan.sessions).
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import pickle
+import random
+import pytest
+from lorawan import sessions
+import lorawan.lorawan_parameters.general as lorawan_parameters
+from lorawan.user_agent.messenger import mock_sessions
+
+DEVADDR = bytes([0x26, 0, 0, 1])
+APPKEY = bytes(range(16))
+APPSKEY = bytes([0xff]) + bytes(range(1, 16))
+NWKSKEY = bytes([0]) + bytes(range(1, 16))
+SECOND = lorawan_parameters.TIMING.MS_IN_SEC
+
+
+def new_device():
+    return sessions.EndDevice(ctx_test_tool_service=None, devaddr=DEVADDR, deveui=bytes(7) + b'\x01',
+                              appkey=APPKEY, appskey=APPSKEY, nwkskey=NWKSKEY)
+
+
+class TestChannelStructure(object):
+    """
+    Tests of the immutable, array-backed ChannelStructure.
+    """
+
+    def test_with_frequency(self):
+        default_channels = sessions.ChannelStructure()
+        channels = default_channels.with_frequency(867.1)
+        assert default_channels.used_frequencies == (868.1, 868.3, 868.5)
+        assert channels.used_frequencies == (868.1, 868.3, 868.5, 867.1)
+        assert channels.channel(3) == {"freq": 867.1, "min_dr": 0, "max_dr": 5, "mandatory": False}
+        assert channels.index_of(867.1) == 3 and default_channels.index_of(867.1) is None
+        assert channels.with_frequency(867.1) is channels
+        assert channels.with_frequency(868.3, idx=5) is channels
+        assert channels.with_frequency(867.5, idx=9).index_of(867.5) == 9
+
+    def test_without_frequency(self):
+        channels = sessions.ChannelStructure().with_frequency(867.1).with_frequency(867.3)
+        assert channels.without_frequency(idx=None, freq=867.1).used_frequencies == (868.1, 868.3, 868.5, 867.3)
+        assert channels.without_frequency(idx=4).used_frequencies == (868.1, 868.3, 868.5, 867.1)
+        assert not channels.without_frequency(idx=4).is_enabled(4)
+        assert channels.without_frequency(idx=0, freq=868.1) is channels
+
+    def test_frequency_pickers(self):
+        channels = sessions.ChannelStructure().with_frequency(867.1)
+        assert [channels.frequency_at(position) for position in range(6)] == [868.1, 868.3, 868.5, 867.1,
+                                                                              868.1, 868.3]
+        rng = random.Random(1)
+        assert {channels.random_frequency(rng) for _ in range(100)} == set(channels.used_frequencies)
+        assert channels.uses_frequency(867.1) and not channels.uses_frequency(867.3)
+
+    def test_immutable(self):
+        channels = sessions.ChannelStructure()
+        with pytest.raises(AttributeError):
+            channels._freqs_hz = None
+        restored = pickle.loads(pickle.dumps(channels.with_frequency(867.1)))
+        assert restored.used_frequencies == (868.1, 868.3, 868.5, 867.1)
+        assert restored.is_mandatory(0) and not restored.is_mandatory(3)
+
+
+class TestLoRaMACParameters(object):
+    """
+    Tests of the immutable LoRaMACParameters.
+    """
+
+    @pytest.mark.parametrize("changes, expected", (
+        ({"rx1_delay": 5 * SECOND}, {"rx1_delay": 5 * SECOND, "rx2_delay": 6 * SECOND}),
+        ({"rx1_dr_offset": 9}, {"rx1_dr_offset": lorawan_parameters.DR_OFFSET.MAX}),
+        ({"devaddr": b'\x01\x02\x03\x04', "rx2_dr": lorawan_parameters.LORA_DR.DR3},
+         {"devaddr": b'\x01\x02\x03\x04', "rx2_dr": lorawan_parameters.LORA_DR.DR3}),
+    ))
+    def test_replace(self, changes, expected):
+        params = sessions.LoRaMACParameters(devaddr=DEVADDR, appskey=APPSKEY, nwkskey=NWKSKEY)
+        replaced = params.replace(**changes)
+        for field, value in expected.items():
+            assert getattr(replaced, field) == value
+        assert params.devaddr == DEVADDR and params.rx1_delay == lorawan_parameters.TIMING.RECEIVE_DELAY1
+        assert replaced.channel_struct is params.channel_struct
+
+    def test_immutable(self):
+        params = sessions.LoRaMACParameters(devaddr=DEVADDR, appskey=APPSKEY, nwkskey=NWKSKEY)
+        with pytest.raises(AttributeError):
+            params.devaddr = bytes(4)
+        with pytest.raises(TypeError):
+            params.replace(rx2_delay=3 * SECOND)
+        restored = pickle.loads(pickle.dumps(params.replace(rx1_delay=2 * SECOND)))
+        assert (restored.devaddr, restored.rx1_delay, restored.rx2_delay) == (DEVADDR, 2 * SECOND, 3 * SECOND)
+
+
+class TestEndDeviceSessions(object):
+    """
+    Tests of the session changes of the EndDevice (join, default session restore).
+    """
+
+    def test_join_keeps_previous_session(self):
+        device = new_device()
+        abp_params = device.loramac_params
+        join_accept = device.accept_join(devnonce=b'\x12\x34',
+                                         cflist=lorawan_parameters.JOIN_ACCEPT_CFLIST.TEMPLATE)
+        assert device.loramac_previous_session is abp_params
+        assert abp_params.devaddr == DEVADDR
+        assert device.loramac_defaults.channel_struct.used_frequencies == (868.1, 868.3, 868.5)
+        assert len(device.loramac_params.channel_struct.used_frequencies) > 3
+        assert device.loramac_params.rx1_delay == SECOND
+
+        mock = mock_sessions.EndDeviceMock(devaddr=DEVADDR, deveui=bytes(7) + b'\x01', appkey=APPKEY,
+                                           appskey=APPSKEY, nwkskey=NWKSKEY)
+        mock._used_otaa_devnonces.add(b'\x12\x34')
+        mock.parse_join_accept(join_accept)
+        assert (mock.loramac_params.devaddr, mock.loramac_params.appskey, mock.loramac_params.nwkskey) == \
+               (device.loramac_params.devaddr, device.loramac_params.appskey, device.loramac_params.nwkskey)
+        assert (mock.loramac_params.rx1_dr_offset, mock.loramac_params.rx2_dr, mock.loramac_params.rx1_delay) == \
+               (device.loramac_params.rx1_dr_offset, device.loramac_params.rx2_dr, device.loramac_params.rx1_delay)
+
+    def test_set_default_loramac(self):
+        device = new_device()
+        device.update_loramac(rx1_delay=3 * SECOND)
+        modified_params = device.loramac_params
+        device.set_default_loramac()
+        assert device.loramac_previous_session is modified_params
+        assert device.loramac_params is device.loramac_defaults
+        assert device.loramac_params.rx1_delay == lorawan_parameters.TIMING.RECEIVE_DELAY1
@@ -0,0 +1,59 @@
+"""
+Automated testing of the consistent hashing of the devices across the TAS workers.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import pytest
+from conformance_testing import sharding
+
+DEVEUIS = [bytes([0, 4, 0xa3, 0x0b, 0, 0, index // 256, index % 256]) for index in range(400)]
+
+
+class TestConsistentHashRing(object):
+    @pytest.mark.parametrize("worker_count", [1, 2, 4, 8])
+    def test_all_workers_get_devices(self, worker_count):
+        ring = sharding.ConsistentHashRing(range(worker_count))
+        owners = [ring.node_for(deveui) for deveui in DEVEUIS]
+        assert set(owners) == set(range(worker_count))
+        assert min(owners.count(worker) for worker in range(worker_count)) > len(DEVEUIS) / worker_count / 3
+
+    def test_assignment_is_stable(self):
+        first_ring = sharding.ConsistentHashRing(range(4))
+        second_ring = sharding.ConsistentHashRing(reversed(range(4)))
+        assert [first_ring.node_for(deveui) for deveui in DEVEUIS] == \
+               [second_ring.node_for(deveui) for deveui in DEVEUIS]
+
+    def test_adding_a_worker_only_moves_its_devices(self):
+        ring = sharding.ConsistentHashRing(range(4))
+        before = [ring.node_for(deveui) for deveui in DEVEUIS]
+        ring.add_node(4)
+        after = [ring.node_for(deveui) for deveui in DEVEUIS]
+        assert all(new_owner in (old_owner, 4) for old_owner, new_owner in zip(before, after))
+        ring.remove_node(4)
+        assert [ring.node_for(deveui) for deveui in DEVEUIS] == before
+
+    def test_empty_ring(self):
+        with pytest.raises(LookupError):
+            sharding.ConsistentHashRing().node_for(DEVEUIS[0])
@@ -0,0 +1,120 @@
+"""
+Automated testing of the virtual clock and the reception windows of the simulated devices.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import pytest
+from conformance_testing import test_registry
+from lorawan import sessions
+from lorawan.parsing import configuration
+from lorawan.simulation import clock as simulation_clock
+from lorawan.simulation import radio
+from lorawan.simulation import session as simulation
+
+MAC_PARAMS = sessions.LoRaMACParameters(devaddr=bytes(4), appskey=bytes(16), nwkskey=bytes(16))
+DEVICE_ID = configuration.DeviceID(devaddr_bytes=bytes([0x26, 0, 0, 1]), deveui_bytes=bytes(7) + b'\x01',
+                                   appkey_bytes=bytes(range(16)), appskey_bytes=bytes([0xff]) + bytes(range(1, 16)),
+                                   nwkskey_bytes=bytes(1) + bytes(range(1, 16)))
+ACTIVATION_TESTS = ["td_lorawan_act_01", "td_lorawan_act_02", "td_lorawan_act_03", "td_lorawan_act_04",
+                    "td_lorawan_act_05", "td_lorawan_deactivate"]
+
+
+class TestVirtualClock(object):
+    def test_events_run_in_time_order(self):
+        clock = simulation_clock.VirtualClock()
+        executed = []
+        clock.schedule_at(300, executed.append, "c")
+        clock.schedule_at(100, executed.append, "a")
+        clock.schedule_at(100, executed.append, "b")
+        clock.run()
+        assert executed == ["a", "b", "c"]
+        assert clock.now_us == 300
+
+    def test_cancelled_event_not_run(self):
+        clock = simulation_clock.VirtualClock()
+        executed = []
+        event = clock.schedule(50, executed.append, "cancelled")
+        clock.schedule(60, executed.append, "run")
+        event.cancel()
+        clock.run()
+        assert executed == ["run"]
+
+    def test_run_until(self):
+        clock = simulation_clock.VirtualClock()
+        executed = []
+        clock.schedule(10, executed.append, 1)
+        clock.schedule(1000, executed.append, 2)
+        clock.run(until_us=500)
+        assert executed == [1]
+        assert clock.now_us == 500
+
+
+class TestReceiveWindows(object):
+    @pytest.mark.parametrize("offset_us, received", [(0, True), (20, True), (-20, True),
+                                                     (-10000, False), (50000, False)])
+    def test_rx1_tolerance(self, offset_us, received):
+        rx1, _ = radio.receive_windows(MAC_PARAMS, uplink_end_us=0, uplink_freq=868.1, uplink_datr="SF7BW125",
+                                       timing=radio.DeviceTiming())
+        start_us = MAC_PARAMS.rx1_delay + offset_us
+        assert rx1.datr == "SF7BW125"
+        assert radio.DeviceTiming().receives(rx1, start_us, 868.1, "SF7BW125") is received
+
+    def test_rx2_frequency_and_data_rate(self):
+        _, rx2 = radio.receive_windows(MAC_PARAMS, uplink_end_us=0, uplink_freq=868.1, uplink_datr="SF7BW125",
+                                       timing=radio.DeviceTiming())
+        timing = radio.DeviceTiming()
+        assert timing.receives(rx2, MAC_PARAMS.rx2_delay, rx2.freq, rx2.datr)
+        assert not timing.receives(rx2, MAC_PARAMS.rx2_delay, 868.1, rx2.datr)
+
+    @pytest.mark.parametrize("tmst, now_us, expected_us", [(1000, 0, 1000),
+                                                           (5, radio.TMST_MODULO - 10, radio.TMST_MODULO + 5),
+                                                           (radio.TMST_MODULO - 10, 5, -10)])
+    def test_tmst_to_time(self, tmst, now_us, expected_us):
+        assert radio.tmst_to_time_us(tmst, now_us) == expected_us
+        assert radio.time_to_tmst(expected_us) == tmst
+
+
+class TestSimulatedSession(object):
+    """
+    Tests of the simulated sessions (lorawan.simulation.session), run end to end with the conformance tests.
+    """
+
+    def test_activation_tests_pass(self):
+        result = simulation.SimulatedSession(DEVICE_ID, ACTIVATION_TESTS, test_registry.TestRegistry()).run()
+        assert result.verdicts == [(test_name, "PASS") for test_name in ACTIVATION_TESTS]
+        assert result.missed_downlinks == []
+        # The Join Accepts are received in the windows opened after the Join Requests.
+        assert sum(downlink.window is not None for downlink in result.downlinks) == len(result.downlinks)
+
+    def test_timing_sweep(self):
+        results = simulation.timing_sweep("early_wakeup_us", [0, -300000], DEVICE_ID, ACTIVATION_TESTS[:2],
+                                          test_registry.TestRegistry())
+        assert [(value, result.passed) for value, result in results] == [(0, True), (-300000, False)]
+
+    def test_silent_device_times_out(self):
+        result = simulation.SimulatedSession(DEVICE_ID, ACTIVATION_TESTS[:1], test_registry.TestRegistry(),
+                                             uplink_interval_us=simulation.DEFAULT_MAX_TIME_US).run()
+        assert result.verdicts == [("td_lorawan_act_01", "Test td_lorawan_act_01 failed with TimeOutError error.")]
+        assert result.simulated_us < simulation.DEFAULT_MAX_TIME_US
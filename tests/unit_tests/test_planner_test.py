@@ -0,0 +1,70 @@
+"""
+Automated testing of the planner of the order of the tests.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import pytest
+from conformance_testing import test_planner
+
+
+class TestTestPlanner(object):
+    @pytest.mark.parametrize("requested_tests, expected_tests", [
+        (["td_lorawan_fun_01"],
+         ["td_lorawan_act_01", "td_lorawan_fun_01", "td_lorawan_deactivate"]),
+        (["td_lorawan_act_01", "td_lorawan_fun_02", "td_lorawan_deactivate"],
+         ["td_lorawan_act_01", "td_lorawan_fun_02", "td_lorawan_deactivate"]),
+        (["td_lorawan_deactivate", "td_lorawan_fun_01", "td_lorawan_act_01"],
+         ["td_lorawan_act_01", "td_lorawan_fun_01", "td_lorawan_deactivate"]),
+        (["td_lorawan_mac_03", "td_lorawan_mac_04", "td_lorawan_fun_01", "td_lorawan_act_02"],
+         ["td_lorawan_act_01", "td_lorawan_fun_01", "td_lorawan_mac_03", "td_lorawan_act_02",
+          "td_lorawan_mac_04", "td_lorawan_deactivate"]),
+    ])
+    def test_plan_order(self, requested_tests, expected_tests):
+        test_plan = test_planner.TestPlanner().plan(requested_tests)
+        assert test_plan.tests == expected_tests
+        assert not test_plan.unsatisfied
+
+    def test_activation_added_once(self):
+        test_plan = test_planner.TestPlanner().plan(["td_lorawan_fun_01", "td_lorawan_sec_01",
+                                                     "td_lorawan_mac_01"])
+        assert test_plan.tests.count(test_planner.ACTIVATION_TEST) == 1
+        assert test_plan.activations == 1
+
+    def test_unsatisfied_channel_plan(self):
+        test_plan = test_planner.TestPlanner().plan(["td_lorawan_mac_03", "td_lorawan_mac_05"])
+        assert test_plan.unsatisfied == ["td_lorawan_mac_05"]
+
+    def test_keep_order(self):
+        requested_tests = ["td_lorawan_mac_03", "td_lorawan_mac_04", "td_lorawan_act_02"]
+        test_plan = test_planner.TestPlanner(reorder=False).plan(requested_tests)
+        assert test_plan.tests == ["td_lorawan_act_01"] + requested_tests + ["td_lorawan_deactivate"]
+
+    def test_replan_after_reset(self):
+        test_plan = test_planner.TestPlanner().plan(["td_lorawan_mac_04", "td_lorawan_act_03",
+                                                     "td_lorawan_deactivate"],
+                                                    state=test_planner.AFTER_RESET_STATE,
+                                                    deactivate=False)
+        assert test_plan.tests == ["td_lorawan_act_03", "td_lorawan_mac_04", "td_lorawan_deactivate"]
+        assert test_plan.activations == 0
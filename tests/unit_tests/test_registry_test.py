@@ -0,0 +1,64 @@
+"""
+Automated testing of the lazy registry of test cases.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import sys
+import pytest
+from conformance_testing import test_registry
+from lorawan.lorawan_conformance import test_names
+
+
+@pytest.fixture
+def registry():
+    return test_registry.TestRegistry(test_groups={"dom": ["minidom", "pulldom"]},
+                                      package="xml",
+                                      discover_entry_points=False)
+
+
+class TestTestRegistry(object):
+    def test_all_tests_registered(self):
+        registry = test_registry.TestRegistry(discover_entry_points=False)
+        assert set(registry) == {name for group in test_names.values() for name in group}
+        assert registry.loaded() == []
+
+    def test_module_imported_when_requested(self, registry):
+        sys.modules.pop("xml.dom.pulldom", None)
+        assert "pulldom" in registry
+        assert "xml.dom.pulldom" not in sys.modules
+        assert registry["pulldom"] is sys.modules["xml.dom.pulldom"]
+        assert registry.loaded() == ["pulldom"]
+        assert registry["pulldom"] is registry["pulldom"]
+        assert "pulldom" in registry.import_report()
+
+    def test_unknown_test(self, registry):
+        assert "td_lorawan_unknown" not in registry
+        with pytest.raises(KeyError):
+            registry["td_lorawan_unknown"]
+
+    def test_register(self, registry):
+        registry.register("td_vendor_01", "json.encoder")
+        assert registry.module_path("td_vendor_01") == "json.encoder"
+        assert registry["td_vendor_01"].__name__ == "json.encoder"
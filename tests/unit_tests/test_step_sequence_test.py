@@ -0,0 +1,75 @@
+"""
+Automated testing of the declarative definition of the steps of the tests.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import json
+import pytest
+from conformance_testing import test_step_sequence
+from conformance_testing.test_step_sequence import StepSpec
+import lorawan.lorawan_conformance.security.td_lorawan_sec_01 as td_lorawan_sec_01
+
+
+class RecordingStep(test_step_sequence.Step):
+    def __init__(self, ctx_test_manager, step_name, next_step=None, count_limit=1):
+        super().__init__(ctx_test_manager=ctx_test_manager, step_name=step_name, next_step=next_step)
+        self.count_limit = count_limit
+
+    def step_handler(self, ch, method, properties, body):
+        pass
+
+
+class TestTestDefinition(object):
+    @pytest.mark.parametrize("steps", [
+        [],
+        [StepSpec(name="S1", step_class=RecordingStep, next_step="S1")],
+        [StepSpec(name="S1", step_class=RecordingStep), StepSpec(name="S1", step_class=RecordingStep)],
+        [StepSpec(name="S1", step_class=RecordingStep, next_step="S2"),
+         StepSpec(name="S2", step_class=RecordingStep, next_step="S1")],
+        [StepSpec(name="S1", step_class=RecordingStep, next_step="Unknown")],
+    ])
+    def test_invalid_steps(self, steps):
+        with pytest.raises(ValueError):
+            test_step_sequence.TestDefinition(test_id="TD_TEST", description="", steps=steps)
+
+    def test_build_steps(self):
+        definition = test_step_sequence.TestDefinition(
+            test_id="TD_TEST",
+            description="Objective: test.",
+            steps=[StepSpec(name="S1", step_class=RecordingStep, next_step="S2", kwargs={"count_limit": 3}),
+                   StepSpec(name="S2", step_class=RecordingStep)])
+        assert definition.initial_step == "S1"
+        steps = definition.build_steps(ctx_test_manager=None)
+        assert steps["S1"].next_step is steps["S2"]
+        assert steps["S1"].count_limit == 3
+        assert steps["S2"].next_step is None
+
+    def test_shared_report(self):
+        definition = td_lorawan_sec_01.TestAppManager.definition
+        report = definition.report_str("td_lorawan_sec_01")
+        assert definition.report_str("td_lorawan_sec_01") is report
+        field_names = [field["name"] for field in json.loads(report)["fields"] if field["name"]]
+        assert field_names == ["Test ID: TD_LoRaWAN_SEC_01", "Step 1: S1ActokToPing", "Step 2: S2RepeatedPingPong",
+                               "Step 3: S3PongFinal"]
@@ -0,0 +1,83 @@
+"""
+Automated testing of the sessions of the devices under test of the testing tool.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import types
+from conformance_testing import test_errors, testingtool_services
+
+
+class FakeCoordinator(object):
+    def __init__(self):
+        self.errors = []
+
+    def handle_error(self, raised_exception, test_name, result_report=None, session=None):
+        self.errors.append((test_name, raised_exception))
+
+    def monotonic_time(self):
+        return 0.0
+
+
+class FakeTestManager(object):
+    started = []
+
+    def __init__(self, session):
+        self.session = session
+
+    def start_test(self):
+        self.started.append(self.session.current_test_name)
+
+
+class BrokenTestModules(dict):
+    """ Test modules whose import fails for the tests in broken."""
+
+    def __init__(self, modules, broken):
+        super().__init__(modules)
+        self.broken = broken
+
+    def __getitem__(self, test_name):
+        if test_name in self.broken:
+            raise ImportError(f"No module named {test_name}")
+        return super().__getitem__(test_name)
+
+
+class TestDeviceTestSession(object):
+    """
+    Tests of the testingtool_services.DeviceTestSession.
+    """
+
+    def test_import_error_reported(self):
+        coordinator = FakeCoordinator()
+        device = types.SimpleNamespace(deveui=bytes.fromhex("70B3D52C70104BE2"))
+        session = testingtool_services.DeviceTestSession(coordinator, device,
+                                                         ["td_broken", "td_unknown", "td_ok"])
+        test_modules = BrokenTestModules({"td_ok": types.SimpleNamespace(TestAppManager=FakeTestManager)},
+                                         broken={"td_broken"})
+        FakeTestManager.started = []
+        assert session.start_next_test(test_modules)
+        assert FakeTestManager.started == ["td_ok"]
+        assert [test_name for test_name, _ in coordinator.errors] == ["td_broken", "td_unknown"]
+        assert all(isinstance(error, test_errors.UnknownTestError) for _, error in coordinator.errors)
+        assert "No module named td_broken" in str(coordinator.errors[0][1])
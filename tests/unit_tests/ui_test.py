@@ -0,0 +1,128 @@
+"""
+Automated testing of the reporting queue of the GUI (user_interface.ui.ReportQueue).
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import threading
+import pytest
+import message_queueing
+import user_interface.ui as ui
+import user_interface.ui_reports as ui_reports
+from conformance_testing import test_errors
+from parameters.message_broker import routing_keys
+
+
+@pytest.fixture
+def display_queue():
+    message_queueing.MemoryBroker.reset()
+    interface = message_queueing.MqInterface(amqp_url='memory://')
+    interface.declare_queue(queue_name='display_q', exclusive=False)
+    interface.bind_queue(queue_name='display_q', routing_key=routing_keys.ui_all_users + '.display')
+    yield message_queueing.MemoryBroker.instance()
+    message_queueing.MemoryBroker.reset()
+
+
+def displayed(broker):
+    return [broker.get('display_q')[-1] for _ in range(broker.message_count('display_q'))]
+
+
+class TestReportQueue(object):
+    """
+    Tests of the ReportQueue, that renders and publishes the reports of the GUI from a background thread.
+    """
+
+    def test_reports_published_in_order(self, display_queue):
+        reports = ui.ReportQueue(amqp_url='memory://', max_rate=100)
+        reports.submit("first")
+        reports.submit(lambda: "second", rate_limited=True)
+        reports.submit("third", level=ui_reports.LEVEL_ERR)
+        assert reports.flush(timeout=5)
+        reports.close(timeout=5)
+        assert displayed(display_queue) == [b"first", b"second", b"third"]
+
+    @pytest.mark.parametrize("min_level, published", ((ui_reports.LEVEL_INFO, 3),
+                                                      (ui_reports.LEVEL_HL, 2),
+                                                      (ui_reports.LEVEL_ERR, 1)))
+    def test_level_filter(self, display_queue, min_level, published):
+        rendered = []
+
+        def render(level):
+            def render_report():
+                rendered.append(level)
+                return level
+            return render_report
+
+        reports = ui.ReportQueue(amqp_url='memory://', min_level=min_level, max_rate=100)
+        for level in (ui_reports.LEVEL_INFO, ui_reports.LEVEL_HL, ui_reports.LEVEL_ERR):
+            reports.submit(render(level), level=level)
+        reports.flush(timeout=5)
+        reports.close(timeout=5)
+        assert len(rendered) == published
+        assert reports.dropped == 3 - published
+        assert len(displayed(display_queue)) == published
+
+    def test_rate_limit(self, display_queue):
+        reports = ui.ReportQueue(amqp_url='memory://', max_rate=2)
+        accepted = [reports.submit(f"step {index}", rate_limited=True) for index in range(5)]
+        assert reports.submit("result")
+        reports.flush(timeout=5)
+        reports.close(timeout=5)
+        assert accepted == [True, True, False, False, False]
+        assert reports.dropped == 3
+        assert displayed(display_queue) == [b"step 0", b"step 1", b"result"]
+
+    def test_only_step_reports_bounded(self, display_queue):
+        publishing = threading.Event()
+
+        def blocking_report():
+            publishing.wait(timeout=5)
+            return "blocking"
+
+        reports = ui.ReportQueue(amqp_url='memory://', max_rate=100, max_pending=2)
+        assert reports.submit(blocking_report)
+        accepted = [reports.submit(f"step {index}", rate_limited=True) for index in range(3)]
+        errors = [reports.submit(f"error {index}", level=ui_reports.LEVEL_ERR) for index in range(3)]
+        publishing.set()
+        reports.flush(timeout=5)
+        reports.close(timeout=5)
+        assert accepted == [True, True, False]
+        assert errors == [True, True, True]
+        assert reports.dropped == 1
+        assert len(displayed(display_queue)) == 6
+
+
+class TestRPCClient(object):
+    """
+    Tests of the ui_reports.RPCClient requests.
+    """
+
+    def test_timeout_context(self):
+        connection = message_queueing.MemoryConnection(broker=message_queueing.MemoryBroker())
+        client = ui_reports.RPCClient(connection.channel())
+        with pytest.raises(test_errors.TimeOutError) as timeout:
+            client.call(routing_keys.ui_all_users + '.request', "{}", timeout_seconds=0.01,
+                        test_case="device registration", step_name="Device information")
+        assert timeout.value.test_case == "device registration"
+        assert timeout.value.step_name == "Device information"
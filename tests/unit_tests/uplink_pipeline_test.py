@@ -0,0 +1,119 @@
+"""
+Automated testing of the staged uplink pipeline of the downlink scheduler.
+"""
+#################################################################################
+# MIT License
+#
+# Copyright (c) 2018, Pablo D. Modernell, Universitat Oberta de Catalunya (UOC),
+# Universidad de la Republica Oriental del Uruguay (UdelaR).
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#################################################################################
+import threading
+import time
+import pytest
+from downlink_scheduler_tool import uplink_pipeline
+
+
+class Uplink(uplink_pipeline.PipelineItem):
+
+    def __init__(self, key, number, deadline=None, finished=None):
+        super().__init__(key=key, deadline=deadline,
+                         on_done=(lambda: finished.append((key, number))) if finished is not None else None)
+        self.number = number
+
+
+def run_pipeline(stages, items):
+    done = threading.Semaphore(0)
+    for item in items:
+        on_done = item.on_done
+        item.on_done = (lambda on_done=on_done: (on_done and on_done(), done.release()))
+    pipeline = uplink_pipeline.UplinkPipeline(stages)
+    for item in items:
+        pipeline.submit(item)
+    for _ in items:
+        assert done.acquire(timeout=5)
+    pipeline.stop(timeout=5)
+    return pipeline
+
+
+class TestUplinkPipeline(object):
+    """
+    Tests of the uplink_pipeline.UplinkPipeline.
+    """
+
+    @pytest.mark.parametrize("workers", (1, 4))
+    def test_order_per_key(self, workers):
+        published = []
+        lock = threading.Lock()
+
+        def slow_first_device(uplink):
+            if uplink.key == "dev0":
+                time.sleep(0.001)
+            return uplink
+
+        def publish(uplink):
+            with lock:
+                published.append((uplink.key, uplink.number))
+
+        items = [Uplink(key=f"dev{number % 3}", number=number) for number in range(30)]
+        pipeline = run_pipeline([("session", slow_first_device, workers),
+                                 ("crypto", slow_first_device, workers),
+                                 ("publish", publish, 1)], items)
+        assert pipeline.finished == 30
+        for key in ("dev0", "dev1", "dev2"):
+            numbers = [number for published_key, number in published if published_key == key]
+            assert numbers == sorted(numbers) and len(numbers) == 10
+
+    def test_expired_dropped(self):
+        published = []
+        finished = []
+        items = [Uplink(key="dev0", number=0, deadline=time.monotonic() - 1, finished=finished),
+                 Uplink(key="dev0", number=1, deadline=time.monotonic() + 10, finished=finished),
+                 Uplink(key="dev0", number=2, finished=finished)]
+        pipeline = run_pipeline([("publish", lambda uplink: published.append(uplink.number), 2)], items)
+        assert published == [1, 2]
+        assert pipeline.dropped["publish"] == 1
+        assert finished == [("dev0", 0), ("dev0", 1), ("dev0", 2)]
+
+    def test_dropped_callback(self):
+        given_back = []
+        items = [Uplink(key="dev0", number=number, deadline=time.monotonic() + (10 if number else -1))
+                 for number in range(2)]
+        for item in items:
+            item.on_dropped = lambda number=item.number: given_back.append(number)
+        pipeline = run_pipeline([("publish", lambda uplink: None, 1)], items)
+        assert given_back == [0]
+        assert pipeline.finished == 2
+
+    def test_failed_and_filtered(self):
+        finished = []
+
+        def decode(uplink):
+            if uplink.number == 0:
+                raise ValueError("Wrong frame.")
+            return uplink if uplink.number == 1 else None
+
+        published = []
+        items = [Uplink(key=None, number=number, finished=finished) for number in range(3)]
+        pipeline = run_pipeline([("decode", decode, 1),
+                                 ("publish", lambda uplink: published.append(uplink.number), 1)], items)
+        assert published == [1]
+        assert pipeline.failed["decode"] == 1
+        assert sorted(finished) == [(None, 0), (None, 1), (None, 2)]
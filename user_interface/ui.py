@@ -25,9 +25,26 @@ This module provides interaction with the user.
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #################################################################################
+import logging
+import os
+import queue
+import threading
+import time
+
 import message_queueing
+import user_interface.ui_reports as ui_reports
 from parameters.message_broker import routing_keys
 
+logger = logging.getLogger(__name__)
+
+# Order of the levels of the reports, the ones below TAS_REPORT_LEVEL are discarded without being rendered.
+REPORT_LEVELS = {ui_reports.LEVEL_INFO: 0, ui_reports.LEVEL_HL: 1, ui_reports.LEVEL_ERR: 2}
+REPORT_LEVEL = os.environ.get('TAS_REPORT_LEVEL', ui_reports.LEVEL_INFO)
+# Maximum number of step reports per second (the reports exceeding it are discarded).
+REPORT_RATE = float(os.environ.get('TAS_REPORT_RATE', 20))
+REPORT_QUEUE_SIZE = 1000
+IDLE_SECONDS = 10
+
 
 class UserInterface(message_queueing.MqInterface):
     """ This class handles the interactions with the users, including message publication in the Web UI and logging."""
@@ -42,6 +59,186 @@ class UserInterface(message_queueing.MqInterface):
         #                      key_prefix=key_prefix)
 
 
-ui_publisher = UserInterface()
+class ReportQueue(object):
+    """
+    Publishes the reports of the GUI from a background thread with its own connection to the broker. The test steps
+    only enqueue their reports after sending the downlinks, and the rendering of the step reports (e.g. decryption
+    and formatting of the received frame) runs off the critical path of the reception windows.
+    The reports below min_level are discarded without rendering them. The step reports are rate limited and at most
+    max_pending of them wait to be published, the other reports (e.g. errors and results) are never discarded.
+    """
+    _STOP = object()
+
+    def __init__(self, amqp_url=None, min_level=REPORT_LEVEL, max_rate=REPORT_RATE, max_pending=REPORT_QUEUE_SIZE):
+        """
+        :param amqp_url: url of the broker (AMQP_URL by default).
+        :param min_level: minimum level of the published reports (ui_reports.LEVEL_INFO, LEVEL_HL or LEVEL_ERR).
+        :param max_rate: maximum number of rate limited reports per second.
+        :param max_pending: maximum number of rate limited reports waiting to be published.
+        """
+        self.amqp_url = amqp_url
+        self.min_level = min_level
+        self.max_rate = max_rate
+        self.dropped = 0
+        self.published = 0
+        self.max_pending = max_pending
+        self._pending_limited = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._tokens = max_rate
+        self._last_refill = time.monotonic()
+
+    def accepts(self, level):
+        """ The reports without level (e.g. the instructions and the results of the session) are always accepted."""
+        return level is None or REPORT_LEVELS.get(level, 0) >= REPORT_LEVELS.get(self.min_level, 0)
+
+    def _take_token(self):
+        now = time.monotonic()
+        self._tokens = min(self.max_rate, self._tokens + (now - self._last_refill) * self.max_rate)
+        self._last_refill = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def submit(self, report, key_prefix="NoLogKey", level=None, rate_limited=False):
+        """
+        Enqueues a report to be published in the GUI.
+        :param report: string of the report or function without arguments that renders it.
+        :param key_prefix: logging key of the report.
+        :param level: level of the report (None if it must not be filtered).
+        :param rate_limited: if True the report is discarded when the rate limit is exceeded or there are too many
+            pending rate limited reports.
+        :return: True if the report was enqueued.
+        """
+        with self._lock:
+            if not self.accepts(level) or (rate_limited and (self._pending_limited >= self.max_pending
+                                                            or not self._take_token())):
+                self.dropped += 1
+                return False
+            if rate_limited:
+                self._pending_limited += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="gui_reports", daemon=True)
+                self._thread.start()
+        self._queue.put((report, key_prefix, rate_limited))
+        return True
+
+    def _run(self):
+        user_interface = UserInterface(amqp_url=self.amqp_url)
+        while True:
+            try:
+                item = self._queue.get(timeout=IDLE_SECONDS)
+            except queue.Empty:
+                # Keeps the connection alive (heartbeats) while there aren't reports.
+                user_interface.connection.process_data_events(time_limit=0)
+                continue
+            try:
+                if item is self._STOP:
+                    user_interface.connection.close()
+                    return
+                report, key_prefix, rate_limited = item
+                if rate_limited:
+                    with self._lock:
+                        self._pending_limited -= 1
+                user_interface.display_on_gui(msg_str=report() if callable(report) else report,
+                                              key_prefix=key_prefix)
+                self.published += 1
+            except Exception:
+                logger.exception("Unable to publish a GUI report.")
+            finally:
+                self._queue.task_done()
+
+    def flush(self, timeout=None):
+        """ Waits until the enqueued reports are published (at most timeout seconds)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """ Publishes the pending reports and stops the thread."""
+        if self._thread is None:
+            return
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+
+class LazyUserInterface(object):
+    """
+    Proxy of the UserInterface that connects to the message broker the first time that it is used instead of
+    when this module is imported.
+    """
+
+    def __init__(self):
+        self._user_interface = None
+        self._report_queue = None
+        self._amqp_url = None
+        self._lock = threading.Lock()
+
+    @property
+    def connected(self):
+        return self._user_interface is not None
+
+    def connect(self, amqp_url=None):
+        """ Connects (or reconnects) to the message broker, e.g. to use the in-process broker when replaying."""
+        with self._lock:
+            self._user_interface = UserInterface(amqp_url=amqp_url)
+            self._amqp_url = amqp_url
+            previous_queue, self._report_queue = self._report_queue, None
+        if previous_queue is not None:
+            previous_queue.close()
+        return self._user_interface
+
+    @property
+    def reports(self):
+        """ ReportQueue that publishes the reports of the GUI."""
+        if self._report_queue is None:
+            with self._lock:
+                if self._report_queue is None:
+                    self._report_queue = ReportQueue(amqp_url=self._amqp_url)
+        return self._report_queue
+
+    def display_on_gui(self, msg_str, key_prefix="NoLogKey", level=None):
+        """
+        Enqueues a report to be published in the GUI by the reporting thread (the order is kept).
+        :param level: level of the report, if given it is discarded when it's below TAS_REPORT_LEVEL.
+        """
+        return self.reports.submit(msg_str, key_prefix=key_prefix, level=level)
+
+    def defer_report(self, render, key_prefix="NoLogKey", level=ui_reports.LEVEL_INFO):
+        """
+        Enqueues a step report, rendered and published by the reporting thread. The step reports are rate
+        limited and discarded without rendering them if their level is below TAS_REPORT_LEVEL.
+        :param render: function without arguments that returns the string of the report.
+        """
+        return self.reports.submit(render, key_prefix=key_prefix, level=level, rate_limited=True)
+
+    def flush_reports(self, timeout=None):
+        """ Waits until the enqueued reports are published."""
+        if self._report_queue is None:
+            return True
+        return self._report_queue.flush(timeout)
+
+    def get_user_interface(self):
+        if self._user_interface is None:
+            with self._lock:
+                if self._user_interface is None:
+                    self._user_interface = UserInterface()
+        return self._user_interface
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get_user_interface(), name)
+
+
+ui_publisher = LazyUserInterface()
 
 
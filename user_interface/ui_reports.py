@@ -27,6 +27,8 @@ interface.
 # SOFTWARE.
 #################################################################################
 import json
+import weakref
+from concurrent import futures
 from uuid import uuid4
 import pika
 import abc
@@ -35,6 +37,7 @@ import time
 from user_interface import API_VERSION
 from message_queueing import DEFAULT_EXCHANGE
 import user_interface.ui_errors
+import conformance_testing.test_errors as test_errors
 
 LEVEL_ERR = "error"
 LEVEL_HL = "highlighted"
@@ -74,20 +77,27 @@ class SessionConfigurationBody(object):
                  testcases=None,
                  session_id="",
                  testing_tools="f-interop/flora",
-                 users=None):
+                 users=None,
+                 devices=None):
 
         self._api_version = api_version
         if not testcases:
             self.testcases = []
         else:
             self.testcases = testcases
+        # Devices to be tested concurrently: [{"DevEUI": hex, "DevAddr": hex, "AppKey": hex}, ...]
+        if not devices:
+            self.devices = []
+        else:
+            self.devices = devices
 
     @classmethod
     def build_from_json(cls, json_str):
         session_configuration_dict = json.loads(json_str)
         if set(session_configuration_dict.keys()).issubset({'api_version', 'message_id',
                                                             'testcases', 'session_id',
-                                                            'testing_tools', 'users'}):
+                                                            'testing_tools', 'users',
+                                                            'devices'}):
             return cls(**session_configuration_dict)
         else:
             raise user_interface.ui_errors.SessionConfigurationBodyError(
@@ -96,7 +106,8 @@ class SessionConfigurationBody(object):
     def to_dict(self):
         return {
             "_api_version": self._api_version,
-            "testcases": self.testcases
+            "testcases": self.testcases,
+            "devices": self.devices
         }
 
     def __str__(self):
@@ -255,6 +266,99 @@ class InputFormBody(object, metaclass=abc.ABCMeta):
         return html_str
 
 
+class RPCClient(object):
+    """
+    Request/reply client over the topic exchange. A single exclusive reply queue is declared per
+    channel and reused by every request; the replies are matched to the pending requests using the
+    correlation id, so the caller is woken up as soon as its reply is dispatched.
+    """
+    _clients = weakref.WeakKeyDictionary()
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.connection = channel.connection
+        queue_result = self.channel.queue_declare(exclusive=True)
+        self.reply_queue = queue_result.method.queue
+        self.consumer_tag = None
+        self._bound_keys = set()
+        self._pending = dict()
+
+    @classmethod
+    def for_channel(cls, channel):
+        """ Returns the RPC client of the channel, creating it the first time it's used."""
+        client = cls._clients.get(channel)
+        if client is None:
+            client = cls(channel)
+            cls._clients[channel] = client
+        return client
+
+    def _bind_reply_key(self, reply_to):
+        if reply_to not in self._bound_keys:
+            self.channel.queue_bind(queue=self.reply_queue,
+                                    exchange=DEFAULT_EXCHANGE,
+                                    routing_key=reply_to)
+            self._bound_keys.add(reply_to)
+
+    def _ensure_consumer(self):
+        """
+        Registers the reply consumer if it isn't active (stop_consuming() cancels all the consumers
+        of the channel, including this one).
+        """
+        if self.consumer_tag not in self.channel.consumer_tags:
+            self.consumer_tag = self.channel.basic_consume(consumer_callback=self.on_response,
+                                                           no_ack=True,
+                                                           queue=self.reply_queue)
+
+    def on_response(self, ch, method, properties, body):
+        future = self._pending.pop(properties.correlation_id, None)
+        if future is not None and not future.done():
+            future.set_result(body)
+
+    def call(self, request_key, body, timeout_seconds=None, reply_to=None, correlation_id=None, test_case=None,
+             step_name=None):
+        """
+        Publishes a request and waits for its reply.
+        :param request_key: routing key of the request.
+        :param body: body of the request.
+        :param timeout_seconds: maximum time to wait for the reply (None waits forever).
+        :param reply_to: routing key of the reply (by default, request_key with "request" replaced by "reply").
+        :param correlation_id: correlation id of the request (a new uuid4 by default).
+        :param test_case: test case (or stage of the session) reported if the reply isn't received in time.
+        :param step_name: step reported if the reply isn't received in time (request_key by default).
+        :return: body of the reply.
+        :raises TimeOutError: if no reply is received in time.
+        """
+        if reply_to is None:
+            reply_to = request_key.replace("request", "reply")
+        if correlation_id is None:
+            correlation_id = str(uuid4())
+        self._bind_reply_key(reply_to)
+        self._ensure_consumer()
+        response = futures.Future()
+        self._pending[correlation_id] = response
+        deadline = None if timeout_seconds is None else time.monotonic() + timeout_seconds
+        try:
+            self.channel.basic_publish(exchange=DEFAULT_EXCHANGE,
+                                       routing_key=request_key,
+                                       properties=pika.BasicProperties(reply_to=reply_to,
+                                                                       correlation_id=correlation_id),
+                                       body=body)
+            while not response.done():
+                if deadline is None:
+                    self.connection.process_data_events(time_limit=None)
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise test_errors.TimeOutError(
+                        description=f"No reply received after {timeout_seconds} seconds.",
+                        test_case=test_case,
+                        step_name=step_name or request_key)
+                self.connection.process_data_events(time_limit=remaining)
+        finally:
+            self._pending.pop(correlation_id, None)
+        return response.result()
+
+
 class RPCRequest(object):
     def __init__(self, request_key, channel, body):
         self.channel = channel
@@ -264,34 +368,23 @@ class RPCRequest(object):
         self.reply_to = request_key.replace("request", "reply")
         self.correlation_id = None
         self.response_body = None
-        self.consumer_tag = None
-        self.temporary_queue = None
-
-    def on_response(self, ch, method, properties, body):
-        if self.correlation_id == properties.correlation_id:
-            self.response_body = body
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-            ch.stop_consuming(consumer_tag=self.consumer_tag)
 
-    def wait_response(self, timeout_seconds=None):
-        # TODO: handle timeout
-        queue_result = self.channel.queue_declare(exclusive=True)
-        self.temporary_queue = queue_result.method.queue
-        self.channel.queue_bind(queue=self.temporary_queue,
-                                exchange=DEFAULT_EXCHANGE,
-                                routing_key=self.reply_to)
-        self.consumer_tag = self.channel.basic_consume(consumer_callback=self.on_response,
-                                                       no_ack=False,
-                                                       queue=self.temporary_queue)
+    def wait_response(self, timeout_seconds=None, test_case=None, step_name=None):
+        """
+        Sends the request and blocks until the reply is received.
+        :param timeout_seconds: maximum time to wait for the reply (None waits forever).
+        :param test_case: test case (or stage of the session) reported if the reply isn't received in time.
+        :param step_name: step reported if the reply isn't received in time (the request key by default).
+        :return: body of the reply.
+        :raises TimeOutError: if no reply is received in time.
+        """
         self.correlation_id = str(uuid4())
-        time.sleep(1)
-        self.channel.basic_publish(exchange=DEFAULT_EXCHANGE,
-                                   routing_key=self.request_key,
-                                   properties=pika.BasicProperties(reply_to=self.reply_to,
-                                                                   correlation_id=self.correlation_id),
-                                   body=self.body)
-
-        while self.response_body is None:
-            self.connection.process_data_events()
-            time.sleep(0.1)
+        self.response_body = RPCClient.for_channel(self.channel).call(
+            request_key=self.request_key,
+            body=self.body,
+            timeout_seconds=timeout_seconds,
+            reply_to=self.reply_to,
+            correlation_id=self.correlation_id,
+            test_case=test_case,
+            step_name=step_name)
         return self.response_body